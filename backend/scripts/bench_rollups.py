@@ -0,0 +1,299 @@
+# backend/scripts/bench_rollups.py
+"""
+Benchmark the deal_event rollups against the base table.
+
+Against a scratch Postgres (NEVER production: --rows writes to deal_event):
+
+    # schema + rollups + 5M generated deals, then benchmark
+    python -m backend.scripts.bench_rollups --dsn postgresql://localhost/bench \
+        --setup --rows 5000000 --repeat 5
+
+    # re-run the benchmark only
+    python -m backend.scripts.bench_rollups --dsn postgresql://localhost/bench
+
+Steps:
+1. --setup      apply migrations/000_base_schema.sql and 001_deal_event_rollups.sql
+2. --rows N     append N seeded deals (backend.scripts.generate_deals)
+                with one COPY per block; the statement-level rollup
+                triggers maintain the rollups once per block
+                (load time is reported)
+3. consistency  rollups are compared with a fresh aggregation of deal_event
+4. benchmark    each query runs --repeat times on deal_event and, rewritten
+                by backend.sql_executor.rollups, on the chosen rollup;
+                results are compared and median timings reported
+
+Generated data: see backend/scripts/generate_deals.py (skewed products and
+counterparties, seasonal dates over --years years, per-product price walks).
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import psycopg2
+
+from backend.scripts.generate_deals import ID_PREFIX, build_model, write_postgres
+from backend.sql_executor.rollups import ROLLUP_TABLES, plan_rewrite
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+MIGRATIONS_DIR = PROJECT_ROOT / "migrations"
+SETUP_MIGRATIONS = ("000_base_schema.sql", "001_deal_event_rollups.sql")
+
+# Queries in the shape the LLM produces for common questions.
+BENCH_QUERIES: Dict[str, str] = {
+    "volume_by_product": (
+        "SELECT ref_product.product_name, SUM(volume) AS total_volume FROM deal_event "
+        "JOIN ref_product ON deal_event.product_id = ref_product.product_id "
+        "GROUP BY ref_product.product_name ORDER BY total_volume DESC"
+    ),
+    "volume_by_product_year": (
+        "SELECT ref_product.product_name, SUM(volume) AS total_volume FROM deal_event "
+        "JOIN ref_product ON deal_event.product_id = ref_product.product_id "
+        "WHERE EXTRACT(YEAR FROM deal_date) = 2024 "
+        "GROUP BY ref_product.product_name ORDER BY total_volume DESC"
+    ),
+    "top_counterparties": (
+        "SELECT ref_counterparty.counterparty_name, SUM(volume) AS total_volume, COUNT(*) AS deals "
+        "FROM deal_event JOIN ref_counterparty ON deal_event.counterparty_id = ref_counterparty.counterparty_id "
+        "GROUP BY ref_counterparty.counterparty_name ORDER BY total_volume DESC LIMIT 20"
+    ),
+    "avg_price_by_product_direction": (
+        "SELECT product_id, direction, AVG(price_usd_per_mt) AS avg_price, COUNT(*) AS deals "
+        "FROM deal_event GROUP BY product_id, direction ORDER BY product_id, direction"
+    ),
+    "monthly_volume": (
+        "SELECT DATE_TRUNC('month', deal_date) AS month, SUM(volume) AS total_volume "
+        "FROM deal_event GROUP BY DATE_TRUNC('month', deal_date) ORDER BY month"
+    ),
+    "yearly_price_range": (
+        "SELECT EXTRACT(YEAR FROM deal_date) AS year, MIN(price_usd_per_mt) AS low, "
+        "MAX(price_usd_per_mt) AS high, AVG(price_usd_per_mt) AS avg_price "
+        "FROM deal_event GROUP BY EXTRACT(YEAR FROM deal_date) ORDER BY year"
+    ),
+    "quarter_sells_by_product": (
+        "SELECT product_id, SUM(volume) AS total_volume FROM deal_event "
+        "WHERE direction = 'sell' AND deal_date >= '2024-01-01' AND deal_date < '2024-04-01' "
+        "GROUP BY product_id ORDER BY total_volume DESC"
+    ),
+    "daily_avg_price": (
+        "SELECT deal_date, AVG(price_usd_per_mt) AS avg_price FROM deal_event "
+        "WHERE deal_date BETWEEN '2024-03-10' AND '2024-06-20' GROUP BY deal_date ORDER BY deal_date"
+    ),
+    "daily_volume_one_product": (
+        "SELECT deal_date, SUM(volume) AS total_volume FROM deal_event "
+        "WHERE product_id = 'P001' GROUP BY deal_date ORDER BY deal_date"
+    ),
+}
+
+
+# -----------------------------
+# Setup / data generation
+# -----------------------------
+
+def apply_migrations(conn, names=SETUP_MIGRATIONS) -> None:
+    with conn.cursor() as cur:
+        for name in names:
+            print(f"Applying {name} ...")
+            cur.execute((MIGRATIONS_DIR / name).read_text(encoding="utf-8"))
+    conn.commit()
+
+
+def generate_deals(conn, rows: int, years: int, products: int, counterparties: int, seed: int) -> float:
+    """
+    Append `rows` synthetic deals (backend.scripts.generate_deals) after the
+    ones already generated with the same seed. Returns elapsed seconds.
+    """
+    model = build_model(seed, products, counterparties, years)
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT coalesce(max(substr(deal_id, %s)::bigint), 0) FROM deal_event WHERE deal_id LIKE %s",
+            (len(ID_PREFIX) + 2, ID_PREFIX + "-%"),
+        )
+        start = cur.fetchone()[0]
+    conn.commit()
+
+    started = time.perf_counter()
+
+    def progress(done: int) -> None:
+        print(f"  inserted {done:,}/{rows:,} ({time.perf_counter() - started:.1f} s)")
+
+    write_postgres(model, conn, rows, start, progress)
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE deal_event")
+        cur.execute("ANALYZE deal_event_rollup_day")
+        cur.execute("ANALYZE deal_event_rollup_month")
+        conn.commit()
+    return time.perf_counter() - started
+
+
+# -----------------------------
+# Consistency check
+# -----------------------------
+
+def check_consistency(conn) -> Dict[str, int]:
+    """
+    Compare each rollup with a fresh aggregation of deal_event.
+    Returns {rollup_table: mismatching groups}.
+    """
+    grain_expr = {"day": "deal_date", "month": "date_trunc('month', deal_date)::date"}
+    out = {}
+    with conn.cursor() as cur:
+        for grain, table in ROLLUP_TABLES.items():
+            cur.execute(
+                f"""
+                SELECT count(*) FROM (
+                    SELECT {grain_expr[grain]} AS deal_date, product_id, counterparty_id, currency_id,
+                           unit_id, direction, count(*) AS deal_count, sum(volume) AS volume_sum,
+                           min(volume) AS volume_min, max(volume) AS volume_max,
+                           sum(price_usd_per_mt) AS price_sum,
+                           min(price_usd_per_mt) AS price_min, max(price_usd_per_mt) AS price_max
+                    FROM deal_event GROUP BY 1, 2, 3, 4, 5, 6
+                ) fresh
+                FULL JOIN {table} r USING (deal_date, product_id, counterparty_id, currency_id, unit_id, direction)
+                WHERE fresh.deal_count IS DISTINCT FROM r.deal_count
+                   OR fresh.volume_sum IS DISTINCT FROM r.volume_sum
+                   OR fresh.volume_min IS DISTINCT FROM r.volume_min
+                   OR fresh.volume_max IS DISTINCT FROM r.volume_max
+                   OR fresh.price_sum IS DISTINCT FROM r.price_sum
+                   OR fresh.price_min IS DISTINCT FROM r.price_min
+                   OR fresh.price_max IS DISTINCT FROM r.price_max
+                """
+            )
+            out[table] = cur.fetchone()[0]
+    conn.rollback()
+    return out
+
+
+def table_sizes(conn) -> Dict[str, Dict]:
+    sizes = {}
+    with conn.cursor() as cur:
+        for table in ("deal_event", *ROLLUP_TABLES.values()):
+            cur.execute(f"SELECT count(*), pg_total_relation_size('{table}') FROM {table}")
+            count, size = cur.fetchone()
+            sizes[table] = {"rows": count, "bytes": size}
+    conn.rollback()
+    return sizes
+
+
+# -----------------------------
+# Benchmark
+# -----------------------------
+
+def _run(conn, sql: str):
+    with conn.cursor() as cur:
+        t0 = time.perf_counter()
+        cur.execute(sql)
+        rows = cur.fetchall()
+        elapsed = time.perf_counter() - t0
+    conn.rollback()
+    return rows, elapsed
+
+
+def _comparable(rows) -> List[tuple]:
+    def norm(v):
+        if isinstance(v, (Decimal, float)):
+            return round(float(v), 6)
+        return v
+    return sorted((tuple(norm(v) for v in row) for row in rows), key=repr)
+
+
+def bench_query(conn, name: str, sql: str, repeat: int) -> Dict:
+    rewrite = plan_rewrite(sql)
+    result = {"query": name, "rollup": rewrite["rollup"], "reason": rewrite["reason"]}
+
+    _run(conn, sql)  # warm cache
+    base_times, base_rows = [], None
+    for _ in range(repeat):
+        base_rows, elapsed = _run(conn, sql)
+        base_times.append(elapsed)
+    result["rows"] = len(base_rows)
+    result["base_ms"] = statistics.median(base_times) * 1000.0
+
+    if rewrite["rollup"] is None:
+        return result
+
+    _run(conn, rewrite["sql"])
+    rollup_times, rollup_rows = [], None
+    for _ in range(repeat):
+        rollup_rows, elapsed = _run(conn, rewrite["sql"])
+        rollup_times.append(elapsed)
+    result["rollup_ms"] = statistics.median(rollup_times) * 1000.0
+    result["speedup"] = result["base_ms"] / max(result["rollup_ms"], 1e-6)
+    result["match"] = _comparable(base_rows) == _comparable(rollup_rows)
+    result["sql"] = rewrite["sql"]
+    return result
+
+
+def print_report(report: Dict) -> None:
+    print("===============================================")
+    for table, info in report["sizes"].items():
+        print(f"{table:<26} {info['rows']:>12,} rows {info['bytes'] / 2**20:>10.1f} MiB")
+    if report.get("load_s") is not None:
+        print(f"Load time:  {report['load_s']:.1f} s (rollups maintained by triggers)")
+    print("Consistency (mismatching groups):", report["consistency"])
+    print("-----------------------------------------------")
+    print(f"{'query':<32}{'rollup':>7}{'rows':>7}{'base ms':>11}{'rollup ms':>11}{'speedup':>9}  match")
+    for r in report["queries"]:
+        if r["rollup"] is None:
+            print(f"{r['query']:<32}{'-':>7}{r['rows']:>7}{r['base_ms']:>11.1f}{'-':>11}{'-':>9}  ({r['reason']})")
+        else:
+            print(
+                f"{r['query']:<32}{r['rollup']:>7}{r['rows']:>7}{r['base_ms']:>11.1f}"
+                f"{r['rollup_ms']:>11.1f}{r['speedup']:>8.1f}x  {'yes' if r['match'] else 'NO'}"
+            )
+    print("===============================================")
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark deal_event rollups.")
+    parser.add_argument("--dsn", required=True, help="Scratch Postgres DSN (data is written!)")
+    parser.add_argument("--setup", action="store_true", help="Apply schema + rollup migrations first")
+    parser.add_argument("--rows", type=int, default=0, help="Generate this many deals first")
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--products", type=int, default=12)
+    parser.add_argument("--counterparties", type=int, default=80)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Write the report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.setup:
+            apply_migrations(conn)
+
+        load_s = None
+        if args.rows:
+            print(f"Generating {args.rows:,} deals ...")
+            load_s = generate_deals(conn, args.rows, args.years, args.products,
+                                    args.counterparties, args.seed)
+
+        report = {
+            "sizes": table_sizes(conn),
+            "load_s": load_s,
+            "consistency": check_consistency(conn),
+            "queries": [bench_query(conn, name, sql, args.repeat) for name, sql in BENCH_QUERIES.items()],
+        }
+    finally:
+        conn.close()
+
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print("Report written to:", args.json)
+
+    if any(report["consistency"].values()) or not all(r.get("match", True) for r in report["queries"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+# backend/scripts/check_local_engine.py
+"""
+Check the in-memory engine (backend.sql_executor.local_engine) against Postgres.
+
+    python -m backend.scripts.check_local_engine --dsn postgresql://localhost/bench
+
+Loads a snapshot of deal_event from --dsn, then runs every query in
+CHECK_QUERIES plus the LLM stub's templates on both the engine and
+Postgres and compares:
+
+- the rows as a multiset (numerics rounded to 6 places, DATE_TRUNC results
+  compared as timestamps),
+- for queries with ORDER BY, the sequence of the ORDER BY output columns
+  (rows that tie on the sort key may legitimately come back in any order,
+  and with LIMIT a different tied row may be picked, so full rows are only
+  compared when the query has no LIMIT).
+
+Queries the engine rejects (Unsupported) are reported, not failed, unless
+they are listed in MUST_RUN_LOCALLY. Read-only; safe against any database.
+"""
+
+import argparse
+import datetime as dt
+import json
+import statistics
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import psycopg2
+import psycopg2.extras
+
+from backend.scripts.bench_rollups import BENCH_QUERIES
+from backend.scripts.llm_stub_server import DEFAULT_RULES, FALLBACK_SQL
+from backend.sql_executor.local_engine import DealSnapshot, Unsupported, execute
+from backend.validator.query_shape import parse_query
+
+# Shapes beyond the benchmark / stub queries: filters, joins, HAVING,
+# DISTINCT, row listings, date parts, edge cases.
+CHECK_QUERIES: Dict[str, str] = {
+    "count_all": "SELECT COUNT(*) FROM deal_event",
+    "global_aggregates": (
+        "SELECT COUNT(*) AS deals, SUM(volume) AS total_volume, AVG(volume) AS avg_volume, "
+        "MIN(price_usd_per_mt) AS low, MAX(price_usd_per_mt) AS high, MIN(deal_date) AS first_day, "
+        "MAX(deal_date) AS last_day FROM deal_event"
+    ),
+    "empty_global_aggregate": (
+        "SELECT COUNT(*) AS deals, SUM(volume) AS total_volume, MAX(price_usd_per_mt) AS high "
+        "FROM deal_event WHERE deal_date < '1900-01-01'"
+    ),
+    "empty_group_by": (
+        "SELECT product_id, SUM(volume) AS v FROM deal_event "
+        "WHERE deal_date < '1900-01-01' GROUP BY product_id"
+    ),
+    "count_distinct": (
+        "SELECT product_id, COUNT(DISTINCT counterparty_id) AS counterparties, "
+        "COUNT(DISTINCT deal_date) AS days FROM deal_event GROUP BY product_id ORDER BY product_id"
+    ),
+    "in_list_and_range": (
+        "SELECT currency_id, unit_id, SUM(volume) AS v, COUNT(*) AS n FROM deal_event "
+        "WHERE product_id IN ('P001', 'P003', 'P007') AND volume BETWEEN 100 AND 5000 "
+        "AND price_usd_per_mt > 250.5 GROUP BY currency_id, unit_id ORDER BY v DESC"
+    ),
+    "not_in_and_not_equal": (
+        "SELECT direction, COUNT(*) AS n FROM deal_event "
+        "WHERE product_id NOT IN ('P001', 'P002') AND currency_id <> 'USD' GROUP BY direction ORDER BY direction"
+    ),
+    "like_on_ref_name": (
+        "SELECT ref_counterparty.counterparty_name, COUNT(*) AS n FROM deal_event "
+        "JOIN ref_counterparty ON deal_event.counterparty_id = ref_counterparty.counterparty_id "
+        "WHERE ref_counterparty.counterparty_name LIKE '%1%' "
+        "GROUP BY ref_counterparty.counterparty_name ORDER BY n DESC, ref_counterparty.counterparty_name"
+    ),
+    "two_joins": (
+        "SELECT ref_product.product_name, ref_currency.currency_name, AVG(price_usd_per_mt) AS avg_price "
+        "FROM deal_event JOIN ref_product ON deal_event.product_id = ref_product.product_id "
+        "JOIN ref_currency ON deal_event.currency_id = ref_currency.currency_id "
+        "GROUP BY ref_product.product_name, ref_currency.currency_name "
+        "ORDER BY ref_product.product_name, ref_currency.currency_name"
+    ),
+    "having": (
+        "SELECT counterparty_id, SUM(volume) AS v FROM deal_event GROUP BY counterparty_id "
+        "HAVING SUM(volume) > 1000000 AND COUNT(*) >= 10 ORDER BY v DESC"
+    ),
+    "distinct": "SELECT DISTINCT product_id, direction FROM deal_event ORDER BY product_id, direction",
+    "extract_parts": (
+        "SELECT EXTRACT(YEAR FROM deal_date) AS y, EXTRACT(QUARTER FROM deal_date) AS q, "
+        "EXTRACT(DOW FROM deal_date) AS dow, COUNT(*) AS n FROM deal_event "
+        "GROUP BY EXTRACT(YEAR FROM deal_date), EXTRACT(QUARTER FROM deal_date), EXTRACT(DOW FROM deal_date) "
+        "ORDER BY y, q, dow"
+    ),
+    "weekly_trunc": (
+        "SELECT DATE_TRUNC('week', deal_date) AS week, SUM(volume) AS v FROM deal_event "
+        "WHERE deal_date >= '2024-01-01' AND deal_date < '2024-03-01' "
+        "GROUP BY DATE_TRUNC('week', deal_date) ORDER BY week"
+    ),
+    "group_by_position": (
+        "SELECT direction, product_id, MAX(volume) AS biggest FROM deal_event "
+        "GROUP BY 1, 2 ORDER BY 3 DESC, 1, 2 LIMIT 10"
+    ),
+    "row_listing_filtered": (
+        "SELECT deal_id, deal_date, product_id, volume, price_usd_per_mt FROM deal_event "
+        "WHERE counterparty_id = 'C0007' AND deal_date BETWEEN '2023-05-01' AND '2023-05-31' "
+        "ORDER BY volume DESC, deal_date"
+    ),
+    "row_listing_top": (
+        "SELECT deal_id, volume, price_usd_per_mt FROM deal_event "
+        "WHERE direction = 'buy' ORDER BY price_usd_per_mt DESC LIMIT 25 OFFSET 5"
+    ),
+    "ref_column_filter": (
+        "SELECT ref_unit.unit_name, SUM(volume) AS v FROM deal_event "
+        "JOIN ref_unit ON deal_event.unit_id = ref_unit.unit_id "
+        "WHERE ref_unit.unit_name = ref_unit.unit_name GROUP BY ref_unit.unit_name"
+    ),
+}
+
+# Shapes the engine is expected to answer itself.
+MUST_RUN_LOCALLY = set(BENCH_QUERIES) | {"stub_" + str(i) for i in range(len(DEFAULT_RULES))} | {
+    "stub_fallback", "count_all", "global_aggregates", "empty_global_aggregate", "empty_group_by",
+    "count_distinct", "in_list_and_range", "not_in_and_not_equal", "like_on_ref_name", "two_joins",
+    "having", "distinct", "extract_parts", "weekly_trunc", "group_by_position",
+    "row_listing_filtered", "row_listing_top",
+}
+
+
+def corpus() -> Dict[str, str]:
+    queries = dict(BENCH_QUERIES)
+    for i, rule in enumerate(DEFAULT_RULES):
+        queries[f"stub_{i}"] = rule["sql"].format(year=2024, direction="sell")
+    queries["stub_fallback"] = FALLBACK_SQL
+    queries.update(CHECK_QUERIES)
+    return queries
+
+
+# -----------------------------
+# Comparison
+# -----------------------------
+
+def _norm(v):
+    if isinstance(v, (Decimal, float)):
+        return round(float(v), 6)
+    if isinstance(v, dt.datetime):
+        return v.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    return v
+
+
+def _rows(rows: List[Dict]) -> List[tuple]:
+    return [tuple(_norm(v) for v in row.values()) for row in rows]
+
+
+def _order_columns(sql: str, names: List[str]) -> Optional[List[int]]:
+    """
+    Positions of the output columns the ORDER BY sorts on
+    (None if some sort key is not an output column).
+    """
+    shape = parse_query(sql)
+    positions = []
+    for item in shape["order_by"]:
+        expr = item["expr"]
+        if expr["kind"] == "literal" and expr["type"] == "number":
+            positions.append(int(expr["value"]) - 1)
+            continue
+        match = [i for i, s in enumerate(shape["select"])
+                 if s["alias"] == expr["text"] or s["text"] == expr["text"] or s["expr"]["text"] == expr["text"]]
+        if not match:
+            return None
+        positions.append(match[0])
+    return positions
+
+
+def compare(sql: str, expected: List[Dict], actual: List[Dict]) -> Optional[str]:
+    """
+    None if the engine's rows match Postgres', else a description.
+    """
+    if len(expected) != len(actual):
+        return f"{len(actual)} rows, expected {len(expected)}"
+    if expected and list(expected[0]) != list(actual[0]):
+        return f"columns {list(actual[0])}, expected {list(expected[0])}"
+    exp, act = _rows(expected), _rows(actual)
+    shape = parse_query(sql)
+
+    if shape["order_by"]:
+        positions = _order_columns(sql, list(expected[0]) if expected else [])
+        if positions is not None:
+            keys_exp = [tuple(r[p] for p in positions) for r in exp]
+            keys_act = [tuple(r[p] for p in positions) for r in act]
+            if keys_exp != keys_act:
+                first = next(i for i, (a, b) in enumerate(zip(keys_exp, keys_act)) if a != b)
+                return f"order differs at row {first}: {keys_act[first]} vs {keys_exp[first]}"
+        if shape["limit"] is not None:
+            return None
+
+    if sorted(exp, key=repr) != sorted(act, key=repr):
+        missing = set(exp) - set(act)
+        return f"rows differ, e.g. expected {next(iter(missing), None)}"
+    return None
+
+
+def check_query(conn, snapshot: DealSnapshot, name: str, sql: str, repeat: int) -> Dict:
+    result = {"query": name}
+
+    pg_times = []
+    for _ in range(repeat):
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            t0 = time.perf_counter()
+            cur.execute(sql)
+            expected = cur.fetchall()
+            pg_times.append(time.perf_counter() - t0)
+        conn.rollback()
+    result["rows"] = len(expected)
+    result["pg_ms"] = statistics.median(pg_times) * 1000.0
+
+    local_times = []
+    try:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            actual = execute(snapshot, sql)
+            local_times.append(time.perf_counter() - t0)
+    except Unsupported as e:
+        result["unsupported"] = str(e)
+        result["ok"] = name not in MUST_RUN_LOCALLY
+        return result
+
+    result["local_ms"] = statistics.median(local_times) * 1000.0
+    result["speedup"] = result["pg_ms"] / max(result["local_ms"], 1e-6)
+    result["mismatch"] = compare(sql, [dict(r) for r in expected], actual)
+    result["ok"] = result["mismatch"] is None
+    return result
+
+
+def print_report(report: Dict) -> None:
+    print("===============================================")
+    print(f"Snapshot: {report['rows']:,} rows, {report['mib']:.1f} MiB, loaded in {report['load_s']:.1f} s")
+    print("-----------------------------------------------")
+    print(f"{'query':<32}{'rows':>7}{'pg ms':>10}{'local ms':>10}{'speedup':>9}  result")
+    for r in report["queries"]:
+        if "unsupported" in r:
+            status = "unsupported" + ("" if r["ok"] else " (EXPECTED LOCAL)")
+            print(f"{r['query']:<32}{r['rows']:>7}{r['pg_ms']:>10.1f}{'-':>10}{'-':>9}  {status}: {r['unsupported']}")
+        else:
+            status = "ok" if r["ok"] else f"MISMATCH: {r['mismatch']}"
+            print(
+                f"{r['query']:<32}{r['rows']:>7}{r['pg_ms']:>10.1f}{r['local_ms']:>10.1f}"
+                f"{r['speedup']:>8.1f}x  {status}"
+            )
+    print("===============================================")
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Check the local engine against Postgres.")
+    parser.add_argument("--dsn", required=True, help="Postgres DSN (read-only use)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="*", help="Run only these query names")
+    parser.add_argument("--json", help="Write the report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        t0 = time.perf_counter()
+        snapshot = DealSnapshot.load(conn)
+        load_s = time.perf_counter() - t0
+
+        queries = corpus()
+        if args.only:
+            queries = {k: v for k, v in queries.items() if k in args.only}
+        report = {
+            "rows": snapshot.rows,
+            "mib": snapshot.nbytes() / 2**20,
+            "load_s": load_s,
+            "queries": [check_query(conn, snapshot, name, sql, args.repeat) for name, sql in queries.items()],
+        }
+    finally:
+        conn.close()
+
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2, default=str), encoding="utf-8")
+        print("Report written to:", args.json)
+
+    if not all(r["ok"] for r in report["queries"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
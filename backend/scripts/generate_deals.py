@@ -0,0 +1,411 @@
+# backend/scripts/generate_deals.py
+"""
+Seeded synthetic deal data for benchmarks (deal_event + ref_* tables).
+
+    # CSV: deal_event.csv + ref_*.csv (loadable by ingest_deals / sqlite_mirror --csv-dir)
+    python -m backend.scripts.generate_deals --rows 10000000 --csv-dir data/synthetic
+
+    # straight into a scratch Postgres (COPY) or a SQLite file
+    python -m backend.scripts.generate_deals --rows 5000000 --dsn postgresql://localhost/bench
+    python -m backend.scripts.generate_deals --rows 1000000 --sqlite data/local_mirror.sqlite
+
+Deterministic: the same --seed and shape options give identical output,
+and row i never depends on --rows. Deals are generated in fixed blocks of
+BLOCK_ROWS, each from its own seed stream, so `--start 5000000 --rows
+5000000` appends exactly the second half of a 10M data set.
+
+Shape:
+- products: Zipf-skewed popularity (a few grades carry most deals), unit
+  from the product (every third one trades in BBL), named after fuel grades.
+- counterparties: Zipf-skewed activity, each with a home currency (USD /
+  EUR / AED) and its own buy/sell bias.
+- dates: weekdays weigh ~7x weekend days, a winter peak and yearly growth,
+  over --years years from --start-date.
+- prices: per-product daily log-AR(1) walk (mean-reverting to a base
+  level), a mild winter premium and lognormal per-deal noise, numeric(10,2).
+- volumes: lognormal around a per-product median, integer.
+- note: set on ~3% of deals.
+
+Memory is one block at a time, and each block is rendered to text as
+numpy byte matrices (no per-row Python); CSV output runs at roughly
+750k rows per second on one core, so a 100M-row set takes minutes and
+COPY into Postgres is limited by the server, not by the generator.
+"""
+
+import argparse
+import csv
+import datetime as dt
+import io
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import psycopg2
+import psycopg2.extras
+
+from backend.sql_executor.sqlite_mirror import connect_mirror, create_schema
+from backend.validator.validator import load_schema_registry
+
+BLOCK_ROWS = 1 << 20
+ID_PREFIX = "SYN"
+DEAL_COLUMNS = ("deal_id", "deal_date", "product_id", "volume", "price_usd_per_mt",
+                "counterparty_id", "currency_id", "unit_id", "direction", "note")
+
+PRODUCT_NAMES = (
+    "HSFO 380cst", "VLSFO 0.5%", "Gasoil 10ppm", "LSMGO 0.1%", "Jet A-1", "Naphtha",
+    "Gasoline 95 RON", "Diesel EN590", "Fuel Oil 180cst", "LPG Propane", "Kerosene",
+    "Bitumen 60/70", "Base Oil SN500", "Condensate", "Marine Gasoil",
+)
+COUNTERPARTY_WORDS = (
+    ("Gulf", "Atlas", "Nordic", "Meridian", "Pacific", "Horizon", "Falcon", "Delta",
+     "Crescent", "Summit", "Orion", "Baltic", "Sahara", "Coral", "Aurora", "Titan"),
+    ("Trading", "Energy", "Petroleum", "Shipping", "Resources", "Bunkering", "Commodities", "Fuels"),
+)
+CURRENCIES = (("USD", "US Dollar", 0.75), ("EUR", "Euro", 0.18), ("AED", "UAE Dirham", 0.07))
+UNITS = (("MT", "Metric tonne"), ("BBL", "Barrel"))
+NOTES = ("Spot cargo", "Term contract", "Partial lift", "Price under review", "Demurrage claimed",
+         "Blend adjustment")
+NOTE_RATE = 0.03
+
+# Seed streams (SeedSequence spawn keys) so each part is independent.
+_STREAM_REFS, _STREAM_PRICES, _STREAM_DEALS = 0, 1, 2
+
+
+def _rng(seed: int, stream: int, index: int = 0) -> np.random.Generator:
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(stream, index)))
+
+
+def _zipf_cdf(n: int, s: float) -> np.ndarray:
+    weights = 1.0 / np.arange(1, n + 1) ** s
+    return np.cumsum(weights) / weights.sum()
+
+
+def _pick(cdf: np.ndarray, u: np.ndarray) -> np.ndarray:
+    return np.minimum(np.searchsorted(cdf, u, side="right"), len(cdf) - 1)
+
+
+# -----------------------------
+# Model (everything but the deals)
+# -----------------------------
+
+def build_model(seed: int = 42, products: int = 12, counterparties: int = 80, years: int = 5,
+                start_date: dt.date = dt.date(2020, 1, 1)) -> Dict[str, Any]:
+    """
+    Ref tables plus the per-product / per-counterparty / per-day parameters
+    the deal blocks are drawn from.
+    """
+    rng = _rng(seed, _STREAM_REFS)
+    width_p, width_c = max(3, len(str(products))), max(4, len(str(counterparties)))
+
+    product_ids = np.array([f"P{i:0{width_p}d}" for i in range(1, products + 1)])
+    product_names = [PRODUCT_NAMES[i] if i < len(PRODUCT_NAMES) else f"Product {i + 1}" for i in range(products)]
+    product_unit = np.where(np.arange(1, products + 1) % 3 == 0, 1, 0)
+    product_price = rng.uniform(250.0, 950.0, products)
+    product_volume_mu = rng.uniform(np.log(800), np.log(9000), products) + np.where(product_unit == 1, np.log(7), 0)
+
+    first, second = COUNTERPARTY_WORDS
+    counterparty_ids = np.array([f"C{i:0{width_c}d}" for i in range(1, counterparties + 1)])
+    counterparty_names = []
+    for i in range(counterparties):
+        name = f"{first[i % len(first)]} {second[(i // len(first)) % len(second)]}"
+        lap = i // (len(first) * len(second))
+        counterparty_names.append(f"{name} {lap + 1}" if lap else name)
+    shares = np.array([c[2] for c in CURRENCIES])
+    counterparty_currency = _pick(np.cumsum(shares) / shares.sum(), rng.random(counterparties))
+    counterparty_buy = rng.beta(2.0, 2.0, counterparties)
+
+    days = np.array([start_date + dt.timedelta(days=d) for d in range(int(years * 365.25))])
+    doy = np.array([d.timetuple().tm_yday for d in days])
+    weekday = np.array([d.weekday() for d in days])
+    day_weight = (
+        np.where(weekday < 5, 1.0, 0.15)
+        * (1.0 + 0.25 * np.cos(2 * np.pi * (doy - 15) / 365.25))  # winter peak
+        * (1.0 + 0.08 * np.arange(len(days)) / 365.25)  # yearly growth
+    )
+
+    # AR(1) in log space: daily moves like a random walk, but pulled back to
+    # the base level so multi-year runs don't drift off to silly prices.
+    shocks = _rng(seed, _STREAM_PRICES).normal(0.0, 0.012, (len(days), products))
+    log_dev = np.empty_like(shocks)
+    level = np.zeros(products)
+    for d in range(len(days)):
+        level = 0.997 * level + shocks[d]
+        log_dev[d] = level
+    seasonal = 0.05 * np.cos(2 * np.pi * (doy - 15) / 365.25)
+    price_level = product_price[:, None] * np.exp(log_dev.T + seasonal[None, :])
+
+    return {
+        "seed": seed,
+        "refs": {
+            "ref_product": list(zip(product_ids.tolist(), product_names)),
+            "ref_counterparty": list(zip(counterparty_ids.tolist(), counterparty_names)),
+            "ref_currency": [(c[0], c[1]) for c in CURRENCIES],
+            "ref_unit": list(UNITS),
+        },
+        "product_ids": product_ids,
+        "product_cdf": _zipf_cdf(products, 1.1),
+        "product_unit": product_unit,
+        "product_volume_mu": product_volume_mu,
+        "counterparty_ids": counterparty_ids,
+        "counterparty_cdf": _zipf_cdf(counterparties, 0.9),
+        "counterparty_currency": counterparty_currency,
+        "counterparty_buy": counterparty_buy,
+        "day_strings": np.array([d.isoformat() for d in days]),
+        "day_cdf": np.cumsum(day_weight) / day_weight.sum(),
+        "price_level": price_level,
+        "currency_ids": np.array([c[0] for c in CURRENCIES]),
+        "unit_ids": np.array([u[0] for u in UNITS]),
+        # the same lookups as byte matrices for render()
+        "day_bytes": _table(d.isoformat() for d in days),
+        "product_bytes": _table(product_ids.tolist()),
+        "counterparty_bytes": _table(counterparty_ids.tolist()),
+        "currency_bytes": _table(c[0] for c in CURRENCIES),
+        "unit_bytes": _table(u[0] for u in UNITS),
+    }
+
+
+# -----------------------------
+# Deals
+# -----------------------------
+
+def _block(model: Dict[str, Any], k: int) -> Dict[str, np.ndarray]:
+    """
+    Block k: deals k * BLOCK_ROWS .. (k + 1) * BLOCK_ROWS - 1 as column arrays
+    (codes into the model's lookup tables where possible).
+    """
+    rng = _rng(model["seed"], _STREAM_DEALS, k)
+    n = BLOCK_ROWS
+    product = _pick(model["product_cdf"], rng.random(n))
+    counterparty = _pick(model["counterparty_cdf"], rng.random(n))
+    day = _pick(model["day_cdf"], rng.random(n))
+    price = model["price_level"][product, day] * rng.lognormal(0.0, 0.02, n)
+    volume = rng.lognormal(model["product_volume_mu"][product], 0.6)
+    note = np.where(rng.random(n) < NOTE_RATE, rng.integers(0, len(NOTES), n), len(NOTES))
+    return {
+        "id": np.arange(k * n, (k + 1) * n, dtype=np.int64) + 1,
+        "day": day,
+        "product": product,
+        "volume": np.clip(np.rint(volume), 1, 2**31 - 1).astype(np.int64),
+        "price_cents": np.clip(np.rint(price * 100), 1, 10**10 - 1).astype(np.int64),
+        "counterparty": counterparty,
+        "currency": model["counterparty_currency"][counterparty],
+        "unit": model["product_unit"][product],
+        "buy": rng.random(n) < model["counterparty_buy"][counterparty],
+        "note": note,
+    }
+
+
+def iter_blocks(model: Dict[str, Any], rows: int, start: int = 0) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Deals start .. start + rows - 1, one block (or part of one) at a time.
+    """
+    stop = start + rows
+    for k in range(start // BLOCK_ROWS, (stop + BLOCK_ROWS - 1) // BLOCK_ROWS):
+        lo, hi = max(start - k * BLOCK_ROWS, 0), min(stop - k * BLOCK_ROWS, BLOCK_ROWS)
+        if lo < hi:
+            yield {name: values[lo:hi] for name, values in _block(model, k).items()}
+
+
+def _digits(values: np.ndarray, width: int, pad: bool = True) -> np.ndarray:
+    """
+    Non-negative integers as an (n, width) ASCII digit matrix. Without pad,
+    leading zeros become NUL bytes (dropped when the block is joined).
+    """
+    dtype = np.uint32 if width <= 9 or values.max(initial=0) < 2**32 else np.int64
+    powers = (10 ** np.arange(width - 1, -1, -1, dtype=np.int64)).astype(dtype)
+    out = (values.astype(dtype)[:, None] // powers % 10).astype(np.uint8) + 48
+    if not pad:
+        blank = values[:, None] < powers
+        blank[:, -1] = False
+        out[blank] = 0
+    return out
+
+
+def _table(strings) -> np.ndarray:
+    """
+    Lookup strings as an (n, longest) byte matrix, NUL-padded.
+    """
+    values = np.array([s.encode() for s in strings], dtype=bytes)
+    return values.view(np.uint8).reshape(len(values), -1)
+
+
+def render(model: Dict[str, Any], block: Dict[str, np.ndarray], sep: str, null: str) -> bytes:
+    """
+    One block as text lines in DEAL_COLUMNS order (CSV: sep=",", null="";
+    COPY text: sep="\\t", null="\\\\N"). Notes contain no separators.
+
+    Every field is a fixed-width byte matrix (digits computed arithmetically,
+    strings taken from NUL-padded lookup tables), the columns are stacked
+    side by side and the padding is dropped from the joined bytes in one go.
+    """
+    n = len(block["id"])
+    cents = block["price_cents"]
+    sep_col = np.full((n, 1), ord(sep), dtype=np.uint8)
+    fields = [
+        np.broadcast_to(np.frombuffer(f"{ID_PREFIX}-".encode(), dtype=np.uint8), (n, len(ID_PREFIX) + 1)),
+        _digits(block["id"], 10),
+        sep_col,
+        model["day_bytes"][block["day"]],
+        sep_col,
+        model["product_bytes"][block["product"]],
+        sep_col,
+        _digits(block["volume"], 10, pad=False),
+        sep_col,
+        _digits(cents // 100, 8, pad=False),
+        np.full((n, 1), ord("."), dtype=np.uint8),
+        _digits(cents % 100, 2),
+        sep_col,
+        model["counterparty_bytes"][block["counterparty"]],
+        sep_col,
+        model["currency_bytes"][block["currency"]],
+        sep_col,
+        model["unit_bytes"][block["unit"]],
+        sep_col,
+        _table(("sell", "buy"))[block["buy"].astype(np.intp)],
+        sep_col,
+        _table(NOTES + (null,))[block["note"]],
+        np.full((n, 1), ord("\n"), dtype=np.uint8),
+    ]
+    flat = np.hstack(fields).ravel()
+    return flat[flat != 0].tobytes()
+
+
+def _tuples(model: Dict[str, Any], block: Dict[str, np.ndarray]) -> Iterator[Tuple]:
+    notes = list(NOTES) + [None]
+    return zip(
+        [f"{ID_PREFIX}-{i:010d}" for i in block["id"].tolist()],
+        model["day_strings"][block["day"]].tolist(),
+        model["product_ids"][block["product"]].tolist(),
+        block["volume"].tolist(),
+        (block["price_cents"] / 100.0).tolist(),
+        model["counterparty_ids"][block["counterparty"]].tolist(),
+        model["currency_ids"][block["currency"]].tolist(),
+        model["unit_ids"][block["unit"]].tolist(),
+        np.where(block["buy"], "buy", "sell").tolist(),
+        [notes[i] for i in block["note"].tolist()],
+    )
+
+
+# -----------------------------
+# Writers
+# -----------------------------
+
+def write_csv(model: Dict[str, Any], out_dir: Path, rows: int, start: int = 0, progress=None) -> int:
+    """
+    <out_dir>/ref_*.csv and deal_event.csv (appended to when start > 0).
+    """
+    registry = load_schema_registry()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for table, refs in model["refs"].items():
+        with open(out_dir / f"{table}.csv", "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(list(registry["tables"][table]["columns"]))
+            writer.writerows(refs)
+
+    done = 0
+    with open(out_dir / "deal_event.csv", "ab" if start else "wb") as f:
+        if not start:
+            f.write((",".join(DEAL_COLUMNS) + "\n").encode())
+        for block in iter_blocks(model, rows, start):
+            f.write(render(model, block, ",", ""))
+            done += len(block["id"])
+            if progress:
+                progress(done)
+    return done
+
+
+def write_postgres(model: Dict[str, Any], conn, rows: int, start: int = 0, progress=None) -> int:
+    """
+    Upsert the ref rows, then COPY the deals one block per transaction.
+    Statement-level triggers (rollups, change feed) fire once per block.
+    """
+    with conn.cursor() as cur:
+        for table, refs in model["refs"].items():
+            key, name = list(load_schema_registry()["tables"][table]["columns"])
+            psycopg2.extras.execute_values(
+                cur, f"INSERT INTO {table} ({key}, {name}) VALUES %s ON CONFLICT DO NOTHING", refs
+            )
+    conn.commit()
+
+    done = 0
+    for block in iter_blocks(model, rows, start):
+        with conn.cursor() as cur:
+            cur.copy_expert(
+                f"COPY deal_event ({', '.join(DEAL_COLUMNS)}) FROM STDIN",
+                io.BytesIO(render(model, block, "\t", "\\N")),
+            )
+        conn.commit()
+        done += len(block["id"])
+        if progress:
+            progress(done)
+    return done
+
+
+def write_sqlite(model: Dict[str, Any], conn: sqlite3.Connection, rows: int, start: int = 0, progress=None) -> int:
+    """
+    Same data into a SQLite file with the mirror's schema (sqlite_mirror.py).
+    """
+    create_schema(conn, load_schema_registry())
+    for table, refs in model["refs"].items():
+        conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?)", refs)
+    done = 0
+    placeholders = ", ".join("?" * len(DEAL_COLUMNS))
+    for block in iter_blocks(model, rows, start):
+        conn.executemany(
+            f"INSERT OR REPLACE INTO deal_event ({', '.join(DEAL_COLUMNS)}) VALUES ({placeholders})",
+            _tuples(model, block),
+        )
+        conn.commit()
+        done += len(block["id"])
+        if progress:
+            progress(done)
+    return done
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Generate seeded synthetic deal data.")
+    parser.add_argument("--rows", type=int, required=True)
+    parser.add_argument("--start", type=int, default=0, help="First deal number (to extend a data set)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--products", type=int, default=12)
+    parser.add_argument("--counterparties", type=int, default=80)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--start-date", type=dt.date.fromisoformat, default=dt.date(2020, 1, 1))
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--csv-dir", type=Path, help="Write CSV files here")
+    target.add_argument("--dsn", help="COPY into this (scratch!) Postgres")
+    target.add_argument("--sqlite", type=Path, help="Write into this SQLite file")
+    args = parser.parse_args(argv)
+
+    model = build_model(args.seed, args.products, args.counterparties, args.years, args.start_date)
+    t0 = time.perf_counter()
+
+    def progress(done: int) -> None:
+        elapsed = time.perf_counter() - t0
+        print(f"  {done:,}/{args.rows:,} rows ({elapsed:.1f} s, {done / max(elapsed, 1e-9):,.0f} rows/s)")
+
+    if args.csv_dir:
+        write_csv(model, args.csv_dir, args.rows, args.start, progress)
+    elif args.dsn:
+        conn = psycopg2.connect(args.dsn)
+        try:
+            write_postgres(model, conn, args.rows, args.start, progress)
+        finally:
+            conn.close()
+    else:
+        conn = connect_mirror(args.sqlite, read_only=False)
+        try:
+            write_sqlite(model, conn, args.rows, args.start, progress)
+        finally:
+            conn.close()
+    print(f"Generated {args.rows:,} deals in {time.perf_counter() - t0:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
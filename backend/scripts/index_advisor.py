@@ -0,0 +1,495 @@
+# backend/scripts/index_advisor.py
+"""
+Propose indexes from the query shapes the API actually ran.
+
+    # 1. let the API trace a share of requests (db_execute spans carry the
+    #    literal-free SQL in db.query.text)
+    TRACE_SAMPLE_RATE=0.2 uvicorn render_service.app.main:app ...
+
+    # 2. offline, against a local copy of the database
+    python -m backend.scripts.index_advisor --dsn postgresql://localhost/bench
+    python -m backend.scripts.index_advisor --dsn ... --build --out migrations/007_advised_indexes.sql
+
+Steps:
+1. read       db_execute spans from logs/traces.jsonl and its rotated files
+              (--traces), grouped by fingerprint: calls and execution ms
+2. columns    per shape and table: equality, range, join and ORDER BY
+              columns (query_shape parser). EXTRACT / DATE_TRUNC on a
+              column is counted as non-sargable: no plain index helps it
+3. candidates btree: equality columns (most frequent across the workload
+              first), then one range or ORDER BY column; BRIN on range
+              columns whose physical order follows the values (pg_stats
+              correlation). Candidates an existing index already covers
+              (same leading columns) are dropped
+4. estimate   EXPLAIN (GENERIC_PLAN) of every affected shape without and
+              with each candidate (Postgres 16+; literals become $n):
+              hypothetical indexes via hypopg when it is installed, else
+              with --build a real CREATE INDEX inside a rolled-back
+              transaction (scratch databases only: it locks the table)
+5. output     migration SQL for candidates saving at least --min-gain of
+              the affected shapes' cost, estimated benefit in comments
+
+Benefit = sum over affected shapes of calls * mean ms * (1 - cost with /
+cost without). Generic plans use default selectivities for ranges, so the
+figures rank candidates rather than predict latencies.
+
+Nothing is applied; without hypopg or --build, Postgres is only read.
+"""
+
+import argparse
+import json
+import re
+import sys
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2
+
+from backend.services.tracing import TRACE_BACKUP_COUNT, TRACE_FILE
+from backend.validator.fingerprint import sql_fingerprint
+from backend.validator.query_shape import expr_columns, parse_query
+from backend.validator.validator import load_schema_registry
+
+EQUALITY_OPS = ("=", "in")
+RANGE_OPS = ("<", ">", "<=", ">=", "between")
+MAX_INDEX_COLUMNS = 3
+
+# '?' with an optional type prefix (DATE '...' became "date ?"), in one pass.
+_PLACEHOLDER = re.compile(r"(?:\b(date|timestamp|interval)\s*)?\?")
+_LIMIT_PLACEHOLDER = re.compile(r"\b(limit|offset)\s+\?")
+
+
+# -----------------------------
+# Logged shapes
+# -----------------------------
+
+def default_trace_files() -> List[Path]:
+    paths = [TRACE_FILE.with_name(f"{TRACE_FILE.name}.{i}") for i in range(TRACE_BACKUP_COUNT, 0, -1)]
+    return [p for p in paths + [TRACE_FILE] if p.exists()]
+
+
+def read_shapes(paths: List[Path]) -> Dict[str, Dict[str, Any]]:
+    """
+    fingerprint -> {"shape", "calls", "total_ms", "max_ms", "errors"} from
+    the db_execute spans of the given trace files.
+    """
+    shapes: Dict[str, Dict[str, Any]] = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                attributes = span.get("attributes") or {}
+                shape = attributes.get("db.query.text")
+                if span.get("name") != "db_execute" or not shape:
+                    continue
+                ms = (span["end_time_unix_nano"] - span["start_time_unix_nano"]) / 1e6
+                fp = attributes.get("db.sql.fingerprint") or sql_fingerprint(shape)
+                entry = shapes.setdefault(fp, {"shape": shape, "calls": 0, "total_ms": 0.0, "max_ms": 0.0, "errors": 0})
+                entry["calls"] += 1
+                entry["total_ms"] += ms
+                entry["max_ms"] = max(entry["max_ms"], ms)
+                if (span.get("status") or {}).get("code") == "STATUS_CODE_ERROR":
+                    entry["errors"] += 1
+    return shapes
+
+
+def _parseable(shape: str) -> str:
+    """
+    A shape with its '?' placeholders turned back into literals the
+    query_shape parser accepts.
+    """
+    text = _LIMIT_PLACEHOLDER.sub(r"\1 1", shape)
+    return _PLACEHOLDER.sub(lambda m: f"{m.group(1)} '?'" if m.group(1) else "'?'", text)
+
+
+def explainable(shape: str) -> str:
+    """
+    A shape as a parameterized statement for EXPLAIN (GENERIC_PLAN).
+    GROUP BY / ORDER BY positions are kept as numbers by query_shape(), so
+    only literals become parameters.
+    """
+    counter = iter(range(1, shape.count("?") + 1))
+    return _PLACEHOLDER.sub(lambda m: f"${next(counter)}::{m.group(1)}" if m.group(1) else f"${next(counter)}", shape)
+
+
+# -----------------------------
+# Columns per shape
+# -----------------------------
+
+def shape_columns(shape: str, registry: Dict[str, Any]) -> Optional[Dict[str, Dict[str, List[str]]]]:
+    """
+    table -> {"eq", "range", "join", "order", "nonsargable"} column lists
+    for one shape, or None if the shape does not parse.
+    """
+    parsed = parse_query(_parseable(shape))
+    if parsed is None:
+        return None
+    tables = registry["tables"]
+
+    def resolve(ref: Tuple[Optional[str], str]) -> Optional[Tuple[str, str]]:
+        table, column = ref
+        if table is None:
+            table = next((t for t in parsed["tables"] if column in tables.get(t, {}).get("columns", {})), None)
+        if table is None or column not in tables.get(table, {}).get("columns", {}):
+            return None
+        return table, column
+
+    usage: Dict[str, Dict[str, List[str]]] = defaultdict(
+        lambda: {"eq": [], "range": [], "join": [], "order": [], "nonsargable": []}
+    )
+
+    def add(kind: str, ref) -> None:
+        resolved = resolve(ref)
+        if resolved and resolved[1] not in usage[resolved[0]][kind]:
+            usage[resolved[0]][kind].append(resolved[1])
+
+    for predicate in parsed["predicates"]:
+        expr = predicate.get("expr")
+        if expr is None:
+            continue
+        if expr["kind"] in ("extract", "date_trunc"):
+            for ref in expr_columns(expr):
+                add("nonsargable", ref)
+        elif expr["kind"] == "column" and predicate["op"] in EQUALITY_OPS:
+            add("eq", (expr["table"], expr["column"]))
+        elif expr["kind"] == "column" and predicate["op"] in RANGE_OPS:
+            add("range", (expr["table"], expr["column"]))
+
+    # A join key on the many side is worth indexing when the other side is
+    # filtered (nested loop into the big table instead of scanning it).
+    filtered = {t for t, u in usage.items() if u["eq"] or u["range"]}
+    for join in parsed["joins"]:
+        if not join["left"] or not join["right"]:
+            continue
+        for this, other in ((join["left"], join["right"]), (join["right"], join["left"])):
+            resolved_other = resolve(other)
+            if resolved_other and resolved_other[0] in filtered:
+                add("join", this)
+
+    # ORDER BY ... LIMIT can read an index in order and stop early.
+    if parsed["limit"] is not None:
+        for item in parsed["order_by"]:
+            if item["expr"]["kind"] == "column":
+                add("order", (item["expr"]["table"], item["expr"]["column"]))
+    return dict(usage)
+
+
+# -----------------------------
+# Candidates
+# -----------------------------
+
+def _index_name(table: str, columns: Tuple[str, ...], method: str) -> str:
+    name = f"{table}_{'_'.join(columns)}_{'brin' if method == 'brin' else 'idx'}"
+    return name[:63]
+
+
+def candidate_indexes(shapes: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    btree candidates (one per shape and table) from the shapes' columns,
+    keyed by (table, method, columns), with the fingerprints they serve.
+    """
+    frequency: Counter = Counter()
+    for entry in shapes.values():
+        for table, usage in (entry["columns"] or {}).items():
+            for column in usage["eq"] + usage["join"]:
+                frequency[(table, column)] += entry["calls"]
+
+    candidates: Dict[Tuple, Dict[str, Any]] = {}
+    for fp, entry in shapes.items():
+        for table, usage in (entry["columns"] or {}).items():
+            leading = sorted(set(usage["eq"] + usage["join"]), key=lambda c: (-frequency[(table, c)], c))
+            trailing = usage["range"][:1] or [c for c in usage["order"] if c not in leading][:1]
+            columns = tuple((leading + trailing)[:MAX_INDEX_COLUMNS])
+            if not columns:
+                continue
+            key = (table, "btree", columns)
+            candidate = candidates.setdefault(key, {"table": table, "method": "btree", "columns": columns, "shapes": []})
+            candidate["shapes"].append(fp)
+    return list(candidates.values())
+
+
+def brin_candidates(conn, shapes: Dict[str, Dict[str, Any]], min_correlation: float) -> List[Dict[str, Any]]:
+    """
+    BRIN on range columns stored in roughly value order (append-only dates):
+    tiny, and as good as a btree for wide ranges on such columns.
+    """
+    wanted: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+    for fp, entry in shapes.items():
+        for table, usage in (entry["columns"] or {}).items():
+            for column in usage["range"]:
+                wanted[(table, column)].append(fp)
+    candidates = []
+    with conn.cursor() as cur:
+        for (table, column), fps in sorted(wanted.items()):
+            cur.execute(
+                "SELECT correlation FROM pg_stats WHERE schemaname = 'public' AND tablename = %s AND attname = %s",
+                (table, column),
+            )
+            row = cur.fetchone()
+            if row and row[0] is not None and abs(row[0]) >= min_correlation:
+                candidates.append({"table": table, "method": "brin", "columns": (column,), "shapes": fps,
+                                   "correlation": round(row[0], 3)})
+    return candidates
+
+
+def existing_indexes(conn) -> Dict[str, List[Tuple[str, Tuple[str, ...]]]]:
+    """
+    table -> [(access method, key columns)] for the public schema.
+    """
+    out: Dict[str, List[Tuple[str, Tuple[str, ...]]]] = defaultdict(list)
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT t.relname, am.amname,
+                   array(SELECT a.attname FROM unnest(ix.indkey) WITH ORDINALITY k(attnum, n)
+                         JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+                         ORDER BY k.n)
+            FROM pg_index ix
+            JOIN pg_class t ON t.oid = ix.indrelid
+            JOIN pg_class i ON i.oid = ix.indexrelid
+            JOIN pg_am am ON am.oid = i.relam
+            JOIN pg_namespace n ON n.oid = t.relnamespace
+            WHERE n.nspname = 'public'
+            """
+        )
+        for table, method, columns in cur.fetchall():
+            out[table].append((method, tuple(columns)))
+    return out
+
+
+def covered(candidate: Dict[str, Any], existing: Dict[str, List[Tuple[str, Tuple[str, ...]]]]) -> bool:
+    columns = candidate["columns"]
+    for method, index_columns in existing.get(candidate["table"], []):
+        if candidate["method"] == "brin":
+            if index_columns[:1] == columns:
+                return True
+        elif method == "btree" and index_columns[:len(columns)] == columns:
+            return True
+    return False
+
+
+def create_statement(candidate: Dict[str, Any]) -> str:
+    using = " USING brin" if candidate["method"] == "brin" else ""
+    return (f"CREATE INDEX IF NOT EXISTS {_index_name(candidate['table'], candidate['columns'], candidate['method'])} "
+            f"ON {candidate['table']}{using} ({', '.join(candidate['columns'])})")
+
+
+# -----------------------------
+# Estimates
+# -----------------------------
+
+def _plan_cost(cur, sql: str) -> float:
+    cur.execute("EXPLAIN (GENERIC_PLAN, FORMAT JSON) " + sql)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return float(plan[0]["Plan"]["Total Cost"])
+
+
+def estimate_mode(conn, build: bool) -> Optional[str]:
+    """
+    "hypopg", "build" or None (no estimates possible).
+    """
+    if conn.server_version < 160000:
+        return None
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'hypopg'")
+        if cur.fetchone():
+            return "hypopg"
+    return "build" if build else None
+
+
+def estimate(conn, candidates: List[Dict[str, Any]], shapes: Dict[str, Dict[str, Any]], mode: str) -> None:
+    """
+    Adds "cost_before" / "cost_after" per shape and "benefit_ms" / "gain"
+    (share of the affected shapes' cost saved) to each candidate.
+    """
+    baseline: Dict[str, Optional[float]] = {}
+    with conn.cursor() as cur:
+        for candidate in candidates:
+            for fp in candidate["shapes"]:
+                if fp in baseline:
+                    continue
+                try:
+                    baseline[fp] = _plan_cost(cur, explainable(shapes[fp]["shape"]))
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    baseline[fp] = None
+                    shapes[fp]["explain_error"] = str(e).strip().splitlines()[0]
+        conn.rollback()
+
+        for candidate in candidates:
+            statement = create_statement(candidate)
+            try:
+                if mode == "hypopg":
+                    cur.execute("SELECT indexrelid, hypopg_relation_size(indexrelid) FROM hypopg_create_index(%s)",
+                                (statement,))
+                    index_oid, size = cur.fetchone()
+                else:
+                    cur.execute(statement)
+                    cur.execute("SELECT pg_relation_size(%s::regclass)",
+                                (_index_name(candidate["table"], candidate["columns"], candidate["method"]),))
+                    size = cur.fetchone()[0]
+                candidate["size_bytes"] = size
+
+                per_shape, before_ms, saved_ms = {}, 0.0, 0.0
+                for fp in candidate["shapes"]:
+                    before = baseline.get(fp)
+                    if not before:
+                        continue
+                    after = _plan_cost(cur, explainable(shapes[fp]["shape"]))
+                    per_shape[fp] = {"cost_before": round(before, 1), "cost_after": round(after, 1)}
+                    before_ms += shapes[fp]["total_ms"]
+                    saved_ms += shapes[fp]["total_ms"] * max(0.0, 1.0 - after / before)
+                candidate["per_shape"] = per_shape
+                candidate["benefit_ms"] = round(saved_ms, 1)
+                candidate["gain"] = round(saved_ms / before_ms, 3) if before_ms else 0.0
+                if mode == "hypopg":
+                    cur.execute("SELECT hypopg_drop_index(%s)", (index_oid,))
+            except psycopg2.Error as e:
+                candidate["error"] = str(e).strip().splitlines()[0]
+            finally:
+                conn.rollback()
+
+
+# -----------------------------
+# Report / migration
+# -----------------------------
+
+def advise(conn, shapes: Dict[str, Dict[str, Any]], build: bool = False,
+           min_correlation: float = 0.9) -> Dict[str, Any]:
+    registry = load_schema_registry()
+    for entry in shapes.values():
+        entry["columns"] = shape_columns(entry["shape"], registry)
+
+    existing = existing_indexes(conn)
+    proposed = candidate_indexes(shapes) + brin_candidates(conn, shapes, min_correlation)
+    candidates = [c for c in proposed if not covered(c, existing)]
+    mode = estimate_mode(conn, build)
+    if mode:
+        estimate(conn, candidates, shapes, mode)
+    for candidate in candidates:
+        candidate["calls"] = sum(shapes[fp]["calls"] for fp in candidate["shapes"])
+        candidate["logged_ms"] = round(sum(shapes[fp]["total_ms"] for fp in candidate["shapes"]), 1)
+    candidates.sort(key=lambda c: (-c.get("benefit_ms", c["logged_ms"]), c["table"], c["columns"]))
+
+    column_usage: Counter = Counter()
+    nonsargable: Counter = Counter()
+    for entry in shapes.values():
+        for table, usage in (entry["columns"] or {}).items():
+            for kind in ("eq", "range", "join", "order"):
+                for column in usage[kind]:
+                    column_usage[(table, column, kind)] += entry["calls"]
+            for column in usage["nonsargable"]:
+                nonsargable[(table, column)] += entry["calls"]
+
+    return {
+        "mode": mode,
+        "shapes": len(shapes),
+        "calls": sum(e["calls"] for e in shapes.values()),
+        "unparsed": [fp for fp, e in shapes.items() if e["columns"] is None],
+        "column_usage": [{"table": t, "column": c, "use": k, "calls": n} for (t, c, k), n in column_usage.most_common()],
+        "nonsargable": [{"table": t, "column": c, "calls": n} for (t, c), n in nonsargable.most_common()],
+        "candidates": candidates,
+        "skipped_existing": [c for c in proposed if covered(c, existing)],
+    }
+
+
+def migration_sql(report: Dict[str, Any], min_gain: float) -> str:
+    how = {"hypopg": "hypothetical indexes (hypopg)", "build": "indexes built in rolled-back transactions",
+           None: "not estimated (needs Postgres 16+ and hypopg or --build); ranked by logged time"}[report["mode"]]
+    lines = [
+        f"-- Index advisor: {report['calls']:,} logged calls over {report['shapes']} query shapes.",
+        f"-- Benefit: {how}.",
+        "-- On a live database prefer CREATE INDEX CONCURRENTLY (outside a transaction).",
+        "",
+    ]
+    chosen = 0
+    for c in report["candidates"]:
+        if report["mode"] and (c.get("error") or c.get("gain", 0.0) < min_gain):
+            continue
+        summary = f"{len(c['shapes'])} shapes, {c['calls']:,} calls, {c['logged_ms']:,.0f} ms logged"
+        if "benefit_ms" in c:
+            summary += f", est. {c['benefit_ms']:,.0f} ms saved ({c['gain']:.0%})"
+        if c.get("size_bytes"):
+            summary += f", ~{c['size_bytes'] / 2**20:,.1f} MiB"
+        if c.get("correlation") is not None:
+            summary += f", correlation {c['correlation']}"
+        lines.append(f"-- {c['table']} {c['method']} ({', '.join(c['columns'])}): {summary}")
+        lines.append(create_statement(c) + ";")
+        lines.append("")
+        chosen += 1
+    if not chosen:
+        lines.append("-- No index is worth adding for this workload.")
+    return "\n".join(lines).rstrip() + "\n"
+
+
+def print_report(report: Dict[str, Any], shapes: Dict[str, Dict[str, Any]]) -> None:
+    print("===============================================")
+    print(f"{report['calls']:,} calls, {report['shapes']} shapes, estimates: {report['mode'] or 'none'}")
+    print("-----------------------------------------------")
+    print(f"{'table.column':<36}{'use':<8}{'calls':>8}")
+    for u in report["column_usage"]:
+        print(f"{u['table'] + '.' + u['column']:<36}{u['use']:<8}{u['calls']:>8,}")
+    for u in report["nonsargable"]:
+        print(f"{u['table'] + '.' + u['column']:<36}{'nonsarg':<8}{u['calls']:>8,}")
+    print("-----------------------------------------------")
+    for c in report["candidates"]:
+        gain = f"{c['gain']:.0%}" if "gain" in c else "-"
+        print(f"{c['table']} {c['method']} ({', '.join(c['columns'])}): {c['calls']:,} calls, "
+              f"{c['logged_ms']:,.0f} ms logged, est. saved {c.get('benefit_ms', '-')} ms ({gain})"
+              + (f"  ERROR: {c['error']}" if c.get("error") else ""))
+    for fp in report["unparsed"]:
+        print(f"unparsed: {shapes[fp]['shape'][:100]}")
+    for fp, e in shapes.items():
+        if e.get("explain_error"):
+            print(f"explain failed ({e['explain_error']}): {e['shape'][:80]}")
+    print("===============================================")
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Propose indexes from logged query shapes.")
+    parser.add_argument("--dsn", required=True, help="Local Postgres with production-like data and statistics")
+    parser.add_argument("--traces", nargs="*", type=Path, help="Trace files (default: TRACE_FILE and its rotations)")
+    parser.add_argument("--build", action="store_true",
+                        help="Without hypopg: build each candidate in a rolled-back transaction (scratch DB only)")
+    parser.add_argument("--min-gain", type=float, default=0.2,
+                        help="Smallest share of the affected shapes' cost an index must save")
+    parser.add_argument("--brin-correlation", type=float, default=0.9)
+    parser.add_argument("--out", type=Path, help="Write the migration SQL here (default: stdout)")
+    parser.add_argument("--json", type=Path, help="Write the full report as JSON")
+    args = parser.parse_args(argv)
+
+    paths = args.traces if args.traces is not None else default_trace_files()
+    shapes = read_shapes(paths)
+    if not shapes:
+        print("No db_execute spans with db.query.text in:", ", ".join(map(str, paths)) or "(no trace files)")
+        sys.exit(1)
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        report = advise(conn, shapes, args.build, args.brin_correlation)
+    finally:
+        conn.close()
+
+    print_report(report, shapes)
+    sql = migration_sql(report, args.min_gain)
+    if args.out:
+        args.out.write_text(sql, encoding="utf-8")
+        print("Migration written to:", args.out)
+    else:
+        print(sql)
+    if args.json:
+        args.json.write_text(json.dumps({**report, "shapes": shapes}, indent=2, default=list), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# backend/scripts/ingest_deals.py
+"""
+Bulk-load deal files into deal_event (backend.services.ingest).
+
+    python -m backend.scripts.ingest_deals --dsn postgresql://localhost/deals deals_2025-01.csv
+    python -m backend.scripts.ingest_deals --dsn ... exports/*.jsonl.gz --rejects-dir rejects/
+
+Each file is validated against metadata/schema_registry.json and the ref
+tables, loaded with COPY in batches, and is idempotent on deal_id: running
+the same file twice inserts nothing the second time. Rejected rows are
+written next to the input as <file>.rejects.jsonl (or into --rejects-dir).
+
+Exit status is 1 if any file failed or had rejected rows.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+import psycopg2
+
+from backend.services.ingest import FORMATS, INGEST_BATCH_ROWS, INGEST_WORKERS, ingest_file
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Bulk-load CSV / JSONL deal files.")
+    parser.add_argument("files", nargs="+", type=Path)
+    parser.add_argument("--dsn", required=True, help="Postgres DSN (data is written!)")
+    parser.add_argument("--format", choices=FORMATS, help="Default: from the file extension")
+    parser.add_argument("--batch-rows", type=int, default=INGEST_BATCH_ROWS)
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Concurrent loader connections")
+    parser.add_argument("--rejects-dir", type=Path, help="Default: next to each input file")
+    parser.add_argument("--json", action="store_true", help="Print summaries as JSON lines")
+    args = parser.parse_args(argv)
+
+    if args.rejects_dir:
+        args.rejects_dir.mkdir(parents=True, exist_ok=True)
+
+    ok = True
+    conn = psycopg2.connect(args.dsn)
+    try:
+        for path in args.files:
+            reject_path = (args.rejects_dir or path.parent) / f"{path.name}.rejects.jsonl"
+            summary = ingest_file(conn, path, fmt=args.format, reject_path=reject_path,
+                                  batch_rows=args.batch_rows, max_rejects_returned=0,
+                                  connect=lambda: psycopg2.connect(args.dsn), workers=args.workers)
+            summary.pop("rejects", None)
+            ok = ok and "error" not in summary and not summary.get("rejected")
+            if args.json:
+                print(json.dumps({"file": str(path), **summary}))
+                continue
+            print(f"{path}: {summary.get('rows', 0):,} rows in {summary.get('seconds', 0):.1f} s "
+                  f"({summary.get('rows_per_s') or 0:,}/s) -> {summary.get('inserted', 0):,} inserted, "
+                  f"{summary.get('duplicates', 0):,} duplicates, {summary.get('rejected', 0):,} rejected")
+            if summary.get("reject_file"):
+                print("  rejects:", summary["reject_file"])
+            if summary.get("ignored_columns"):
+                print("  ignored columns:", ", ".join(summary["ignored_columns"]))
+            if "error" in summary:
+                print("  ERROR:", summary["error"])
+    finally:
+        conn.close()
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+# backend/scripts/llm_stub_server.py
+"""
+Local OpenAI-compatible chat-completions stub for offline load testing.
+
+Serves POST /v1/chat/completions with the same request/response shape as the
+real OpenAI API (including `stream=true` server-sent events), but instead of
+calling a model it maps the last user message to SQL using regex rules.
+
+Point the chat handler at it with:
+
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1
+    OPENAI_API_KEY=stub            (any non-empty value)
+
+Run it from the project root:
+
+    python -m backend.scripts.llm_stub_server --port 8089
+
+Behaviour is controlled through environment variables (or CLI flags):
+
+- LLM_STUB_RULES       path to a JSON file: [{"pattern": "...", "sql": "..."}, ...]
+                       Named regex groups can be used in the SQL, e.g. {year}.
+                       Rules with "plan" instead of "sql" answer the compound
+                       query planner prompt (backend.services.planner).
+- LLM_STUB_LATENCY     latency distribution in ms:
+                         "fixed:200", "uniform:100,400",
+                         "normal:300,50", "lognormal:250,0.5" (median, sigma)
+- LLM_STUB_ERROR_RATE  fraction of requests answered with an API error (0..1)
+- LLM_STUB_SEED        seed for latency / error sampling (deterministic runs)
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+# -----------------------------
+# Default question -> SQL rules
+# -----------------------------
+
+# Every SQL template here passes Validator v1, so the full pipeline
+# (validator + DB execution) is exercised when running against the stub.
+DEFAULT_RULES: List[Dict[str, str]] = [
+    {
+        "pattern": r"(volume|quantity).*product.*(?P<year>20\d\d)",
+        "sql": (
+            "SELECT ref_product.product_name, SUM(volume) AS total_volume "
+            "FROM deal_event "
+            "JOIN ref_product ON deal_event.product_id = ref_product.product_id "
+            "WHERE EXTRACT(YEAR FROM deal_date) = {year} "
+            "GROUP BY ref_product.product_name ORDER BY total_volume DESC"
+        ),
+    },
+    {
+        "pattern": r"(volume|quantity).*product",
+        "sql": (
+            "SELECT ref_product.product_name, SUM(volume) AS total_volume "
+            "FROM deal_event "
+            "JOIN ref_product ON deal_event.product_id = ref_product.product_id "
+            "GROUP BY ref_product.product_name ORDER BY total_volume DESC"
+        ),
+    },
+    {
+        "pattern": r"counterpart",
+        "sql": (
+            "SELECT ref_counterparty.counterparty_name, SUM(volume) AS total_volume, COUNT(*) AS deals "
+            "FROM deal_event "
+            "JOIN ref_counterparty ON deal_event.counterparty_id = ref_counterparty.counterparty_id "
+            "GROUP BY ref_counterparty.counterparty_name ORDER BY total_volume DESC LIMIT 20"
+        ),
+    },
+    {
+        "pattern": r"(daily|per day).*price",
+        "sql": (
+            "SELECT deal_date, AVG(price_usd_per_mt) AS avg_price "
+            "FROM deal_event GROUP BY deal_date ORDER BY deal_date"
+        ),
+    },
+    {
+        "pattern": r"(average|avg|mean).*price",
+        "sql": (
+            "SELECT product_id, AVG(price_usd_per_mt) AS avg_price "
+            "FROM deal_event GROUP BY product_id ORDER BY product_id"
+        ),
+    },
+    {
+        "pattern": r"month",
+        "sql": (
+            "SELECT DATE_TRUNC('month', deal_date) AS month, SUM(volume) AS total_volume "
+            "FROM deal_event GROUP BY DATE_TRUNC('month', deal_date) ORDER BY month"
+        ),
+    },
+    {
+        "pattern": r"\b(?P<direction>buy|sell)s?\b",
+        "sql": (
+            "SELECT deal_id, deal_date, product_id, volume, price_usd_per_mt "
+            "FROM deal_event WHERE direction = '{direction}' "
+            "ORDER BY deal_date DESC LIMIT 100"
+        ),
+    },
+]
+
+# Answers to the planner prompt (backend.services.planner). Questions no
+# plan rule matches get a single query from DEFAULT_RULES, as a model would.
+DEFAULT_PLAN_RULES: List[Dict] = [
+    {
+        "pattern": r"(volume|quantity).*product.*(?P<first>20\d\d)\s*(vs\.?|versus|and|to|against)\s*(?P<second>20\d\d)",
+        "plan": {
+            "queries": [
+                {"name": "y{first}", "sql": (
+                    "SELECT ref_product.product_name, SUM(volume) AS total_volume FROM deal_event "
+                    "JOIN ref_product ON deal_event.product_id = ref_product.product_id "
+                    "WHERE EXTRACT(YEAR FROM deal_date) = {first} GROUP BY ref_product.product_name")},
+                {"name": "y{second}", "sql": (
+                    "SELECT ref_product.product_name, SUM(volume) AS total_volume FROM deal_event "
+                    "JOIN ref_product ON deal_event.product_id = ref_product.product_id "
+                    "WHERE EXTRACT(YEAR FROM deal_date) = {second} GROUP BY ref_product.product_name")},
+            ],
+            "combine": {"op": "compare", "keys": ["product_name"], "values": ["total_volume"],
+                        "fill_missing": 0, "order_by": "diff", "desc": True},
+        },
+    },
+    {
+        "pattern": r"counterpart.*(share|percent|%)",
+        "plan": {
+            "queries": [
+                {"name": "counterparties", "sql": (
+                    "SELECT ref_counterparty.counterparty_name, SUM(volume) AS total_volume FROM deal_event "
+                    "JOIN ref_counterparty ON deal_event.counterparty_id = ref_counterparty.counterparty_id "
+                    "GROUP BY ref_counterparty.counterparty_name ORDER BY total_volume DESC LIMIT 10")},
+                {"name": "total", "sql": "SELECT SUM(volume) AS total_volume FROM deal_event"},
+            ],
+            "combine": {"op": "share", "keys": ["counterparty_name"], "values": ["total_volume"]},
+        },
+    },
+    {
+        "pattern": r"(buy|sell).*ratio|ratio.*(buy|sell)",
+        "plan": {
+            "queries": [
+                {"name": "buys", "sql": (
+                    "SELECT product_id, SUM(volume) AS total_volume FROM deal_event "
+                    "WHERE direction = 'buy' GROUP BY product_id")},
+                {"name": "sells", "sql": (
+                    "SELECT product_id, SUM(volume) AS total_volume FROM deal_event "
+                    "WHERE direction = 'sell' GROUP BY product_id")},
+            ],
+            "combine": {"op": "ratio", "keys": ["product_id"], "values": ["total_volume"],
+                        "order_by": "ratio", "desc": True},
+        },
+    },
+]
+
+# Only the planner prompt asks for this.
+PLANNER_PROMPT_MARKER = '"queries"'
+
+FALLBACK_SQL = (
+    "SELECT deal_id, deal_date, product_id, volume, price_usd_per_mt, direction "
+    "FROM deal_event ORDER BY deal_date DESC LIMIT 50"
+)
+
+
+def load_rules(path: Optional[str], kind: str = "sql") -> List[Tuple[re.Pattern, str]]:
+    """
+    Load and compile question -> SQL rules (kind="sql") or question -> plan
+    rules (kind="plan", plans serialized to JSON).
+    Rules from a JSON file are tried before the built-in defaults.
+    """
+    rules: List[Dict] = []
+    if path:
+        with Path(path).open("r", encoding="utf-8") as f:
+            rules.extend(json.load(f))
+    rules.extend(DEFAULT_RULES if kind == "sql" else DEFAULT_PLAN_RULES)
+    return [
+        (re.compile(r["pattern"], re.IGNORECASE), r[kind] if kind == "sql" else json.dumps(r[kind]))
+        for r in rules if kind in r
+    ]
+
+
+def answer_for(question: str, rules: List[Tuple[re.Pattern, str]], fallback: Optional[str] = FALLBACK_SQL) -> Optional[str]:
+    """
+    Return the answer of the first matching rule (or the fallback).
+    """
+    for pattern, answer in rules:
+        m = pattern.search(question)
+        if m:
+            # Plain replacement: plan answers are JSON, full of braces.
+            for name, value in m.groupdict().items():
+                if value is not None:
+                    answer = answer.replace("{" + name + "}", value)
+            return answer
+    return fallback
+
+
+# -----------------------------
+# Latency / error simulation
+# -----------------------------
+
+def parse_latency(spec: str):
+    """
+    Turn a latency spec like "uniform:100,400" into a sampler returning seconds.
+    """
+    kind, _, args = spec.partition(":")
+    params = [float(x) for x in args.split(",") if x.strip()] if args else []
+    kind = kind.strip().lower()
+
+    if kind == "fixed":
+        ms = params[0] if params else 0.0
+        return lambda rng: ms / 1000.0
+    if kind == "uniform":
+        lo, hi = params
+        return lambda rng: rng.uniform(lo, hi) / 1000.0
+    if kind == "normal":
+        mu, sigma = params
+        return lambda rng: max(0.0, rng.gauss(mu, sigma)) / 1000.0
+    if kind == "lognormal":
+        median, sigma = params
+        mu = math.log(median)
+        return lambda rng: rng.lognormvariate(mu, sigma) / 1000.0
+
+    raise ValueError(f"Unknown latency distribution '{spec}'.")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count (~4 chars per token), good enough for usage accounting.
+    """
+    return max(1, len(text) // 4)
+
+
+# -----------------------------
+# App
+# -----------------------------
+
+app = FastAPI(
+    title="OpenAI stub",
+    version="0.1.0",
+    description="Offline OpenAI-compatible chat-completions stub for load tests.",
+)
+
+STATE: Dict = {}
+
+
+def configure(
+    rules_path: Optional[str] = None,
+    latency: str = "fixed:0",
+    error_rate: float = 0.0,
+    seed: Optional[int] = None,
+) -> None:
+    """
+    (Re)configure the stub. Called at import time from env vars and again
+    from the CLI entry point with any flags given.
+    """
+    STATE["rules"] = load_rules(rules_path)
+    STATE["plan_rules"] = load_rules(rules_path, kind="plan")
+    STATE["latency"] = parse_latency(latency)
+    STATE["error_rate"] = error_rate
+    STATE["rng"] = random.Random(seed)
+    STATE["requests"] = 0
+    STATE["errors"] = 0
+
+
+configure(
+    rules_path=os.getenv("LLM_STUB_RULES"),
+    latency=os.getenv("LLM_STUB_LATENCY", "fixed:0"),
+    error_rate=float(os.getenv("LLM_STUB_ERROR_RATE", "0")),
+    seed=int(os.environ["LLM_STUB_SEED"]) if os.getenv("LLM_STUB_SEED") else None,
+)
+
+
+@app.get("/health")
+def health():
+    return {
+        "status": "ok",
+        "service": "llm-stub",
+        "requests": STATE["requests"],
+        "errors": STATE["errors"],
+    }
+
+
+@app.get("/v1/models")
+def list_models():
+    return {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "local"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """
+    OpenAI-compatible chat completion. Supports `stream: true` (SSE chunks).
+    """
+    body = await request.json()
+    model = body.get("model", "stub")
+    messages = body.get("messages", [])
+    question = next(
+        (m.get("content", "") for m in reversed(messages) if m.get("role") == "user"),
+        "",
+    )
+
+    rng = STATE["rng"]
+    STATE["requests"] += 1
+    delay = STATE["latency"](rng)
+    fail = rng.random() < STATE["error_rate"]
+    streaming = bool(body.get("stream"))
+
+    # Streaming answers send headers after ~20% of the latency (time to
+    # first token) and spread the rest over the chunks.
+    await asyncio.sleep(delay * 0.2 if streaming and not fail else delay)
+
+    if fail:
+        STATE["errors"] += 1
+        return JSONResponse(
+            status_code=500,
+            content={
+                "error": {
+                    "message": "Injected stub failure.",
+                    "type": "server_error",
+                    "code": "stub_error",
+                }
+            },
+        )
+
+    planning = any(m.get("role") == "system" and PLANNER_PROMPT_MARKER in m.get("content", "") for m in messages)
+    sql = (planning and answer_for(question, STATE["plan_rules"], fallback=None)) or answer_for(question, STATE["rules"])
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+    completion_tokens = estimate_tokens(sql)
+
+    if streaming:
+        usage = None
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+        return StreamingResponse(
+            _stream_chunks(completion_id, created, model, sql, usage, delay * 0.8),
+            media_type="text/event-stream",
+        )
+
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": sql},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+async def _stream_chunks(completion_id: str, created: int, model: str, sql: str,
+                         usage: Optional[Dict] = None, generation_time: float = 0.0):
+    """
+    Emit the SQL as chat.completion.chunk events, a few words at a time.
+    With stream_options.include_usage, a final chunk carries token usage.
+    """
+    def chunk(delta: Dict, finish_reason: Optional[str] = None) -> str:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(payload)}\n\n"
+
+    yield chunk({"role": "assistant", "content": ""})
+
+    words = sql.split(" ")
+    n_chunks = max(1, math.ceil(len(words) / 4))
+    for i in range(0, len(words), 4):
+        await asyncio.sleep(generation_time / n_chunks)
+        piece = " ".join(words[i:i + 4])
+        if i + 4 < len(words):
+            piece += " "
+        yield chunk({"content": piece})
+
+    yield chunk({}, finish_reason="stop")
+    if usage is not None:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [],
+            "usage": usage,
+        }
+        yield f"data: {json.dumps(payload)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the local OpenAI-compatible stub.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--rules", default=os.getenv("LLM_STUB_RULES"))
+    parser.add_argument("--latency", default=os.getenv("LLM_STUB_LATENCY", "fixed:0"))
+    parser.add_argument("--error-rate", type=float, default=float(os.getenv("LLM_STUB_ERROR_RATE", "0")))
+    parser.add_argument("--seed", type=int, default=int(os.environ["LLM_STUB_SEED"]) if os.getenv("LLM_STUB_SEED") else None)
+    args = parser.parse_args()
+
+    configure(
+        rules_path=args.rules,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
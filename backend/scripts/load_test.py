@@ -0,0 +1,399 @@
+# backend/scripts/load_test.py
+"""
+End-to-end load generator for the /chat pipeline.
+
+Replays a question mix against one or more endpoints of a running API and
+reports throughput, latency percentiles (overall and per stage), error rates
+and server memory growth.
+
+Typical offline setup (everything on localhost):
+
+    # 1. LLM stub
+    python -m backend.scripts.llm_stub_server --port 8089 --latency lognormal:300,0.4
+
+    # 2. API pointed at the stub and a local Postgres
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 DB_HOST=127.0.0.1 ... \
+        uvicorn render_service.app.main:app --port 8000
+
+    # 3. Load
+    python -m backend.scripts.load_test --concurrency 16 --duration 60 \
+        --server-pid $(pgrep -f "uvicorn render_service") --json report.json
+
+Two load models are supported:
+- closed loop (--concurrency N): N workers, each sends the next request
+  as soon as the previous one finishes.
+- open loop (--rate R): Poisson arrivals at R requests/second, independent
+  of how fast the server answers (shows queueing under overload).
+
+Per-stage timings are read from the `Server-Timing` response header
+(`name;dur=ms` entries) when the server sends one; client-side `ttfb` and
+`total` are always recorded.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+DEFAULT_QUESTIONS = [
+    "Total volume by product in 2024",
+    "Total volume by product",
+    "Top counterparties by volume",
+    "Average price by product",
+    "Monthly volume",
+    "Daily average price",
+    "Show me the latest sells",
+    "Show me the latest buys",
+    "List recent deals",
+]
+
+
+# -----------------------------
+# Helpers
+# -----------------------------
+
+def load_question_mix(path: Optional[str]) -> List[Dict]:
+    """
+    Load the question mix.
+
+    Accepts a plain text file (one question per line) or a JSON list of
+    {"question": "...", "weight": 3} objects. Defaults to DEFAULT_QUESTIONS.
+    """
+    if not path:
+        return [{"question": q, "weight": 1.0} for q in DEFAULT_QUESTIONS]
+
+    text = Path(path).read_text(encoding="utf-8")
+    if path.endswith(".json"):
+        items = json.loads(text)
+        return [
+            {"question": i["question"], "weight": float(i.get("weight", 1.0))}
+            for i in items
+        ]
+
+    return [
+        {"question": line.strip(), "weight": 1.0}
+        for line in text.splitlines()
+        if line.strip() and not line.startswith("#")
+    ]
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """
+    Parse a Server-Timing header into {stage: duration_ms}.
+    """
+    stages: Dict[str, float] = {}
+    if not header:
+        return stages
+
+    for entry in header.split(","):
+        parts = [p.strip() for p in entry.split(";")]
+        name = parts[0]
+        for p in parts[1:]:
+            if p.startswith("dur="):
+                try:
+                    stages[name] = float(p[4:])
+                except ValueError:
+                    pass
+    return stages
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile on an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def read_rss_kb(pid: int) -> Optional[int]:
+    """
+    Resident set size of a local process in KiB (Linux /proc), or None.
+    """
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+# -----------------------------
+# Load generator
+# -----------------------------
+
+class LoadRun:
+    """
+    Collects per-request samples for one load run.
+    """
+
+    def __init__(self, base_url: str, endpoints: List[str], questions: List[Dict], seed: int):
+        self.base_url = base_url.rstrip("/")
+        self.endpoints = endpoints
+        self.questions = [q["question"] for q in questions]
+        self.weights = [q["weight"] for q in questions]
+        self.rng = random.Random(seed)
+
+        self.samples: List[Dict] = []
+        self.rss_samples: List[int] = []
+        self.started = 0.0
+        self.finished = 0.0
+
+    def next_request(self):
+        question = self.rng.choices(self.questions, weights=self.weights, k=1)[0]
+        endpoint = self.rng.choice(self.endpoints)
+        return endpoint, question
+
+    async def one_request(self, client: httpx.AsyncClient, endpoint: str, question: str):
+        sample = {
+            "endpoint": endpoint,
+            "question": question,
+            "ok": False,
+            "http_status": None,
+            "outcome": None,
+            "stages": {},
+            "bytes": 0,
+        }
+        t0 = time.perf_counter()
+        try:
+            async with client.stream("POST", endpoint, json={"question": question}) as resp:
+                ttfb = None
+                chunks = []
+                async for chunk in resp.aiter_bytes():
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - t0
+                    chunks.append(chunk)
+                body = b"".join(chunks)
+
+            total = time.perf_counter() - t0
+            sample["http_status"] = resp.status_code
+            sample["bytes"] = len(body)
+            sample["stages"] = parse_server_timing(resp.headers.get("server-timing"))
+            sample["stages"]["ttfb"] = (ttfb if ttfb is not None else total) * 1000.0
+            sample["stages"]["total"] = total * 1000.0
+            sample["outcome"] = _outcome(resp.status_code, resp.headers.get("content-type", ""), body)
+            sample["ok"] = sample["outcome"] == "ok"
+        except httpx.HTTPError as e:
+            sample["stages"]["total"] = (time.perf_counter() - t0) * 1000.0
+            sample["outcome"] = f"transport:{type(e).__name__}"
+
+        self.samples.append(sample)
+
+    async def run_closed(self, client: httpx.AsyncClient, concurrency: int, deadline: float, max_requests: Optional[int]):
+        counter = {"sent": 0}
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                if max_requests is not None:
+                    if counter["sent"] >= max_requests:
+                        return
+                    counter["sent"] += 1
+                endpoint, question = self.next_request()
+                await self.one_request(client, endpoint, question)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    async def run_open(self, client: httpx.AsyncClient, rate: float, deadline: float, max_requests: Optional[int]):
+        tasks = []
+        sent = 0
+        next_at = time.perf_counter()
+        while time.perf_counter() < deadline and (max_requests is None or sent < max_requests):
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            endpoint, question = self.next_request()
+            tasks.append(asyncio.create_task(self.one_request(client, endpoint, question)))
+            sent += 1
+            next_at += self.rng.expovariate(rate)
+        await asyncio.gather(*tasks)
+
+    async def sample_memory(self, pid: int, stop: asyncio.Event, interval: float = 1.0):
+        while not stop.is_set():
+            rss = read_rss_kb(pid)
+            if rss is not None:
+                self.rss_samples.append(rss)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+        rss = read_rss_kb(pid)
+        if rss is not None:
+            self.rss_samples.append(rss)
+
+    async def run(self, concurrency: int, rate: Optional[float], duration: float,
+                  max_requests: Optional[int], timeout: float, server_pid: Optional[int]):
+        limits = httpx.Limits(max_connections=max(concurrency, 100), max_keepalive_connections=max(concurrency, 100))
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=timeout, limits=limits) as client:
+            stop = asyncio.Event()
+            mem_task = asyncio.create_task(self.sample_memory(server_pid, stop)) if server_pid else None
+
+            self.started = time.perf_counter()
+            deadline = self.started + duration
+            if rate:
+                await self.run_open(client, rate, deadline, max_requests)
+            else:
+                await self.run_closed(client, concurrency, deadline, max_requests)
+            self.finished = time.perf_counter()
+
+            stop.set()
+            if mem_task:
+                await mem_task
+
+    def report(self) -> Dict:
+        elapsed = max(self.finished - self.started, 1e-9)
+        n = len(self.samples)
+        ok = sum(1 for s in self.samples if s["ok"])
+
+        outcomes: Dict[str, int] = defaultdict(int)
+        for s in self.samples:
+            outcomes[s["outcome"]] += 1
+
+        per_stage: Dict[str, List[float]] = defaultdict(list)
+        for s in self.samples:
+            for stage, ms in s["stages"].items():
+                per_stage[stage].append(ms)
+
+        stages = {}
+        for stage, values in per_stage.items():
+            values.sort()
+            stages[stage] = {
+                "count": len(values),
+                "mean_ms": sum(values) / len(values),
+                "p50_ms": percentile(values, 50),
+                "p95_ms": percentile(values, 95),
+                "p99_ms": percentile(values, 99),
+                "max_ms": values[-1],
+            }
+
+        report = {
+            "requests": n,
+            "ok": ok,
+            "error_rate": (n - ok) / n if n else 0.0,
+            "elapsed_s": elapsed,
+            "throughput_rps": n / elapsed,
+            "bytes_received": sum(s["bytes"] for s in self.samples),
+            "outcomes": dict(outcomes),
+            "stages": stages,
+        }
+
+        if self.rss_samples:
+            report["server_rss_kb"] = {
+                "start": self.rss_samples[0],
+                "end": self.rss_samples[-1],
+                "peak": max(self.rss_samples),
+                "growth": self.rss_samples[-1] - self.rss_samples[0],
+            }
+
+        return report
+
+
+def _outcome(http_status: int, content_type: str, body: bytes) -> str:
+    """
+    Classify a response: "ok", "http_<code>" or "<status>:<stage>" from the
+    ChatResponse payload (e.g. "invalid_sql:validator").
+    """
+    if http_status != 200:
+        return f"http_{http_status}"
+    if "application/json" not in content_type:
+        return "ok"
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return "bad_json"
+    if not isinstance(payload, dict):
+        return "ok"
+    if payload.get("error"):
+        return f"error:{payload.get('stage')}"
+    if payload.get("status") not in (None, "ok"):
+        return f"{payload.get('status')}:{payload.get('stage')}"
+    return "ok"
+
+
+def print_report(report: Dict) -> None:
+    print("===============================================")
+    print(f"Requests:    {report['requests']}  (ok {report['ok']})")
+    print(f"Elapsed:     {report['elapsed_s']:.2f} s")
+    print(f"Throughput:  {report['throughput_rps']:.2f} req/s")
+    print(f"Error rate:  {report['error_rate'] * 100:.2f} %")
+    print(f"Received:    {report['bytes_received'] / 1024:.1f} KiB")
+    print("Outcomes:")
+    for outcome, count in sorted(report["outcomes"].items(), key=lambda kv: -kv[1]):
+        print(f"  {outcome:<32} {count}")
+
+    print("-----------------------------------------------")
+    print(f"{'stage':<20}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for stage, st in sorted(report["stages"].items()):
+        print(
+            f"{stage:<20}{st['count']:>8}{st['p50_ms']:>10.1f}{st['p95_ms']:>10.1f}"
+            f"{st['p99_ms']:>10.1f}{st['max_ms']:>10.1f}"
+        )
+
+    if "server_rss_kb" in report:
+        mem = report["server_rss_kb"]
+        print("-----------------------------------------------")
+        print(
+            f"Server RSS:  start {mem['start'] / 1024:.1f} MiB, end {mem['end'] / 1024:.1f} MiB, "
+            f"peak {mem['peak'] / 1024:.1f} MiB, growth {mem['growth'] / 1024:+.1f} MiB"
+        )
+    print("===============================================")
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Load-test the /chat pipeline.")
+    parser.add_argument("--base-url", default=os.getenv("LOAD_TEST_BASE_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--endpoint", action="append", dest="endpoints",
+                        help="Endpoint to hit (repeatable). Default: /chat")
+    parser.add_argument("--questions", help="Question mix file (.txt one per line, or .json with weights)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Closed-loop workers")
+    parser.add_argument("--rate", type=float, help="Open-loop arrival rate (req/s); overrides --concurrency")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--requests", type=int, help="Stop after this many requests")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout (s)")
+    parser.add_argument("--server-pid", type=int, help="Sample RSS of this local server process")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="Write the full report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    run = LoadRun(
+        base_url=args.base_url,
+        endpoints=args.endpoints or ["/chat"],
+        questions=load_question_mix(args.questions),
+        seed=args.seed,
+    )
+    asyncio.run(run.run(
+        concurrency=args.concurrency,
+        rate=args.rate,
+        duration=args.duration,
+        max_requests=args.requests,
+        timeout=args.timeout,
+        server_pid=args.server_pid,
+    ))
+
+    report = run.report()
+    print_report(report)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print("Report written to:", args.json)
+
+    return 0 if report["requests"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+# backend/scripts/partitions.py
+"""
+Maintain the monthly deal_event partitions (migrations/003_deal_event_partitioning.sql).
+
+    # convert deal_event (locks it while the rows are copied)
+    python -m backend.scripts.partitions --dsn postgresql://localhost/deals --apply
+
+    # daily, unless pg_cron runs deal_event_ensure_partitions in the database
+    python -m backend.scripts.partitions --dsn postgresql://localhost/deals
+
+    # which partitions does a query read?
+    python -m backend.scripts.partitions --dsn ... --explain \
+        "SELECT SUM(volume) FROM deal_event WHERE EXTRACT(YEAR FROM deal_date) = 2024"
+
+Each run makes sure the partitions for the next DEAL_EVENT_PARTITIONS_AHEAD
+months exist, moves rows parked in deal_event_default into partitions of
+their own month, and lists the partitions with estimated rows and size.
+
+--explain shows the partitions scanned by the query as written and after
+backend.validator.sargable has rewritten its deal_date predicates.
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+
+from backend.validator.sargable import rewrite_date_predicates
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+MIGRATION = PROJECT_ROOT / "migrations" / "003_deal_event_partitioning.sql"
+
+DEAL_EVENT_PARTITIONS_AHEAD = int(os.getenv("DEAL_EVENT_PARTITIONS_AHEAD", "3"))
+
+DEFAULT_PARTITION = "deal_event_default"
+
+
+# -----------------------------
+# Maintenance
+# -----------------------------
+
+def is_partitioned(conn) -> bool:
+    with conn.cursor() as cur:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = 'deal_event'::regclass")
+        return cur.fetchone()[0] == "p"
+
+
+def ensure_partitions(conn, months_ahead: int = DEAL_EVENT_PARTITIONS_AHEAD) -> Dict[str, int]:
+    """
+    Create the partitions up to months_ahead months from today and one for
+    every month that has rows in the default partition. One transaction.
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT DISTINCT date_trunc('month', deal_date)::date FROM {DEFAULT_PARTITION}")
+        parked = [r[0] for r in cur.fetchall()]
+        created = 0
+        for month in parked:
+            cur.execute("SELECT deal_event_ensure_partitions(%s, %s)", (month, month))
+            created += cur.fetchone()[0]
+        cur.execute(
+            "SELECT deal_event_ensure_partitions(current_date, (current_date + make_interval(months => %s))::date)",
+            (months_ahead,),
+        )
+        created += cur.fetchone()[0]
+    conn.commit()
+    return {"created": created, "absorbed_months": len(parked)}
+
+
+def list_partitions(conn) -> List[Dict[str, Any]]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint,
+                   pg_total_relation_size(c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'deal_event'::regclass
+            ORDER BY c.relname = %s, c.relname
+            """,
+            (DEFAULT_PARTITION,),
+        )
+        return [{"name": name, "bound": bound, "rows": max(rows, 0), "bytes": size}
+                for name, bound, rows, size in cur.fetchall()]
+
+
+# -----------------------------
+# Pruning check
+# -----------------------------
+
+def _scanned(plan: Dict[str, Any], found: List[str]) -> int:
+    """
+    Collects the partitions a plan reads; returns subplans removed at run time.
+    """
+    removed = plan.get("Subplans Removed", 0)
+    name = plan.get("Relation Name", "")
+    if name.startswith("deal_event_p") or name == DEFAULT_PARTITION:
+        found.append(name)
+    for child in plan.get("Plans", []):
+        removed += _scanned(child, found)
+    return removed
+
+
+def explain_partitions(conn, sql: str) -> Dict[str, Any]:
+    with conn.cursor() as cur:
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+        plan = cur.fetchone()[0]
+    conn.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    found: List[str] = []
+    removed = _scanned(plan[0]["Plan"], found)
+    return {"partitions": sorted(set(found)), "runtime_removed": removed}
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Maintain the monthly deal_event partitions.")
+    parser.add_argument("--dsn", required=True)
+    parser.add_argument("--apply", action="store_true", help="Apply migrations/003 (converts deal_event)")
+    parser.add_argument("--ahead", type=int, default=DEAL_EVENT_PARTITIONS_AHEAD, help="Months to create ahead")
+    parser.add_argument("--explain", metavar="SQL", help="Show the partitions this query reads")
+    args = parser.parse_args(argv)
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        if args.apply:
+            print(f"Applying {MIGRATION.name} ...")
+            with conn.cursor() as cur:
+                cur.execute(MIGRATION.read_text(encoding="utf-8"))
+            conn.commit()
+        if not is_partitioned(conn):
+            print("deal_event is not partitioned; run with --apply first")
+            sys.exit(1)
+
+        if args.explain:
+            partitions = list_partitions(conn)
+            dates = rewrite_date_predicates(args.explain)
+            variants = [("as written", args.explain)]
+            if dates["rewrites"]:
+                variants.append(("rewritten", dates["sql"]))
+            print(f"deal_date filter: {dates['date_filter']}")
+            for label, sql in variants:
+                result = explain_partitions(conn, sql)
+                print(f"{label:<11} {len(result['partitions'])}/{len(partitions)} partitions"
+                      + (f" ({result['runtime_removed']} pruned at run time)" if result["runtime_removed"] else "")
+                      + f": {sql}")
+            return
+
+        summary = ensure_partitions(conn, args.ahead)
+        partitions = list_partitions(conn)
+    finally:
+        conn.close()
+
+    print("===============================================")
+    for p in partitions:
+        print(f"{p['name']:<22}{p['rows']:>12,} rows {p['bytes'] / 2**20:>9.1f} MiB  {p['bound']}")
+    print("===============================================")
+    print(f"{summary['created']} partitions created, {summary['absorbed_months']} months moved out of "
+          f"{DEFAULT_PARTITION}, {len(partitions)} partitions in total")
+
+
+if __name__ == "__main__":
+    main()
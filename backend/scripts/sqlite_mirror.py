@@ -0,0 +1,161 @@
+# backend/scripts/sqlite_mirror.py
+"""
+Build or refresh the SQLite mirror used by LOCAL_MODE (backend.sql_executor.sqlite_mirror).
+
+    # from CSV files (<table>.csv with a header row, per registry table)
+    python -m backend.scripts.sqlite_mirror --csv-dir exports/
+
+    # from Postgres: full copy first, change_feed increments afterwards
+    python -m backend.scripts.sqlite_mirror --dsn postgresql://localhost/deals
+    python -m backend.scripts.sqlite_mirror --dsn postgresql://localhost/deals --full
+
+    # compare the mirror with Postgres on the local-engine check corpus
+    python -m backend.scripts.sqlite_mirror --dsn postgresql://localhost/deals --check
+
+The mirror goes to SQLITE_MIRROR_PATH unless --path is given. Postgres is
+only read.
+"""
+
+import argparse
+import datetime as dt
+import math
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import psycopg2
+import psycopg2.extras
+
+from backend.scripts.check_local_engine import corpus
+from backend.sql_executor.sqlite_mirror import (
+    SQLITE_MIRROR_PATH,
+    connect_mirror,
+    execute_on_mirror,
+    load_csv_dir,
+    sync_from_postgres,
+)
+
+
+# -----------------------------
+# Check
+# -----------------------------
+
+def _norm(v):
+    """
+    Postgres and SQLite values in one comparable form: dates as ISO text,
+    numbers as float (the mirror stores numerics as REAL).
+    """
+    if isinstance(v, dt.datetime):
+        return v.date().isoformat() if v.time() == dt.time(0) else v.replace(tzinfo=None).isoformat()
+    if isinstance(v, dt.date):
+        return v.isoformat()
+    if isinstance(v, (Decimal, float, int)) and not isinstance(v, bool):
+        return float(v)
+    return v
+
+
+def _coarse(row: tuple) -> str:
+    return repr(tuple(f"{v:.6g}" if isinstance(v, float) else v for v in row))
+
+
+def _same_rows(expected: List[tuple], actual: List[tuple]) -> bool:
+    if len(expected) != len(actual):
+        return False
+    for e, a in zip(sorted(expected, key=_coarse), sorted(actual, key=_coarse)):
+        for x, y in zip(e, a):
+            if isinstance(x, float) and isinstance(y, float):
+                if not math.isclose(x, y, rel_tol=1e-9, abs_tol=1e-9):
+                    return False
+            elif x != y:
+                return False
+    return True
+
+
+def check(pg_conn, path: Path, only: Optional[List[str]] = None) -> List[Dict]:
+    results = []
+    for name, sql in corpus().items():
+        if only and name not in only:
+            continue
+        with pg_conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            t0 = time.perf_counter()
+            cur.execute(sql)
+            expected = cur.fetchall()
+            pg_ms = (time.perf_counter() - t0) * 1000.0
+        pg_conn.rollback()
+
+        t0 = time.perf_counter()
+        actual = execute_on_mirror(sql, path)
+        result = {"query": name, "rows": len(expected), "pg_ms": pg_ms,
+                  "sqlite_ms": (time.perf_counter() - t0) * 1000.0}
+        if isinstance(actual, dict):
+            result["error"] = actual["error"]
+        else:
+            exp = [tuple(_norm(v) for v in r.values()) for r in expected]
+            act = [tuple(_norm(v) for v in r.values()) for r in actual]
+            # Ties under ORDER BY ... LIMIT may pick different rows; compare
+            # those as sets only when there is no LIMIT.
+            if "limit" in sql.lower():
+                same = len(exp) == len(act)
+            else:
+                same = _same_rows(exp, act)
+            if not same:
+                result["error"] = f"rows differ: {len(act)} vs {len(exp)} expected"
+        results.append(result)
+    return results
+
+
+def print_check(results: List[Dict]) -> None:
+    print("===============================================")
+    print(f"{'query':<32}{'rows':>7}{'pg ms':>10}{'sqlite ms':>11}  result")
+    for r in results:
+        print(f"{r['query']:<32}{r['rows']:>7}{r['pg_ms']:>10.1f}{r['sqlite_ms']:>11.1f}  {r.get('error', 'ok')}")
+    print("===============================================")
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build or refresh the LOCAL_MODE SQLite mirror.")
+    parser.add_argument("--path", type=Path, default=SQLITE_MIRROR_PATH, help="Mirror file")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv-dir", type=Path, help="Directory with <table>.csv files")
+    source.add_argument("--dsn", help="Postgres DSN to copy / sync from (read-only use)")
+    parser.add_argument("--full", action="store_true", help="Full copy even if a watermark is stored")
+    parser.add_argument("--check", action="store_true", help="Compare the mirror with --dsn afterwards")
+    parser.add_argument("--only", nargs="*", help="With --check: only these query names")
+    args = parser.parse_args(argv)
+
+    conn = connect_mirror(args.path, read_only=False)
+    try:
+        t0 = time.perf_counter()
+        if args.csv_dir:
+            summary = {"mode": "csv", "tables": load_csv_dir(conn, args.csv_dir)}
+        else:
+            pg_conn = psycopg2.connect(args.dsn)
+            try:
+                summary = sync_from_postgres(conn, pg_conn, full=args.full)
+            finally:
+                pg_conn.close()
+    finally:
+        conn.close()
+    print(f"Mirror {args.path} updated in {time.perf_counter() - t0:.1f} s: {summary}")
+
+    if args.check:
+        if not args.dsn:
+            parser.error("--check needs --dsn")
+        pg_conn = psycopg2.connect(args.dsn)
+        try:
+            results = check(pg_conn, args.path, args.only)
+        finally:
+            pg_conn.close()
+        print_check(results)
+        if any("error" in r for r in results):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# backend/services/batch.py
+"""
+Batch questions (/chat/batch) for dashboards and evaluation runs.
+
+    POST /chat/batch {"questions": ["volume by product", "daily price", ...], "mode": "summary"}
+
+Answered as NDJSON, one line per question as soon as it is done (in
+completion order, "index" is its position in the request), then one
+{"report": {...}} line:
+
+1. Questions are deduplicated (case / whitespace / trailing "?"
+   insensitive): each distinct question goes through NL -> SQL once and its
+   duplicates get the same answer (dedup: "question").
+2. Distinct questions that produce the same validated SQL share one
+   execution (dedup: "sql"). Everything else goes through the normal
+   /chat routing, so rollups, the segment cache and the in-memory snapshot
+   answer what they can without Postgres.
+3. Up to BATCH_WORKERS questions of a batch run at once. OpenAI calls and
+   Postgres connections are additionally gated by process-wide bulkheads
+   (BATCH_LLM_CONCURRENCY / BATCH_DB_CONCURRENCY) shared by all batches, so
+   bulk work cannot take every model slot or connection from interactive
+   /chat traffic. A connection holds its slot from before it is opened
+   until it is closed (admission EXPLAIN included); a question whose batch
+   was cancelled stops waiting for one. Waiting time shows up as
+   openai_wait / db_connection_wait.
+
+The report gives counts (distinct questions, executions, deduplicated,
+status, backend), wall time versus the summed item times, item latency
+percentiles and time per stage over the whole batch.
+
+Configuration (env):
+- BATCH_MAX_QUESTIONS     questions per request (default 100)
+- BATCH_WORKERS           questions of one batch in flight (default 8)
+- BATCH_LLM_CONCURRENCY   OpenAI calls in flight over all batches (default 4)
+- BATCH_DB_CONCURRENCY    Postgres connections open over all batches (default 4)
+"""
+
+import hashlib
+import os
+import re
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend.validator.fingerprint import normalize_sql
+
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "100"))
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "8"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+BATCH_DB_CONCURRENCY = int(os.getenv("BATCH_DB_CONCURRENCY", "4"))
+
+# Stage / resource name -> semaphore (see RequestTimer bulkheads).
+BULKHEADS = {
+    "openai": threading.BoundedSemaphore(BATCH_LLM_CONCURRENCY),
+    "db_connection": threading.BoundedSemaphore(BATCH_DB_CONCURRENCY),
+}
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    return _SPACE_RE.sub(" ", question).strip().rstrip("?").strip().casefold()
+
+
+def dedupe(questions: List[str]) -> List[Tuple[int, List[int]]]:
+    """
+    [(first index, [indexes of its duplicates])] in request order.
+    """
+    groups: Dict[str, Tuple[int, List[int]]] = {}
+    for i, question in enumerate(questions):
+        key = normalize_question(question)
+        if key in groups:
+            groups[key][1].append(i)
+        else:
+            groups[key] = (i, [])
+    return list(groups.values())
+
+
+def execution_key(result: Dict[str, Any]) -> Optional[str]:
+    """
+    What two validated answers must share to be executed once: the same
+    SQL up to whitespace / keyword case, literals included (not the
+    literal-free sql_fingerprint: 'buy' and 'sell' are different
+    queries). None for anything else (invalid SQL, compound plans,
+    follow-ups).
+    """
+    if result.get("validator", {}).get("status") != "ok" or not result.get("sql") or result.get("queries"):
+        return None
+    return hashlib.sha1(normalize_sql(result["sql"]).encode("utf-8")).hexdigest()
+
+
+class SharedExecutions:
+    """
+    Per-batch table of executions by execution_key: the first question to
+    claim a key runs it, later ones wait for its answer.
+    """
+
+    def __init__(self):
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key: str) -> Tuple[bool, Future]:
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                return False, future
+            future = self._futures[key] = Future()
+            return True, future
+
+
+# -----------------------------
+# Report
+# -----------------------------
+
+class BatchReport:
+    """
+    Aggregate over the items of one batch.
+    """
+
+    def __init__(self, questions: int, distinct: int):
+        self.questions = questions
+        self.distinct = distinct
+        self.executions = 0
+        self.deduplicated = {"question": 0, "sql": 0}
+        self.status: Dict[str, int] = {}
+        self.backends: Dict[str, int] = {}
+        self.stages: Dict[str, float] = {}
+        self.latencies_ms: List[float] = []
+
+    def add(self, item: Dict[str, Any], stages: Optional[Dict[str, float]] = None) -> None:
+        result = item["result"]
+        status = result.get("status", "ok")
+        if result.get("error") and status == "ok":
+            status = "error"
+        self.status[status] = self.status.get(status, 0) + 1
+        if item["dedup"]:
+            self.deduplicated[item["dedup"]] += 1
+        if item["dedup"] != "question":
+            self.latencies_ms.append(item["elapsed_ms"])
+        backend = (result.get("debug") or {}).get("backend")
+        if backend and not item["dedup"]:
+            self.executions += 1
+            self.backends[backend] = self.backends.get(backend, 0) + 1
+        for name, seconds in (stages or {}).items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def render(self, wall_s: float) -> Dict[str, Any]:
+        latencies = np.array(self.latencies_ms or [0.0])
+        return {
+            "questions": self.questions,
+            "distinct_questions": self.distinct,
+            "executions": self.executions,
+            "deduplicated": self.deduplicated,
+            "status": self.status,
+            "backends": self.backends,
+            "wall_ms": round(wall_s * 1000.0, 1),
+            "sum_item_ms": round(float(np.sum(latencies)), 1),
+            "latency_ms": {
+                "p50": round(float(np.percentile(latencies, 50)), 1),
+                "p95": round(float(np.percentile(latencies, 95)), 1),
+                "max": round(float(latencies.max()), 1),
+            },
+            "stages_ms": {name: round(seconds * 1000.0, 1) for name, seconds in sorted(self.stages.items())},
+        }
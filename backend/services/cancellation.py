@@ -0,0 +1,101 @@
+# backend/services/cancellation.py
+"""
+Per-request time budget and cancellation.
+
+A CancelToken is created for every /chat request. It carries:
+
+- a deadline (REQUEST_BUDGET_S from now), used to derive the OpenAI client
+  timeout and the Postgres `statement_timeout` for each execution, and
+- a cancelled flag plus callbacks. Code that starts something abortable
+  (an OpenAI stream, a running query) registers an abort callback; when the
+  HTTP client disconnects, cancel() runs them (e.g. psycopg2's
+  connection.cancel(), which uses the server cancel protocol).
+
+Configuration (env):
+- REQUEST_BUDGET_S           total time budget per request (default 60)
+- STATEMENT_TIMEOUT_MIN_MS   floor for the derived statement_timeout (default 250)
+"""
+
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+
+REQUEST_BUDGET_S = float(os.getenv("REQUEST_BUDGET_S", "60"))
+STATEMENT_TIMEOUT_MIN_MS = int(os.getenv("STATEMENT_TIMEOUT_MIN_MS", "250"))
+
+
+class RequestCancelled(Exception):
+    """
+    Raised when work is attempted on an already cancelled request.
+    """
+
+
+class CancelToken:
+    """
+    Deadline + cancellation flag shared by all stages of one request.
+    """
+
+    def __init__(self, budget_s: Optional[float] = None):
+        self.budget_s = REQUEST_BUDGET_S if budget_s is None else budget_s
+        self.deadline = time.monotonic() + self.budget_s
+        self.cancelled = False
+        self.reason: Optional[str] = None
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        """
+        Seconds left in the budget (never negative).
+        """
+        return max(0.0, self.deadline - time.monotonic())
+
+    def statement_timeout_ms(self) -> int:
+        """
+        statement_timeout for the next query: whatever budget is left.
+        """
+        return max(STATEMENT_TIMEOUT_MIN_MS, int(self.remaining() * 1000))
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Register an abort callback for the duration of some work.
+        Returns a function that unregisters it. If the token is already
+        cancelled, the callback runs immediately.
+        """
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        _safe_call(callback)
+        return lambda: None
+
+    def _unregister(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """
+        Mark the request cancelled and abort whatever is in flight.
+        """
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            self.reason = reason
+            callbacks = list(self._callbacks)
+            self._callbacks.clear()
+        for cb in callbacks:
+            _safe_call(cb)
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise RequestCancelled(self.reason)
+
+
+def _safe_call(callback: Callable[[], None]) -> None:
+    try:
+        callback()
+    except Exception:
+        # Aborting is best effort; the work itself will surface any error.
+        pass
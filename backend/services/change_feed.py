@@ -0,0 +1,261 @@
+# backend/services/change_feed.py
+"""
+Incremental change feed from Postgres (LISTEN/NOTIFY + watermark polling).
+
+migrations/002_change_feed.sql logs every change to deal_event and the
+ref_* tables into change_feed and sends NOTIFY 'change_feed' per statement
+(004 adds the row before an UPDATE / DELETE as old_data, 005 the writing
+transaction's id as xact_id). A ChangeFeedListener keeps one dedicated
+connection open in the API process:
+
+1. LISTEN change_feed; wake up on a notification, or every
+   CHANGE_FEED_POLL_S seconds when nothing arrives (the fallback for
+   notifications lost while reconnecting).
+2. Read change_feed rows with xact_id >= watermark in id order, skipping
+   ids already applied (read_changes). The watermark is the xmin of the
+   previous read's snapshot: every transaction below it had finished, so
+   rows of a writer that commits late (a long COPY) are read whenever it
+   commits, however long it ran.
+3. Hand the new rows to the subscribers (e.g. SnapshotStore.apply, which
+   patches the in-memory snapshot), then bump the invalidation epoch of
+   every table that changed.
+
+Epochs are plain per-table counters: a cache stores the epochs it was
+built at and is stale once epoch(table) moved on. No subscriber ever
+needs to reload a table in full.
+
+Configuration (env):
+- CHANGE_FEED_ENABLED    "true"/"false" (default false; needs the migration)
+- CHANGE_FEED_POLL_S     seconds between watermark polls (default 30)
+- CHANGE_FEED_BATCH      change rows read per query (default 50000)
+"""
+
+import os
+import select
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Container, Dict, Iterable, List, Optional, Tuple
+
+import psycopg2.extensions
+import psycopg2.extras
+
+from backend.services.metrics import CHANGE_FEED_ROWS, CHANGE_FEED_WAKEUPS
+
+CHANGE_FEED_ENABLED = os.getenv("CHANGE_FEED_ENABLED", "false").lower() == "true"
+CHANGE_FEED_POLL_S = float(os.getenv("CHANGE_FEED_POLL_S", "30"))
+CHANGE_FEED_BATCH = int(os.getenv("CHANGE_FEED_BATCH", "50000"))
+
+CHANNEL = "change_feed"
+RECONNECT_BACKOFF_S = (1, 2, 5, 10, 30)
+
+# Subscriber: fn(changes, sort_values). `changes` are change_feed rows as
+# dicts (id, xact_id, changed_at, table_name, op, row_key, row_data, old_data) in feed order;
+# sort_values(strings) returns them in database collation order.
+Subscriber = Callable[[List[Dict[str, Any]], Callable[[Iterable[str]], List[str]]], None]
+
+
+# -----------------------------
+# Invalidation epochs
+# -----------------------------
+
+_epochs: Dict[str, int] = {}
+_epochs_lock = threading.Lock()
+
+
+def epoch(table: str) -> int:
+    """
+    Current invalidation epoch of a table (0 until it first changes).
+    """
+    return _epochs.get(table, 0)
+
+
+def epochs() -> Dict[str, int]:
+    with _epochs_lock:
+        return dict(_epochs)
+
+
+def bump(tables: Iterable[str]) -> None:
+    with _epochs_lock:
+        for table in tables:
+            _epochs[table] = _epochs.get(table, 0) + 1
+
+
+# -----------------------------
+# Reading the feed
+# -----------------------------
+
+def horizon(conn) -> int:
+    """
+    xmin of a fresh snapshot: every transaction below it has committed or
+    rolled back, so no change_feed row with a lower xact_id is still to come.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text")
+        return int(cur.fetchone()[0])
+
+
+def read_changes(conn, watermark: int, applied: Container[int], columns: str,
+                 batch: int = CHANGE_FEED_BATCH) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    change_feed rows not applied yet, in id order, and the next watermark.
+
+    watermark is the previous call's (or horizon() when starting), applied
+    the ids already applied among rows with xact_id >= watermark; columns
+    the column list to select (id and xact_id are always included, xact_id
+    as int). The caller keeps the ids it applies with xact_id >= the new
+    watermark: those rows are read again until their horizon passes.
+    """
+    # Before the rows: a horizon older than the rows' snapshot only means
+    # re-reading a few rows next time.
+    next_watermark = horizon(conn)
+    changes: List[Dict[str, Any]] = []
+    last_id = 0
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        while True:
+            cur.execute(
+                f"SELECT id, xact_id::text AS xact_id, {columns} FROM change_feed "
+                "WHERE xact_id >= %s::xid8 AND id > %s ORDER BY id LIMIT %s",
+                (str(watermark), last_id, batch),
+            )
+            page = cur.fetchall()
+            for row in page:
+                if row["id"] not in applied:
+                    row["xact_id"] = int(row["xact_id"])
+                    changes.append(row)
+            if len(page) < batch:
+                break
+            last_id = page[-1]["id"]
+    return changes, next_watermark
+
+
+# -----------------------------
+# Listener
+# -----------------------------
+
+class ChangeFeedListener:
+    """
+    Background thread that follows change_feed on its own connection.
+    """
+
+    def __init__(self, connect: Callable[[], Any], poll_s: float = CHANGE_FEED_POLL_S,
+                 batch: int = CHANGE_FEED_BATCH):
+        self.connect = connect
+        self.poll_s = poll_s
+        self.batch = batch
+        self.subscribers: List[Subscriber] = []
+        self.connected = False
+        self.watermark: Optional[int] = None  # snapshot xmin of the last read (see read_changes)
+        self.applied_ids: Dict[int, int] = {}  # id -> xact_id, for rows at or above the watermark
+        self.rows_applied = 0
+        self.last_catch_up: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, fn: Subscriber) -> None:
+        self.subscribers.append(fn)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "connected": self.connected,
+            "watermark": self.watermark,
+            "rows_applied": self.rows_applied,
+            "since_catch_up_s": round(time.time() - self.last_catch_up, 1) if self.last_catch_up else None,
+            "epochs": epochs(),
+            "error": self.last_error,
+        }
+
+    # -- connection loop --
+
+    def _run(self) -> None:
+        attempt = 0
+        while not self._stop.is_set():
+            try:
+                conn = self.connect()
+            except Exception as e:
+                self.last_error = str(e)
+                self._stop.wait(RECONNECT_BACKOFF_S[min(attempt, len(RECONNECT_BACKOFF_S) - 1)])
+                attempt += 1
+                continue
+            attempt = 0
+            try:
+                self._follow(conn)
+            except Exception as e:
+                self.last_error = str(e)
+            finally:
+                self.connected = False
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+    def _follow(self, conn) -> None:
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {CHANNEL}")
+        if self.watermark is None:
+            self.watermark = horizon(conn)
+        self.connected = True
+        self.last_error = None
+
+        # Anything committed while we were disconnected.
+        self.catch_up(conn)
+        while not self._stop.is_set():
+            # Notifications that arrived during catch_up() are already buffered.
+            if not conn.notifies:
+                if select.select([conn], [], [], self.poll_s)[0]:
+                    conn.poll()
+            if conn.notifies:
+                conn.notifies.clear()  # payloads only say "look"; the table is the source
+                CHANGE_FEED_WAKEUPS.inc(source="notify")
+            else:
+                CHANGE_FEED_WAKEUPS.inc(source="poll")
+            self.catch_up(conn)
+
+    # -- applying changes --
+
+    def catch_up(self, conn) -> int:
+        """
+        Read and apply everything past the watermark. Returns rows applied.
+        """
+        changes, watermark = read_changes(
+            conn, self.watermark, self.applied_ids,
+            "changed_at, table_name, op, row_key, row_data, old_data", self.batch,
+        )
+
+        if changes:
+            sort_values = _collation_sorter(conn)
+            for fn in self.subscribers:
+                fn(changes, sort_values)
+            bump({c["table_name"] for c in changes})
+            for c in changes:
+                self.applied_ids[c["id"]] = c["xact_id"]
+            for (table, op), n in Counter((c["table_name"], c["op"]) for c in changes).items():
+                CHANGE_FEED_ROWS.inc(n, table=table, op=op)
+            self.rows_applied += len(changes)
+        else:
+            for fn in self.subscribers:
+                fn([], None)  # nothing changed: consumers are current as of now
+
+        # Rows below the new watermark are never read again.
+        self.watermark = watermark
+        self.applied_ids = {i: x for i, x in self.applied_ids.items() if x >= watermark}
+        self.last_catch_up = time.time()
+        return len(changes)
+
+
+def _collation_sorter(conn) -> Callable[[Iterable[str]], List[str]]:
+    def sort_values(values: Iterable[str]) -> List[str]:
+        with conn.cursor() as cur:
+            cur.execute("SELECT v FROM unnest(%s::text[]) AS v ORDER BY v", (list(values),))
+            return [r[0] for r in cur.fetchall()]
+    return sort_values
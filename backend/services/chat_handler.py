@@ -3,19 +3,33 @@
 import os
 import json
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 
 from dotenv import load_dotenv
 from openai import OpenAI
 
 from backend.validator.validator import validate_sql  # adjust import if needed
+from backend.validator.fingerprint import sql_fingerprint
+from backend.validator.sargable import rewrite_date_predicates
+from backend.services.metrics import RequestTimer, DATE_FILTERS, OPENAI_REQUESTS, OPENAI_TOKENS
+from backend.services.cancellation import CancelToken
+from backend.services.sessions import rewrite_follow_up
+from backend.services.planner import COMPOUND_PLANNER_ENABLED, PLAN_INSTRUCTIONS, looks_compound, needs_plan, parse_plan
 
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
 SCHEMA_REGISTRY_PATH = PROJECT_ROOT / "metadata" / "schema_registry.json"
 
 load_dotenv(PROJECT_ROOT / ".env")
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# OPENAI_BASE_URL lets us point at any OpenAI-compatible server, e.g. the
+# offline stub in backend/scripts/llm_stub_server.py (http://127.0.0.1:8089/v1).
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
+
+client = OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY") or ("stub" if OPENAI_BASE_URL else None),
+    base_url=OPENAI_BASE_URL,
+)
 
 with SCHEMA_REGISTRY_PATH.open("r", encoding="utf-8") as f:
     SCHEMA_REGISTRY = json.load(f)
@@ -43,27 +57,69 @@ def build_system_prompt() -> str:
 
 
 
-def handle_question(question: str) -> Dict[str, Any]:
-    """
-    Core NL -> SQL -> Validator pipeline used by both the CLI script and /chat endpoint.
-    Returns a structured dict for nice JSON in the API.
-    """
+def build_planner_prompt() -> str:
+    return build_system_prompt() + "\n" + PLAN_INSTRUCTIONS
+
 
-    system_prompt = build_system_prompt()
+def _complete(
+    question: str,
+    system_prompt: str,
+    timer: RequestTimer,
+    cancel: CancelToken,
+    history: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    Streamed chat completion. Returns {"text": ...}, or a cancelled / error
+    response for handle_question to return as is.
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": question},
-    ]
+    history: earlier turns of the session ({"question", "sql"}), sent as
+    user / assistant messages so follow-ups can refer to them.
+    """
+    messages = [{"role": "system", "content": system_prompt}]
+    for turn in history or []:
+        if turn["sql"]:
+            messages.append({"role": "user", "content": turn["question"]})
+            messages.append({"role": "assistant", "content": turn["sql"]})
+    messages.append({"role": "user", "content": question})
 
+    usage = None
     try:
-        completion = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=messages,
-            temperature=0,
-        )
-        raw_sql = completion.choices[0].message.content.strip()
+        cancel.check()
+        with timer.stage("openai") as span:
+            span.set_attribute("gen_ai.request.model", OPENAI_MODEL)
+            stream = client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=messages,
+                temperature=0,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=cancel.remaining(),
+            )
+            unregister = cancel.on_cancel(stream.close)
+            try:
+                parts = []
+                for chunk in stream:
+                    if chunk.choices:
+                        parts.append(chunk.choices[0].delta.content or "")
+                    if chunk.usage is not None:
+                        usage = chunk.usage
+            finally:
+                unregister()
+            cancel.check()
+            if usage is not None:
+                span.set_attribute("gen_ai.usage.input_tokens", usage.prompt_tokens)
+                span.set_attribute("gen_ai.usage.output_tokens", usage.completion_tokens)
+        text = "".join(parts).strip()
     except Exception as e:
+        if cancel.cancelled:
+            OPENAI_REQUESTS.inc(outcome="cancelled")
+            return {
+                "status": "cancelled",
+                "stage": "openai",
+                "question": question,
+                "error": f"Request cancelled ({cancel.reason}).",
+            }
+        OPENAI_REQUESTS.inc(outcome="error")
         return {
             "status": "error",
             "stage": "openai",
@@ -71,6 +127,14 @@ def handle_question(question: str) -> Dict[str, Any]:
             "error": str(e),
         }
 
+    OPENAI_REQUESTS.inc(outcome="ok")
+    if usage is not None:
+        OPENAI_TOKENS.inc(usage.prompt_tokens, kind="prompt")
+        OPENAI_TOKENS.inc(usage.completion_tokens, kind="completion")
+    return {"text": text}
+
+
+def _clean_sql(raw_sql: str) -> str:
     # Clean ```sql fences if present
     if raw_sql.startswith("```"):
         raw_sql = raw_sql.strip("`")
@@ -85,22 +149,168 @@ def handle_question(question: str) -> Dict[str, Any]:
 
     # 🚨 OPTIONAL: block aliases by removing " de", " rp", etc.
     # We won't do this aggressively yet; system prompt should handle it.
+    return raw_sql
+
+
+def _validate(raw_sql: str, timer: RequestTimer) -> Tuple[str, Dict[str, Any]]:
+    """
+    Run the validator (and the deal_date rewrite on valid SQL).
+    Returns (sql to run, validation result).
+    """
+    with timer.stage("validate") as span:
+        validation_result = validate_sql(raw_sql, SCHEMA_REGISTRY)
+        # EXTRACT(YEAR FROM deal_date) = 2024 -> deal_date range, so
+        # partitions are pruned and the deal_date index applies.
+        if validation_result.get("status") == "ok":
+            dates = rewrite_date_predicates(raw_sql)
+            # The rewritten SQL runs instead, so it has to pass as well.
+            if dates["rewrites"] and validate_sql(dates["sql"], SCHEMA_REGISTRY).get("status") != "ok":
+                dates = {"sql": raw_sql, "date_filter": "nonsargable", "rewrites": []}
+            validation_result["date_filter"] = dates["date_filter"]
+            if dates["rewrites"]:
+                validation_result["rewrites"] = dates["rewrites"]
+                raw_sql = dates["sql"]
+            DATE_FILTERS.inc(filter=dates["date_filter"])
+            span.set_attribute("db.date_filter", dates["date_filter"])
+        span.set_attribute("db.sql.fingerprint", sql_fingerprint(raw_sql))
+        span.set_attribute("validator.status", validation_result.get("status"))
+    return raw_sql, validation_result
 
-    # Run validator
-    validation_result = validate_sql(raw_sql, SCHEMA_REGISTRY)
 
-    response: Dict[str, Any] = {
+def _single_response(question: str, raw_sql: str, timer: RequestTimer) -> Dict[str, Any]:
+    sql, validation_result = _validate(_clean_sql(raw_sql), timer)
+    return {
         "status": "ok" if validation_result.get("status") == "ok" else "invalid_sql",
         "stage": "validator",
         "question": question,
-        "sql": raw_sql,
+        "sql": sql,
         "validator": validation_result,
     }
 
+
+def check_sql(sql: str, timer: Optional[RequestTimer] = None) -> Dict[str, Any]:
+    """
+    Validate SQL given directly (e.g. /chat/export) with the same checks and
+    rewrites as model output. Same result shape as handle_question.
+    """
+    return _single_response(sql, sql, timer or RequestTimer())
+
+
+def handle_question(
+    question: str,
+    timer: Optional[RequestTimer] = None,
+    cancel: Optional[CancelToken] = None,
+    session: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Core NL -> SQL -> Validator pipeline used by both the CLI script and /chat endpoint.
+    Returns a structured dict for nice JSON in the API.
+
+    If a RequestTimer is passed, the prompt / openai / validate stages are
+    recorded on it (used for Server-Timing and /metrics).
+
+    The OpenAI call is streamed so it can be aborted mid-generation: if the
+    CancelToken is cancelled (client disconnected) the stream is closed.
+    Its timeout is whatever is left of the request budget.
+
+    Compound questions (backend.services.planner) are answered with a plan
+    of several validated queries instead: "queries" and "combine" are set
+    and "sql" is None. A plan is also tried when the single query was
+    rejected for a subquery / CTE / UNION / window function.
+
+    With a session (backend.services.sessions) the question is a follow-up:
+    simple ones ("only sells", "sort that by price") edit the previous SQL
+    without calling the model ("follow_up" says which rule), the others
+    are sent along with the earlier turns.
+    """
+    timer = timer or RequestTimer()
+    cancel = cancel or CancelToken()
+    history = session["turns"] if session is not None else None
+
+    if session is not None and session["shape"] is not None:
+        edit = rewrite_follow_up(question, session["shape"], session["rows"] or [])
+        if edit is not None:
+            response = _single_response(question, edit["sql"], timer)
+            if response["status"] == "ok":
+                response["follow_up"] = {"source": "rule", "rule": edit["rule"], "previous_sql": session["sql"]}
+                return response
+
+    if COMPOUND_PLANNER_ENABLED and looks_compound(question):
+        return handle_plan(question, timer, cancel, history)
+
+    with timer.stage("prompt"):
+        system_prompt = build_system_prompt()
+
+    completion = _complete(question, system_prompt, timer, cancel, history)
+    if "text" not in completion:
+        return completion
+
+    response = _single_response(question, completion["text"], timer)
+    if session is not None and session["sql"]:
+        response["follow_up"] = {"source": "llm", "previous_sql": session["sql"]}
+    if response["status"] == "invalid_sql" and COMPOUND_PLANNER_ENABLED and needs_plan(response["validator"]):
+        planned = handle_plan(question, timer, cancel, history)
+        if planned["status"] == "ok":
+            return planned
+
     # TODO (later): if status ok, execute SQL on Supabase and add "rows" to response
 
     return response
 
+
+def handle_plan(
+    question: str,
+    timer: Optional[RequestTimer] = None,
+    cancel: Optional[CancelToken] = None,
+    history: Optional[List[Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    NL -> query plan -> Validator for every query of the plan.
+
+    "validator" sums up the plan ("errors" are prefixed with the query
+    name); each entry of "queries" carries its own validation result. A
+    model that answers with a single query gets a single-query response.
+    """
+    timer = timer or RequestTimer()
+    cancel = cancel or CancelToken()
+
+    with timer.stage("prompt"):
+        system_prompt = build_planner_prompt()
+
+    completion = _complete(question, system_prompt, timer, cancel, history)
+    if "text" not in completion:
+        return completion
+
+    with timer.stage("plan") as span:
+        parsed = parse_plan(completion["text"])
+        span.set_attribute("planner.queries", len(parsed["plan"]["queries"]) if "plan" in parsed else 0)
+    if "sql" in parsed:
+        return _single_response(question, parsed["sql"], timer)
+    if "error" in parsed:
+        return {
+            "status": "invalid_sql",
+            "stage": "planner",
+            "question": question,
+            "validator": {"status": "error", "errors": [parsed["error"]]},
+        }
+
+    plan = parsed["plan"]
+    queries, errors = [], []
+    for query in plan["queries"]:
+        sql, validation_result = _validate(_clean_sql(query["sql"]), timer)
+        queries.append({"name": query["name"], "sql": sql, "validator": validation_result})
+        errors += [f"{query['name']}: {e}" for e in validation_result.get("errors", [])]
+
+    return {
+        "status": "invalid_sql" if errors else "ok",
+        "stage": "planner",
+        "question": question,
+        "sql": None,
+        "validator": {"status": "error" if errors else "ok", "errors": errors},
+        "queries": queries,
+        "combine": plan["combine"],
+    }
+
 import asyncpg
 
 async def execute_sql(sql: str, dsn: str):
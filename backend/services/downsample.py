@@ -0,0 +1,204 @@
+# backend/services/downsample.py
+"""
+Server-side downsampling of time-series results for charting.
+
+With `"downsample": <points>` on /chat, a result that has a date /
+timestamp column and at least one numeric column is reduced to about
+<points> rows before it is sent:
+
+- "lttb" (default): Largest-Triangle-Three-Buckets. Keeps the first and
+  last point and, per bucket, the point forming the largest triangle with
+  the previously kept point and the next bucket's average. Bucket bounds
+  and averages are computed for all buckets at once; only the argmax per
+  bucket follows the previously chosen point.
+- "minmax": per bucket, the rows holding the measure's minimum and
+  maximum (about <points> / 2 buckets), so spikes survive.
+
+The time axis is the first date / timestamp column, the measure the first
+numeric column (other columns ride along with the chosen rows). Text and
+boolean columns split the result into series, e.g. one per product for
+(deal_date, product_id, volume); each series is reduced on its own, with a
+share of <points> proportional to its length. A time value repeated
+within one series is not a time series: the result is left as it is.
+Rows come back ordered by time; rows with a null time or measure are left
+out. Returned rows are actual result rows, never interpolated.
+
+The response carries:
+    "downsample": {"method": "lttb", "x": "deal_date", "y": "avg_price", "by": [],
+                   "series": 1, "original_rows": 1823, "rows": 200, "target": 200}
+or {"skipped": reason} when the result has no time series shape, is
+already small enough, or has more series than fit in <points>.
+
+Configuration (env):
+- DOWNSAMPLE_MAX_POINTS   largest accepted target (default 10000)
+"""
+
+import datetime as dt
+import os
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+DOWNSAMPLE_MAX_POINTS = int(os.getenv("DOWNSAMPLE_MAX_POINTS", "10000"))
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+
+
+def check_request(points: Optional[int], method: str) -> Optional[str]:
+    """
+    Error message for bad /chat downsample options, else None.
+    """
+    if points is None:
+        return None
+    if method not in DOWNSAMPLE_METHODS:
+        return f"Unknown downsample method {method!r}; expected one of {', '.join(DOWNSAMPLE_METHODS)}."
+    if not 3 <= points <= DOWNSAMPLE_MAX_POINTS:
+        return f"downsample must be between 3 and {DOWNSAMPLE_MAX_POINTS} points."
+    return None
+
+
+# -----------------------------
+# Series detection
+# -----------------------------
+
+def _first_value(rows: List[Dict[str, Any]], name: str) -> Any:
+    for row in rows:
+        if row.get(name) is not None:
+            return row[name]
+    return None
+
+
+def find_series(rows: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    {"x": time column, "y": measure column, "by": [series columns]}, or
+    None if the result has no date/timestamp column or no numeric column.
+    Series columns are the text / boolean columns (product, direction, ...).
+    """
+    if not rows:
+        return None
+    x = y = None
+    by = []
+    for name in rows[0].keys():
+        value = _first_value(rows, name)
+        if x is None and isinstance(value, dt.date):
+            x = name
+        elif y is None and isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            y = name
+        elif isinstance(value, (str, bool)):
+            by.append(name)
+    if x is None or y is None:
+        return None
+    return {"x": x, "y": y, "by": by}
+
+
+def _time_axis(values: List[Any]) -> np.ndarray:
+    if isinstance(values[0], dt.datetime):
+        return np.array([v.timestamp() for v in values], dtype=float)
+    return np.array(values, dtype="datetime64[D]").astype(np.int64).astype(float)
+
+
+# -----------------------------
+# Algorithms (x sorted ascending)
+# -----------------------------
+
+def lttb(x: np.ndarray, y: np.ndarray, target: int) -> np.ndarray:
+    """
+    Indices of the points Largest-Triangle-Three-Buckets keeps.
+    """
+    n = len(x)
+    if target >= n or target < 3:
+        return np.arange(n)
+    # Bucket i covers [starts[i], starts[i + 1]); the last bucket is the last
+    # point. Integer arithmetic, so the bounds are exact for any n.
+    starts = np.arange(target - 1, dtype=np.int64) * (n - 2) // (target - 2) + 1
+    bounds = np.append(starts, n)
+
+    # Average of every bucket at once (prefix sums).
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    sizes = bounds[1:] - bounds[:-1]
+    avg_x = (cx[bounds[1:]] - cx[bounds[:-1]]) / sizes
+    avg_y = (cy[bounds[1:]] - cy[bounds[:-1]]) / sizes
+
+    picked = np.empty(target, dtype=np.int64)
+    picked[0] = a = 0
+    for i in range(target - 2):
+        lo, hi = starts[i], starts[i + 1]
+        area = np.abs((x[a] - avg_x[i + 1]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y[i + 1] - y[a]))
+        a = lo + int(np.argmax(area))
+        picked[i + 1] = a
+    picked[-1] = n - 1
+    return picked
+
+
+def minmax(y: np.ndarray, target: int) -> np.ndarray:
+    """
+    Indices of the min and max point of each of target // 2 equal-count
+    buckets, plus the first and last point.
+    """
+    n = len(y)
+    buckets = max(1, target // 2)
+    if n <= target:
+        return np.arange(n)
+    bucket = np.arange(n) * buckets // n
+    starts = np.flatnonzero(np.diff(bucket, prepend=-1))
+    lowest = np.lexsort((y, bucket))[starts]
+    highest = np.lexsort((-y, bucket))[starts]
+    return np.unique(np.concatenate(([0, n - 1], lowest, highest)))
+
+
+def downsample(rows: List[Dict[str, Any]], target: int, method: str = "lttb") -> Dict[str, Any]:
+    """
+    {"rows": reduced rows, "meta": {...}}, or {"meta": {"skipped": reason}}
+    when the rows are left as they are.
+    """
+    series = find_series(rows)
+    if series is None:
+        return {"meta": {"skipped": "no date/time column with a numeric measure", "original_rows": len(rows)}}
+    if len(rows) <= target:
+        return {"meta": {"skipped": "result already within target", "original_rows": len(rows), **series}}
+
+    keep = [r for r in rows if r.get(series["x"]) is not None and r.get(series["y"]) is not None]
+    if not keep:
+        return {"meta": {"skipped": "no row has both a time and a measure", "original_rows": len(rows), **series}}
+    x = _time_axis([r[series["x"]] for r in keep])
+    y = np.array([r[series["y"]] for r in keep], dtype=float)
+
+    # One series per combination of the series columns, rows in time order.
+    by = series["by"]
+    labels = [r.get(by[0]) for r in keep] if len(by) == 1 else [tuple(r.get(c) for c in by) for r in keep]
+    keys: Dict[Any, int] = {}
+    group = np.fromiter((keys.setdefault(k, len(keys)) for k in labels), dtype=np.int64, count=len(labels))
+    order = np.lexsort((x, group))
+    x, y, group = x[order], y[order], group[order]
+    skipped = None
+    if ((group[1:] == group[:-1]) & (x[1:] == x[:-1])).any():
+        skipped = "time values repeat within a series"
+    elif 3 * len(keys) > target:
+        skipped = f"{len(keys)} series do not fit in {target} points"
+    if skipped:
+        return {"meta": {"skipped": skipped, "original_rows": len(rows), **series}}
+
+    # Each series gets a share of the target proportional to its length.
+    starts = np.flatnonzero(np.diff(group, prepend=-1))
+    bounds = np.append(starts, len(group))
+    picked = []
+    for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        share = max(3, target * (hi - lo) // len(group))
+        picked.append(lo + (lttb(x[lo:hi], y[lo:hi], share) if method == "lttb" else minmax(y[lo:hi], share)))
+    picked = np.concatenate(picked)
+    picked = picked[np.lexsort((group[picked], x[picked]))]  # back to time order
+    reduced = [keep[i] for i in order[picked].tolist()]
+    return {
+        "rows": reduced,
+        "meta": {
+            "method": method,
+            **series,
+            "series": len(keys),
+            "original_rows": len(rows),
+            "dropped_nulls": len(rows) - len(keep),
+            "rows": len(reduced),
+            "target": target,
+        },
+    }
@@ -0,0 +1,198 @@
+# backend/services/export.py
+"""
+Streaming CSV / JSONL export of full query results.
+
+    stream = QueryStream(conn, sql, close=close_db_connection)   # runs the query, reads the first batch
+    out = Exporter("csv", stream.columns, compress=True)
+    yield out.start()
+    while batch := stream.fetch():
+        yield out.encode(batch)
+    yield out.finish()
+
+QueryStream reads through a server-side (named) cursor, EXPORT_FETCH_ROWS
+rows per FETCH, so neither the database driver nor the API holds more
+than one batch. The connection is closed as soon as the cursor is drained
+(before the last bytes are sent) or the stream is abandoned.
+
+Exporter turns batches into CSV (header row, RFC 4180 quoting) or JSONL
+(one object per line) and, optionally, into one gzip member written
+incrementally. Values are encoded as in /chat responses: numerics and
+dates as strings / ISO text, NULL as an empty CSV field or JSON null.
+
+Configuration (env):
+- EXPORT_FETCH_ROWS            rows per FETCH from the server-side cursor (default 10000)
+- EXPORT_GZIP_LEVEL            gzip compression level (default 6)
+- EXPORT_STATEMENT_TIMEOUT_MS  statement_timeout for the export query and each FETCH (default 300000)
+- EXPORT_MAX_CONCURRENT        exports streaming at once; more get 429 (default 4)
+"""
+
+import csv
+import datetime as dt
+import io
+import json
+import os
+import uuid
+import zlib
+from decimal import Decimal
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", "10000"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+EXPORT_STATEMENT_TIMEOUT_MS = int(os.getenv("EXPORT_STATEMENT_TIMEOUT_MS", "300000"))
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "4"))
+
+EXPORT_FORMATS = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+
+# -----------------------------
+# Server-side cursor
+# -----------------------------
+
+class QueryStream:
+    """
+    A validated query read in batches through a named cursor. Raises
+    (psycopg2 errors) from the constructor if the query fails to start.
+    """
+
+    def __init__(self, conn, sql: str, close: Callable[[Any], None],
+                 fetch_rows: int = EXPORT_FETCH_ROWS, timeout_ms: int = EXPORT_STATEMENT_TIMEOUT_MS):
+        self.conn = conn
+        self.fetch_rows = fetch_rows
+        self.rows = 0
+        self._close = close
+        try:
+            with conn.cursor() as setup:
+                setup.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+            self.cur = conn.cursor(name=f"export_{uuid.uuid4().hex[:12]}")
+            self.cur.execute(sql)
+            self._pending: Optional[List[Tuple]] = self.cur.fetchmany(fetch_rows)
+            self.columns = [d[0] for d in self.cur.description]
+        except Exception:
+            self.close()
+            raise
+
+    def fetch(self) -> List[Tuple]:
+        """
+        The next batch; [] once the result is exhausted (the connection is
+        closed at that point).
+        """
+        if self.conn is None:
+            return []
+        if self._pending is not None:
+            batch, self._pending = self._pending, None
+        else:
+            batch = self.cur.fetchmany(self.fetch_rows)
+        self.rows += len(batch)
+        if len(batch) < self.fetch_rows:
+            self.close()
+        return batch
+
+    def cancel(self) -> None:
+        """
+        Cancel a FETCH still running on the connection (cancel protocol), so
+        close() does not wait behind it. Safe to call from any thread.
+        """
+        conn = self.conn
+        if conn is None:
+            return
+        try:
+            conn.cancel()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        try:
+            conn.rollback()  # read-only; ends the transaction and drops the cursor
+        except Exception:
+            pass
+        self._close(conn)
+
+
+def rows_from_dicts(rows: Sequence[dict]) -> Tuple[List[str], Callable[[], List[Tuple]]]:
+    """
+    Column names and a batch reader for rows already in memory (summary
+    result handles), shaped like QueryStream.fetch.
+    """
+    columns = list(rows[0].keys()) if rows else []
+    position = 0
+
+    def fetch() -> List[Tuple]:
+        nonlocal position
+        chunk = rows[position:position + EXPORT_FETCH_ROWS]
+        position += len(chunk)
+        return [tuple(r.get(c) for c in columns) for r in chunk]
+
+    return columns, fetch
+
+
+# -----------------------------
+# Encoding
+# -----------------------------
+
+def _text(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (dt.date, dt.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    return value
+
+
+def _json_default(value: Any) -> Any:
+    converted = _text(value)
+    if converted is value:
+        return str(value)
+    return converted
+
+
+class Exporter:
+    """
+    Encodes batches of row tuples as CSV / JSONL bytes, gzip-compressed
+    when compress is set.
+    """
+
+    def __init__(self, fmt: str, columns: List[str], compress: bool = True, level: int = EXPORT_GZIP_LEVEL):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {fmt!r}; expected one of {', '.join(EXPORT_FORMATS)}.")
+        self.fmt = fmt
+        self.columns = columns
+        self.bytes_out = 0
+        # wbits=31: a gzip member (header + trailer), not a raw zlib stream
+        self._gzip = zlib.compressobj(level, zlib.DEFLATED, 31) if compress else None
+
+    def _out(self, text: str) -> bytes:
+        data = text.encode("utf-8")
+        if self._gzip is not None:
+            data = self._gzip.compress(data)
+        self.bytes_out += len(data)
+        return data
+
+    def start(self) -> bytes:
+        if self.fmt == "csv":
+            return self._out(self._csv([self.columns]))
+        return b""
+
+    def encode(self, batch: List[Tuple]) -> bytes:
+        if self.fmt == "csv":
+            return self._out(self._csv([[_text(v) for v in row] for row in batch]))
+        columns = self.columns
+        return self._out("".join(
+            json.dumps(dict(zip(columns, row)), default=_json_default, ensure_ascii=False) + "\n" for row in batch
+        ))
+
+    def finish(self) -> bytes:
+        if self._gzip is None:
+            return b""
+        data = self._gzip.flush()
+        self.bytes_out += len(data)
+        return data
+
+    @staticmethod
+    def _csv(rows: List[List[Any]]) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\r\n").writerows(rows)
+        return buffer.getvalue()
@@ -0,0 +1,572 @@
+# backend/services/ingest.py
+"""
+Bulk ingestion of deal files (CSV / JSONL) into deal_event.
+
+    summary = ingest_file(conn, "deals_2025-01.csv", reject_path="deals_2025-01.rejects.jsonl")
+
+Pipeline, one pass over the input with memory bounded by INGEST_BATCH_ROWS:
+
+1. Stream-parse the file (csv.reader / one json.loads per line; .gz is
+   read transparently). CSV needs a header row naming registry columns.
+2. Validate every row against schema_registry.json: NOT NULL, integer,
+   numeric(p,s) precision/scale, ISO dates, deal_direction values, and
+   references to ref_* keys (loaded once per run into sets).
+3. Valid rows are written to a COPY text buffer; every INGEST_BATCH_ROWS
+   rows the buffer is COPYed into a temporary staging table and its new
+   deal_ids are moved with INSERT ... SELECT, then committed. Batches
+   load on worker threads while the next one is parsed, on up to
+   INGEST_WORKERS connections.
+4. Invalid rows go to the reject file (JSONL: line, errors per column,
+   original record); the run carries on.
+
+Validation is vectorized per batch and column, and the collector is paused
+while parsing: on one core this validates about 200k rows/s. Past that the
+database decides: the row-level FK triggers of deal_event (ref_* lookups)
+cost more than COPY and the insert together, which is what extra workers
+on a multi-core server spread out.
+
+Loading is idempotent on deal_id: re-running a file (or one that overlaps
+an earlier load) inserts only new deals and counts the rest as duplicates,
+so a run interrupted half-way can simply be started again. Existing deals
+are never modified. This holds on the partitioned deal_event of migration
+003 too, whose primary key is (deal_id, deal_date): a deal re-sent with
+another date is still a duplicate (see _flush; migration 006 rejects
+such a deal from any other writer).
+
+Configuration (env):
+- INGEST_BATCH_ROWS   rows per COPY batch / commit (default 50000)
+- INGEST_WORKERS      concurrent loader connections (default 2)
+- INGEST_REJECT_DIR   where the API writes reject files (default logs/ingest)
+"""
+
+import concurrent.futures
+import csv
+import datetime as dt
+import gc
+import gzip
+import io
+import json
+import os
+import queue
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, IO, Iterator, List, Optional, Tuple
+
+import psycopg2.errors
+
+from backend.services.metrics import INGEST_ROWS
+from backend.validator.validator import load_schema_registry
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+INGEST_BATCH_ROWS = int(os.getenv("INGEST_BATCH_ROWS", "50000"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_REJECT_DIR = Path(os.getenv("INGEST_REJECT_DIR", str(PROJECT_ROOT / "logs" / "ingest")))
+
+TABLE = "deal_event"
+STAGE_TABLE = "ingest_deal_event_stage"
+DEADLOCK_RETRIES = 3
+
+# Allowed values for semantic types the registry only describes in prose.
+SEMANTIC_VALUES = {"deal_direction": {"buy", "sell"}}
+
+FORMATS = ("csv", "jsonl")
+
+# (line numbers, original records, values) for one batch of input records.
+Batch = Tuple[Any, list, list]
+
+
+class _Reject(Exception):
+    """
+    A value failed validation (message is the reason).
+    """
+
+
+# -----------------------------
+# Column checks
+# -----------------------------
+
+def _copy_text(value: str) -> str:
+    if "\\" in value or "\t" in value or "\n" in value or "\r" in value:
+        return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    return value
+
+
+def _make_check(cdef: Dict, ref_keys: Optional[set]) -> Tuple[Callable[[str], str], Optional[re.Pattern]]:
+    """
+    Build (check, bulk) for one column.
+
+    check(raw) returns the value in COPY text format or raises _Reject; raw
+    is "" for a missing / NULL value. bulk, when not None, fullmatches the
+    column's values joined by newlines iff every value is valid and goes to
+    COPY unchanged, so a clean column is validated by one regex scan
+    instead of a call per value.
+    """
+    sql_type = cdef["sql_type"].lower()
+    nullable = cdef.get("nullable", True)
+    allowed = SEMANTIC_VALUES.get(cdef.get("semantic_type"))
+    unchanged = None  # regex for a valid value that needs no conversion
+
+    if sql_type.startswith(("integer", "int", "bigint", "smallint")):
+        pattern = re.compile(r"[+-]?\d+")
+        bits = 64 if sql_type.startswith("bigint") else 16 if sql_type.startswith("smallint") else 32
+        limit = 2 ** (bits - 1)
+        unchanged = rf"[+-]?\d{{1,{len(str(limit)) - 1}}}"
+
+        def convert(v: str) -> str:
+            if not pattern.fullmatch(v) or not -limit <= int(v) < limit:
+                raise _Reject(f"invalid {sql_type}: {v!r}")
+            return v
+
+    elif sql_type.startswith(("numeric", "decimal")):
+        m = re.search(r"\((\d+)\s*(?:,\s*(\d+))?\)", sql_type)
+        if m:
+            precision, scale = int(m.group(1)), int(m.group(2) or 0)
+            whole = f"\\d{{1,{precision - scale}}}" if precision > scale else "0?"
+            frac = f"(?:\\.\\d{{0,{scale}}})?" if scale else ""
+            unchanged = f"[+-]?(?:{whole}{frac}|\\.\\d{{1,{max(scale, 1)}}})"
+        else:
+            unchanged = r"[+-]?(?:\d+(?:\.\d*)?|\.\d+)"
+        pattern = re.compile(unchanged)
+
+        def convert(v: str) -> str:
+            if not pattern.fullmatch(v):
+                raise _Reject(f"invalid {sql_type}: {v!r}")
+            return v
+
+    elif sql_type == "date":
+        seen: set = set()  # deals cluster on a few thousand distinct days
+        # fromisoformat alone also takes forms COPY rejects (2024-W01-1).
+        pattern = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+        def convert(v: str) -> str:
+            if v not in seen:
+                try:
+                    if not pattern.fullmatch(v):
+                        raise ValueError
+                    dt.date.fromisoformat(v)
+                except ValueError:
+                    raise _Reject(f"not an ISO date (YYYY-MM-DD): {v!r}")
+                seen.add(v)
+            return v
+
+    else:
+        convert = _copy_text
+        unchanged = r"[^\\\t\n\r]+"
+
+    def check(v: str) -> str:
+        if v == "":
+            if not nullable:
+                raise _Reject("required")
+            return "\\N"
+        v = convert(v)
+        if ref_keys is not None and v not in ref_keys:
+            raise _Reject(f"unknown {cdef['references']['table']} key {v!r}")
+        if allowed is not None and v not in allowed:
+            raise _Reject(f"must be one of {sorted(allowed)}")
+        return v
+
+    bulk = None
+    if unchanged is not None and ref_keys is None and allowed is None:
+        bulk = re.compile(f"(?:{unchanged})(?:\n(?:{unchanged}))*")
+    return check, bulk
+
+
+def load_ref_keys(conn, registry: Dict, table: str = TABLE) -> Dict[str, set]:
+    """
+    Key sets of every ref table that `table` references, read once per run.
+    """
+    keys = {}
+    with conn.cursor() as cur:
+        for col, cdef in registry["tables"][table]["columns"].items():
+            ref = cdef.get("references")
+            if ref:
+                cur.execute(f"SELECT {ref['column']} FROM {ref['table']}")
+                keys[col] = {r[0] for r in cur.fetchall()}
+    conn.rollback()
+    return keys
+
+
+# -----------------------------
+# Readers
+# -----------------------------
+
+def detect_format(name: str) -> str:
+    name = name.lower().removesuffix(".gz")
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    raise ValueError(f"cannot tell the format of {name!r}; pass format='csv' or 'jsonl'")
+
+
+def open_text(path: Path) -> IO[str]:
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def _read_csv(f: IO[str], columns: List[str], size: int) -> Tuple[Dict, Iterator[Batch]]:
+    """
+    Records come back as parsed (full header width); info["index"] maps
+    registry columns to their position (None: not in the file). Line
+    numbers assume no quoted line breaks.
+    """
+    reader = csv.reader(f)
+    try:
+        header = [h.strip() for h in next(reader)]
+    except StopIteration:
+        header = []
+    positions = {name: i for i, name in enumerate(header)}
+    info = {
+        "header": header,
+        "width": len(header),
+        "index": [positions.get(c) for c in columns],
+        "ignored_columns": [h for h in header if h not in columns],
+    }
+
+    def batches():
+        line = 2
+        while True:
+            rows = list(islice(reader, size))
+            if not rows:
+                return
+            yield range(line, line + len(rows)), rows, rows
+            line += len(rows)
+
+    return info, batches()
+
+
+def _read_jsonl(f: IO[str], columns: List[str], size: int) -> Tuple[Dict, Iterator[Batch]]:
+    """
+    Records come back as string values in registry column order
+    (an empty list for a line that is not a JSON object).
+    """
+    def value(v: Any) -> str:
+        if v is None:
+            return ""
+        if isinstance(v, (bool, dict, list)):
+            return json.dumps(v)  # "true" / "{...}": fails every non-text check
+        return v if isinstance(v, str) else str(v)
+
+    def batches():
+        lines, raws, values = [], [], []
+        for line, text in enumerate(f, start=1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError:
+                record = text.rstrip("\n")
+            lines.append(line)
+            raws.append(record)
+            values.append([value(record.get(c)) for c in columns] if isinstance(record, dict) else [])
+            if len(values) >= size:
+                yield lines, raws, values
+                lines, raws, values = [], [], []
+        if values:
+            yield lines, raws, values
+
+    return {"width": len(columns), "index": list(range(len(columns)))}, batches()
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Parsing allocates millions of short-lived, acyclic lists and tuples;
+    collector passes over them cost as much as the parsing itself.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+# -----------------------------
+# Loading
+# -----------------------------
+
+def ingest_stream(conn, f: IO[str], fmt: str, reject_file: Optional[IO[str]] = None,
+                  batch_rows: int = INGEST_BATCH_ROWS, registry: Optional[Dict] = None,
+                  max_rejects_returned: int = 20, connect: Optional[Callable[[], Any]] = None,
+                  workers: int = INGEST_WORKERS) -> Dict[str, Any]:
+    """
+    Validate and load one text stream. Returns a summary:
+        {rows, inserted, duplicates, rejected, batches, seconds, rows_per_s,
+         rejects: [first few], ignored_columns?, error?}
+    A database error stops the run (batches already committed stay).
+
+    With connect (a no-argument connection factory) and workers > 1, up to
+    `workers` batches are loaded concurrently on their own connections.
+    """
+    if fmt not in FORMATS:
+        return {"error": f"unknown format {fmt!r}; expected one of {FORMATS}"}
+    registry = registry or load_schema_registry()
+    tdef = registry["tables"][TABLE]
+    columns = list(tdef["columns"])
+
+    ref_keys = load_ref_keys(conn, registry)
+    checks = [_make_check(tdef["columns"][name], ref_keys.get(name)) for name in columns]
+
+    info, batches = (_read_csv if fmt == "csv" else _read_jsonl)(f, columns, batch_rows)
+    summary: Dict[str, Any] = {"rows": 0, "inserted": 0, "duplicates": 0, "rejected": 0, "batches": 0, "rejects": []}
+    if fmt == "csv":
+        missing = [c for c in columns if c not in info["header"] and not tdef["columns"][c].get("nullable", True)]
+        if missing:
+            return {**summary, "error": f"CSV header is missing required columns: {missing}"}
+        if info["ignored_columns"]:
+            summary["ignored_columns"] = info["ignored_columns"]
+
+    def reject(line: int, raw: Any, errors: Dict[str, str]) -> None:
+        summary["rejected"] += 1
+        entry = {"line": line, "errors": errors, "record": raw}
+        if len(summary["rejects"]) < max_rejects_returned:
+            summary["rejects"].append(entry)
+        if reject_file is not None:
+            reject_file.write(json.dumps(entry, default=str) + "\n")
+
+    t0 = time.perf_counter()
+    conns = [conn]
+    try:
+        if connect is not None:
+            conns += [connect() for _ in range(max(workers, 1) - 1)]
+        loader = _Loader(conns, columns, summary)
+        try:
+            with _gc_paused():
+                for lines, raws, values in batches:
+                    summary["rows"] += len(values)
+                    n, buf = _validate_batch(lines, raws, values, info, columns, checks, reject)
+                    if n:
+                        loader.submit(buf, n)
+            loader.finish()
+        except Exception as e:
+            loader.abort()
+            summary["error"] = f"batch {summary['batches'] + 1} failed: {e}"
+    except Exception as e:
+        summary["error"] = f"cannot open loader connections: {e}"
+    finally:
+        for extra in conns[1:]:
+            extra.close()
+
+    summary["seconds"] = round(time.perf_counter() - t0, 3)
+    summary["rows_per_s"] = round(summary["rows"] / summary["seconds"]) if summary["seconds"] else None
+    INGEST_ROWS.inc(summary["inserted"], outcome="inserted")
+    INGEST_ROWS.inc(summary["duplicates"], outcome="duplicate")
+    INGEST_ROWS.inc(summary["rejected"], outcome="rejected")
+    return summary
+
+
+def _validate_batch(lines, raws: list, values: list, info: Dict, columns: List[str], checks: list,
+                    reject: Callable[[int, Any, Dict[str, str]], None]) -> Tuple[int, Optional[io.StringIO]]:
+    """
+    Validate one batch column by column and render the good rows as COPY
+    text. Returns (rows in the buffer, buffer); bad rows go to reject().
+
+    Each distinct value is checked once (a batch has a few dozen products
+    but 50k deal_ids), and only rows holding a bad value are looked at
+    individually.
+    """
+    width = info["width"]
+    kept = range(len(values))
+    if set(map(len, values)) != {width}:
+        kept = [i for i, v in enumerate(values) if len(v) == width]
+        for i in sorted(set(range(len(values))) - set(kept)):
+            reject(lines[i], raws[i], {"_row": "malformed record"})
+        values = [values[i] for i in kept]
+    if not values:
+        return 0, None
+
+    by_position = list(zip(*values))
+    blank = ("",) * len(values)
+    errors: Dict[int, Dict[str, str]] = {}
+    out_columns = []
+    for name, (check, bulk), pos in zip(columns, checks, info["index"]):
+        column = blank if pos is None else by_position[pos]
+        distinct = set(column)
+        if bulk is not None and bulk.fullmatch("\n".join(distinct)):
+            out_columns.append(column)
+            continue
+        converted, bad = {}, {}
+        for v in distinct:
+            try:
+                c = check(v)
+            except _Reject as e:
+                bad[v] = str(e)
+                continue
+            if c is not v:
+                converted[v] = c
+        if bad:
+            for i, v in enumerate(column):
+                if v in bad:
+                    errors.setdefault(i, {})[name] = bad[v]
+        out_columns.append([converted.get(v, v) for v in column] if converted else column)
+
+    out_rows = zip(*out_columns)
+    if errors:
+        for i in sorted(errors):
+            reject(lines[kept[i]], raws[kept[i]], errors[i])
+        out_rows = (r for i, r in enumerate(out_rows) if i not in errors)
+    n = len(values) - len(errors)
+    if not n:
+        return 0, None
+    return n, io.StringIO("\n".join(map("\t".join, out_rows)) + "\n")
+
+
+def ingest_file(conn, path, fmt: Optional[str] = None, reject_path=None, **kwargs) -> Dict[str, Any]:
+    """
+    ingest_stream() on a file; rejects go to reject_path (created only if
+    something is rejected). The summary includes "reject_file".
+    """
+    path = Path(path)
+    try:
+        fmt = fmt or detect_format(path.name)
+    except ValueError as e:
+        return {"error": str(e)}
+    reject_path = Path(reject_path) if reject_path else None
+    tmp_path = reject_path.with_name(reject_path.name + ".part") if reject_path else None
+    reject_file = open(tmp_path, "w", encoding="utf-8") if tmp_path else None
+    summary: Dict[str, Any] = {}
+    try:
+        with open_text(path) as f:
+            summary = ingest_stream(conn, f, fmt, reject_file=reject_file, **kwargs)
+    finally:
+        if reject_file is not None:
+            reject_file.close()
+            if not summary.get("rejected"):
+                tmp_path.unlink()  # nothing rejected, or ingest_stream raised
+    if tmp_path is not None and summary.get("rejected"):
+        tmp_path.replace(reject_path)
+        summary["reject_file"] = str(reject_path)
+    return summary
+
+
+class _Loader:
+    """
+    Loads COPY buffers on worker threads, one connection per worker, while
+    the caller parses the next batch (psycopg2 releases the GIL during
+    COPY). submit() blocks once every worker is busy, so at most
+    len(conns) + 1 batches are in memory.
+    """
+
+    def __init__(self, conns: list, columns: List[str], summary: Dict[str, Any]):
+        self.idle: "queue.Queue" = queue.Queue()
+        for conn in conns:
+            _create_stage(conn)
+            self.idle.put(conn)
+        self.conns = conns
+        self.columns = columns
+        self.partitioned = _is_partitioned(conns[0])
+        self.summary = summary
+        self.pool = ThreadPoolExecutor(max_workers=len(conns), thread_name_prefix="ingest-copy")
+        self.in_flight: "deque[concurrent.futures.Future]" = deque()
+
+    def submit(self, buf: io.StringIO, n: int) -> None:
+        while len(self.in_flight) >= len(self.conns):
+            self._collect(self.in_flight.popleft())
+        self.in_flight.append(self.pool.submit(self._load, buf, n))
+
+    def finish(self) -> None:
+        while self.in_flight:
+            self._collect(self.in_flight.popleft())
+        self._close()
+
+    def abort(self) -> None:
+        concurrent.futures.wait(self.in_flight)
+        for future in self.in_flight:
+            if future.exception() is None:
+                self._collect(future)
+        self.in_flight.clear()
+        for conn in self.conns:
+            conn.rollback()
+        self._close()
+
+    def _collect(self, future: concurrent.futures.Future) -> None:
+        inserted, n = future.result()
+        self.summary["batches"] += 1
+        self.summary["inserted"] += inserted
+        self.summary["duplicates"] += n - inserted
+
+    def _close(self) -> None:
+        self.pool.shutdown()
+        for conn in self.conns:
+            _drop_stage(conn)
+
+    def _load(self, buf: io.StringIO, n: int) -> Tuple[int, int]:
+        conn = self.idle.get()
+        try:
+            for attempt in range(DEADLOCK_RETRIES + 1):
+                try:
+                    return _flush(conn, buf, self.columns, self.partitioned), n
+                except psycopg2.errors.DeadlockDetected:
+                    # Concurrent batches holding the same deal_id; skipping
+                    # existing deal_ids makes the retry safe.
+                    conn.rollback()
+                    if attempt == DEADLOCK_RETRIES:
+                        raise
+                    buf.seek(0)
+        finally:
+            self.idle.put(conn)
+
+
+def _create_stage(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {STAGE_TABLE} (LIKE {TABLE} INCLUDING DEFAULTS) "
+            "ON COMMIT DELETE ROWS"
+        )
+    conn.commit()
+
+
+def _drop_stage(conn) -> None:
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {STAGE_TABLE}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+
+
+def _is_partitioned(conn) -> bool:
+    with conn.cursor() as cur:
+        cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass", (TABLE,))
+        row = cur.fetchone()
+    conn.rollback()
+    return bool(row and row[0])
+
+
+def _flush(conn, buf: io.StringIO, columns: List[str], partitioned: bool = False) -> int:
+    """
+    COPY one batch into the staging table and move it over, skipping deal_ids
+    that already exist (or repeat within the input: the first occurrence
+    wins). One transaction. Returns rows inserted.
+
+    On the partitioned deal_event the primary key is (deal_id, deal_date),
+    so ON CONFLICT alone would let a deal re-sent with another date in. The
+    NOT EXISTS check covers that; moves are serialized across loader
+    connections with a transaction-level advisory lock so two batches
+    carrying the same deal_id cannot both pass it.
+    """
+    col_list = ", ".join(columns)
+    staged = ", ".join(f"s.{c}" for c in columns)
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY {STAGE_TABLE} ({col_list}) FROM STDIN", buf)
+        if partitioned:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"{TABLE} ingest",))
+        cur.execute(
+            f"INSERT INTO {TABLE} ({col_list}) "
+            f"SELECT DISTINCT ON (s.deal_id) {staged} FROM {STAGE_TABLE} s "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {TABLE} e WHERE e.deal_id = s.deal_id) "
+            "ORDER BY s.deal_id, s.ctid "  # ctid: COPY order
+            "ON CONFLICT DO NOTHING"
+        )
+        inserted = cur.rowcount
+    conn.commit()  # ON COMMIT DELETE ROWS empties the stage
+    return inserted
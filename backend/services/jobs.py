@@ -0,0 +1,250 @@
+# backend/services/jobs.py
+"""
+Background jobs for /chat questions that outlive HTTP / proxy timeouts.
+
+    POST /chat/jobs               {"question": ..., "priority": "batch"}  -> 202 {"job_id", "url", ...}
+    GET  /chat/jobs/{id}          status, current stage, queue position, timings
+    GET  /chat/jobs/{id}/events   the same as Server-Sent Events, one per change, until the job ends
+    GET  /chat/jobs/{id}/result   the /chat response body (gzip on the wire if the client accepts it)
+    DELETE /chat/jobs/{id}        cancel (queued: dropped, running: query / OpenAI stream aborted)
+
+Jobs run the normal /chat pipeline on JOB_WORKERS threads, taken from a
+priority queue: every queued "interactive" job starts before any "batch"
+job, FIFO within a priority. At most JOB_QUEUE_MAX jobs wait; further
+submissions are refused (the API answers 429). A job's time budget
+(OpenAI timeout, statement_timeout) is JOB_BUDGET_S from the moment it
+starts rather than REQUEST_BUDGET_S.
+
+Finished responses are gzip-compressed into JOB_RESULT_DIR
+(<job id>.json.gz) and kept, together with the job record, for
+JOB_RESULT_TTL_S after the job ends. Expired jobs are swept on submit and
+lookup; files left over from a previous process are removed at start.
+
+Configuration (env):
+- JOBS_ENABLED         serve /chat/jobs (default true)
+- JOB_WORKERS          concurrent jobs (default 2)
+- JOB_QUEUE_MAX        jobs waiting to start (default 100)
+- JOB_BUDGET_S         time budget of a running job (default 900)
+- JOB_RESULT_DIR       compressed results (default logs/jobs)
+- JOB_RESULT_TTL_S     seconds a finished job and its result are kept (default 3600)
+"""
+
+import gzip
+import itertools
+import os
+import queue
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from backend.services import metrics
+from backend.services.cancellation import CancelToken
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "true").lower() == "true"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "100"))
+JOB_BUDGET_S = float(os.getenv("JOB_BUDGET_S", "900"))
+JOB_RESULT_DIR = Path(os.getenv("JOB_RESULT_DIR", str(PROJECT_ROOT / "logs" / "jobs")))
+JOB_RESULT_TTL_S = float(os.getenv("JOB_RESULT_TTL_S", "3600"))
+
+PRIORITIES = {"interactive": 0, "batch": 1}
+FINISHED = ("done", "failed", "cancelled")
+
+# run(request, on_stage, cancel) -> (response body, pipeline status)
+Runner = Callable[[Any, Callable[[str], None], CancelToken], Tuple[bytes, str]]
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    Bounded worker pool over a priority queue, plus the job records and
+    their compressed results.
+    """
+
+    def __init__(self, run: Runner, workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_MAX,
+                 result_dir: Path = JOB_RESULT_DIR, ttl_s: float = JOB_RESULT_TTL_S):
+        self.run = run
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_dir = result_dir
+        self.ttl_s = ttl_s
+        self._queue: "queue.PriorityQueue[Tuple[int, int, str]]" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self) -> None:
+        self.result_dir.mkdir(parents=True, exist_ok=True)
+        for path in self.result_dir.glob("*.json.gz"):
+            path.unlink(missing_ok=True)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"chat-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    # -----------------------------
+    # Client side
+    # -----------------------------
+
+    def submit(self, request: Any, question: str, priority: str) -> Dict[str, Any]:
+        """
+        Queue a job; raises QueueFull when JOB_QUEUE_MAX jobs are waiting.
+        """
+        self._sweep()
+        job_id = uuid.uuid4().hex
+        seq = next(self._seq)
+        with self._lock:
+            waiting = sum(1 for job in self._jobs.values() if job["status"] == "queued")
+            if waiting >= self.max_queued:
+                raise QueueFull(f"{waiting} jobs already queued (JOB_QUEUE_MAX={self.max_queued}).")
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "question": question,
+                "priority": priority,
+                "status": "queued",
+                "stage": None,
+                "result_status": None,
+                "error": None,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "version": 0,
+                "_seq": (PRIORITIES[priority], seq),
+                "_request": request,
+                "_cancel": None,  # created when the job starts, so the budget runs from there
+            }
+            self._queue.put((PRIORITIES[priority], seq, job_id))
+        metrics.CHAT_JOBS_QUEUED.inc(priority=priority)
+        return self.status(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        self._sweep()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._public(job) if job is not None else None
+
+    def result(self, job_id: str) -> Optional[bytes]:
+        """
+        The gzip-compressed response body of a finished job, else None.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != "done":
+                return None
+        try:
+            return self._path(job_id).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] == "queued":
+                # Left in the queue; the worker that pops it skips it.
+                self._finish(job, "cancelled", error="Cancelled before it started.")
+                metrics.CHAT_JOBS_QUEUED.dec(priority=job["priority"])
+            cancel = job["_cancel"]
+        if cancel is not None and not cancel.cancelled:
+            cancel.cancel("job_cancelled")
+        return self.status(job_id)
+
+    # -----------------------------
+    # Workers
+    # -----------------------------
+
+    def _work(self) -> None:
+        while True:
+            _, _, job_id = self._queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job["status"] != "queued":
+                    continue
+                job["status"] = "running"
+                job["started_at"] = time.time()
+                job["_cancel"] = CancelToken(JOB_BUDGET_S)
+                self._touch(job)
+            metrics.CHAT_JOBS_QUEUED.dec(priority=job["priority"])
+
+            try:
+                body, result_status = self.run(job["_request"], lambda stage: self._stage(job, stage), job["_cancel"])
+            except Exception as e:
+                with self._lock:
+                    self._finish(job, "failed", error=f"{type(e).__name__}: {e}")
+                continue
+
+            if result_status == "cancelled":
+                with self._lock:
+                    self._finish(job, "cancelled", result_status=result_status, error="Cancelled while running.")
+                continue
+            try:
+                self._path(job_id).write_bytes(gzip.compress(body, compresslevel=6))
+            except OSError as e:
+                with self._lock:
+                    self._finish(job, "failed", result_status=result_status, error=f"Could not store the result: {e}")
+                continue
+            with self._lock:
+                self._finish(job, "done", result_status=result_status)
+
+    def _stage(self, job: Dict[str, Any], stage: str) -> None:
+        with self._lock:
+            job["stage"] = stage
+            self._touch(job)
+
+    # -----------------------------
+    # Internals (callers hold self._lock)
+    # -----------------------------
+
+    def _touch(self, job: Dict[str, Any]) -> None:
+        # Bumped on every change; /events sends a new event per version.
+        job["version"] += 1
+
+    def _finish(self, job: Dict[str, Any], status: str, result_status: Optional[str] = None,
+                error: Optional[str] = None) -> None:
+        job["status"] = status
+        job["result_status"] = result_status
+        job["error"] = error
+        job["finished_at"] = time.time()
+        self._touch(job)
+        metrics.CHAT_JOBS.inc(priority=job["priority"], status=status)
+
+    def _public(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        now = time.time()
+        info = {k: v for k, v in job.items() if not k.startswith("_")}
+        info["url"] = f"/chat/jobs/{job['job_id']}"
+        if job["status"] == "queued":
+            info["position"] = sum(
+                1 for other in self._jobs.values() if other["status"] == "queued" and other["_seq"] < job["_seq"]
+            )
+        started, finished = job["started_at"], job["finished_at"]
+        info["queued_s"] = round((started or finished or now) - job["submitted_at"], 3)
+        if started is not None:
+            info["run_s"] = round((finished or now) - started, 3)
+        if job["status"] == "done":
+            info["result_url"] = f"/chat/jobs/{job['job_id']}/result"
+            info["expires_in_s"] = round(self.ttl_s - (now - finished), 1)
+        return info
+
+    def _path(self, job_id: str) -> Path:
+        return self.result_dir / f"{job_id}.json.gz"
+
+    def _sweep(self) -> None:
+        now = time.time()
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job["finished_at"] is not None and now - job["finished_at"] > self.ttl_s
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+        for job_id in expired:
+            self._path(job_id).unlink(missing_ok=True)
@@ -0,0 +1,358 @@
+# backend/services/metrics.py
+"""
+Lightweight in-process metrics for the /chat pipeline.
+
+- RequestTimer: per-request stage timings, rendered as a `Server-Timing`
+  response header (e.g. "openai;dur=812.4, validate;dur=0.6").
+- Counter / Gauge / Histogram: process-wide aggregates, rendered in the
+  Prometheus text exposition format by render_prometheus() for /metrics.
+
+Recording is a dict update under a lock (plus a bisect for histograms), and
+the text output is only built when /metrics is scraped, so the cost when no
+one scrapes is negligible. Set METRICS_ENABLED=false to skip aggregation
+entirely (Server-Timing headers are still emitted).
+
+No external dependency (prometheus_client is not required).
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from backend.services import tracing
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Slice of a bulkhead wait between cancellation checks (RequestTimer.hold).
+BULKHEAD_POLL_S = 0.1
+
+# Default latency buckets in seconds (1 ms .. 60 s).
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    parts = []
+    for k, v in items:
+        v = v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# -----------------------------
+# Metric types
+# -----------------------------
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    Monotonic counter with optional labels.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        lines = self._header()
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Gauge with optional labels. A callback can be given instead of set()
+    calls; it is only evaluated at scrape time.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, help_text)
+        self._values: Dict[LabelKey, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_callback(self, callback: Callable[[], float]) -> None:
+        self._callback = callback
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        if self._callback is not None:
+            try:
+                lines.append(f"{self.name} {_format_value(self._callback())}")
+            except Exception:
+                pass
+            return lines
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """
+    Cumulative-bucket histogram with optional labels.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(labels)
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            slot = self._values.get(key)
+            if slot is None:
+                slot = [0] * (len(self.buckets) + 1) + [0.0, 0]
+                self._values[key] = slot
+            slot[idx] += 1
+            slot[-2] += value
+            slot[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = self._header()
+        n_buckets = len(self.buckets)
+        for key, slot in items:
+            cumulative = 0
+            for i, bound in enumerate(self.buckets + (float("inf"),)):
+                cumulative += slot[i]
+                le = ("le", _format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(slot[n_buckets + 1])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {slot[n_buckets + 2]}")
+        return lines
+
+
+def render_prometheus() -> str:
+    """
+    Render every registered metric in Prometheus text format (v0.0.4).
+    """
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------------
+# Pipeline metrics
+# -----------------------------
+
+CHAT_REQUESTS = Counter("chat_requests_total", "Chat requests by final status and stage.")
+CHAT_REQUEST_SECONDS = Histogram("chat_request_duration_seconds", "End-to-end /chat handler time.")
+CHAT_STAGE_SECONDS = Histogram("chat_stage_duration_seconds", "Time spent per pipeline stage.")
+CHAT_CANCELLED = Counter("chat_cancelled_total", "Requests cancelled (e.g. client disconnect) by stage reached.")
+
+OPENAI_REQUESTS = Counter("openai_requests_total", "OpenAI chat-completion calls by outcome.")
+OPENAI_TOKENS = Counter("openai_tokens_total", "OpenAI token usage by kind (prompt/completion).")
+
+DB_CONNECTIONS_OPENED = Counter("db_connections_opened_total", "New database connections opened.")
+DB_CONNECTION_ERRORS = Counter("db_connection_errors_total", "Failed database connection attempts.")
+DB_CONNECTIONS_IN_USE = Gauge("db_connections_in_use", "Database connections currently checked out.")
+DB_QUERIES = Counter("db_queries_total", "Executed queries by outcome (ok/error/timeout/cancelled).")
+DB_ROWS_RETURNED = Counter("db_rows_returned_total", "Rows returned by executed queries.")
+
+ADMISSION_DECISIONS = Counter("admission_decisions_total", "Cost-based admission decisions (ok/limited/rejected).")
+PLAN_CACHE_REQUESTS = Counter("plan_cache_requests_total", "EXPLAIN plan cache lookups by result (hit/miss).")
+ROLLUP_REWRITES = Counter("rollup_rewrites_total", "Validated queries by rollup used (day/month/none).")
+DATE_FILTERS = Counter("date_filter_queries_total", "Validated queries by deal_date filter (sargable/rewritten/nonsargable/none).")
+QUERY_BACKEND_REQUESTS = Counter("query_backend_requests_total", "Queries by backend that served them (and fallbacks).")
+QUERY_BACKEND_SECONDS = Histogram("query_backend_duration_seconds", "Query execution time by serving backend.")
+SEGMENT_CACHE_SEGMENTS = Counter("segment_cache_segments_total", "Month segments read by the segment cache by source (cached/fetched/edge).")
+CHANGE_FEED_ROWS = Counter("change_feed_rows_total", "Change-feed rows applied by table and op.")
+CHANGE_FEED_WAKEUPS = Counter("change_feed_wakeups_total", "Change-feed listener wakeups by source (notify/poll).")
+INGEST_ROWS = Counter("ingest_rows_total", "Bulk-ingested deal rows by outcome (inserted/duplicate/rejected).")
+CHAT_JOBS = Counter("chat_jobs_total", "Background /chat jobs by priority and final status (done/failed/cancelled).")
+CHAT_JOBS_QUEUED = Gauge("chat_jobs_queued", "Background /chat jobs waiting for a worker, by priority.")
+EXPORT_ROWS = Counter("export_rows_total", "Rows streamed by /chat/export by format.")
+SESSION_FOLLOW_UPS = Counter("session_follow_ups_total", "Questions in a session by SQL source (rule/llm) and answer source (cached/database).")
+
+TRACE_SPANS_EXPORTED = Gauge("trace_spans_exported", "Spans written by the trace exporter.",
+                             callback=lambda: tracing.exporter_stats()["exported"])
+TRACE_SPANS_DROPPED = Gauge("trace_spans_dropped", "Spans dropped because the export queue was full.",
+                            callback=lambda: tracing.exporter_stats()["dropped"])
+
+
+# -----------------------------
+# Per-request stage timer
+# -----------------------------
+
+class RequestTimer:
+    """
+    Collects stage durations for a single request.
+
+    Each stage is also a tracing span (a no-op when the request is not
+    sampled), so attributes can be attached where the work happens.
+
+    Usage:
+        timer = RequestTimer()
+        with timer.stage("openai") as span:
+            ...
+            span.set_attribute("gen_ai.usage.input_tokens", 812)
+        response.headers["Server-Timing"] = timer.server_timing_header()
+        timer.finish(status="ok", stage="db_execution")
+    """
+
+    def __init__(self, on_stage: Optional[Callable[[str], None]] = None,
+                 bulkheads: Optional[Dict[str, threading.Semaphore]] = None):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self._lock = threading.Lock()  # compound plans time sub-queries from worker threads
+        self._on_stage = on_stage  # progress hook (background jobs)
+        # stage -> semaphore held while the stage runs (batch requests),
+        # or held between hold() and release() for work spanning stages;
+        # time spent waiting is recorded as "<name>_wait".
+        self._bulkheads = bulkheads or {}
+
+    @contextmanager
+    def stage(self, name: str):
+        if self._on_stage is not None:
+            self._on_stage(name)
+        bulkhead = self._bulkheads.get(name)
+        if bulkhead is not None:
+            t_wait = time.perf_counter()
+            bulkhead.acquire()
+            self.add(f"{name}_wait", time.perf_counter() - t_wait)
+        t0 = time.perf_counter()
+        try:
+            with tracing.span(name) as span:
+                try:
+                    yield span
+                finally:
+                    self.add(name, time.perf_counter() - t0)
+        finally:
+            if bulkhead is not None:
+                bulkhead.release()
+
+    def hold(self, name: str, cancel=None) -> Optional[str]:
+        """
+        Take the bulkhead `name`, if this timer has one, until release(name)
+        (e.g. a database connection from open to close). The wait gives up
+        when the CancelToken is cancelled or out of budget. Returns None
+        once held (or without a bulkhead), else why it gave up.
+        """
+        bulkhead = self._bulkheads.get(name)
+        if bulkhead is None:
+            return None
+        t_wait = time.perf_counter()
+        try:
+            while not bulkhead.acquire(timeout=BULKHEAD_POLL_S):
+                if cancel is not None and cancel.cancelled:
+                    return f"cancelled ({cancel.reason})"
+                if cancel is not None and cancel.remaining() <= 0:
+                    return f"no {name} slot free within the time budget"
+            return None
+        finally:
+            self.add(f"{name}_wait", time.perf_counter() - t_wait)
+
+    def release(self, name: str) -> None:
+        bulkhead = self._bulkheads.get(name)
+        if bulkhead is not None:
+            bulkhead.release()
+
+    def add(self, name: str, seconds: float) -> None:
+        # A stage may run more than once per request (e.g. retries); accumulate.
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing_header(self) -> str:
+        parts = [f"{name};dur={seconds * 1000.0:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000.0:.1f}")
+        return ", ".join(parts)
+
+    def finish(self, status: str, stage: str) -> None:
+        """
+        Fold this request into the process-wide histograms and counters.
+        """
+        if not METRICS_ENABLED:
+            return
+        for name, seconds in self.stages.items():
+            CHAT_STAGE_SECONDS.observe(seconds, stage=name)
+        CHAT_REQUEST_SECONDS.observe(self.elapsed())
+        CHAT_REQUESTS.inc(status=status, stage=stage)
@@ -0,0 +1,297 @@
+# backend/services/planner.py
+"""
+Compound questions as several simple queries combined in process.
+
+Validator v1 forbids subqueries, CTEs, UNION and window functions, so
+"compare 2023 vs 2024 volume per product" or "top counterparties and their
+share of total" have no single compliant SELECT. For those the model is
+asked for a plan instead:
+
+    {
+      "queries": [
+        {"name": "y2023", "sql": "SELECT product_id, SUM(volume) AS volume FROM deal_event WHERE ... GROUP BY product_id"},
+        {"name": "y2024", "sql": "SELECT product_id, SUM(volume) AS volume FROM deal_event WHERE ... GROUP BY product_id"}
+      ],
+      "combine": {"op": "compare", "keys": ["product_id"], "values": ["volume"],
+                  "fill_missing": 0, "order_by": "diff", "desc": true, "limit": 20}
+    }
+
+Every query goes through the validator like a single-query answer (the
+safety model does not change); the API runs them concurrently and
+combine_results() merges their rows:
+
+    join     outer join on keys; value columns become <value>_<name>
+    compare  join of two queries plus diff (second - first) and pct_change
+    ratio    join of two queries plus ratio (first / second)
+    share    first query = parts, second = totals keyed by a subset of the
+             keys (often none: one total row); adds share_pct per part
+
+With several values, computed columns are prefixed: volume_diff, ... .
+Arithmetic runs on NumPy arrays aligned by key; a key missing from a query
+is NULL, or fill_missing when given (0 for SUM / COUNT comparisons).
+
+Plans are used when the question looks compound (looks_compound) or when
+the single-query answer was rejected for a construct a plan avoids
+(needs_plan).
+
+Configuration (env):
+- COMPOUND_PLANNER_ENABLED  "true"/"false" (default true)
+- PLANNER_MAX_QUERIES       queries per plan (default 4)
+"""
+
+import json
+import math
+import os
+import re
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from backend.validator.query_shape import parse_query
+
+COMPOUND_PLANNER_ENABLED = os.getenv("COMPOUND_PLANNER_ENABLED", "true").lower() == "true"
+PLANNER_MAX_QUERIES = int(os.getenv("PLANNER_MAX_QUERIES", "4"))
+
+COMBINE_OPS = ("join", "compare", "ratio", "share")
+TWO_QUERY_OPS = ("compare", "ratio", "share")
+
+_NAME_RE = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+_COMPOUND_RE = re.compile(
+    r"\b(compare[ds]?|comparison|versus|vs\.?|against|share\s+of|percent(age)?\s+of|"
+    r"%\s+of|ratio|proportion|difference\s+between|year[- ]over[- ]year|yoy|growth)\b",
+    re.IGNORECASE,
+)
+
+# Validator errors a plan can avoid (see validator._check_complexity).
+_PLANNABLE_ERRORS = ("too complex", "subqueries are not allowed")
+
+PLAN_INSTRUCTIONS = (
+    "If the question needs more than one query (comparisons between periods or groups, shares of a total,\n"
+    "ratios), respond with ONLY a JSON query plan instead of SQL:\n"
+    '{"queries": [{"name": "<identifier>", "sql": "<SELECT>"}, ...],\n'
+    ' "combine": {"op": "join" | "compare" | "ratio" | "share", "keys": [<columns to match rows on>],\n'
+    '             "values": [<columns to combine>], "fill_missing": 0 | null,\n'
+    '             "order_by": "<output column>", "desc": true | false, "limit": <n>}}\n'
+    f"Use 2 to {PLANNER_MAX_QUERIES} queries; compare, ratio and share take exactly 2.\n"
+    "Every query must follow the SQL rules above and return the key and value columns under the same\n"
+    "names (use AS). compare adds diff (second - first) and pct_change; ratio adds ratio (first / second);\n"
+    "share expects the parts first and the total second (keyed by none or some of the keys) and adds share_pct.\n"
+    "join / compare / ratio outputs name value columns <value>_<query name>.\n"
+)
+
+
+# -----------------------------
+# Detection
+# -----------------------------
+
+def looks_compound(question: str) -> bool:
+    return bool(_COMPOUND_RE.search(question))
+
+
+def needs_plan(validation: Dict[str, Any]) -> bool:
+    """
+    True when a single query failed validation on a construct (subquery,
+    CTE, UNION, window function) that a plan replaces.
+    """
+    return any(p in e.lower() for e in validation.get("errors", []) for p in _PLANNABLE_ERRORS)
+
+
+# -----------------------------
+# Parsing
+# -----------------------------
+
+def parse_plan(text: str) -> Dict[str, Any]:
+    """
+    Model output -> {"plan": {...}} or {"error": ...}. Output that is not
+    JSON comes back as {"sql": text}: the model answered with one query.
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        if "\n" in text:
+            text = text.split("\n", 1)[1]
+    text = text.strip()
+    if not text.startswith("{"):
+        return {"sql": text}
+    try:
+        plan = json.loads(text)
+    except ValueError as e:
+        return {"error": f"Plan is not valid JSON: {e}"}
+    errors = check_plan(plan)
+    if errors:
+        return {"error": "Invalid plan: " + "; ".join(errors)}
+    return {"plan": plan}
+
+
+def check_plan(plan: Any) -> List[str]:
+    """
+    Structural checks; the SQL itself is checked by the validator.
+    """
+    if not isinstance(plan, dict) or not isinstance(plan.get("queries"), list):
+        return ["expected an object with a queries list"]
+    queries, combine = plan["queries"], plan.get("combine")
+    if not 2 <= len(queries) <= PLANNER_MAX_QUERIES:
+        return [f"expected 2 to {PLANNER_MAX_QUERIES} queries, got {len(queries)}"]
+    if not isinstance(combine, dict) or combine.get("op") not in COMBINE_OPS:
+        return [f"combine.op must be one of {', '.join(COMBINE_OPS)}"]
+
+    errors = []
+    names = [q.get("name") if isinstance(q, dict) else None for q in queries]
+    if any(not isinstance(n, str) or not _NAME_RE.match(n) for n in names) or len(set(names)) != len(names):
+        errors.append("query names must be distinct lowercase identifiers")
+    if any(not isinstance(q, dict) or not isinstance(q.get("sql"), str) for q in queries):
+        errors.append("every query needs an sql string")
+    if combine["op"] in TWO_QUERY_OPS and len(queries) != 2:
+        errors.append(f"{combine['op']} takes exactly 2 queries")
+    keys, values = combine.get("keys", []), combine.get("values")
+    if not isinstance(keys, list) or not all(isinstance(k, str) for k in keys):
+        errors.append("combine.keys must be a list of column names")
+    if not isinstance(values, list) or not values or not all(isinstance(v, str) for v in values):
+        errors.append("combine.values must be a non-empty list of column names")
+    if combine.get("limit") is not None and not (isinstance(combine["limit"], int) and combine["limit"] > 0):
+        errors.append("combine.limit must be a positive integer")
+    fill = combine.get("fill_missing")
+    if fill is not None and (not isinstance(fill, (int, float)) or isinstance(fill, bool) or not math.isfinite(fill)):
+        errors.append("combine.fill_missing must be a number or null")
+    if errors:
+        return errors
+
+    for i, query in enumerate(queries):
+        shape = parse_query(query["sql"])
+        if shape is None:
+            errors.append(f"query {query['name']} is not a simple SELECT")
+            continue
+        columns = {item["name"] for item in shape["select"]}
+        expected = list(values) + (keys if combine["op"] != "share" or i == 0 else [])
+        missing = [c for c in expected if c.lower() not in columns]
+        if missing:
+            errors.append(f"query {query['name']} does not return {', '.join(missing)}")
+        if combine["op"] == "share" and i == 1 and not columns & set(values):
+            errors.append("the share total must return the value columns")
+    return errors
+
+
+# -----------------------------
+# Combining
+# -----------------------------
+
+def _numbers(rows: List[Dict[str, Any]], column: str) -> np.ndarray:
+    out = np.full(len(rows), np.nan)
+    for i, row in enumerate(rows):
+        value = row.get(column)
+        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            out[i] = float(value)
+    return out
+
+
+def _key(row: Dict[str, Any], keys: List[str]) -> tuple:
+    return tuple(row.get(k) for k in keys)
+
+
+def _aligned(rows: List[Dict[str, Any]], keys: List[str], index: Dict[tuple, int]) -> np.ndarray:
+    """
+    Position of each combined key in rows (-1 when absent).
+    """
+    positions = np.full(len(index), -1, dtype=np.int64)
+    for i, row in enumerate(rows):
+        at = index.get(_key(row, keys))
+        if at is not None and positions[at] < 0:
+            positions[at] = i
+    return positions
+
+
+def _take(values: np.ndarray, positions: np.ndarray, fill: Optional[float]) -> np.ndarray:
+    out = np.full(len(positions), np.nan if fill is None else float(fill))
+    present = positions >= 0
+    out[present] = values[positions[present]]
+    if fill is not None:
+        out[present & np.isnan(out)] = float(fill)
+    return out
+
+
+def _column(values: np.ndarray) -> List[Optional[float]]:
+    return [None if np.isnan(v) else v for v in values.tolist()]
+
+
+def combine_results(plan: Dict[str, Any], results: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Merge the rows of the plan's queries (in plan order) into one result.
+    """
+    combine = plan["combine"]
+    op, keys, values = combine["op"], [k.lower() for k in combine.get("keys", [])], [v.lower() for v in combine["values"]]
+    names = [q["name"] for q in plan["queries"]]
+    fill = combine.get("fill_missing")
+    prefix = (lambda v: f"{v}_") if len(values) > 1 else (lambda v: "")
+
+    if op == "share":
+        parts, totals = results
+        # Totals are keyed by the keys they return (none: a single total).
+        total_keys = [k for k in keys if totals and k in totals[0]]
+        total_index: Dict[tuple, int] = {}
+        for i, row in enumerate(totals):
+            total_index.setdefault(_key(row, total_keys), i)
+        total_at = np.array([total_index.get(_key(p, total_keys), -1) for p in parts], dtype=np.int64)
+        out = [dict(row) for row in parts]
+        for v in values:
+            part = _numbers(parts, v)
+            total = _take(_numbers(totals, v), total_at, None)
+            share = np.divide(part * 100.0, total, out=np.full(len(parts), np.nan), where=(total != 0) & ~np.isnan(total))
+            for row, s in zip(out, _column(share)):
+                row[f"{prefix(v)}share_pct"] = s
+        return _order(out, combine)
+
+    # join / compare / ratio: outer join on keys, first query's order first.
+    index: Dict[tuple, int] = {}
+    key_rows: List[Dict[str, Any]] = []
+    for rows in results:
+        for row in rows:
+            k = _key(row, keys)
+            if k not in index:
+                index[k] = len(key_rows)
+                key_rows.append({c: row.get(c) for c in keys})
+    positions = [_aligned(rows, keys, index) for rows in results]
+
+    out = key_rows
+    aligned: Dict[str, List[np.ndarray]] = {}
+    for v in values:
+        aligned[v] = []
+        for name, rows, pos in zip(names, results, positions):
+            column = _take(_numbers(rows, v), pos, fill)
+            aligned[v].append(column)
+            raw = [rows[p].get(v) if p >= 0 else fill for p in pos.tolist()]
+            for row, value in zip(out, raw):
+                row[f"{v}_{name}"] = value
+
+    for v in values:
+        first, second = aligned[v][0], aligned[v][-1]
+        if op == "compare":
+            diff = second - first
+            pct = np.divide(diff * 100.0, np.abs(first), out=np.full(len(out), np.nan), where=(first != 0) & ~np.isnan(first))
+            for row, d, p in zip(out, _column(diff), _column(pct)):
+                row[f"{prefix(v)}diff"] = d
+                row[f"{prefix(v)}pct_change"] = p
+        elif op == "ratio":
+            ratio = np.divide(first, second, out=np.full(len(out), np.nan), where=(second != 0) & ~np.isnan(second))
+            for row, r in zip(out, _column(ratio)):
+                row[f"{prefix(v)}ratio"] = r
+    return _order(out, combine)
+
+
+def _order(rows: List[Dict[str, Any]], combine: Dict[str, Any]) -> List[Dict[str, Any]]:
+    column = (combine.get("order_by") or "").lower()
+    if rows and column in rows[0]:
+        desc = bool(combine.get("desc"))
+        numbers = _numbers(rows, column)
+        if not np.isnan(numbers).all() or all(r[column] is None for r in rows):
+            # NULLs last either way; stable for ties.
+            keyed = np.where(np.isnan(numbers), np.inf, -numbers if desc else numbers)
+            rows = [rows[i] for i in np.argsort(keyed, kind="stable")]
+        else:
+            present = [r for r in rows if r[column] is not None]
+            present.sort(key=lambda r: r[column], reverse=desc)
+            rows = present + [r for r in rows if r[column] is None]
+    if combine.get("limit"):
+        rows = rows[:combine["limit"]]
+    return rows
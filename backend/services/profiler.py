@@ -0,0 +1,134 @@
+# backend/services/profiler.py
+"""
+On-demand sampling profiler for single requests.
+
+A background thread snapshots the stack of the request's thread every few
+milliseconds (via sys._current_frames) and, when the request finishes,
+writes a flamegraph-compatible "collapsed stack" file:
+
+    chat (main.py:190);_run_chat (main.py:203);validate_sql (validator.py:77) 42
+
+Render it with flamegraph.pl, speedscope or inferno:
+
+    flamegraph.pl logs/profiles/20250101-120000-chat-1234.collapsed > chat.svg
+
+A request is profiled when:
+- it sends `X-Profile: <PROFILE_TOKEN>` (PROFILE_TOKEN must be set), or
+- it is picked by PROFILE_SAMPLE_RATE (0..1, default 0).
+
+Other settings (env):
+- PROFILE_DIR           output directory (default logs/profiles)
+- PROFILE_INTERVAL_MS   sampling interval (default 2)
+
+When neither trigger is configured, maybe_profile() is a single boolean
+check, so there is no cost for normal traffic.
+"""
+
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN") or None
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(PROJECT_ROOT / "logs" / "profiles")))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "2"))
+
+PROFILING_ENABLED = PROFILE_TOKEN is not None or PROFILE_SAMPLE_RATE > 0
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread at a fixed interval.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = 0.0
+        self.stopped = 0.0
+        self.output_path: Optional[Path] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.stopped = time.perf_counter()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.stacks[_collapse(frame)] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _collapse(frame) -> str:
+    """
+    Turn a frame chain into "root;...;leaf" with one entry per frame.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        name = getattr(code, "co_qualname", code.co_name)
+        filename = os.path.basename(code.co_filename)
+        names.append(f"{name} ({filename}:{frame.f_lineno})".replace(";", ":"))
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+def should_profile(header_value: Optional[str]) -> bool:
+    """
+    Decide whether this request gets profiled.
+    """
+    if not PROFILING_ENABLED:
+        return False
+    if PROFILE_TOKEN and header_value and hmac.compare_digest(header_value.encode(), PROFILE_TOKEN.encode()):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+@contextmanager
+def maybe_profile(header_value: Optional[str], label: str = "request"):
+    """
+    Profile the enclosed block if the request qualifies.
+
+    Yields None when not profiling, otherwise a SamplingProfiler; its
+    collapsed stacks are written to `output_path` when the block exits.
+    """
+    if not should_profile(header_value):
+        yield None
+        return
+
+    prof = SamplingProfiler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000.0)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    prof.output_path = PROFILE_DIR / f"{stamp}-{label}-{os.getpid()}-{threading.get_ident()}.collapsed"
+    prof.start()
+    try:
+        yield prof
+    finally:
+        prof.stop()
+        prof.write_collapsed(prof.output_path)
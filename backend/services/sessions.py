@@ -0,0 +1,321 @@
+# backend/services/sessions.py
+"""
+Conversation sessions for /chat follow-ups.
+
+Each /chat response carries a session_id; sending it back with the next
+question makes that question a follow-up. Per session we keep:
+
+- the last few turns (question + SQL), given to the model as context so
+  "now only sells" can be turned into a complete query,
+- the last validated SQL, its parsed shape and its rows (when small
+  enough), so a follow-up that only filters, sorts, projects, limits or
+  re-aggregates that result is answered in process
+  (backend.sql_executor.refine) instead of by the database.
+
+Simple follow-ups do not even need the model: rewrite_follow_up() edits
+the previous SQL for
+
+    "sort that by price [desc]"     ORDER BY
+    "top 5" / "first 10 rows"       LIMIT
+    "only sells" / "just Product 4" WHERE <output column> = <value seen in the result>
+    "exclude Product 4"             WHERE <output column> <> ...
+    "only the product and volume columns"
+    "just by product"               GROUP BY a subset of the keys
+
+and the edited SQL goes through the validator like any generated query.
+
+The store is bounded: at most SESSION_MAX sessions and SESSION_MAX_ROWS
+cached rows in total (least recently used sessions lose their rows first,
+then the sessions themselves), sessions idle for SESSION_TTL_S expire, and
+cached rows are only reused for SESSION_RESULT_MAX_AGE_S (or the request's
+max_staleness_s) after they were read.
+
+Configuration (env):
+- SESSIONS_ENABLED          "true"/"false" (default true)
+- SESSION_MAX               sessions kept (default 1000)
+- SESSION_MAX_ROWS          cached result rows over all sessions (default 500000)
+- SESSION_RESULT_MAX_ROWS   larger results are not cached (default 50000)
+- SESSION_TTL_S             idle time before a session expires (default 1800)
+- SESSION_RESULT_MAX_AGE_S  age up to which cached rows answer follow-ups (default 300)
+- SESSION_HISTORY_TURNS     turns sent to the model as context (default 4)
+"""
+
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from backend.validator.query_shape import contains_aggregate, parse_query, render_clauses, split_conjuncts
+
+SESSIONS_ENABLED = os.getenv("SESSIONS_ENABLED", "true").lower() == "true"
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_MAX_ROWS = int(os.getenv("SESSION_MAX_ROWS", "500000"))
+SESSION_RESULT_MAX_ROWS = int(os.getenv("SESSION_RESULT_MAX_ROWS", "50000"))
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "1800"))
+SESSION_RESULT_MAX_AGE_S = float(os.getenv("SESSION_RESULT_MAX_AGE_S", "300"))
+SESSION_HISTORY_TURNS = int(os.getenv("SESSION_HISTORY_TURNS", "4"))
+
+
+# -----------------------------
+# Store
+# -----------------------------
+
+class SessionStore:
+    """
+    LRU of sessions:
+        {"id", "turns": [{"question", "sql"}], "sql", "shape", "rows",
+         "rows_at", "updated_at"}
+    get() hands out a copy, so a request never sees another one's update.
+    """
+
+    def __init__(self, max_sessions: int = SESSION_MAX, max_rows: int = SESSION_MAX_ROWS,
+                 ttl_s: float = SESSION_TTL_S):
+        self.max_sessions = max_sessions
+        self.max_rows = max_rows
+        self.ttl_s = ttl_s
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    def get(self, session_id: str, max_age_s: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        The session, or None when unknown / expired. Its rows are None when
+        older than max_age_s (default SESSION_RESULT_MAX_AGE_S).
+        """
+        now = time.time()
+        max_age_s = SESSION_RESULT_MAX_AGE_S if max_age_s is None else max_age_s
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if now - entry["updated_at"] > self.ttl_s:
+                self._drop(session_id)
+                return None
+            self._sessions.move_to_end(session_id)
+            entry = dict(entry, turns=list(entry["turns"]))
+        if entry["rows"] is not None and now - entry["rows_at"] > max_age_s:
+            entry["rows"] = None
+        return entry
+
+    def record(self, session_id: str, question: str, sql: Optional[str], rows: Optional[List[Dict[str, Any]]],
+               rows_at: Optional[float] = None) -> None:
+        """
+        Add a successful turn. rows=None keeps the SQL without a result
+        (dry run, local mode); sql=None (compound plan) forgets the result.
+        rows_at is when the rows were read (now; earlier when they were
+        derived from cached rows).
+        """
+        now = time.time()
+        shape = parse_query(sql) if sql else None
+        if rows is not None and (shape is None or len(rows) > SESSION_RESULT_MAX_ROWS):
+            rows = None
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is None:
+                entry = {"id": session_id, "turns": [], "rows": None}
+            self._rows -= len(entry["rows"]) if entry["rows"] is not None else 0
+            entry["turns"] = (entry["turns"] + [{"question": question, "sql": sql}])[-SESSION_HISTORY_TURNS:]
+            entry.update(sql=sql, shape=shape, rows=rows, rows_at=rows_at or now, updated_at=now)
+            self._rows += len(rows) if rows is not None else 0
+            self._sessions[session_id] = entry
+            self._evict(now)
+
+    def _drop(self, session_id: str) -> None:
+        entry = self._sessions.pop(session_id)
+        self._rows -= len(entry["rows"]) if entry["rows"] is not None else 0
+
+    def _evict(self, now: float) -> None:
+        for session_id in [k for k, e in self._sessions.items() if now - e["updated_at"] > self.ttl_s]:
+            self._drop(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._drop(next(iter(self._sessions)))
+        for entry in self._sessions.values():
+            if self._rows <= self.max_rows:
+                break
+            if entry["rows"] is not None:
+                self._rows -= len(entry["rows"])
+                entry["rows"] = None
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "cached_rows": self._rows,
+                "max_sessions": self.max_sessions,
+                "max_rows": self.max_rows,
+            }
+
+
+# -----------------------------
+# Rule-based follow-ups
+# -----------------------------
+
+_SORT_RE = re.compile(
+    r"^(?:now\s+|and\s+)?(?:sort|order|rank)\s+(?:(?:it|that|this|them|these|those|the\s+results?)\s+)?by\s+"
+    r"(?:the\s+)?(?P<column>[\w ]+?)"
+    r"(?:\s*,?\s*(?P<direction>asc(?:ending)?|desc(?:ending)?|(?:highest|largest|biggest|most)\s+first|"
+    r"(?:lowest|smallest|least|fewest)\s+first))?$"
+)
+_LIMIT_RE = re.compile(
+    r"^(?:now\s+|and\s+)?(?:only\s+|just\s+)?(?:show\s+(?:me\s+)?)?(?:the\s+)?(?:top|first)\s+(?P<n>\d+)"
+    r"(?:\s+(?:rows|results|ones|of\s+them))?$"
+)
+_COLUMNS_RE = re.compile(
+    r"^(?:now\s+|and\s+)?(?:only|just)\s+(?:show\s+(?:me\s+)?)?(?:the\s+)?(?P<columns>[\w ,]+?)\s+columns?$"
+)
+_REGROUP_RE = re.compile(
+    r"^(?:now\s+|and\s+)?(?:only\s+|just\s+)?(?:by|per|grouped\s+by|group\s+(?:it\s+|them\s+)?by)\s+"
+    r"(?:the\s+)?(?P<columns>[\w ,]+?)(?:\s+only)?$"
+)
+_FILTER_RE = re.compile(r"^(?:now\s+|and\s+)?(?:only|just)\s+(?:the\s+)?(?P<value>[\w .\-/]+?)$")
+_EXCLUDE_RE = re.compile(r"^(?:now\s+|and\s+)?(?:exclude|without|except|drop|remove)\s+(?:the\s+)?(?P<value>[\w .\-/]+?)$")
+
+_DESC_WORDS = ("desc", "highest", "largest", "biggest", "most")
+
+
+def _normalize(question: str) -> str:
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip(".!?").strip()
+
+
+def _singular(word: str) -> List[str]:
+    forms = [word]
+    if word.endswith("es"):
+        forms.append(word[:-2])
+    if word.endswith("s"):
+        forms.append(word[:-1])
+    return forms
+
+
+def _find_column(phrase: str, shape: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    The select item a phrase like "price" / "product name" means: exact
+    name, else the only item whose name contains all the words.
+    """
+    words = [w for w in re.split(r"[\s_]+", phrase.strip()) if w]
+    if not words:
+        return None
+    items = [i for i in shape["select"] if i["expr"]["kind"] != "star"]
+    exact = [i for i in items if i["name"] in ("_".join(words), "_".join(words[:-1] + [_singular(words[-1])[-1]]))]
+    if len(exact) == 1:
+        return exact[0]
+    matches = [i for i in items
+               if all(any(form in i["name"].split("_") for form in _singular(w)) for w in words)]
+    return matches[0] if len(matches) == 1 else None
+
+
+def _output_ref(item: Dict[str, Any]) -> str:
+    """
+    How ORDER BY refers to a select item.
+    """
+    return item["alias"] or item["expr"]["text"]
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _value_filter(phrase: str, shape: Dict[str, Any], rows: List[Dict[str, Any]], op: str) -> Optional[str]:
+    """
+    "<key expr> <op> '<value>'" when the phrase names a value of exactly
+    one text output column of the previous result.
+    """
+    grouped = bool(shape["group_by"]) or shape["has_aggregates"]
+    hits = []
+    for item in shape["select"]:
+        if item["expr"]["kind"] == "star" or (grouped and contains_aggregate(item["expr"])):
+            continue
+        values = {v for v in (row.get(item["name"]) for row in rows) if isinstance(v, str)}
+        by_lower = {v.lower(): v for v in values}
+        for form in _singular(phrase):
+            if form in by_lower:
+                hits.append((item, by_lower[form]))
+                break
+    if len(hits) != 1:
+        return None
+    item, value = hits[0]
+    return f"{item['expr']['text']} {op} {_quote(value)}"
+
+
+def rewrite_follow_up(question: str, shape: Dict[str, Any], rows: List[Dict[str, Any]]) -> Optional[Dict[str, str]]:
+    """
+    Edit the previous query (shape) for a simple follow-up question.
+    Returns {"sql": ..., "rule": sort|limit|filter|exclude|columns|regroup}
+    or None when the question is not one of those.
+    """
+    text = _normalize(question)
+    clauses = dict(shape["clauses"])
+
+    m = _SORT_RE.match(text)
+    if m:
+        item = _find_column(m.group("column"), shape)
+        if item is None:
+            return None
+        desc = bool(m.group("direction")) and m.group("direction").startswith(_DESC_WORDS)
+        clauses["order by"] = _output_ref(item) + (" desc" if desc else "")
+        return {"sql": render_clauses(clauses), "rule": "sort"}
+
+    m = _LIMIT_RE.match(text)
+    if m:
+        clauses["limit"] = str(int(m.group("n")))
+        clauses.pop("offset", None)
+        return {"sql": render_clauses(clauses), "rule": "limit"}
+
+    m = _COLUMNS_RE.match(text)
+    if m:
+        picked = []
+        for phrase in re.split(r",|\band\b", m.group("columns")):
+            if phrase.strip():
+                item = _find_column(phrase, shape)
+                if item is None:
+                    return None
+                picked.append(item)
+        dropped = [i for i in shape["select"] if i not in picked]
+        clauses["select"] = ("distinct " if shape["distinct"] else "") + ", ".join(i["text"] for i in picked)
+        if shape["order_by"]:
+            # ORDER BY may name a dropped alias; use its expression instead.
+            aliases = {i["alias"]: i["expr"]["text"] for i in dropped if i["alias"]}
+            clauses["order by"] = ", ".join(
+                aliases.get(o["expr"]["text"], o["expr"]["text"]) + (" desc" if o["desc"] else "")
+                + (f" nulls {o['nulls']}" if o["nulls"] else "")
+                for o in shape["order_by"]
+            )
+        return {"sql": render_clauses(clauses), "rule": "columns"}
+
+    m = _REGROUP_RE.match(text)
+    if m and shape["group_by"]:
+        keys = []
+        for phrase in re.split(r",|\band\b", m.group("columns")):
+            if phrase.strip():
+                item = _find_column(phrase, shape)
+                if item is None or contains_aggregate(item["expr"]):
+                    return None
+                keys.append(item)
+        aggregates = [i for i in shape["select"] if contains_aggregate(i["expr"])]
+        clauses["select"] = ", ".join(i["text"] for i in keys + aggregates)
+        clauses["group by"] = ", ".join(i["expr"]["text"] for i in keys)
+        kept = {i["name"] for i in keys + aggregates} | {i["expr"]["text"] for i in keys + aggregates}
+        order = [o["text"] for o in shape["order_by"] if o["expr"]["text"] in kept]
+        clauses.pop("order by", None)
+        if order:
+            clauses["order by"] = ", ".join(order)
+        return {"sql": render_clauses(clauses), "rule": "regroup"}
+
+    for pattern, op, rule in ((_EXCLUDE_RE, "<>", "exclude"), (_FILTER_RE, "=", "filter")):
+        m = pattern.match(text)
+        if m:
+            condition = _value_filter(m.group("value"), shape, rows, op)
+            if condition is None:
+                return None
+            where = clauses.get("where")
+            if where and split_conjuncts(where) is None:
+                where = f"({where})"
+            clauses["where"] = f"{where} and {condition}" if where else condition
+            return {"sql": render_clauses(clauses), "rule": rule}
+    return None
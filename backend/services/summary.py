@@ -0,0 +1,244 @@
+# backend/services/summary.py
+"""
+Summary responses for large /chat results.
+
+With `"mode": "summary"` (or "auto" and more than SUMMARY_AUTO_ROWS rows)
+/chat answers with what the result looks like instead of every row:
+
+    {
+      "row_count": 48213,
+      "columns": [
+        {"name": "volume", "type": "number", "count": 48213, "nulls": 0,
+         "min": 1, "max": 9999, "mean": 5003.2,
+         "percentiles": {"p5": 498.0, "p25": 2511.0, "p50": 5004.0, "p75": 7497.0, "p95": 9501.0}},
+        {"name": "deal_date", "type": "date", ..., "min": "2024-01-01", "percentiles": {...}},
+        {"name": "direction", "type": "text", ..., "distinct": 2,
+         "top": [{"value": "sell", "count": 24190}, {"value": "buy", "count": 24023}]}
+      ],
+      "sample": [... SUMMARY_SAMPLE_ROWS rows ...],
+      "sample_method": "head" | "spread",
+      "handle": {"id": "...", "url": "/chat/results/<id>", "expires_in_s": 600}
+    }
+
+Statistics are computed per column on NumPy arrays (one conversion per
+column, then vectorized min / max / mean / percentiles / counts). The sample
+is the first rows when the query is ordered, else rows spread evenly over
+the result.
+
+The full rows stay in a ResultStore (LRU bounded by total rows, with a TTL)
+and are paged with GET /chat/results/{id}?offset=&limit=. Without a handle
+(store disabled, or the result alone is over the budget) only the summary
+is returned.
+
+Configuration (env):
+- SUMMARY_AUTO_ROWS        "auto" mode summarizes above this many rows (default 1000)
+- SUMMARY_SAMPLE_ROWS      sample size (default 20)
+- SUMMARY_TOP_K            most frequent values listed per text column (default 5)
+- RESULT_STORE_MAX_ROWS    rows kept for paging over all results (default 1000000; 0 disables)
+- RESULT_STORE_TTL_S       seconds a result can be paged (default 600)
+- RESULT_PAGE_MAX_ROWS     largest page (default 1000)
+"""
+
+import datetime as dt
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+SUMMARY_AUTO_ROWS = int(os.getenv("SUMMARY_AUTO_ROWS", "1000"))
+SUMMARY_SAMPLE_ROWS = int(os.getenv("SUMMARY_SAMPLE_ROWS", "20"))
+SUMMARY_TOP_K = int(os.getenv("SUMMARY_TOP_K", "5"))
+RESULT_STORE_MAX_ROWS = int(os.getenv("RESULT_STORE_MAX_ROWS", "1000000"))
+RESULT_STORE_TTL_S = float(os.getenv("RESULT_STORE_TTL_S", "600"))
+RESULT_PAGE_MAX_ROWS = int(os.getenv("RESULT_PAGE_MAX_ROWS", "1000"))
+
+RESPONSE_MODES = ("rows", "summary", "auto")
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def wants_summary(mode: str, row_count: int) -> bool:
+    return mode == "summary" or (mode == "auto" and row_count > SUMMARY_AUTO_ROWS)
+
+
+# -----------------------------
+# Column statistics
+# -----------------------------
+
+def _column_type(values: np.ndarray) -> str:
+    sample = values[0] if len(values) else None
+    if sample is None:
+        return "null"
+    if isinstance(sample, bool):
+        return "boolean"
+    if isinstance(sample, (int, float, Decimal)):
+        return "number"
+    if isinstance(sample, dt.datetime):
+        return "timestamp"
+    if isinstance(sample, dt.date):
+        return "date"
+    return "text"
+
+
+def _percentiles(points: np.ndarray) -> Dict[str, float]:
+    return {f"p{p}": v for p, v in zip(PERCENTILES, points.tolist())}
+
+
+def _numeric_stats(values: np.ndarray) -> Dict[str, Any]:
+    numbers = values.astype(float)
+    return {
+        "min": values[int(np.argmin(numbers))],
+        "max": values[int(np.argmax(numbers))],
+        "mean": float(numbers.mean()),
+        "percentiles": _percentiles(np.percentile(numbers, PERCENTILES)),
+    }
+
+
+def _date_stats(values: np.ndarray) -> Dict[str, Any]:
+    days = values.astype("datetime64[D]").astype(np.int64)
+    as_date = lambda d: dt.date(1970, 1, 1) + dt.timedelta(days=int(round(d)))
+    points = np.percentile(days, PERCENTILES)
+    return {
+        "min": values[int(np.argmin(days))],
+        "max": values[int(np.argmax(days))],
+        "mean": as_date(days.mean()),
+        "percentiles": {f"p{p}": as_date(v) for p, v in zip(PERCENTILES, points.tolist())},
+    }
+
+
+def _timestamp_stats(values: np.ndarray) -> Dict[str, Any]:
+    seconds = np.array([v.timestamp() for v in values])
+    tz = values[0].tzinfo
+    as_stamp = lambda s: dt.datetime.fromtimestamp(float(s), tz)
+    points = np.percentile(seconds, PERCENTILES)
+    return {
+        "min": values[int(np.argmin(seconds))],
+        "max": values[int(np.argmax(seconds))],
+        "mean": as_stamp(seconds.mean()),
+        "percentiles": {f"p{p}": as_stamp(v) for p, v in zip(PERCENTILES, points.tolist())},
+    }
+
+
+def _top_values(values: np.ndarray, top_k: int) -> Dict[str, Any]:
+    keys = values.astype(str)
+    distinct, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    # Most frequent first; ties by value.
+    order = np.lexsort((distinct, -counts))[:top_k]
+    return {
+        "distinct": len(distinct),
+        "top": [{"value": values[first[i]], "count": int(counts[i])} for i in order.tolist()],
+    }
+
+
+def column_stats(name: str, values: List[Any], top_k: int = SUMMARY_TOP_K) -> Dict[str, Any]:
+    column = np.array(values, dtype=object)
+    present = column[column != None]  # noqa: E711 (element-wise)
+    kind = _column_type(present)
+    stats: Dict[str, Any] = {"name": name, "type": kind, "count": len(present), "nulls": len(column) - len(present)}
+    if not len(present):
+        return stats
+    try:
+        if kind == "number":
+            stats.update(_numeric_stats(present))
+        elif kind == "date":
+            stats.update(_date_stats(present))
+        elif kind == "timestamp":
+            stats.update(_timestamp_stats(present))
+        else:
+            stats.update(_top_values(present, top_k))
+    except (TypeError, ValueError):
+        # Mixed types in one column: fall back to value counts.
+        stats["type"] = "mixed"
+        stats.update(_top_values(present, top_k))
+    return stats
+
+
+def _sample(rows: List[Dict[str, Any]], size: int, ordered: bool) -> Dict[str, Any]:
+    if ordered or len(rows) <= size:
+        return {"sample": rows[:size], "sample_method": "head"}
+    picks = np.linspace(0, len(rows) - 1, num=size).round().astype(np.int64)
+    return {"sample": [rows[i] for i in picks.tolist()], "sample_method": "spread"}
+
+
+def summarize(rows: List[Dict[str, Any]], ordered: bool = False,
+              sample_rows: int = SUMMARY_SAMPLE_ROWS, top_k: int = SUMMARY_TOP_K) -> Dict[str, Any]:
+    """
+    Per-column statistics plus a bounded sample of rows.
+    """
+    names = list(rows[0].keys()) if rows else []
+    return {
+        "row_count": len(rows),
+        "columns": [column_stats(name, [row.get(name) for row in rows], top_k) for name in names],
+        **_sample(rows, sample_rows, ordered),
+    }
+
+
+# -----------------------------
+# Paging store
+# -----------------------------
+
+class ResultStore:
+    """
+    Full results behind summary handles. LRU bounded by the total number
+    of rows held; entries expire after ttl_s.
+    """
+
+    def __init__(self, max_rows: int = RESULT_STORE_MAX_ROWS, ttl_s: float = RESULT_STORE_TTL_S):
+        self.max_rows = max_rows
+        self.ttl_s = ttl_s
+        self._results: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    def put(self, rows: List[Dict[str, Any]]) -> Optional[str]:
+        """
+        Keep rows for paging; returns the handle id, or None when they do
+        not fit.
+        """
+        if len(rows) > self.max_rows:
+            return None
+        handle = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._results[handle] = {"rows": rows, "stored_at": now}
+            self._rows += len(rows)
+            while self._rows > self.max_rows or (
+                    self._results and now - next(iter(self._results.values()))["stored_at"] > self.ttl_s):
+                _, old = self._results.popitem(last=False)
+                self._rows -= len(old["rows"])
+        return handle
+
+    def rows(self, handle: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        All rows behind a handle, or None for an unknown / expired handle.
+        """
+        with self._lock:
+            entry = self._results.get(handle)
+            if entry is None:
+                return None
+            if time.time() - entry["stored_at"] > self.ttl_s:
+                del self._results[handle]
+                self._rows -= len(entry["rows"])
+                return None
+            self._results.move_to_end(handle)
+            return entry["rows"]
+
+    def page(self, handle: str, offset: int, limit: int) -> Optional[Dict[str, Any]]:
+        """
+        {"rows", "total", "offset", "limit"}, or None for an unknown /
+        expired handle.
+        """
+        limit = max(0, min(limit, RESULT_PAGE_MAX_ROWS))
+        offset = max(0, offset)
+        rows = self.rows(handle)
+        if rows is None:
+            return None
+        return {"rows": rows[offset:offset + limit], "total": len(rows), "offset": offset, "limit": limit}
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"results": len(self._results), "rows": self._rows, "max_rows": self.max_rows}
@@ -0,0 +1,295 @@
+# backend/services/tracing.py
+"""
+Minimal request tracing with an OpenTelemetry-compatible span model.
+
+No collector or SDK is needed: finished spans are handed to a background
+exporter thread that appends them, one JSON object per line, to a rotating
+file. The request thread only does a non-blocking queue put; if the queue
+is full the span is dropped (and counted) rather than slowing the request.
+
+Each exported line looks like:
+
+    {"trace_id": "4bf92f35...", "span_id": "00f067aa...", "parent_span_id": "...",
+     "name": "openai", "kind": "SPAN_KIND_INTERNAL",
+     "start_time_unix_nano": ..., "end_time_unix_nano": ...,
+     "attributes": {"gen_ai.usage.input_tokens": 812, ...},
+     "status": {"code": "STATUS_CODE_OK"},
+     "resource": {"service.name": "deal-analytics-api"}}
+
+Configuration (env):
+- TRACE_SAMPLE_RATE   fraction of requests traced, 0..1 (default 0 = off)
+- TRACE_FILE          output path (default logs/traces.jsonl)
+- TRACE_MAX_BYTES     rotate when the file exceeds this size (default 10 MB)
+- TRACE_BACKUP_COUNT  rotated files to keep (default 5)
+
+Sampling is decided once per trace at the root span; unsampled requests get
+a shared no-op span, so the cost when tracing is off is one random() call
+and a context-variable lookup per stage.
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_FILE = Path(os.getenv("TRACE_FILE", str(PROJECT_ROOT / "logs" / "traces.jsonl")))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "5"))
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+
+SERVICE_NAME = "deal-analytics-api"
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+# -----------------------------
+# Span model
+# -----------------------------
+
+class Span:
+    """
+    A timed operation within a trace.
+    """
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None, kind: str = "SPAN_KIND_INTERNAL"):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status_code = "STATUS_CODE_UNSET"
+        self.status_message: Optional[str] = None
+        self.start_time_unix_nano = time.time_ns()
+        self.end_time_unix_nano: Optional[int] = None
+
+    @property
+    def is_recording(self) -> bool:
+        return True
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        self.attributes.update(attributes)
+
+    def set_status(self, ok: bool, message: Optional[str] = None) -> None:
+        self.status_code = "STATUS_CODE_OK" if ok else "STATUS_CODE_ERROR"
+        self.status_message = message
+
+    def traceparent(self) -> str:
+        """
+        W3C trace-context header value for this span.
+        """
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self) -> None:
+        if self.end_time_unix_nano is None:
+            self.end_time_unix_nano = time.time_ns()
+            _exporter.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        status: Dict[str, Any] = {"code": self.status_code}
+        if self.status_message:
+            status["message"] = self.status_message
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time_unix_nano": self.start_time_unix_nano,
+            "end_time_unix_nano": self.end_time_unix_nano,
+            "attributes": self.attributes,
+            "status": status,
+            "resource": {"service.name": SERVICE_NAME},
+        }
+
+
+class _NoopSpan:
+    """
+    Stand-in for unsampled requests; every method is a no-op.
+    """
+
+    is_recording = False
+    trace_id = None
+    span_id = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        pass
+
+    def set_status(self, ok: bool, message: Optional[str] = None) -> None:
+        pass
+
+    def traceparent(self) -> Optional[str]:
+        return None
+
+    def end(self) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+# -----------------------------
+# Exporter
+# -----------------------------
+
+class JsonlFileExporter:
+    """
+    Background thread writing spans to a size-rotated JSONL file.
+    """
+
+    def __init__(self, path: Path, max_bytes: int, backup_count: int, queue_size: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.dropped = 0
+        self.exported = 0
+
+    def export(self, span: Span) -> None:
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+                atexit.register(self.shutdown)
+
+    def _run(self) -> None:
+        f = self.path.open("a", encoding="utf-8")
+        try:
+            while True:
+                span = self._queue.get()
+                if span is None:
+                    break
+                lines = [json.dumps(span.to_dict(), default=str)]
+                # Drain whatever else is waiting so we write in batches.
+                while True:
+                    try:
+                        more = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if more is None:
+                        self._queue.put(None)
+                        break
+                    lines.append(json.dumps(more.to_dict(), default=str))
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                self.exported += len(lines)
+                if f.tell() >= self.max_bytes:
+                    f.close()
+                    self._rotate()
+                    f = self.path.open("a", encoding="utf-8")
+        finally:
+            f.close()
+
+    def _rotate(self) -> None:
+        """
+        traces.jsonl -> traces.jsonl.1 -> ... -> traces.jsonl.N (oldest dropped).
+        """
+        for i in range(self.backup_count - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}")
+            if src.exists():
+                src.replace(self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backup_count > 0:
+            self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+
+    def shutdown(self, timeout: float = 2.0) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+_exporter = JsonlFileExporter(TRACE_FILE, TRACE_MAX_BYTES, TRACE_BACKUP_COUNT, TRACE_QUEUE_SIZE)
+
+
+# -----------------------------
+# Public API
+# -----------------------------
+
+def current_span():
+    """
+    The active span for this request, or the no-op span.
+    """
+    return _current_span.get() or NOOP_SPAN
+
+
+@contextmanager
+def start_trace(name: str, attributes: Optional[Dict[str, Any]] = None,
+                sample_rate: Optional[float] = None, kind: str = "SPAN_KIND_SERVER"):
+    """
+    Open the root span of a new trace, subject to sampling.
+    Yields the span (or NOOP_SPAN when the request is not sampled).
+    """
+    rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        yield NOOP_SPAN
+        return
+
+    root = Span(name, trace_id=os.urandom(16).hex(), attributes=attributes, kind=kind)
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.set_status(False, f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        root.end()
+
+
+@contextmanager
+def span(name: str, attributes: Optional[Dict[str, Any]] = None):
+    """
+    Open a child span of the current span. No-op outside a sampled trace.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+
+    child = Span(name, trace_id=parent.trace_id, parent_span_id=parent.span_id, attributes=attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.set_status(False, f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def exporter_stats() -> Dict[str, int]:
+    return {"exported": _exporter.exported, "dropped": _exporter.dropped}
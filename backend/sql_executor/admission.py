@@ -0,0 +1,308 @@
+"""
+Cost-based admission control for validated SQL.
+
+Runs after validate_sql and before execution:
+
+1. EXPLAIN (FORMAT JSON) the query (plans are cached, see below).
+2. Compare the planner's estimated total cost and row count with budgets.
+3. Decide:
+   - "ok"        within budget, run as-is
+   - "limited"   too many rows (or too costly, but a LIMIT brings it back
+                 into budget): run with LIMIT ADMISSION_AUTO_LIMIT appended
+   - "rejected"  over budget and a LIMIT does not help (e.g. a full
+                 aggregate over an unfiltered multi-way join)
+
+Plan estimates are returned to the caller so the UI can warn the user.
+
+The plan cache is an in-process LRU with a TTL. It is keyed by the exact
+normalized SQL (literals included) because estimates depend on literal
+values: `deal_date >= '2024-12-01'` and `deal_date >= '2010-01-01'` share a
+fingerprint but not a row estimate. The literal-free fingerprint is still
+reported so related queries can be grouped.
+
+Configuration (env):
+- ADMISSION_ENABLED      "true"/"false" (default true)
+- ADMISSION_MAX_COST     planner cost budget (default 1000000)
+- ADMISSION_MAX_ROWS     estimated result-row budget (default 50000)
+- ADMISSION_ACTION       "limit" (default) or "reject" for row overruns
+- ADMISSION_AUTO_LIMIT   LIMIT applied when auto-limiting (default 5000)
+- PLAN_CACHE_SIZE        cached plans (default 1024)
+- PLAN_CACHE_TTL         seconds a cached plan stays valid (default 300)
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.services.metrics import ADMISSION_DECISIONS, PLAN_CACHE_REQUESTS
+from backend.validator.fingerprint import normalize_sql, sql_fingerprint
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_COST = float(os.getenv("ADMISSION_MAX_COST", "1000000"))
+ADMISSION_MAX_ROWS = float(os.getenv("ADMISSION_MAX_ROWS", "50000"))
+ADMISSION_ACTION = os.getenv("ADMISSION_ACTION", "limit").lower()
+ADMISSION_AUTO_LIMIT = int(os.getenv("ADMISSION_AUTO_LIMIT", "5000"))
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "1024"))
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", "300"))
+
+_LIMIT_AT_END = re.compile(r"\blimit\s+(\d+)\s*(offset\s+\d+\s*)?$", re.IGNORECASE)
+
+
+# -----------------------------
+# Plan cache
+# -----------------------------
+
+class PlanCache:
+    """
+    Thread-safe LRU cache of plan summaries with a TTL.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or now - item[0] > self.ttl:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: str, summary: Dict) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), summary)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+PLAN_CACHE = PlanCache(PLAN_CACHE_SIZE, PLAN_CACHE_TTL)
+
+
+def plan_cache_key(sql: str) -> str:
+    return hashlib.sha1(normalize_sql(sql).encode("utf-8")).hexdigest()
+
+
+# -----------------------------
+# EXPLAIN helpers
+# -----------------------------
+
+def summarize_plan(plan_json: Any) -> Dict:
+    """
+    Reduce EXPLAIN (FORMAT JSON) output to the numbers we act on.
+    """
+    if isinstance(plan_json, str):
+        plan_json = json.loads(plan_json)
+    root = plan_json[0]["Plan"]
+
+    seq_scans: List[str] = []
+
+    def walk(node: Dict) -> None:
+        if node.get("Node Type") == "Seq Scan" and node.get("Relation Name"):
+            seq_scans.append(node["Relation Name"])
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(root)
+
+    return {
+        "node_type": root.get("Node Type"),
+        "total_cost": float(root.get("Total Cost", 0.0)),
+        "estimated_rows": float(root.get("Plan Rows", 0.0)),
+        "seq_scans": seq_scans,
+    }
+
+
+def explain(conn, sql: str) -> Dict:
+    """
+    Run EXPLAIN (FORMAT JSON) on a DB-API connection and summarize it.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+        plan_json = cur.fetchone()[0]
+    finally:
+        cur.close()
+    return summarize_plan(plan_json)
+
+
+def cached_explain(conn, sql: str) -> Tuple[Dict, bool]:
+    """
+    EXPLAIN through the plan cache. Returns (summary, cache_hit).
+    """
+    key = plan_cache_key(sql)
+    summary = PLAN_CACHE.get(key)
+    if summary is not None:
+        PLAN_CACHE_REQUESTS.inc(result="hit")
+        return summary, True
+    PLAN_CACHE_REQUESTS.inc(result="miss")
+    summary = explain(conn, sql)
+    PLAN_CACHE.put(key, summary)
+    return summary, False
+
+
+def apply_limit(sql: str, limit: int) -> str:
+    """
+    Ensure the query returns at most `limit` rows.
+    An existing trailing LIMIT is lowered if it is larger.
+    """
+    m = _LIMIT_AT_END.search(sql)
+    if m:
+        if int(m.group(1)) <= limit:
+            return sql
+        return sql[:m.start(1)] + str(limit) + sql[m.end(1):]
+    return f"{sql.rstrip()} LIMIT {limit}"
+
+
+# -----------------------------
+# Admission decision
+# -----------------------------
+
+def admit(conn, sql: str) -> Dict:
+    """
+    Decide whether (and how) a validated query may run; see _decide().
+    """
+    decision = _decide(conn, sql)
+    ADMISSION_DECISIONS.inc(decision=decision["decision"])
+    return decision
+
+
+def admit_result(sql: str, row_count: int) -> Dict:
+    """
+    Admission for a result computed outside Postgres (local engine, merged
+    segments): the row count is exact and there is no planner cost, so only
+    the row budget applies. "limited" means: keep the first
+    ADMISSION_AUTO_LIMIT rows. Same shape as _decide(); "plan" carries the
+    actual row count.
+    """
+    if not ADMISSION_ENABLED or row_count <= ADMISSION_MAX_ROWS:
+        decision = {"decision": "ok" if ADMISSION_ENABLED else "skipped", "sql": sql, "reason": None}
+    elif ADMISSION_ACTION == "reject":
+        decision = {
+            "decision": "rejected",
+            "sql": sql,
+            "reason": f"{row_count} rows exceeds the budget of {ADMISSION_MAX_ROWS:.0f}. Add filters or a LIMIT.",
+        }
+    else:
+        decision = {
+            "decision": "limited",
+            "sql": apply_limit(sql, ADMISSION_AUTO_LIMIT),
+            "reason": f"Result limited to {ADMISSION_AUTO_LIMIT} rows to stay within budget.",
+        }
+    decision["plan"] = {"actual_rows": row_count, "budget_rows": ADMISSION_MAX_ROWS}
+    ADMISSION_DECISIONS.inc(decision=decision["decision"])
+    return decision
+
+
+def admit_cost(conn, sql: str) -> Dict:
+    """
+    Admission for a query whose rows are not the result (segment cache
+    fetch: partials are merged before anything is returned), so only the
+    cost budget applies; the merged rows go through admit_result().
+    Decision is "ok", "rejected" or "skipped"; same shape as _decide().
+    """
+    if not ADMISSION_ENABLED:
+        return {"decision": "skipped", "sql": sql, "reason": None, "plan": None}
+    summary, hit = cached_explain(conn, sql)
+    plan = {**summary, "fingerprint": sql_fingerprint(sql), "cached": hit, "budget_cost": ADMISSION_MAX_COST}
+    if summary["total_cost"] > ADMISSION_MAX_COST:
+        decision = {
+            "decision": "rejected",
+            "sql": sql,
+            "reason": f"Estimated cost {summary['total_cost']:.0f} exceeds the budget of {ADMISSION_MAX_COST:.0f}.",
+            "plan": plan,
+        }
+    else:
+        decision = {"decision": "ok", "sql": sql, "reason": None, "plan": plan}
+    ADMISSION_DECISIONS.inc(decision=decision["decision"])
+    return decision
+
+
+def _decide(conn, sql: str) -> Dict:
+    """
+    Returns:
+        {
+          "decision": "ok" | "limited" | "rejected" | "skipped",
+          "sql": <sql to execute>,
+          "reason": <str or None>,
+          "plan": {total_cost, estimated_rows, node_type, seq_scans,
+                   fingerprint, cached, budget_cost, budget_rows}
+        }
+    """
+    if not ADMISSION_ENABLED:
+        return {"decision": "skipped", "sql": sql, "reason": None, "plan": None}
+
+    summary, hit = cached_explain(conn, sql)
+    plan = dict(summary)
+    plan.update({
+        "fingerprint": sql_fingerprint(sql),
+        "cached": hit,
+        "budget_cost": ADMISSION_MAX_COST,
+        "budget_rows": ADMISSION_MAX_ROWS,
+    })
+
+    over_cost = summary["total_cost"] > ADMISSION_MAX_COST
+    over_rows = summary["estimated_rows"] > ADMISSION_MAX_ROWS
+
+    if not over_cost and not over_rows:
+        return {"decision": "ok", "sql": sql, "reason": None, "plan": plan}
+
+    if over_rows and not over_cost and ADMISSION_ACTION == "reject":
+        return {
+            "decision": "rejected",
+            "sql": sql,
+            "reason": (
+                f"Estimated {summary['estimated_rows']:.0f} rows exceeds the budget "
+                f"of {ADMISSION_MAX_ROWS:.0f}. Add filters or a LIMIT."
+            ),
+            "plan": plan,
+        }
+
+    # Try a LIMIT: helps when the plan can stop early, not for full aggregates.
+    limited_sql = apply_limit(sql, ADMISSION_AUTO_LIMIT)
+    if limited_sql != sql and (over_rows and ADMISSION_ACTION == "limit" or over_cost):
+        limited, _ = cached_explain(conn, limited_sql)
+        if limited["total_cost"] <= ADMISSION_MAX_COST:
+            plan["limited_total_cost"] = limited["total_cost"]
+            plan["limited_estimated_rows"] = limited["estimated_rows"]
+            return {
+                "decision": "limited",
+                "sql": limited_sql,
+                "reason": f"Result limited to {ADMISSION_AUTO_LIMIT} rows to stay within budget.",
+                "plan": plan,
+            }
+
+    return {
+        "decision": "rejected",
+        "sql": sql,
+        "reason": (
+            f"Estimated cost {summary['total_cost']:.0f} exceeds the budget of "
+            f"{ADMISSION_MAX_COST:.0f}. Narrow the date range or filter by product/counterparty."
+            if over_cost else
+            f"Estimated {summary['estimated_rows']:.0f} rows exceeds the budget of "
+            f"{ADMISSION_MAX_ROWS:.0f}."
+        ),
+        "plan": plan,
+    }
@@ -0,0 +1,996 @@
+"""
+In-memory columnar snapshot of deal_event and a vectorized query engine.
+
+For a mid-size book the whole deal_event table fits in RAM as NumPy arrays:
+
+    deal_date         int32   days since 1970-01-01
+    product_id,       int32   dictionary codes (see below)
+    counterparty_id,
+    currency_id,
+    unit_id,
+    direction
+    volume            int64
+    price_usd_per_mt  int64   cents (numeric(10,2) stays exact)
+    deal_id           str
+
+Dictionaries are fetched with ORDER BY, so code order == Postgres collation
+order: ORDER BY / MIN / MAX work on the codes directly. Reference-table
+columns (ref_product.product_name, ...) are dictionary-encoded the same way
+plus a lookup table from the deal_event key code, so JOINs to ref tables
+become array gathers.
+
+execute() runs the validator-approved SELECT subset on a snapshot:
+WHERE (AND of simple predicates), JOIN to ref tables, GROUP BY,
+COUNT / COUNT(DISTINCT) / SUM / AVG / MIN / MAX, HAVING, DISTINCT,
+ORDER BY, LIMIT / OFFSET, EXTRACT and DATE_TRUNC on deal_date.
+Anything else raises Unsupported so the caller can use Postgres instead
+(so does anything referencing `note`, which is not kept in memory, and
+range comparisons / ORDER BY on raw text, whose collation we do not model).
+
+Results are lists of dicts shaped like psycopg2's RealDictCursor rows:
+dates as datetime.date, DATE_TRUNC as timezone-aware datetime, prices as
+Decimal; AVG is returned as float.
+
+Correctness against Postgres: python -m backend.scripts.check_local_engine
+
+Configuration (env):
+- LOCAL_ENGINE_ENABLED      "true"/"false" (default false)
+- LOCAL_SNAPSHOT_MAX_ROWS   do not load a bigger deal_event (default 20000000)
+- LOCAL_SNAPSHOT_TTL        seconds before a snapshot is reloaded in the
+                            background (default 300)
+"""
+
+import datetime as dt
+import io
+import os
+import re
+import threading
+import time
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from backend.validator.query_shape import parse_conjunction, parse_query
+from backend.validator.validator import load_schema_registry
+
+LOCAL_ENGINE_ENABLED = os.getenv("LOCAL_ENGINE_ENABLED", "false").lower() == "true"
+LOCAL_SNAPSHOT_MAX_ROWS = int(os.getenv("LOCAL_SNAPSHOT_MAX_ROWS", "20000000"))
+LOCAL_SNAPSHOT_TTL = float(os.getenv("LOCAL_SNAPSHOT_TTL", "300"))
+
+BASE_TABLE = "deal_event"
+EPOCH = np.datetime64("1970-01-01", "D")
+
+# Dictionary-encoded deal_event columns -> referenced table (if any).
+DICT_COLUMNS = {
+    "product_id": "ref_product",
+    "counterparty_id": "ref_counterparty",
+    "currency_id": "ref_currency",
+    "unit_id": "ref_unit",
+    "direction": None,
+}
+
+# Column kinds: how values are stored and decoded.
+#   code   dictionary codes (Column.dictionary holds the values)
+#   day    days since epoch (date)
+#   ts     days since epoch, returned as timestamptz (DATE_TRUNC result)
+#   int    integers
+#   cents  numeric(10,2) as integer cents
+#   float  floats (AVG)
+#   str    raw strings (deal_id)
+BASE_KINDS = {
+    "deal_id": "str",
+    "deal_date": "day",
+    "volume": "int",
+    "price_usd_per_mt": "cents",
+    **{c: "code" for c in DICT_COLUMNS},
+}
+
+_ORDERABLE = ("code", "day", "ts", "int", "cents", "float")
+
+
+class Unsupported(Exception):
+    """
+    The query uses something the local engine does not implement.
+    """
+
+
+# -----------------------------
+# Snapshot
+# -----------------------------
+
+class DealSnapshot:
+    """
+    Immutable columnar copy of deal_event plus encoded reference tables.
+    apply_changes() returns a patched copy; readers holding the old one
+    are unaffected.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], dictionaries: Dict[str, np.ndarray],
+                 refs: Dict[str, Dict], as_of=None):
+        self.columns = columns
+        self.dictionaries = dictionaries
+        # refs[table] = {"key": fk column, "present": bool[key codes],
+        #                "columns": {col: (lut int32[key codes], dictionary)},
+        #                "rows": {key: {col: value}}}
+        self.refs = refs
+        self.rows = len(columns["deal_date"])
+        self.as_of = as_of  # database time of the load transaction
+        # Last time the snapshot was known to be current (load, or a
+        # change-feed catch-up); the router's staleness check uses it.
+        self.loaded_at = time.time()
+
+    def nbytes(self) -> int:
+        return int(sum(a.nbytes for a in self.columns.values()))
+
+    @classmethod
+    def load(cls, conn) -> "DealSnapshot":
+        """
+        Load deal_event and the ref tables in one REPEATABLE READ snapshot.
+        """
+        registry = load_schema_registry()
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT now()")
+                as_of = cur.fetchone()[0]
+
+                dictionaries = {}
+                for col, ref in DICT_COLUMNS.items():
+                    if ref:
+                        cur.execute(
+                            f"SELECT v FROM (SELECT {col} AS v FROM {ref} "
+                            f"UNION SELECT {col} FROM {BASE_TABLE}) s ORDER BY v"
+                        )
+                    else:
+                        cur.execute(f"SELECT DISTINCT {col} FROM {BASE_TABLE} ORDER BY 1")
+                    dictionaries[col] = np.array([r[0] for r in cur.fetchall()], dtype=object)
+
+                columns = _copy_deal_event(cur, dictionaries)
+
+                refs = {}
+                sort_values = _collation_sorter(cur)
+                for col, ref in DICT_COLUMNS.items():
+                    if ref:
+                        names = list(registry["tables"][ref]["columns"])
+                        cur.execute(f"SELECT {', '.join(names)} FROM {ref}")
+                        rows = {r[names.index(col)]: dict(zip(names, r)) for r in cur.fetchall()}
+                        refs[ref] = _encode_ref(col, names, rows, dictionaries[col], {}, sort_values)
+        finally:
+            conn.rollback()
+            conn.set_session(isolation_level="DEFAULT", readonly="DEFAULT")
+        return cls(columns, dictionaries, refs, as_of)
+
+    def apply_changes(self, changes: List[Dict[str, Any]],
+                      sort_values: Callable[[Iterable[str]], List[str]]) -> "DealSnapshot":
+        """
+        Snapshot with change_feed rows applied (see backend/services/change_feed.py).
+
+        Per key only the last change counts, so applying the same rows
+        twice is harmless. New dictionary values are placed with
+        sort_values() (database collation order) and existing codes are
+        remapped, keeping code order == collation order.
+        """
+        deals: Dict[str, Optional[Dict]] = {}
+        deals_truncated = False
+        ref_changes: Dict[str, Dict[str, Optional[Dict]]] = {}
+        refs_truncated = set()
+        for change in changes:
+            table, op = change["table_name"], change["op"]
+            if table == BASE_TABLE:
+                target = deals
+                if op == "truncate":
+                    deals_truncated = True
+            elif table in self.refs:
+                target = ref_changes.setdefault(table, {})
+                if op == "truncate":
+                    refs_truncated.add(table)
+            else:
+                continue
+            if op == "truncate":
+                target.clear()
+            else:
+                target[change["row_key"]] = change["row_data"] if op == "upsert" else None
+
+        # Dictionaries gain values; codes of existing rows are remapped.
+        dictionaries = dict(self.dictionaries)
+        remaps: Dict[str, np.ndarray] = {}
+        for col, ref in DICT_COLUMNS.items():
+            seen = {row[col] for row in deals.values() if row}
+            if ref:
+                seen |= {key for key, row in ref_changes.get(ref, {}).items() if row}
+            known = self.dictionaries[col].tolist()
+            if seen - set(known):
+                ordered = sort_values(set(known) | seen)
+                position = {v: i for i, v in enumerate(ordered)}
+                remaps[col] = np.array([position[v] for v in known], dtype=np.int32)
+                dictionaries[col] = np.array(ordered, dtype=object)
+
+        # deal_event: drop touched keys, append their final versions.
+        old = self.columns
+        if deals_truncated:
+            keep = np.zeros(self.rows, dtype=bool)
+        elif deals:
+            keep = ~np.isin(old["deal_id"], np.array(list(deals)))
+        else:
+            keep = None
+        added = _encode_deals([row for row in deals.values() if row], dictionaries)
+        columns = {}
+        for name, values in old.items():
+            if name in remaps:
+                values = remaps[name][values]
+            if keep is not None:
+                values = values[keep]
+            columns[name] = np.concatenate([values, added[name]]) if len(added[name]) else values
+
+        # Ref tables are small: re-encode those that changed (or whose key
+        # dictionary did) from their rows.
+        refs = {}
+        for table, ref in self.refs.items():
+            key = ref["key"]
+            if table not in ref_changes and key not in remaps:
+                refs[table] = ref
+                continue
+            rows = {} if table in refs_truncated else dict(ref["rows"])
+            for k, row in ref_changes.get(table, {}).items():
+                if row is None:
+                    rows.pop(k, None)
+                else:
+                    rows[k] = row
+            names = list(ref["names"])
+            previous = {col: dictionary for col, (_, dictionary) in ref["columns"].items()}
+            refs[table] = _encode_ref(key, names, rows, dictionaries[key], previous, sort_values)
+
+        return DealSnapshot(columns, dictionaries, refs, self.as_of)
+
+
+def _collation_sorter(cur) -> Callable[[Iterable[str]], List[str]]:
+    def sort_values(values: Iterable[str]) -> List[str]:
+        cur.execute("SELECT v FROM unnest(%s::text[]) AS v ORDER BY v", (list(values),))
+        return [r[0] for r in cur.fetchall()]
+    return sort_values
+
+
+def _copy_deal_event(cur, dictionaries: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    COPY deal_event with dates as day numbers, prices as cents and the
+    dictionary columns already encoded (joins against the dictionaries).
+    """
+    dims = list(DICT_COLUMNS)
+    select = ", ".join(f"{c}_d.code - 1" for c in dims)
+    joins = " ".join(
+        f"JOIN unnest(%s::text[]) WITH ORDINALITY {c}_d(v, code) ON {c}_d.v = d.{c}" for c in dims
+    )
+    sql = cur.mogrify(
+        f"COPY (SELECT d.deal_date - date '1970-01-01', d.volume, "
+        f"(d.price_usd_per_mt * 100)::bigint, {select}, d.deal_id "
+        f"FROM {BASE_TABLE} d {joins}) TO STDOUT",
+        [dictionaries[c].tolist() for c in dims],
+    ).decode()
+
+    buf = io.StringIO()
+    cur.copy_expert(sql, buf)
+    text = buf.getvalue()
+    buf.close()
+
+    n_numeric = 3 + len(dims)
+    if text:
+        numeric = np.loadtxt(io.StringIO(text), delimiter="\t", usecols=range(n_numeric),
+                             dtype=np.int64, comments=None, ndmin=2)
+        deal_ids = np.array([line[line.rfind("\t") + 1:] for line in text.split("\n") if line])
+    else:
+        numeric = np.zeros((0, n_numeric), dtype=np.int64)
+        deal_ids = np.array([], dtype=str)
+
+    columns = {
+        "deal_date": numeric[:, 0].astype(np.int32),
+        "volume": numeric[:, 1].copy(),
+        "price_usd_per_mt": numeric[:, 2].copy(),
+        "deal_id": deal_ids,
+    }
+    for i, c in enumerate(dims):
+        columns[c] = numeric[:, 3 + i].astype(np.int32)
+    return columns
+
+
+def _encode_deals(rows: List[Dict], dictionaries: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Encode deal_event rows (change_feed row_data) like _copy_deal_event.
+    """
+    columns = {
+        "deal_date": np.array([(dt.date.fromisoformat(r["deal_date"]) - dt.date(1970, 1, 1)).days
+                               for r in rows], dtype=np.int32),
+        "volume": np.array([int(r["volume"]) for r in rows], dtype=np.int64),
+        "price_usd_per_mt": np.array([int(Decimal(str(r["price_usd_per_mt"])).scaleb(2)) for r in rows],
+                                     dtype=np.int64),
+        "deal_id": np.array([r["deal_id"] for r in rows], dtype=str),
+    }
+    for col in DICT_COLUMNS:
+        position = {v: i for i, v in enumerate(dictionaries[col].tolist())}
+        columns[col] = np.array([position[r[col]] for r in rows], dtype=np.int32)
+    return columns
+
+
+def _encode_ref(key: str, names: List[str], rows: Dict[str, Dict], key_dictionary: np.ndarray,
+                previous: Dict[str, np.ndarray], sort_values: Callable[[Iterable[str]], List[str]]) -> Dict:
+    """
+    Encode each non-key column of a ref table, aligned to the key's codes.
+    A column keeps its previous dictionary while its set of values is unchanged.
+    """
+    code_of = {v: i for i, v in enumerate(key_dictionary.tolist())}
+    present = np.zeros(len(key_dictionary), dtype=bool)
+    present[[code_of[k] for k in rows]] = True
+    out = {"key": key, "names": names, "present": present, "rows": rows, "columns": {}}
+
+    for col in names:
+        if col == key:
+            continue
+        values = {row[col] for row in rows.values()}
+        dictionary = previous.get(col)
+        if dictionary is None or set(dictionary.tolist()) != values:
+            dictionary = np.array(sort_values(values), dtype=object)
+        position = {v: i for i, v in enumerate(dictionary.tolist())}
+        lut = np.full(len(key_dictionary), -1, dtype=np.int32)
+        for k, row in rows.items():
+            lut[code_of[k]] = position[row[col]]
+        out["columns"][col] = (lut, dictionary)
+    return out
+
+
+class SnapshotStore:
+    """
+    Holds the current snapshot. get() never blocks on a load: the first
+    call (or a call after LOCAL_SNAPSHOT_TTL) starts a background load and
+    returns whatever is current (possibly None).
+
+    With a change feed attached (backend.services.change_feed), the
+    snapshot is patched from row deltas instead of TTL reloads for as long
+    as the listener is connected.
+    """
+
+    def __init__(self, connect: Callable[[], Any], ttl: float = LOCAL_SNAPSHOT_TTL,
+                 max_rows: int = LOCAL_SNAPSHOT_MAX_ROWS):
+        self.connect = connect
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.snapshot: Optional[DealSnapshot] = None
+        self.last_error: Optional[str] = None
+        self.loading = False
+        self.feed = None
+        self._pending: List[Dict[str, Any]] = []  # changes seen while a load runs
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[DealSnapshot]:
+        snap = self.snapshot
+        following = self.feed is not None and self.feed.connected
+        if snap is None or (not following and time.time() - snap.loaded_at > self.ttl):
+            self._start_load()
+        return snap
+
+    def attach(self, feed) -> None:
+        self.feed = feed
+        feed.subscribe(self.apply)
+
+    def apply(self, changes: List[Dict[str, Any]], sort_values) -> None:
+        """
+        Change-feed subscriber. An empty batch means "nothing changed up to
+        now" and only refreshes the snapshot's currency.
+        """
+        with self._lock:
+            if self.loading and changes:
+                # Replayed on top of the new snapshot (applying twice is harmless).
+                self._pending.extend(changes)
+            snap = self.snapshot
+            if snap is None:
+                return
+            if changes:
+                snap = snap.apply_changes(changes, sort_values)
+            snap.loaded_at = time.time()
+            self.snapshot = snap
+
+    def _start_load(self) -> None:
+        with self._lock:
+            if self.loading:
+                return
+            self.loading = True
+            self._pending = []
+        threading.Thread(target=self._load, name="snapshot-loader", daemon=True).start()
+
+    def load_now(self) -> Optional[DealSnapshot]:
+        with self._lock:
+            self.loading = True
+            self._pending = []
+        self._load()
+        return self.snapshot
+
+    def _load(self) -> None:
+        try:
+            conn = self.connect()
+            try:
+                with conn.cursor() as cur:
+                    # A partitioned deal_event (migration 003) has no rows of
+                    # its own: sum its partitions.
+                    cur.execute(
+                        "SELECT coalesce("
+                        "(SELECT sum(greatest(c.reltuples, 0)) FROM pg_inherits i "
+                        "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass), "
+                        "(SELECT greatest(reltuples, 0) FROM pg_class WHERE oid = %s::regclass))::bigint",
+                        (BASE_TABLE, BASE_TABLE),
+                    )
+                    row = cur.fetchone()
+                conn.rollback()
+                if row and row[0] > self.max_rows:
+                    raise RuntimeError(
+                        f"{BASE_TABLE} has ~{row[0]} rows, above LOCAL_SNAPSHOT_MAX_ROWS={self.max_rows}"
+                    )
+                snap = DealSnapshot.load(conn)
+                with self._lock:
+                    if self._pending:
+                        with conn.cursor() as cur:
+                            snap = snap.apply_changes(self._pending, _collation_sorter(cur))
+                        conn.rollback()
+                    self.snapshot = snap
+                    self._pending = []
+                self.last_error = None
+            finally:
+                conn.close()
+        except Exception as e:
+            self.last_error = str(e)
+        finally:
+            with self._lock:
+                self.loading = False
+
+
+# -----------------------------
+# Columns
+# -----------------------------
+
+class Column:
+    """
+    A vector of values of one kind (see BASE_KINDS).
+    """
+
+    __slots__ = ("values", "kind", "dictionary")
+
+    def __init__(self, values: np.ndarray, kind: str, dictionary: Optional[np.ndarray] = None):
+        self.values = values
+        self.kind = kind
+        self.dictionary = dictionary
+
+    def take(self, idx: np.ndarray) -> "Column":
+        return Column(self.values[idx], self.kind, self.dictionary)
+
+    def decode(self) -> List[Any]:
+        v = self.values
+        if self.kind == "code":
+            return self.dictionary[v].tolist()
+        if self.kind == "day":
+            return (EPOCH + v.astype("timedelta64[D]")).astype(object).tolist()
+        if self.kind == "ts":
+            days = (EPOCH + v.astype("timedelta64[D]")).astype(object).tolist()
+            return [dt.datetime(d.year, d.month, d.day, tzinfo=dt.timezone.utc) for d in days]
+        if self.kind == "cents":
+            return [Decimal(int(x)).scaleb(-2) for x in v.tolist()]
+        if self.kind == "float":
+            return [None if x != x else x for x in v.tolist()]
+        return v.tolist()
+
+
+# -----------------------------
+# Query context / expression evaluation
+# -----------------------------
+
+class _Query:
+    """
+    Per-query state: snapshot, joined ref tables, select aliases.
+    """
+
+    def __init__(self, snap: DealSnapshot, shape: Dict):
+        self.snap = snap
+        self.shape = shape
+        self.joined = self._check_joins(shape)
+        self.aliases = {item["alias"]: item for item in shape["select"] if item["alias"]}
+
+    def _check_joins(self, shape: Dict) -> Dict[str, Dict]:
+        if shape["from"] != BASE_TABLE:
+            raise Unsupported(f"FROM {shape['from']}")
+        joined = {}
+        for join in shape["joins"]:
+            ref = self.snap.refs.get(join["table"])
+            if ref is None or join["left"] is None or join["type"] not in ("join", "inner join"):
+                raise Unsupported(f"join to {join['table']}")
+            ends = {join["left"], join["right"]}
+            if ends != {(BASE_TABLE, ref["key"]), (join["table"], ref["key"])}:
+                raise Unsupported(f"join condition {join['on']}")
+            joined[join["table"]] = ref
+        return joined
+
+    def row_mask(self) -> np.ndarray:
+        """
+        Rows that survive the (inner) joins: keys present in the ref table.
+        """
+        mask = np.ones(self.snap.rows, dtype=bool)
+        for join in self.shape["joins"]:
+            ref = self.joined[join["table"]]
+            mask &= ref["present"][self.snap.columns[ref["key"]]]
+        return mask
+
+    # -- expressions over rows --
+
+    def column(self, expr: Dict, idx: Optional[np.ndarray]) -> Column:
+        """
+        Evaluate a row-level expression for rows idx (None = all rows).
+        """
+        kind = expr["kind"]
+        if kind == "column":
+            return self._column_ref(expr, idx)
+        if kind == "extract":
+            return _extract(expr["field"], self._date_arg(expr, idx))
+        if kind == "date_trunc":
+            return _date_trunc(expr["unit"], self._date_arg(expr, idx))
+        raise Unsupported(f"expression {expr['text']}")
+
+    def _date_arg(self, expr: Dict, idx) -> np.ndarray:
+        arg = self.column(expr["arg"], idx)
+        if arg.kind not in ("day", "ts"):
+            raise Unsupported(f"{expr['text']} on a non-date")
+        return arg.values
+
+    def _column_ref(self, expr: Dict, idx) -> Column:
+        table, name = expr["table"], expr["column"]
+        cols = self.snap.columns
+
+        if table in (None, BASE_TABLE) and name in cols:
+            values = cols[name] if idx is None else cols[name][idx]
+            return Column(values, BASE_KINDS[name], self.snap.dictionaries.get(name))
+
+        candidates = [table] if table is not None else [t for t, r in self.joined.items() if name in r["columns"]
+                                                        or name == r["key"]]
+        if len(candidates) != 1 or candidates[0] not in self.joined:
+            raise Unsupported(f"column {expr['text']}")
+        ref = self.joined[candidates[0]]
+        if name == ref["key"]:
+            return self._column_ref({"kind": "column", "table": BASE_TABLE, "column": name, "text": name}, idx)
+        if name not in ref["columns"]:
+            raise Unsupported(f"column {expr['text']}")
+        lut, dictionary = ref["columns"][name]
+        keys = cols[ref["key"]] if idx is None else cols[ref["key"]][idx]
+        return Column(lut[keys], "code", dictionary)
+
+    # -- predicates --
+
+    def predicate_mask(self, pred: Dict, col: Column) -> np.ndarray:
+        op = pred["op"]
+        if op == "is null":
+            return np.zeros(len(col.values), dtype=bool)
+        if op == "is not null":
+            return np.ones(len(col.values), dtype=bool)
+
+        if col.kind == "code":
+            # Evaluate on the (small) dictionary, then gather.
+            lut = _compare_values(col.dictionary, op, pred, "text")
+            return lut[col.values] if len(lut) else np.zeros(len(col.values), dtype=bool)
+        if col.kind == "str":
+            return _compare_values(col.values, op, pred, "text")
+        return _compare_values(col.values, op, pred, col.kind)
+
+
+def _by_day(fn: Callable[[np.ndarray], np.ndarray], days: np.ndarray) -> np.ndarray:
+    """
+    Apply a day -> value function once per distinct day in range and gather
+    (a few thousand calendar computations instead of one per row).
+    """
+    if len(days) == 0:
+        return fn(days.astype(np.int64))
+    lo, hi = int(days.min()), int(days.max())
+    table = fn(np.arange(lo, hi + 1, dtype=np.int64))
+    return table[days - lo]
+
+
+def _extract(field: str, days: np.ndarray) -> Column:
+    return Column(_by_day(lambda d: _extract_days(field, d), days), "int")
+
+
+def _date_trunc(unit: str, days: np.ndarray) -> Column:
+    return Column(_by_day(lambda d: _trunc_days(unit, d), days), "ts")
+
+
+def _extract_days(field: str, days: np.ndarray) -> np.ndarray:
+    d = EPOCH + days.astype("timedelta64[D]")
+    if field == "year":
+        out = d.astype("datetime64[Y]").astype(np.int64) + 1970
+    elif field == "month":
+        out = d.astype("datetime64[M]").astype(np.int64) % 12 + 1
+    elif field == "quarter":
+        out = (d.astype("datetime64[M]").astype(np.int64) % 12) // 3 + 1
+    elif field == "day":
+        out = (d - d.astype("datetime64[M]")).astype(np.int64) + 1
+    elif field == "doy":
+        out = (d - d.astype("datetime64[Y]")).astype(np.int64) + 1
+    elif field == "dow":
+        out = (days.astype(np.int64) + 4) % 7
+    elif field == "isodow":
+        out = (days.astype(np.int64) + 3) % 7 + 1
+    else:
+        raise Unsupported(f"EXTRACT({field})")
+    return out
+
+
+def _trunc_days(unit: str, days: np.ndarray) -> np.ndarray:
+    d = EPOCH + days.astype("timedelta64[D]")
+    if unit == "day":
+        out = days.astype(np.int64)
+    elif unit == "week":
+        out = days.astype(np.int64) - (days.astype(np.int64) + 3) % 7
+    elif unit == "month":
+        out = (d.astype("datetime64[M]").astype("datetime64[D]") - EPOCH).astype(np.int64)
+    elif unit == "quarter":
+        months = d.astype("datetime64[M]").astype(np.int64)
+        out = ((months - months % 3).astype("datetime64[M]").astype("datetime64[D]") - EPOCH).astype(np.int64)
+    elif unit == "year":
+        out = (d.astype("datetime64[Y]").astype("datetime64[D]") - EPOCH).astype(np.int64)
+    else:
+        raise Unsupported(f"DATE_TRUNC('{unit}')")
+    return out
+
+
+def _literal_value(lit: Dict, kind: str) -> Any:
+    """
+    Convert a parsed literal to the storage representation of `kind`.
+    """
+    value = lit["value"]
+    if value is None:
+        raise Unsupported("comparison with NULL")
+    if kind in ("day", "ts"):
+        try:
+            return (np.datetime64(dt.date.fromisoformat(str(value).strip()), "D") - EPOCH).astype(np.int64)
+        except ValueError:
+            raise Unsupported(f"date literal {lit['text']}")
+    if kind in ("int", "float", "cents"):
+        try:
+            number = Decimal(str(value))
+        except Exception:
+            raise Unsupported(f"numeric literal {lit['text']}")
+        return float(number * 100) if kind == "cents" else float(number)
+    if lit["type"] != "string":
+        raise Unsupported(f"text compared with {lit['text']}")
+    return value
+
+
+def _compare_values(values: np.ndarray, op: str, pred: Dict, kind: str) -> np.ndarray:
+    if op in ("like", "ilike", "not like", "not ilike"):
+        if kind != "text":
+            raise Unsupported("LIKE on a non-text column")
+        rx = _like_regex(_literal_value(pred["value"], "text"), "ilike" in op)
+        hits = np.array([v is not None and rx.fullmatch(v) is not None for v in values.tolist()], dtype=bool)
+        return ~hits if op.startswith("not") else hits
+
+    if op in ("in", "not in"):
+        targets = [_literal_value(v, kind) for v in pred["values"]]
+        hits = np.isin(values, np.array(targets, dtype=object if kind == "text" else None))
+        return ~hits if op == "not in" else hits
+
+    if kind == "text" and op not in ("=", "<>"):
+        # Ordering of text depends on the database collation.
+        raise Unsupported("range comparison on text")
+
+    if op == "between":
+        low = _literal_value(pred["low"], kind)
+        high = _literal_value(pred["high"], kind)
+        return (values >= low) & (values <= high)
+
+    target = _literal_value(pred["value"], kind)
+    if op == "=":
+        return values == target
+    if op == "<>":
+        return values != target
+    if op == "<":
+        return values < target
+    if op == "<=":
+        return values <= target
+    if op == ">":
+        return values > target
+    if op == ">=":
+        return values >= target
+    raise Unsupported(f"operator {op}")
+
+
+def _like_regex(pattern: str, ignore_case: bool) -> re.Pattern:
+    out = []
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\" and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        out.append(".*" if ch == "%" else "." if ch == "_" else re.escape(ch))
+        i += 1
+    return re.compile("".join(out), re.DOTALL | (re.IGNORECASE if ignore_case else 0))
+
+
+# -----------------------------
+# Grouping / aggregation
+# -----------------------------
+
+def _group_ids(keys: List[Column], n: int) -> Tuple[np.ndarray, int, List[Column]]:
+    """
+    Assign a dense group id to every row from the key columns.
+    Returns (ids per row, number of groups, key columns per group).
+    """
+    if not keys:
+        return np.zeros(n, dtype=np.int64), 1, []
+
+    combined = np.zeros(n, dtype=np.int64)
+    stride = 1
+    parts = []
+    for col in keys:
+        if col.kind == "str":
+            raise Unsupported("GROUP BY on raw text")
+        values = col.values.astype(np.int64)
+        lo = int(values.min()) if n else 0
+        size = (int(values.max()) - lo + 1) if n else 1
+        parts.append((lo, size, stride))
+        combined += (values - lo) * stride
+        stride *= size
+        if stride > 2 ** 62:
+            raise Unsupported("group key space too large")
+
+    if stride <= max(4 * n, 1 << 20):
+        counts = np.bincount(combined, minlength=stride)
+        present = np.flatnonzero(counts)
+        rank = np.full(stride, -1, dtype=np.int64)
+        rank[present] = np.arange(len(present))
+        ids = rank[combined]
+    else:
+        present, ids = np.unique(combined, return_inverse=True)
+
+    group_keys = []
+    for col, (lo, size, st) in zip(keys, parts):
+        group_keys.append(Column((present // st) % size + lo, col.kind, col.dictionary))
+    return ids, len(present), group_keys
+
+
+def _aggregate(q: _Query, expr: Dict, idx: np.ndarray, ids: np.ndarray, n_groups: int,
+               counts: np.ndarray) -> Column:
+    """
+    Evaluate one aggregate per group.
+    """
+    func, arg = expr["func"], expr["arg"]
+
+    if func == "count" and not expr["distinct"]:
+        if arg is None or (arg["kind"] == "literal" and arg["value"] is not None):
+            return Column(counts.astype(np.int64), "int")
+        if arg["kind"] == "literal":  # COUNT(NULL)
+            return Column(np.zeros(n_groups, dtype=np.int64), "int")
+        # Unknown columns (e.g. note, not in the snapshot) raise Unsupported.
+        col = q.column(arg, idx)
+        present = np.ones(len(col.values), dtype=bool)
+        if col.kind == "code" and len(col.dictionary):
+            present = np.array([v is not None for v in col.dictionary.tolist()], dtype=bool)[col.values]
+        elif col.kind == "float":
+            present = ~np.isnan(col.values)
+        return Column(np.bincount(ids[present], minlength=n_groups).astype(np.int64), "int")
+
+    if arg is None or arg["kind"] == "literal":
+        raise Unsupported(f"aggregate {expr['text']}")
+    col = q.column(arg, idx)
+
+    if func == "count":  # COUNT(DISTINCT x)
+        if col.kind == "str":
+            _, inverse = np.unique(col.values, return_inverse=True)
+            values = inverse.astype(np.int64)
+        else:
+            values = col.values.astype(np.int64)
+        lo = int(values.min()) if len(values) else 0
+        span = (int(values.max()) - lo + 1) if len(values) else 1
+        pairs = np.unique(ids * span + (values - lo))
+        return Column(np.bincount(pairs // span, minlength=n_groups).astype(np.int64), "int")
+
+    if expr["distinct"]:
+        raise Unsupported(f"aggregate {expr['text']}")
+
+    if func in ("sum", "avg"):
+        if col.kind not in ("int", "cents"):
+            raise Unsupported(f"{func} over {col.kind}")
+        sums = np.bincount(ids, weights=col.values, minlength=n_groups)
+        if func == "avg":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                avg = sums / counts
+            return Column(avg / 100.0 if col.kind == "cents" else avg, "float")
+        out = Column(np.rint(sums).astype(np.int64), col.kind)
+        if (counts == 0).any():
+            out = _with_nulls(out, counts == 0)
+        return out
+
+    if func in ("min", "max"):
+        if col.kind not in _ORDERABLE:
+            raise Unsupported(f"{func} over {col.kind}")
+        values = col.values.astype(np.int64)
+        info = np.iinfo(np.int64)
+        if n_groups == 1 and len(values):
+            out = np.array([values.min() if func == "min" else values.max()], dtype=np.int64)
+        elif func == "min":
+            out = np.full(n_groups, info.max, dtype=np.int64)
+            np.minimum.at(out, ids, values)
+        else:
+            out = np.full(n_groups, info.min, dtype=np.int64)
+            np.maximum.at(out, ids, values)
+        result = Column(out, col.kind, col.dictionary)
+        if (counts == 0).any():
+            result = _with_nulls(result, counts == 0)
+        return result
+
+    raise Unsupported(f"aggregate {expr['text']}")
+
+
+class _NullableColumn(Column):
+    """
+    Column where some groups are NULL (aggregates over an empty input).
+    """
+
+    __slots__ = ("nulls",)
+
+    def decode(self) -> List[Any]:
+        out = Column(np.where(self.nulls, 0, self.values), self.kind, self.dictionary).decode()
+        return [None if null else v for v, null in zip(out, self.nulls.tolist())]
+
+    def take(self, idx: np.ndarray) -> "Column":
+        col = _NullableColumn(self.values[idx], self.kind, self.dictionary)
+        col.nulls = self.nulls[idx]
+        return col
+
+
+def _with_nulls(col: Column, nulls: np.ndarray) -> Column:
+    out = _NullableColumn(col.values, col.kind, col.dictionary)
+    out.nulls = nulls
+    return out
+
+
+# -----------------------------
+# Execution
+# -----------------------------
+
+def execute(snapshot: DealSnapshot, sql: str, shape: Optional[Dict] = None) -> List[Dict[str, Any]]:
+    """
+    Run a validated SELECT on the snapshot. Raises Unsupported when the
+    query is outside what the engine implements.
+    """
+    shape = shape or parse_query(sql)
+    if shape is None:
+        raise Unsupported("query shape not recognized")
+    if not shape["where_supported"]:
+        raise Unsupported("WHERE is not a plain conjunction")
+    if any(item["expr"]["kind"] == "star" for item in shape["select"]):
+        raise Unsupported("SELECT *")
+    if any(item["nulls"] for item in shape["order_by"]):
+        raise Unsupported("NULLS FIRST/LAST")
+
+    q = _Query(snapshot, shape)
+
+    mask = q.row_mask()
+    for pred in shape["predicates"]:
+        expr = pred["expr"]
+        if expr["kind"] == "agg":
+            raise Unsupported("aggregate in WHERE")
+        mask &= q.predicate_mask(pred, q.column(expr, None))
+    idx = np.flatnonzero(mask)
+
+    if shape["has_aggregates"] or shape["group_by"] or shape["distinct"]:
+        names, columns = _run_grouped(q, idx)
+    else:
+        names, columns = _run_rows(q, idx)
+
+    decoded = [c.decode() for c in columns]
+    return [dict(zip(names, row)) for row in zip(*decoded)] if decoded else []
+
+
+def _resolve_output_ref(q: _Query, expr: Dict) -> Optional[Dict]:
+    """
+    ORDER BY / GROUP BY / HAVING may name a select item (alias or position).
+    """
+    if expr["kind"] == "column" and expr["table"] is None and expr["column"] in q.aliases:
+        return q.aliases[expr["column"]]
+    if expr["kind"] == "literal" and expr["type"] == "number":
+        pos = int(expr["value"])
+        if not 1 <= pos <= len(q.shape["select"]):
+            raise Unsupported(f"position {pos}")
+        return q.shape["select"][pos - 1]
+    return None
+
+
+def _run_rows(q: _Query, idx: np.ndarray) -> Tuple[List[str], List[Column]]:
+    shape = q.shape
+    select = shape["select"]
+
+    if shape["order_by"]:
+        keys = []
+        for item in shape["order_by"]:
+            ref = _resolve_output_ref(q, item["expr"])
+            col = q.column(ref["expr"] if ref else item["expr"], idx)
+            keys.append(_sort_key(col, item["desc"]))
+        limit = shape["limit"]
+        if limit is not None and len(keys) == 1 and limit + (shape["offset"] or 0) < len(idx):
+            k = limit + (shape["offset"] or 0)
+            part = np.argpartition(keys[0], k - 1)[:k] if k > 0 else np.array([], dtype=np.int64)
+            order = part[np.argsort(keys[0][part], kind="stable")]
+        else:
+            order = np.lexsort(keys[::-1])
+        idx = idx[order]
+
+    idx = _slice(idx, shape)
+    return [item["name"] for item in select], [q.column(item["expr"], idx) for item in select]
+
+
+def _run_grouped(q: _Query, idx: np.ndarray) -> Tuple[List[str], List[Column]]:
+    shape = q.shape
+    select = shape["select"]
+
+    group_exprs = []
+    for expr in shape["group_by"]:
+        ref = _resolve_output_ref(q, expr)
+        group_exprs.append(ref["expr"] if ref else expr)
+    if shape["distinct"] and not shape["has_aggregates"]:
+        group_exprs = [item["expr"] for item in select]
+    elif shape["distinct"]:
+        raise Unsupported("DISTINCT with aggregates")
+
+    key_cols = [q.column(e, idx) for e in group_exprs]
+    ids, n_groups, group_keys = _group_ids(key_cols, len(idx))
+    counts = np.bincount(ids, minlength=n_groups) if len(idx) else np.zeros(n_groups, dtype=np.int64)
+    key_by_text = {e["text"]: col for e, col in zip(group_exprs, group_keys)}
+
+    cache: Dict[str, Column] = {}
+
+    def group_column(expr: Dict) -> Column:
+        ref = _resolve_output_ref(q, expr)
+        if ref is not None:
+            expr = ref["expr"]
+        if expr["text"] in cache:
+            return cache[expr["text"]]
+        if expr["kind"] == "agg":
+            col = _aggregate(q, expr, idx, ids, n_groups, counts)
+        elif expr["text"] in key_by_text:
+            col = key_by_text[expr["text"]]
+        else:
+            raise Unsupported(f"{expr['text']} is neither grouped nor aggregated")
+        cache[expr["text"]] = col
+        return col
+
+    out_cols = [group_column(item["expr"]) for item in select]
+
+    keep = np.ones(n_groups, dtype=bool)
+    if shape["having"]:
+        predicates = parse_conjunction(shape["having"])
+        if predicates is None:
+            raise Unsupported("HAVING is not a plain conjunction")
+        for pred in predicates:
+            col = group_column(pred["expr"])
+            keep &= q.predicate_mask(pred, col)
+    rows = np.flatnonzero(keep)
+
+    if shape["order_by"]:
+        keys = [_sort_key(group_column(item["expr"]).take(rows), item["desc"]) for item in shape["order_by"]]
+        rows = rows[np.lexsort(keys[::-1])]
+
+    rows = _slice(rows, shape)
+    return [item["name"] for item in select], [c.take(rows) for c in out_cols]
+
+
+def _sort_key(col: Column, desc: bool) -> np.ndarray:
+    if col.kind not in _ORDERABLE:
+        raise Unsupported("ORDER BY on raw text")
+    values = col.values.astype(np.float64) if col.kind == "float" else col.values.astype(np.int64)
+    if isinstance(col, _NullableColumn):
+        # Postgres sorts NULLs last ascending, first descending.
+        values = np.where(col.nulls, np.iinfo(np.int64).max, values) if col.kind != "float" \
+            else np.where(col.nulls, np.inf, values)
+    if col.kind == "float":
+        values = np.where(np.isnan(values), np.inf, values)
+    return -values if desc else values
+
+
+def _slice(idx: np.ndarray, shape: Dict) -> np.ndarray:
+    start = shape["offset"] or 0
+    stop = None if shape["limit"] is None else start + shape["limit"]
+    return idx[start:stop]
@@ -0,0 +1,514 @@
+"""
+Answer a follow-up query from the previous query's result, in process.
+
+A conversation (backend.services.sessions) keeps the last validated SQL and
+its rows. When the next query only narrows or reshapes that result, the
+cached rows already hold the answer:
+
+    previous:  SELECT product_name, direction, SUM(volume) AS volume
+               FROM deal_event JOIN ref_product ON ... WHERE <w>
+               GROUP BY product_name, direction
+    follow-up: ... WHERE <w> AND direction = 'sell' ...     filter a key
+               ... ORDER BY volume DESC LIMIT 5              sort / limit
+               SELECT product_name, volume ...               project
+               ... GROUP BY product_name                     re-aggregate
+
+refine() checks that the new query is derivable from the previous one and
+evaluates it on the rows:
+
+- same FROM / JOINs, and every previous WHERE conjunct is still there;
+  extra conjuncts compare an output column of the previous query (a group
+  key when it was grouped) with constants: = <> < <= > >= BETWEEN IN /
+  NOT IN, IS [NOT] NULL; range comparisons on text are refused (the
+  database collation is not modelled),
+- same grouping: every select item is a previous output,
+- coarser grouping (GROUP BY a subset of the keys, or none): SUM / MIN /
+  MAX of previous SUM / MIN / MAX, COUNT as the SUM of previous COUNTs,
+- previous result not grouped: any aggregate over its columns,
+- ORDER BY output columns; text only in the order the previous result
+  already had (its rows give the collation ranks), LIMIT / OFFSET,
+- a previous LIMIT only serves the same query with a smaller one.
+
+Anything else raises NotDerivable and the query goes to the database.
+Filters, sorting and aggregation run on NumPy arrays; results are dicts
+shaped like the database rows (SUM keeps int / Decimal, AVG of int or
+numeric is Decimal).
+"""
+
+import datetime as dt
+import re
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend.validator.query_shape import contains_aggregate, parse_predicate, parse_query, split_conjuncts
+
+COMPARE_OPS = ("=", "<>", "<", "<=", ">", ">=")
+FILTER_OPS = COMPARE_OPS + ("between", "in", "not in", "is null", "is not null")
+
+# Re-aggregating a previous aggregate: previous func -> func applied to it.
+REAGGREGATE = {"sum": "sum", "count": "sum", "min": "min", "max": "max"}
+
+_TOKEN_RE = re.compile(r"'(?:[^']|'')*'|[a-z_][a-z0-9_.]*|\d+(?:\.\d+)?|<=|>=|<>|!=|\S")
+
+
+class NotDerivable(Exception):
+    """
+    The query needs data the previous result does not hold.
+    """
+
+
+def canonical(text: str) -> str:
+    """
+    Whitespace-insensitive form of an expression / predicate for comparisons.
+    """
+    return " ".join(_TOKEN_RE.findall(text))
+
+
+# -----------------------------
+# Derivability
+# -----------------------------
+
+def _conjuncts(shape: Dict[str, Any]) -> List[str]:
+    if not shape["where"]:
+        return []
+    parts = split_conjuncts(shape["where"])
+    return [canonical(p) for p in (parts if parts is not None else [shape["where"]])]
+
+
+def _outputs(shape: Dict[str, Any], columns: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Output column name -> select item of the previous query.
+    """
+    if any(item["expr"]["kind"] == "star" for item in shape["select"]):
+        if len(shape["select"]) != 1:
+            raise NotDerivable("previous select list mixes * and expressions")
+        return {c: {"expr": {"kind": "column", "table": None, "column": c, "text": c}, "name": c} for c in columns}
+    names = [item["name"] for item in shape["select"]]
+    if len(set(names)) != len(names) or "?column?" in names:
+        raise NotDerivable("previous result has ambiguous column names")
+    return {item["name"]: item for item in shape["select"]}
+
+
+def _resolve(expr: Dict[str, Any], outputs: Dict[str, Dict[str, Any]], aliases: bool = False) -> Optional[str]:
+    """
+    The output column an expression refers to: same expression, same
+    column, or (aliases=True: ORDER BY / GROUP BY) an output name.
+    """
+    text = canonical(expr["text"])
+    for name, item in outputs.items():
+        if canonical(item["expr"]["text"]) == text:
+            return name
+    if expr["kind"] == "column":
+        for name, item in outputs.items():
+            other = item["expr"]
+            if other["kind"] == "column" and other["column"] == expr["column"] and \
+                    (expr["table"] is None or other["table"] in (None, expr["table"])):
+                return name
+        if aliases and expr["table"] is None and expr["column"] in outputs:
+            return expr["column"]
+    return None
+
+
+def derive(prev: Dict[str, Any], columns: List[str], sql: str) -> Dict[str, Any]:
+    """
+    How to compute `sql` from the previous query's rows. prev is its
+    parse_query() shape, columns the keys of its rows. Raises NotDerivable.
+    """
+    new = parse_query(sql)
+    if new is None:
+        raise NotDerivable("not a simple SELECT")
+    if new["from"] != prev["from"] or \
+            sorted((j["type"], canonical(j["on"])) for j in new["joins"]) != \
+            sorted((j["type"], canonical(j["on"])) for j in prev["joins"]):
+        raise NotDerivable("different tables or joins")
+    if prev["offset"] is not None:
+        raise NotDerivable("previous query has an OFFSET")
+
+    outputs = _outputs(prev, columns)
+    prev_grouped = bool(prev["group_by"]) or prev["has_aggregates"]
+    new_grouped = bool(new["group_by"]) or new["has_aggregates"]
+
+    # Filters: a superset of the previous WHERE, extras on output columns.
+    prev_where, new_where = _conjuncts(prev), _conjuncts(new)
+    if any(c not in new_where for c in prev_where):
+        raise NotDerivable("a filter of the previous query was dropped")
+    if new["where"] and split_conjuncts(new["where"]) is None and new_where != prev_where:
+        raise NotDerivable("WHERE with OR / NOT")
+    filters = []
+    extra = (split_conjuncts(new["where"]) or []) if new["where"] else []
+    for text in extra:
+        if canonical(text) in prev_where:
+            continue
+        pred = parse_predicate(text)
+        if pred["op"] not in FILTER_OPS or pred.get("expr") is None:
+            raise NotDerivable(f"unsupported filter: {text}")
+        name = _resolve(pred["expr"], outputs)
+        if name is None:
+            raise NotDerivable(f"filter on a column the previous result does not have: {text}")
+        if (prev_grouped or prev["distinct"]) and contains_aggregate(outputs[name]["expr"]):
+            raise NotDerivable(f"filter on an aggregate: {text}")
+        filters.append({"column": name, "pred": pred})
+
+    if canonical(new["having"] or "") != canonical(prev["having"] or ""):
+        raise NotDerivable("different HAVING")
+
+    prev_keys = [canonical(g["text"]) for g in prev["group_by"]]
+    new_keys = [canonical(g["text"]) for g in new["group_by"]]
+    select: List[Dict[str, Any]] = []
+    new_outputs: Dict[str, Dict[str, Any]] = {}
+    if new_grouped == prev_grouped and sorted(new_keys) == sorted(prev_keys) and \
+            (new["distinct"] == prev["distinct"] or (new["distinct"] and not prev_grouped)):
+        mode = "same"
+        for item in new["select"]:
+            if item["expr"]["kind"] == "star":
+                select += [{"name": c, "source": c} for c in outputs]
+                new_outputs.update({c: outputs[c] for c in outputs})
+                continue
+            name = _resolve(item["expr"], outputs)
+            if name is None:
+                raise NotDerivable(f"{item['text']} is not in the previous result")
+            select.append({"name": item["name"], "source": name})
+            new_outputs[item["name"]] = item
+    elif new_grouped and ((not prev_grouped and not prev["distinct"]) or
+                          (prev["group_by"] and set(new_keys) < set(prev_keys))):
+        if prev["having"] or prev["distinct"] or new["distinct"]:
+            raise NotDerivable("HAVING / DISTINCT with a different grouping")
+        if prev["limit"] is not None:
+            raise NotDerivable("previous result is limited")
+        mode = "regroup"
+        for g in new["group_by"]:
+            if _resolve(g, outputs, aliases=True) is None:
+                raise NotDerivable(f"GROUP BY {g['text']} is not in the previous result")
+        for item in new["select"]:
+            expr = item["expr"]
+            if not contains_aggregate(expr):
+                if canonical(expr["text"]) not in new_keys and not any(
+                        _resolve(g, outputs, aliases=True) == _resolve(expr, outputs) for g in new["group_by"]):
+                    raise NotDerivable(f"{item['text']} is neither grouped nor aggregated")
+                select.append({"name": item["name"], "source": _resolve(expr, outputs), "key": True})
+            elif expr["kind"] != "agg":
+                raise NotDerivable(f"unsupported aggregate expression {item['text']}")
+            elif prev_grouped:
+                # Aggregate of a previous aggregate.
+                name = _resolve(expr, outputs)
+                if name is None or expr["func"] not in REAGGREGATE or expr["distinct"]:
+                    raise NotDerivable(f"{item['text']} cannot be computed from the previous groups")
+                select.append({"name": item["name"], "source": name, "func": REAGGREGATE[expr["func"]]})
+            else:
+                arg = expr["arg"]
+                source = None if arg is None or arg["kind"] == "star" else _resolve(arg, outputs)
+                if source is None and not (expr["func"] == "count" and not expr["distinct"]):
+                    raise NotDerivable(f"{item['text']} needs a column the previous result does not have")
+                select.append({"name": item["name"], "source": source, "func": expr["func"],
+                               "distinct": expr["distinct"]})
+    else:
+        raise NotDerivable("different grouping")
+
+    names = [s["name"] for s in select]
+    if len(set(names)) != len(names):
+        raise NotDerivable("ambiguous output column names")
+
+    if mode == "regroup":
+        new_outputs = {item["name"]: item for item in new["select"]}
+
+    # ORDER BY: new outputs first; the previous outputs while not regrouping.
+    order_by = []
+    for item in new["order_by"]:
+        name = _resolve(item["expr"], new_outputs, aliases=True)
+        if name is not None:
+            column = name if mode == "regroup" else next(x["source"] for x in select if x["name"] == name)
+        elif mode == "same":
+            column = _resolve(item["expr"], outputs, aliases=True)
+        else:
+            column = None
+        if column is None:
+            raise NotDerivable(f"ORDER BY {item['text']} is not an output column")
+        order_by.append({"column": column, "desc": item["desc"], "nulls": item["nulls"]})
+
+    if prev["limit"] is not None:
+        same_order = [(o["column"], o["desc"], o["nulls"]) for o in order_by] == \
+            [(_resolve(o["expr"], outputs, aliases=True), o["desc"], o["nulls"]) for o in prev["order_by"]]
+        if filters or mode != "same" or not prev["order_by"] or not same_order or new["limit"] is None \
+                or new["limit"] + (new["offset"] or 0) > prev["limit"]:
+            raise NotDerivable("previous result is limited")
+        if new["distinct"] and not prev["distinct"]:
+            # Duplicates among the kept rows leave fewer distinct rows than
+            # the database has.
+            raise NotDerivable("previous result is limited; DISTINCT needs all rows")
+
+    # Text columns can only be sorted in the order the previous rows had.
+    ranked = None
+    if prev["order_by"]:
+        first = prev["order_by"][0]
+        ranked = {"column": _resolve(first["expr"], outputs, aliases=True), "desc": first["desc"]}
+
+    return {
+        "mode": mode,
+        "filters": filters,
+        "select": select,
+        "group_by": [_resolve(g, outputs, aliases=True) for g in new["group_by"]],
+        "order_by": order_by,
+        "ranked": ranked,
+        "distinct": new["distinct"] and not prev["distinct"],
+        "limit": new["limit"],
+        "offset": new["offset"],
+    }
+
+
+# -----------------------------
+# Evaluation
+# -----------------------------
+
+def _kind(values: List[Any]) -> str:
+    sample = next((v for v in values if v is not None), None)
+    if sample is None:
+        return "null"
+    if isinstance(sample, bool):
+        return "bool"
+    if isinstance(sample, (int, float, Decimal)):
+        return "number"
+    if isinstance(sample, dt.datetime):
+        return "datetime"
+    if isinstance(sample, dt.date):
+        return "date"
+    if isinstance(sample, str):
+        return "str"
+    return "other"
+
+
+def _coerce(literal: Dict[str, Any], kind: str) -> Any:
+    value = literal["value"]
+    if literal["type"] == "null":
+        return None
+    try:
+        if kind == "number" and literal["type"] == "number":
+            return float(value)
+        if kind == "bool" and literal["type"] == "boolean":
+            return float(value)
+        if kind == "str" and literal["type"] == "string":
+            return value
+        if kind == "date" and literal["type"] in ("string", "date"):
+            return float(dt.date.fromisoformat(str(value).strip()[:10]).toordinal())
+        if kind == "datetime" and literal["type"] in ("string", "timestamp", "date"):
+            stamp = dt.datetime.fromisoformat(str(value).strip())
+            if stamp.tzinfo is None:
+                raise NotDerivable("timestamp literal without a time zone")
+            return stamp.timestamp()
+    except ValueError:
+        pass
+    raise NotDerivable(f"cannot compare {literal['text']} with a {kind} column")
+
+
+def _numeric(values: List[Any], kind: str) -> np.ndarray:
+    """
+    Sortable float64 view of a column (NaN for NULL).
+    """
+    out = np.full(len(values), np.nan)
+    for i, v in enumerate(values):
+        if v is None:
+            continue
+        if kind == "date":
+            out[i] = v.toordinal()
+        elif kind == "datetime":
+            out[i] = v.timestamp()
+        else:
+            out[i] = float(v)
+    return out
+
+
+def _filter_mask(values: List[Any], pred: Dict[str, Any]) -> np.ndarray:
+    op = pred["op"]
+    nulls = np.array([v is None for v in values], dtype=bool)
+    if op == "is null":
+        return nulls
+    if op == "is not null":
+        return ~nulls
+    kind = _kind(values)
+    if kind == "null":
+        return np.zeros(len(values), dtype=bool)
+    if kind == "other":
+        raise NotDerivable("unsupported column type")
+    literals = [pred["value"]] if op in COMPARE_OPS else \
+        [pred["low"], pred["high"]] if op == "between" else pred["values"]
+    wanted = [_coerce(lit, kind) for lit in literals]
+    if any(w is None for w in wanted):
+        return np.zeros(len(values), dtype=bool)
+
+    if kind == "str":
+        if op not in ("=", "<>", "in", "not in"):
+            raise NotDerivable("range comparison on text")
+        column = np.array(values, dtype=object)
+        mask = np.isin(column, np.array(wanted, dtype=object))
+        return (mask if op in ("=", "in") else ~mask) & ~nulls
+
+    column = _numeric(values, kind)
+    with np.errstate(invalid="ignore"):
+        if op == "=":
+            mask = column == wanted[0]
+        elif op == "<>":
+            mask = column != wanted[0]
+        elif op == "<":
+            mask = column < wanted[0]
+        elif op == "<=":
+            mask = column <= wanted[0]
+        elif op == ">":
+            mask = column > wanted[0]
+        elif op == ">=":
+            mask = column >= wanted[0]
+        elif op == "between":
+            mask = (column >= wanted[0]) & (column <= wanted[1])
+        else:
+            mask = np.isin(column, np.array(wanted))
+            mask = mask if op == "in" else ~mask
+    return mask & ~nulls
+
+
+def _group_ids(keys: List[List[Any]], n: int) -> Tuple[np.ndarray, int, List[int]]:
+    """
+    (group id per row, number of groups, first row of each group).
+    """
+    index: Dict[tuple, int] = {}
+    ids = np.empty(n, dtype=np.int64)
+    first: List[int] = []
+    for i, key in enumerate(zip(*keys) if keys else [()] * n):
+        at = index.get(key)
+        if at is None:
+            at = index[key] = len(first)
+            first.append(i)
+        ids[i] = at
+    return ids, max(len(first), 0 if keys else 1), first
+
+
+def _aggregate(func: str, values: Optional[List[Any]], ids: np.ndarray, n_groups: int,
+               distinct: bool = False) -> List[Any]:
+    if values is None:  # COUNT(*)
+        return np.bincount(ids, minlength=n_groups).tolist()
+    present = np.array([v is not None for v in values], dtype=bool)
+    counts = np.bincount(ids[present], minlength=n_groups)
+    if func == "count":
+        if distinct:
+            seen = {(g, v) for g, v, p in zip(ids.tolist(), values, present) if p}
+            return np.bincount(np.array([g for g, _ in seen], dtype=np.int64), minlength=n_groups).tolist()
+        return counts.tolist()
+
+    kind = _kind(values)
+    if func in ("sum", "avg"):
+        if kind != "number":
+            raise NotDerivable(f"{func.upper()} of a non-numeric column")
+        sample = next(v for v in values if v is not None)
+        if isinstance(sample, float):
+            totals = np.zeros(n_groups)
+            np.add.at(totals, ids[present], np.array(values, dtype=object)[present].astype(float))
+        elif all(isinstance(v, int) for v in values if v is not None):
+            totals = np.zeros(n_groups, dtype=object)
+            np.add.at(totals, ids[present], np.array(values, dtype=object)[present])
+        else:
+            totals = np.full(n_groups, Decimal(0), dtype=object)
+            np.add.at(totals, ids[present], np.array([Decimal(v) if v is not None else None for v in values],
+                                                     dtype=object)[present])
+        out = []
+        for total, count in zip(totals.tolist(), counts.tolist()):
+            if not count:
+                out.append(None)
+            elif func == "sum":
+                out.append(total)
+            else:
+                out.append(total / count if isinstance(total, float) else Decimal(total) / Decimal(count))
+        return out
+
+    # MIN / MAX: first row of each group in sorted order.
+    if kind == "str":
+        raise NotDerivable(f"{func.upper()} of text needs the database collation")
+    if kind == "other":
+        raise NotDerivable("unsupported column type")
+    keys = _numeric(values, kind)
+    rows = np.flatnonzero(present)
+    order = rows[np.lexsort((keys[rows] if func == "min" else -keys[rows], ids[rows]))]
+    out: List[Any] = [None] * n_groups
+    sorted_ids = ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]) if len(order) else []
+    for start in starts:
+        out[int(sorted_ids[start])] = values[int(order[start])]
+    return out
+
+
+def _sort_keys(values: List[Any], desc: bool, nulls: Optional[str], rank: Optional[Dict[Any, int]]) -> List[np.ndarray]:
+    """
+    lexsort keys (least significant first) for one ORDER BY item; NULLs
+    sort as larger than any value, like Postgres.
+    """
+    kind = _kind(values)
+    if kind == "str":
+        if rank is None or any(v is not None and v not in rank for v in values):
+            raise NotDerivable("ORDER BY on text needs the database collation")
+        keys = np.array([np.nan if v is None else rank[v] for v in values], dtype=float)
+    elif kind in ("number", "date", "datetime", "bool", "null"):
+        keys = _numeric(values, kind)
+    else:
+        raise NotDerivable("unsupported column type")
+    null = np.isnan(keys)
+    nulls_first = (nulls == "first") if nulls else desc
+    keys = np.where(null, 0.0, -keys if desc else keys)
+    return [keys, (~null if nulls_first else null).astype(np.int8)]
+
+
+def refine(rows: List[Dict[str, Any]], prev: Dict[str, Any], sql: str) -> List[Dict[str, Any]]:
+    """
+    Rows of `sql` computed from `rows`, the result of the query with shape
+    prev. Raises NotDerivable when that is not possible.
+    """
+    columns = list(rows[0].keys()) if rows else [item["name"] for item in prev["select"]]
+    spec = derive(prev, columns, sql)
+    table = {c: [row.get(c) for row in rows] for c in columns}
+
+    # Collation ranks from the previous order.
+    rank = None
+    ranked = spec["ranked"]
+    if ranked and ranked["column"] in table:
+        rank = {}
+        for v in table[ranked["column"]]:
+            if v is not None and v not in rank:
+                rank[v] = len(rank)
+        if ranked["desc"]:
+            rank = {v: len(rank) - r for v, r in rank.items()}
+
+    mask = np.ones(len(rows), dtype=bool)
+    for f in spec["filters"]:
+        mask &= _filter_mask(table[f["column"]], f["pred"])
+    keep = np.flatnonzero(mask)
+    table = {c: [values[i] for i in keep] for c, values in table.items()}
+    n = len(keep)
+
+    if spec["mode"] == "regroup":
+        ids, n_groups, first = _group_ids([table[g] for g in spec["group_by"]], n)
+        out = {}
+        for s in spec["select"]:
+            if s.get("key"):
+                out[s["name"]] = [table[s["source"]][i] for i in first]
+            else:
+                out[s["name"]] = _aggregate(s["func"], table[s["source"]] if s["source"] else None,
+                                            ids, n_groups, s.get("distinct", False))
+        table, n = out, n_groups
+
+    order = np.arange(n)
+    if spec["order_by"]:
+        keys: List[np.ndarray] = []
+        for o in reversed(spec["order_by"]):
+            keys += _sort_keys(table[o["column"]], o["desc"], o["nulls"],
+                               rank if o["column"] == (ranked or {}).get("column") else None)
+        order = np.lexsort(keys)
+
+    names = [(s["name"], s["name"] if spec["mode"] == "regroup" else s["source"]) for s in spec["select"]]
+    result = [{name: table[source][i] for name, source in names} for i in order.tolist()]
+    if spec["distinct"]:
+        seen, unique = set(), []
+        for row in result:
+            key = tuple(row.values())
+            if key not in seen:
+                seen.add(key)
+                unique.append(row)
+        result = unique
+    start = spec["offset"] or 0
+    return result[start:start + spec["limit"] if spec["limit"] is not None else None]
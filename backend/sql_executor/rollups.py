@@ -0,0 +1,335 @@
+"""
+Automatic rewrite of aggregate queries onto the deal_event rollups.
+
+migrations/001_deal_event_rollups.sql maintains two pre-aggregated copies of
+deal_event:
+
+    deal_event_rollup_day    one row per (deal_date, product, counterparty,
+    deal_event_rollup_month  currency, unit, direction); month rows have
+                             deal_date = first day of the month
+
+with deal_count, volume_sum/min/max and price_sum/min/max per group.
+
+After validation, rewrite_for_rollup() checks whether a query can be answered
+from a rollup and, if so, returns an equivalent query against the smallest
+one (month before day). A query is eligible when:
+
+- it reads FROM deal_event, optionally with inner JOINs to reference tables
+  on dimension columns,
+- it has at least one aggregate, every aggregate is one of
+      COUNT(*) / COUNT(col), SUM / AVG / MIN / MAX of volume or
+      price_usd_per_mt, MIN / MAX / COUNT(DISTINCT) of a dimension,
+- every other deal_event column it touches (SELECT, WHERE, GROUP BY,
+  ORDER BY) is a dimension, and WHERE is a plain AND of simple predicates,
+- there is no HAVING.
+
+The month rollup additionally requires deal_date to appear only as
+DATE_TRUNC('month'|'quarter'|'year', deal_date),
+EXTRACT(YEAR|QUARTER|MONTH FROM deal_date), or in range predicates that
+start on the first / end on the last day of a month.
+
+Aggregates are mapped so the result keeps the same column names and types
+(e.g. SUM(volume) -> SUM(volume_sum)::bigint AS sum,
+AVG(price_usd_per_mt) -> SUM(price_sum) / SUM(deal_count)).
+
+Configuration (env):
+- ROLLUP_REWRITE_ENABLED  "true"/"false" (default false; turn on once the
+                          rollup migration has been applied)
+"""
+
+import datetime as dt
+import os
+from typing import Any, Dict, Optional, Set, Tuple
+
+from backend.services.metrics import ROLLUP_REWRITES
+from backend.validator.query_shape import (
+    contains_aggregate,
+    expr_columns,
+    parse_query,
+    replace_identifier,
+)
+from backend.validator.validator import build_registry_index, load_schema_registry
+
+ROLLUP_REWRITE_ENABLED = os.getenv("ROLLUP_REWRITE_ENABLED", "false").lower() == "true"
+
+BASE_TABLE = "deal_event"
+
+# Smallest first.
+ROLLUP_TABLES = {
+    "month": "deal_event_rollup_month",
+    "day": "deal_event_rollup_day",
+}
+
+DIMENSIONS = {"deal_date", "product_id", "counterparty_id", "currency_id", "unit_id", "direction"}
+
+# Measure column -> prefix of its rollup columns (<prefix>_sum/_min/_max).
+MEASURES = {"volume": "volume", "price_usd_per_mt": "price"}
+
+MONTH_TRUNC_UNITS = {"month", "quarter", "year"}
+MONTH_EXTRACT_FIELDS = {"year", "quarter", "month"}
+
+_REGISTRY_COLUMNS: Dict[str, Set[str]] = build_registry_index(load_schema_registry())["columns"]
+_BASE_COLUMNS = _REGISTRY_COLUMNS[BASE_TABLE]
+# COUNT(col) over a NOT NULL column is COUNT(*).
+_NOT_NULL_COLUMNS = _BASE_COLUMNS - {"note"}
+
+
+class NotEligible(Exception):
+    """
+    The query cannot be answered from a rollup (message says why).
+    """
+
+
+# -----------------------------
+# Entry points
+# -----------------------------
+
+def rewrite_for_rollup(sql: str) -> Dict:
+    """
+    Returns:
+        {
+          "rollup": "month" | "day" | None,
+          "table": rollup table or None,
+          "sql": <sql to execute>,
+          "reason": why no rollup was used (None when rewritten),
+        }
+    """
+    if not ROLLUP_REWRITE_ENABLED:
+        return {"rollup": None, "table": None, "sql": sql, "reason": "disabled"}
+    result = plan_rewrite(sql)
+    ROLLUP_REWRITES.inc(rollup=result["rollup"] or "none")
+    return result
+
+
+def plan_rewrite(sql: str) -> Dict:
+    """
+    Same as rewrite_for_rollup() but ignores ROLLUP_REWRITE_ENABLED
+    (used by the benchmark script).
+    """
+    shape = parse_query(sql)
+    try:
+        grain = _choose_grain(shape)
+    except NotEligible as e:
+        return {"rollup": None, "table": None, "sql": sql, "reason": str(e)}
+    table = ROLLUP_TABLES[grain]
+    return {"rollup": grain, "table": table, "sql": _render(shape, table), "reason": None}
+
+
+# -----------------------------
+# Eligibility
+# -----------------------------
+
+def _choose_grain(shape: Optional[Dict]) -> str:
+    if shape is None:
+        raise NotEligible("query shape not recognized")
+    if shape["from"] != BASE_TABLE:
+        raise NotEligible(f"not a {BASE_TABLE} query")
+    if not shape["has_aggregates"]:
+        raise NotEligible("no aggregates")
+    if shape["having"]:
+        raise NotEligible("HAVING is not supported")
+    if not shape["where_supported"]:
+        raise NotEligible("WHERE is not a plain conjunction")
+
+    joined = set()
+    for join in shape["joins"]:
+        if join["type"] not in ("join", "inner join") or join["left"] is None:
+            raise NotEligible("only inner equi-joins are supported")
+        base_side = [side for side in (join["left"], join["right"]) if side[0] == BASE_TABLE]
+        if not base_side or base_side[0][1] not in DIMENSIONS or base_side[0][1] == "deal_date":
+            raise NotEligible("join is not on a dimension key")
+        joined.add(join["table"])
+
+    aliases = {item["alias"] for item in shape["select"] if item["alias"]}
+    if aliases & _BASE_COLUMNS:
+        raise NotEligible("select alias shadows a deal_event column")
+
+    ctx = {"joined": joined, "aliases": aliases}
+    month_ok = True
+
+    for item in shape["select"]:
+        expr = item["expr"]
+        if expr["kind"] == "agg":
+            month_ok &= _rollup_aggregate(expr)[1]
+        else:
+            month_ok &= _check_expr(expr, ctx)
+
+    for expr in shape["group_by"]:
+        month_ok &= _check_expr(expr, ctx)
+
+    for item in shape["order_by"]:
+        expr = item["expr"]
+        if expr["kind"] == "agg":
+            month_ok &= _rollup_aggregate(expr)[1]
+        else:
+            month_ok &= _check_expr(expr, ctx)
+
+    for pred in shape["predicates"]:
+        month_ok &= _check_predicate(pred, ctx)
+
+    return "month" if month_ok else "day"
+
+
+def _base_column(expr: Optional[Dict]) -> Optional[str]:
+    """
+    Column name if expr is a deal_event column reference, else None.
+    """
+    if expr is None or expr["kind"] != "column":
+        return None
+    if expr["table"] == BASE_TABLE:
+        return expr["column"]
+    if expr["table"] is None and expr["column"] in _BASE_COLUMNS:
+        return expr["column"]
+    return None
+
+
+def _is_ref_column(expr: Dict, ctx: Dict) -> bool:
+    if expr["kind"] != "column":
+        return False
+    if expr["table"] is not None:
+        return expr["table"] in ctx["joined"]
+    return any(expr["column"] in _REGISTRY_COLUMNS.get(t, ()) for t in ctx["joined"])
+
+
+def _check_expr(expr: Dict, ctx: Dict) -> bool:
+    """
+    Raise NotEligible if expr cannot be evaluated on a rollup.
+    Returns whether the month rollup can evaluate it too.
+    """
+    kind = expr["kind"]
+    if kind == "literal":
+        return True
+    if kind == "column":
+        if expr["table"] is None and expr["column"] in ctx["aliases"]:
+            return True
+        col = _base_column(expr)
+        if col is not None:
+            if col not in DIMENSIONS:
+                raise NotEligible(f"row-level column {col} is referenced")
+            return col != "deal_date"
+        if _is_ref_column(expr, ctx):
+            return True
+        raise NotEligible(f"unknown column {expr['text']}")
+    if kind in ("extract", "date_trunc"):
+        if _base_column(expr["arg"]) == "deal_date":
+            if kind == "extract":
+                return expr["field"] in MONTH_EXTRACT_FIELDS
+            return expr["unit"] in MONTH_TRUNC_UNITS
+        return _check_expr(expr["arg"], ctx)
+    if kind == "other":
+        if contains_aggregate(expr):
+            raise NotEligible("aggregate inside an expression")
+        month_ok = True
+        for table, column in expr_columns(expr):
+            month_ok &= _check_expr({"kind": "column", "table": table, "column": column,
+                                     "text": f"{table}.{column}" if table else column}, ctx)
+        return month_ok
+    raise NotEligible(f"unsupported expression {expr['text']}")
+
+
+def _check_predicate(pred: Dict, ctx: Dict) -> bool:
+    """
+    WHERE conjunct: must only filter on dimensions. For the month rollup,
+    deal_date ranges must cover whole months.
+    """
+    expr = pred["expr"]
+    if _base_column(expr) != "deal_date":
+        return _check_expr(expr, ctx)
+
+    op = pred["op"]
+    if op in (">=", "<"):
+        return _month_edge(pred["value"], first=True)
+    if op in (">", "<="):
+        return _month_edge(pred["value"], first=False)
+    if op == "between":
+        return _month_edge(pred["low"], first=True) and _month_edge(pred["high"], first=False)
+    return False
+
+
+def _month_edge(literal: Dict, first: bool) -> bool:
+    """
+    True if the literal is the first (or last) day of a month.
+    """
+    if literal["type"] not in ("string", "date"):
+        return False
+    try:
+        day = dt.date.fromisoformat(str(literal["value"]).strip())
+    except ValueError:
+        return False
+    if first:
+        return day.day == 1
+    return (day + dt.timedelta(days=1)).day == 1
+
+
+def _rollup_aggregate(expr: Dict) -> Tuple[str, bool]:
+    """
+    Map an aggregate over deal_event to its rollup equivalent.
+    Returns (sql text, month_ok).
+    """
+    func, arg, distinct = expr["func"], expr["arg"], expr["distinct"]
+    col = _base_column(arg) if arg is not None else None
+
+    if func == "count" and not distinct and (arg is None or col in _NOT_NULL_COLUMNS):
+        # COUNT is never NULL, also over no rows at all.
+        return "coalesce(sum(deal_count), 0)::bigint", True
+
+    if col in MEASURES and not distinct:
+        prefix = MEASURES[col]
+        if func == "sum":
+            return (f"sum({prefix}_sum)::bigint" if col == "volume" else f"sum({prefix}_sum)"), True
+        if func == "avg":
+            return f"sum({prefix}_sum)::numeric / sum(deal_count)", True
+        if func in ("min", "max"):
+            return f"{func}({prefix}_{func})", True
+
+    if arg is not None and arg["kind"] == "column" and (col in DIMENSIONS or col is None):
+        if func in ("min", "max") or (func == "count" and distinct):
+            return expr["text"], col != "deal_date"
+
+    raise NotEligible(f"aggregate {expr['text']} has no rollup equivalent")
+
+
+# -----------------------------
+# Rendering
+# -----------------------------
+
+def _render(shape: Dict[str, Any], table: str) -> str:
+    """
+    Rebuild the query against `table`, swapping aggregates for their
+    rollup equivalents and keeping output column names.
+    """
+    clauses = shape["clauses"]
+
+    items = []
+    for item in shape["select"]:
+        if item["expr"]["kind"] == "agg":
+            text, _ = _rollup_aggregate(item["expr"])
+            items.append(f"{replace_identifier(text, BASE_TABLE, table)} as {item['name']}")
+        else:
+            items.append(replace_identifier(item["text"], BASE_TABLE, table))
+
+    parts = ["select " + ("distinct " if shape["distinct"] else "") + ", ".join(items)]
+    parts.append("from " + replace_identifier(clauses["from"], BASE_TABLE, table))
+    if "where" in clauses:
+        parts.append("where " + replace_identifier(clauses["where"], BASE_TABLE, table))
+    if "group by" in clauses:
+        parts.append("group by " + replace_identifier(clauses["group by"], BASE_TABLE, table))
+    if shape["order_by"]:
+        order = []
+        for item in shape["order_by"]:
+            if item["expr"]["kind"] == "agg":
+                text, _ = _rollup_aggregate(item["expr"])
+                text = replace_identifier(text, BASE_TABLE, table)
+                if item["desc"]:
+                    text += " desc"
+                if item["nulls"]:
+                    text += f" nulls {item['nulls']}"
+                order.append(text)
+            else:
+                order.append(replace_identifier(item["text"], BASE_TABLE, table))
+        parts.append("order by " + ", ".join(order))
+    if shape["limit"] is not None:
+        parts.append(f"limit {shape['limit']}")
+    if shape["offset"] is not None:
+        parts.append(f"offset {shape['offset']}")
+    return " ".join(parts)
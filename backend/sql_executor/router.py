@@ -0,0 +1,192 @@
+"""
+Query router: pick the execution backend for a validated query.
+
+Backends, cheapest first for the queries they can answer:
+
+    rollup_month  deal_event_rollup_month (see rollups.py); a few thousand
+                  rows, usually the fastest answer for monthly+ aggregates
+    segments      per-month partial aggregates (see segment_cache.py); only
+                  the months not cached yet are read from deal_event
+    local         in-memory columnar snapshot (see local_engine.py); no DB
+                  round trip, scans millions of rows in tens of ms, but is
+                  up to LOCAL_SNAPSHOT_TTL seconds stale
+    rollup_day    deal_event_rollup_day; fresher than the snapshot but
+                  still a sizeable scan
+    postgres      live deal_event
+
+route() looks at the parsed query shape (tables, aggregates, filters,
+ordering/limit) and the caller's freshness requirement and returns the
+candidates in order, each with the reason it was or was not eligible. The
+caller runs the first one and falls through to the next if it fails with
+local_engine.Unsupported (the engine only knows its subset at run time).
+
+Rules:
+- relative-time queries (CURRENT_DATE, NOW(), ...) always need live data,
+- the snapshot is skipped when it is older than the allowed staleness
+  (request max_staleness_s, else ROUTER_MAX_STALENESS_S) or not loaded yet;
+  the segment cache refetches months older than that,
+- row listings ordered by an indexed column with a LIMIT go to Postgres:
+  an index scan stops after LIMIT rows, the snapshot has to sort.
+
+Configuration (env):
+- ROUTER_MAX_STALENESS_S  default staleness accepted for the snapshot
+                          (default 600)
+- LOCAL_ENGINE_ENABLED / ROLLUP_REWRITE_ENABLED / SEGMENT_CACHE_ENABLED
+  switch the backends on.
+"""
+
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from backend.sql_executor.local_engine import LOCAL_ENGINE_ENABLED, DealSnapshot
+from backend.sql_executor.rollups import ROLLUP_REWRITE_ENABLED, rewrite_for_rollup
+from backend.sql_executor.segment_cache import SEGMENT_CACHE_ENABLED, plan_segments
+from backend.validator.query_shape import parse_query
+
+ROUTER_MAX_STALENESS_S = float(os.getenv("ROUTER_MAX_STALENESS_S", "600"))
+
+# deal_event columns with a btree index (base schema / rollup migration).
+INDEXED_COLUMNS = {"deal_id", "deal_date"}
+
+_RELATIVE_TIME_RE = re.compile(
+    r"\b(current_date|current_timestamp|localtimestamp|localtime|now\s*\(|clock_timestamp|statement_timestamp)",
+    re.IGNORECASE,
+)
+
+
+def route(sql: str, snapshot: Optional[DealSnapshot] = None,
+          max_staleness_s: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Returns:
+        {
+          "candidates": [{"backend", "sql", "table"?, "plan"?}, ...]  (eligible,
+                        in order; always ends with postgres),
+          "considered": [{"backend", "eligible", "reason"}, ...],
+          "shape": {tables, aggregates, predicates, group_by, order_by, limit},
+          "rollup": rollup rewrite result (see rollups.rewrite_for_rollup),
+        }
+    """
+    shape = parse_query(sql)
+    considered: List[Dict[str, Any]] = []
+    candidates: List[Dict[str, Any]] = []
+
+    def consider(backend: str, reason: str, eligible: bool = False, **extra) -> None:
+        considered.append({"backend": backend, "eligible": eligible, "reason": reason})
+        if eligible:
+            candidates.append({"backend": backend, "sql": extra.pop("sql", sql), **extra})
+
+    live_only = bool(_RELATIVE_TIME_RE.search(sql))
+    staleness = ROUTER_MAX_STALENESS_S if max_staleness_s is None else max_staleness_s
+
+    rewrite = rewrite_for_rollup(sql)
+    rollup_grain = rewrite["rollup"]
+
+    # Rollups are maintained by triggers in the same transaction as the
+    # base table, so they are as fresh as Postgres itself.
+    if rollup_grain == "month":
+        consider("rollup_month", "aggregate answerable at month grain", True,
+                 sql=rewrite["sql"], table=rewrite["table"])
+    else:
+        consider("rollup_month", _rollup_reason(rewrite, "month"))
+
+    reason, eligible, plan = _segment_eligibility(sql, live_only, staleness)
+    consider("segments", reason, eligible, plan=plan, max_staleness_s=staleness)
+
+    consider("local", *_local_eligibility(shape, snapshot, staleness, live_only))
+
+    if rollup_grain == "day":
+        consider("rollup_day", "aggregate answerable at day grain", True,
+                 sql=rewrite["sql"], table=rewrite["table"])
+    else:
+        consider("rollup_day", _rollup_reason(rewrite, "day"))
+
+    consider("postgres", "live data" if live_only else "always available", True)
+
+    # Promote Postgres when an index answers an ordered LIMIT directly.
+    indexed = _index_order_limit(shape)
+    if indexed and candidates[0]["backend"] == "local":
+        candidates.insert(0, candidates.pop())
+        considered[-1]["reason"] = f"index scan on {indexed} stops after LIMIT rows"
+
+    return {
+        "candidates": candidates,
+        "considered": considered,
+        "shape": _shape_summary(shape),
+        "rollup": rewrite,
+    }
+
+
+def _rollup_reason(rewrite: Dict, grain: str) -> str:
+    if not ROLLUP_REWRITE_ENABLED:
+        return "rollups disabled"
+    if rewrite["rollup"] == "day" and grain == "month":
+        return "needs day grain"
+    if rewrite["rollup"] == "month" and grain == "day":
+        return "month rollup is smaller"
+    return rewrite["reason"] or "not eligible"
+
+
+def _segment_eligibility(sql: str, live_only: bool, staleness: float) -> tuple:
+    """
+    Returns (reason, eligible, plan) for the segment cache.
+    """
+    if not SEGMENT_CACHE_ENABLED:
+        return "segment cache disabled", False, None
+    if live_only:
+        return "relative-time query needs live data", False, None
+    if staleness <= 0:
+        return "live data requested", False, None
+    planned = plan_segments(sql)
+    if planned["plan"] is None:
+        return planned["reason"], False, None
+    return "aggregate combinable from month segments", True, planned["plan"]
+
+
+def _local_eligibility(shape: Optional[Dict], snapshot: Optional[DealSnapshot],
+                       staleness: float, live_only: bool) -> tuple:
+    """
+    Returns (reason, eligible) for the in-memory snapshot.
+    """
+    if not LOCAL_ENGINE_ENABLED:
+        return "local engine disabled", False
+    if shape is None:
+        return "query shape not recognized", False
+    if live_only:
+        return "relative-time query needs live data", False
+    if snapshot is None:
+        return "snapshot not loaded", False
+    age = time.time() - snapshot.loaded_at
+    if age > staleness:
+        return f"snapshot is {age:.0f}s old, allowed {staleness:.0f}s", False
+    return f"snapshot of {snapshot.rows} rows, {age:.0f}s old", True
+
+
+def _index_order_limit(shape: Optional[Dict]) -> Optional[str]:
+    """
+    Indexed column name if the query is a row listing whose first ORDER BY
+    key is an indexed deal_event column and that has a LIMIT.
+    """
+    if shape is None or shape["limit"] is None or shape["has_aggregates"] or shape["group_by"]:
+        return None
+    if shape["distinct"] or not shape["order_by"]:
+        return None
+    expr = shape["order_by"][0]["expr"]
+    if expr["kind"] == "column" and expr["table"] in (None, "deal_event") and expr["column"] in INDEXED_COLUMNS:
+        return expr["column"]
+    return None
+
+
+def _shape_summary(shape: Optional[Dict]) -> Optional[Dict]:
+    if shape is None:
+        return None
+    aggregates = [item["expr"]["text"] for item in shape["select"] if item["expr"]["kind"] == "agg"]
+    return {
+        "tables": shape["tables"],
+        "aggregates": aggregates,
+        "predicates": [p["text"] for p in shape["predicates"]],
+        "group_by": [e["text"] for e in shape["group_by"]],
+        "order_by": [o["text"] for o in shape["order_by"]],
+        "limit": shape["limit"],
+    }
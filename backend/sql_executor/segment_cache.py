@@ -0,0 +1,610 @@
+"""
+Segmented result cache for decomposable aggregates over deal_event.
+
+Analysts narrow and widen date ranges: volume by product for Jan-Jun, then
+Jan-Sep, then Q3. Each is a fresh scan of the same months. This cache keeps
+partial aggregates per calendar month for a query *template* (the query
+without its deal_date range) and answers a new range by combining the
+months it already has with a query for the missing ones only:
+
+    SELECT product_id, SUM(volume), AVG(price_usd_per_mt) FROM deal_event
+    WHERE direction = 'buy' AND deal_date >= '2024-01-15' AND deal_date < '2024-10-01'
+    GROUP BY product_id
+
+    months  2024-02 .. 2024-09   full months: from the cache, or fetched and cached
+    edges   2024-01-15 .. 01-31  partial months: always fetched, never cached
+
+Misses and edges are fetched in one query, grouped by month:
+
+    select date_trunc('month', deal_event.deal_date) as _segment, product_id as _g0,
+           sum(volume) as _a0, sum(price_usd_per_mt) as _a1, count(price_usd_per_mt) as _a2
+    from deal_event
+    where direction = 'buy' and (deal_event.deal_date >= '2024-01-15' and deal_event.deal_date < '2024-02-01' or ...)
+    group by 1, 2
+
+then every month's partials are merged per group (SUM / COUNT add up,
+MIN / MAX combine, AVG = SUM / COUNT) and ORDER BY / LIMIT / OFFSET are
+applied to the merged rows (text keys in database collation order).
+
+plan_segments() decides eligibility. A query qualifies when:
+
+- it reads FROM deal_event, optionally with inner / left joins,
+- every select item is a GROUP BY expression or SUM / COUNT / MIN / MAX /
+  AVG (no DISTINCT inside), and there is no SELECT DISTINCT or HAVING,
+- WHERE is a plain AND and deal_date only appears in it compared with
+  date constants ('YYYY-MM-DD'; the validator's sargable rewrite turns
+  EXTRACT(YEAR ...) filters into such ranges),
+- ORDER BY names output columns (alias, position or the same expression).
+
+A range open on one side runs from / to the oldest / newest deal.
+
+Freshness:
+
+- "hot" months (ending less than SEGMENT_CACHE_HOT_DAYS ago, or in the
+  future) are only cached while the change feed is connected, and are
+  dropped on any deal_event change: late deals and corrections land
+  there.
+- closed months are dropped when the change feed reports a row dated in
+  them, before or after the change (UPDATE / DELETE carry the old row in
+  change_feed.old_data, so a deal moved out of a month drops that month
+  too); all months on a TRUNCATE or a change logged without the old row
+  (before migrations/004 added old_data); and months of templates joining
+  a ref table when it changes.
+- a segment is current as of its fetch, or of the change feed's last
+  catch-up while the feed is connected; older than the allowed staleness
+  (request max_staleness_s, else ROUTER_MAX_STALENESS_S) it is fetched
+  again. Every segment expires after SEGMENT_CACHE_TTL_S regardless.
+
+Configuration (env):
+- SEGMENT_CACHE_ENABLED   "true"/"false" (default false)
+- SEGMENT_CACHE_MAX_ROWS  partial-aggregate rows kept across all segments,
+                          least recently used evicted first (default 1000000)
+- SEGMENT_CACHE_HOT_DAYS  days after its end a month still counts as hot
+                          (default 7)
+- SEGMENT_CACHE_TTL_S     upper bound on a segment's age (default 3600)
+"""
+
+import datetime as dt
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from backend.services.metrics import SEGMENT_CACHE_SEGMENTS
+from backend.validator.query_shape import expr_columns, parse_query
+
+SEGMENT_CACHE_ENABLED = os.getenv("SEGMENT_CACHE_ENABLED", "false").lower() == "true"
+SEGMENT_CACHE_MAX_ROWS = int(os.getenv("SEGMENT_CACHE_MAX_ROWS", "1000000"))
+SEGMENT_CACHE_HOT_DAYS = int(os.getenv("SEGMENT_CACHE_HOT_DAYS", "7"))
+SEGMENT_CACHE_TTL_S = float(os.getenv("SEGMENT_CACHE_TTL_S", "3600"))
+
+BASE_TABLE = "deal_event"
+DATE_COLUMN = "deal_date"
+SEGMENT_COLUMN = f"{BASE_TABLE}.{DATE_COLUMN}"
+
+# Aggregate -> partials it is computed from.
+PARTIALS = {
+    "sum": ("sum",),
+    "count": ("count",),
+    "min": ("min",),
+    "max": ("max",),
+    "avg": ("sum", "count"),
+}
+
+RANGE_OPS = ("=", "<", "<=", ">", ">=", "between")
+JOIN_TYPES = ("join", "inner join", "left join", "left outer join")
+
+_DAY_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+# Strings ranked in collation order at most once in a while; see _rank().
+_MAX_RANKED_STRINGS = 100000
+
+# run(sql, admission=False) -> rows (list of dicts) or {"error": ...}; with
+# admission=True the caller may raise Unavailable instead of running it.
+Runner = Callable[..., Any]
+
+
+class NotEligible(Exception):
+    """
+    The query cannot be answered from month segments (message says why).
+    """
+
+
+class Unavailable(Exception):
+    """
+    The segment cache cannot serve this request after all (e.g. admission
+    control refused the fetch); the caller should use the next backend.
+    """
+
+
+# -----------------------------
+# Eligibility
+# -----------------------------
+
+def plan_segments(sql: str) -> Dict[str, Any]:
+    """
+    Returns:
+        {
+          "plan": segment plan (see _plan) or None,
+          "reason": why the query is not eligible (None when it is),
+        }
+    """
+    try:
+        return {"plan": _plan(parse_query(sql)), "reason": None}
+    except NotEligible as e:
+        return {"plan": None, "reason": str(e)}
+
+
+def _plan(shape: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Plan:
+        {
+          "template": key shared by queries that differ only in their deal_date range,
+          "low" / "high": date range [low, high) (None = open),
+          "from": FROM clause, "filters": other WHERE conjuncts,
+          "groups": GROUP BY expressions, "partials": [(func, expr text)],
+          "outputs": [(name, ("group", i) | (func, [partial indexes]))],
+          "order_by": [(output index, desc, nulls_first)], "limit", "offset",
+          "tables": joined tables,
+        }
+    """
+    if shape is None:
+        raise NotEligible("query shape not recognized")
+    if shape["from"] != BASE_TABLE:
+        raise NotEligible(f"not a {BASE_TABLE} query")
+    if not shape["has_aggregates"]:
+        raise NotEligible("no aggregates")
+    if shape["distinct"]:
+        raise NotEligible("SELECT DISTINCT is not supported")
+    if shape["having"]:
+        raise NotEligible("HAVING is not supported")
+    if not shape["where_supported"]:
+        raise NotEligible("WHERE is not a plain conjunction")
+    for join in shape["joins"]:
+        if join["type"] not in JOIN_TYPES:
+            raise NotEligible(f"{join['type'].upper()} is not supported")
+
+    select = shape["select"]
+    groups: List[str] = []
+    for expr in shape["group_by"]:
+        resolved = _output_ref(expr, select)
+        text = select[resolved]["expr"]["text"] if resolved is not None else expr["text"]
+        if text not in groups:
+            groups.append(text)
+
+    partials: List[Tuple[str, str]] = []
+    outputs = []
+    for item in select:
+        expr = item["expr"]
+        if expr["text"] in groups:
+            outputs.append((item["name"], ("group", groups.index(expr["text"]))))
+            continue
+        if expr["kind"] != "agg":
+            raise NotEligible(f"select item is neither grouped nor a plain aggregate: {item['text']}")
+        if expr["distinct"]:
+            raise NotEligible(f"{expr['func'].upper()}(DISTINCT ...) does not combine across months")
+        arg = "*" if expr["arg"] is None else expr["arg"]["text"]
+        indexes = []
+        for func in PARTIALS[expr["func"]]:
+            partial = (func, f"{func}({arg})")
+            if partial not in partials:
+                partials.append(partial)
+            indexes.append(partials.index(partial))
+        outputs.append((item["name"], (expr["func"], indexes)))
+
+    low, high, filters = None, None, []
+    for pred in shape["predicates"]:
+        bounds = _date_bounds(pred)
+        if bounds is None:
+            if any(c == DATE_COLUMN and t in (None, BASE_TABLE) for t, c in expr_columns(pred["expr"])):
+                raise NotEligible(f"deal_date is filtered through an expression: {pred['text']}")
+            filters.append(pred["text"])
+            continue
+        if bounds[0] is not None:
+            low = bounds[0] if low is None else max(low, bounds[0])
+        if bounds[1] is not None:
+            high = bounds[1] if high is None else min(high, bounds[1])
+
+    order_by = []
+    for item in shape["order_by"]:
+        resolved = _output_ref(item["expr"], select)
+        if resolved is None:
+            matches = [i for i, s in enumerate(select) if s["expr"]["text"] == item["expr"]["text"]]
+            if not matches:
+                raise NotEligible(f"ORDER BY is not an output column: {item['text']}")
+            resolved = matches[0]
+        nulls_first = item["nulls"] == "first" if item["nulls"] else item["desc"]
+        order_by.append((resolved, item["desc"], nulls_first))
+
+    key = "\n".join([shape["clauses"]["from"], *filters, "|", *groups, "|", *(p[1] for p in partials)])
+    return {
+        "template": hashlib.sha1(key.encode("utf-8")).hexdigest()[:16],
+        "low": low,
+        "high": high,
+        "from": shape["clauses"]["from"],
+        "filters": filters,
+        "groups": groups,
+        "partials": partials,
+        "outputs": outputs,
+        "order_by": order_by,
+        "limit": shape["limit"],
+        "offset": shape["offset"],
+        "tables": frozenset(shape["tables"][1:]),
+    }
+
+
+def _output_ref(expr: Dict[str, Any], select: List[Dict[str, Any]]) -> Optional[int]:
+    """
+    Select item a GROUP BY / ORDER BY entry refers to by position or
+    output name, else None.
+    """
+    if expr["kind"] == "literal" and expr["type"] == "number":
+        if isinstance(expr["value"], int) and 1 <= expr["value"] <= len(select):
+            return expr["value"] - 1
+        raise NotEligible(f"position {expr['text']} is not in the select list")
+    if expr["kind"] == "column" and expr["table"] is None:
+        for i, item in enumerate(select):
+            if item["alias"] == expr["column"]:
+                return i
+    return None
+
+
+def _date_bounds(pred: Dict[str, Any]) -> Optional[Tuple[Optional[dt.date], Optional[dt.date]]]:
+    """
+    (low, high) as `deal_date >= low and deal_date < high` for a comparison
+    of the bare column with date constants, else None.
+    """
+    expr = pred.get("expr")
+    if (expr is None or expr["kind"] != "column" or expr["column"] != DATE_COLUMN
+            or expr["table"] not in (None, BASE_TABLE) or pred["op"] not in RANGE_OPS):
+        return None
+    literals = [pred["low"], pred["high"]] if pred["op"] == "between" else [pred["value"]]
+    if any(lit["type"] not in ("string", "date") or not _DAY_RE.match(str(lit["value"])) for lit in literals):
+        return None
+    try:
+        days = [dt.date.fromisoformat(lit["value"]) for lit in literals]
+    except ValueError:
+        return None
+    one = dt.timedelta(days=1)
+    op = pred["op"]
+    if op == "=":
+        return days[0], days[0] + one
+    if op == "between":
+        return days[0], days[1] + one
+    if op in (">=", ">"):
+        return days[0] + (one if op == ">" else dt.timedelta(0)), None
+    return None, days[0] + (one if op == "<=" else dt.timedelta(0))
+
+
+# -----------------------------
+# Months
+# -----------------------------
+
+def _month(day: dt.date) -> dt.date:
+    return day.replace(day=1)
+
+
+def _next_month(month: dt.date) -> dt.date:
+    return dt.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _ranges_sql(ranges: List[Tuple[dt.date, dt.date]]) -> str:
+    """
+    OR of [low, high) ranges on deal_date, adjacent ranges merged.
+    """
+    merged: List[List[dt.date]] = []
+    for low, high in sorted(ranges):
+        if merged and merged[-1][1] == low:
+            merged[-1][1] = high
+        else:
+            merged.append([low, high])
+    terms = [f"{SEGMENT_COLUMN} >= '{low.isoformat()}' and {SEGMENT_COLUMN} < '{high.isoformat()}'"
+             for low, high in merged]
+    return terms[0] if len(terms) == 1 else "(" + " or ".join(terms) + ")"
+
+
+def fetch_sql(plan: Dict[str, Any], ranges: List[Tuple[dt.date, dt.date]]) -> str:
+    """
+    Partial aggregates of the plan's template per month over the ranges.
+    """
+    columns = [f"date_trunc('month', {SEGMENT_COLUMN}) as _segment"]
+    columns += [f"{g} as _g{i}" for i, g in enumerate(plan["groups"])]
+    columns += [f"{text} as _a{i}" for i, (_, text) in enumerate(plan["partials"])]
+    where = " and ".join(plan["filters"] + [_ranges_sql(ranges)])
+    group_by = ", ".join(str(i + 1) for i in range(1 + len(plan["groups"])))
+    return f"select {', '.join(columns)} from {plan['from']} where {where} group by {group_by}"
+
+
+# -----------------------------
+# Merging
+# -----------------------------
+
+def _combine(func: str, a: Any, b: Any, rank: Dict[str, int]) -> Any:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if func in ("sum", "count"):
+        return a + b
+    if a == b:
+        return a
+    if isinstance(a, str):
+        a_first = rank[a] <= rank[b]
+    else:
+        a_first = a <= b
+    return a if a_first == (func == "min") else b
+
+
+def _finish(func: str, indexes: List[int], partials: List[Any]) -> Any:
+    if func == "avg":
+        total, count = partials[indexes[0]], partials[indexes[1]]
+        if not count:
+            return None
+        if isinstance(total, float):
+            return total / count
+        return Decimal(total) / Decimal(count)
+    value = partials[indexes[0]]
+    return 0 if func == "count" and value is None else value
+
+
+def _sort(rows: List[List[Any]], order_by: List[Tuple[int, bool, bool]], rank: Dict[str, int]) -> None:
+    # One stable sort per key, last key first.
+    for index, desc, nulls_first in reversed(order_by):
+        null_flag = 1 if nulls_first == desc else 0
+
+        def key(row, index=index, null_flag=null_flag):
+            value = row[index]
+            if value is None:
+                return (null_flag, 0)
+            return (1 - null_flag, rank[value] if isinstance(value, str) else value)
+
+        rows.sort(key=key, reverse=desc)
+
+
+# -----------------------------
+# Cache
+# -----------------------------
+
+class SegmentCache:
+    """
+    LRU of month segments: (template, month) -> partial-aggregate rows.
+    Thread-safe; fetches run outside the lock.
+    """
+
+    def __init__(self, max_rows: int = SEGMENT_CACHE_MAX_ROWS, hot_days: int = SEGMENT_CACHE_HOT_DAYS,
+                 ttl: float = SEGMENT_CACHE_TTL_S):
+        self.max_rows = max_rows
+        self.hot_days = hot_days
+        self.ttl = ttl
+        self.feed = None
+        self._segments: "OrderedDict[Tuple[str, dt.date], Dict[str, Any]]" = OrderedDict()
+        self._rows = 0
+        self._generation = 0  # bumped by every invalidation
+        self._ranked: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # -- change feed --
+
+    def attach(self, feed) -> None:
+        self.feed = feed
+        feed.subscribe(self.invalidate)
+
+    def invalidate(self, changes: List[Dict[str, Any]], sort_values=None) -> None:
+        """
+        Change-feed subscriber: drop the segments the changes may affect.
+        """
+        if not changes:
+            return
+        months, tables = set(), set()
+        deals_changed = everything = False
+        for change in changes:
+            if change["table_name"] != BASE_TABLE:
+                tables.add(change["table_name"])
+                continue
+            deals_changed = True
+            # The new row's month, and for UPDATE / DELETE the old row's
+            # (change_feed.old_data, {} for INSERT). Without the old row
+            # (TRUNCATE, or logged before old_data existed) any month may
+            # be affected.
+            old = change.get("old_data")
+            rows = [old, change["row_data"] if change["op"] == "upsert" else None]
+            days = [row[DATE_COLUMN] for row in rows if row and row.get(DATE_COLUMN) is not None]
+            if old is None:
+                everything = True
+            for day in days:
+                months.add(_month(dt.date.fromisoformat(str(day)[:10])))
+        with self._lock:
+            self._generation += 1
+            for key, segment in list(self._segments.items()):
+                if (everything or key[1] in months or (deals_changed and segment["hot"])
+                        or segment["tables"] & tables):
+                    self._drop(key)
+
+    def _following(self) -> bool:
+        return self.feed is not None and self.feed.connected
+
+    def _hot(self, month: dt.date, today: dt.date) -> bool:
+        return _next_month(month) > today - dt.timedelta(days=self.hot_days)
+
+    # -- storage --
+
+    def _get(self, key: Tuple[str, dt.date], max_staleness_s: float) -> Optional[List]:
+        now = time.time()
+        with self._lock:
+            segment = self._segments.get(key)
+            if segment is None:
+                return None
+            current_as_of = segment["fetched_at"]
+            if self._following() and self.feed.last_catch_up:
+                current_as_of = max(current_as_of, self.feed.last_catch_up)
+            if (now - segment["fetched_at"] > self.ttl or now - current_as_of > max_staleness_s
+                    or (segment["hot"] and not self._following())):
+                self._drop(key)
+                return None
+            self._segments.move_to_end(key)
+            return segment["rows"]
+
+    def _put(self, key: Tuple[str, dt.date], rows: List, hot: bool, tables: frozenset, fetched_at: float) -> None:
+        if key in self._segments:
+            self._drop(key)
+        self._segments[key] = {"rows": rows, "hot": hot, "tables": tables, "fetched_at": fetched_at}
+        self._rows += max(len(rows), 1)
+        while self._rows > self.max_rows and self._segments:
+            self._drop(next(iter(self._segments)))
+
+    def _drop(self, key: Tuple[str, dt.date]) -> None:
+        segment = self._segments.pop(key)
+        self._rows -= max(len(segment["rows"]), 1)
+
+    def status(self) -> Dict[str, Any]:
+        return {"segments": len(self._segments), "rows": self._rows, "hits": self.hits, "misses": self.misses}
+
+    # -- execution --
+
+    def execute(self, plan: Dict[str, Any], run: Runner, max_staleness_s: float) -> Dict[str, Any]:
+        """
+        Answer a plan from cached months plus one fetch for the rest.
+
+        Returns {"rows": [...], "segments": {"cached", "fetched", "edges"},
+        "fetch_sql": sql or None}, or {"error": ...} (with "cancelled" when
+        the fetch was cancelled). Raises Unavailable when the fetch is
+        refused by run(..., admission=True).
+        """
+        low, high = plan["low"], plan["high"]
+        if low is None or high is None:
+            extent = run(f"select min({DATE_COLUMN}) as low, max({DATE_COLUMN}) as high from {BASE_TABLE}")
+            if isinstance(extent, dict):
+                return extent
+            if extent[0]["low"] is None:
+                low = high = dt.date.today()  # empty table
+            else:
+                low = extent[0]["low"] if low is None else low
+                high = extent[0]["high"] + dt.timedelta(days=1) if high is None else high
+
+        today = dt.date.today()
+        cached: List[Tuple[dt.date, List]] = []
+        missing: List[dt.date] = []
+        edges: List[Tuple[dt.date, dt.date]] = []
+        month = _month(low)
+        while month < high:
+            end = _next_month(month)
+            if low <= month and end <= high:
+                rows = self._get((plan["template"], month), max_staleness_s)
+                if rows is None:
+                    missing.append(month)
+                else:
+                    cached.append((month, rows))
+            else:
+                edges.append((max(low, month), min(high, end)))
+            month = end
+        self.hits += len(cached)
+        self.misses += len(missing)
+
+        sql = None
+        partial_rows = [row for _, rows in cached for row in rows]
+        if missing or edges:
+            with self._lock:
+                generation = self._generation
+            fetched_at = time.time()
+            sql = fetch_sql(plan, [(m, _next_month(m)) for m in missing] + edges)
+            fetched = run(sql, admission=True)
+            if isinstance(fetched, dict):
+                return fetched
+
+            n_groups, n_partials = len(plan["groups"]), len(plan["partials"])
+            by_month: Dict[dt.date, List] = {m: [] for m in missing}
+            for r in fetched:
+                values = list(r.values())
+                row = (tuple(values[1:1 + n_groups]), tuple(values[1 + n_groups:1 + n_groups + n_partials]))
+                partial_rows.append(row)
+                segment = values[0].date() if isinstance(values[0], dt.datetime) else values[0]
+                if segment in by_month:
+                    by_month[segment].append(row)
+
+            following = self._following()
+            with self._lock:
+                if generation == self._generation:
+                    for m in missing:
+                        hot = self._hot(m, today)
+                        if following or not hot:
+                            self._put((plan["template"], m), by_month[m], hot, plan["tables"], fetched_at)
+
+        SEGMENT_CACHE_SEGMENTS.inc(len(cached), source="cached")
+        SEGMENT_CACHE_SEGMENTS.inc(len(missing), source="fetched")
+        SEGMENT_CACHE_SEGMENTS.inc(len(edges), source="edge")
+
+        rank, error = self._rank(self._strings(plan, partial_rows), run)
+        if error is not None:
+            return error
+        return {
+            "rows": self._merge(plan, partial_rows, rank),
+            "segments": {"cached": len(cached), "fetched": len(missing), "edges": len(edges)},
+            "fetch_sql": sql,
+        }
+
+    def _merge(self, plan: Dict[str, Any], partial_rows: List, rank: Dict[str, int]) -> List[Dict[str, Any]]:
+        funcs = [func for func, _ in plan["partials"]]
+        groups: Dict[tuple, List[Any]] = {}
+        for key, partials in partial_rows:
+            acc = groups.get(key)
+            if acc is None:
+                groups[key] = list(partials)
+            else:
+                for i, func in enumerate(funcs):
+                    acc[i] = _combine(func, acc[i], partials[i], rank)
+        if not groups and not plan["groups"]:
+            groups[()] = [None] * len(funcs)  # aggregate over no rows: one row
+
+        rows = []
+        for key, partials in groups.items():
+            rows.append([key[spec[1]] if spec[0] == "group" else _finish(spec[0], spec[1], partials)
+                         for _, spec in plan["outputs"]])
+        _sort(rows, plan["order_by"], rank)
+        if plan["offset"]:
+            rows = rows[plan["offset"]:]
+        if plan["limit"] is not None:
+            rows = rows[:plan["limit"]]
+        names = [name for name, _ in plan["outputs"]]
+        return [dict(zip(names, row)) for row in rows]
+
+    @staticmethod
+    def _strings(plan: Dict[str, Any], partial_rows: List) -> set:
+        """
+        Text values whose collation order matters: MIN / MAX partials and
+        ORDER BY keys.
+        """
+        minmax = [i for i, (func, _) in enumerate(plan["partials"]) if func in ("min", "max")]
+        ordered = [plan["outputs"][index][1] for index, _, _ in plan["order_by"]]
+        group_keys = {spec[1] for spec in ordered if spec[0] == "group"}
+        found = set()
+        for key, partials in partial_rows:
+            found.update(v for i, v in enumerate(key) if i in group_keys and isinstance(v, str))
+            found.update(partials[i] for i in minmax if isinstance(partials[i], str))
+        return found
+
+    def _rank(self, strings: Iterable[str], run: Runner) -> Tuple[Dict[str, int], Optional[Dict]]:
+        """
+        (collation-order positions covering the strings, error). Positions
+        from an earlier sort are reused when they cover every string: the
+        relative order of a subset does not change.
+        """
+        strings = set(strings)
+        ranked = self._ranked
+        if len(strings) < 2:
+            return dict.fromkeys(strings, 0), None
+        if strings <= ranked.keys():
+            return ranked, None
+        union = strings | ranked.keys() if len(ranked) + len(strings) <= _MAX_RANKED_STRINGS else strings
+        array = ", ".join("'" + s.replace("'", "''") + "'" for s in union)
+        rows = run(f"select v from unnest(array[{array}]::text[]) as v order by v")
+        if isinstance(rows, dict):
+            return {}, rows
+        ranked = {r["v"]: i for i, r in enumerate(rows)}
+        self._ranked = ranked
+        return ranked, None
@@ -0,0 +1,472 @@
+"""
+SQLite mirror of the registry tables, for executing queries in LOCAL_MODE.
+
+With LOCAL_MODE=true there is no database to run approved SQL on. If a
+mirror file exists at SQLITE_MIRROR_PATH, /chat runs the query there
+instead, so the whole pipeline (LLM -> validator -> execution -> JSON)
+can be exercised and benchmarked offline.
+
+Building the mirror (python -m backend.scripts.sqlite_mirror):
+- from CSV files, one <table>.csv per registry table with a header row,
+- or from Postgres: a full copy the first time, then incremental syncs
+  from change_feed (migrations/002_change_feed.sql) past the stored
+  transaction watermark (migrations/005; see read_changes in
+  backend/services/change_feed.py).
+
+translate_sql() maps the Postgres dialect the validator lets through to
+SQLite:
+
+    EXTRACT(YEAR|QUARTER|MONTH|WEEK|DAY|DOW|ISODOW|DOY|HOUR|EPOCH FROM x) -> strftime()
+    DATE_TRUNC('day'|'week'|'month'|'quarter'|'year', x)                  -> date(x, modifiers)
+    TO_CHAR(x, 'YYYY-MM-DD ...')                                          -> strftime()
+    x::date / ::int / ::numeric / ::text, DATE '...'                      -> date() / CAST / literal
+    a ILIKE 'p'                                                           -> lower(a) LIKE lower('p')
+    NOW(), x +/- INTERVAL 'n unit'                                        -> datetime('now'), date(x, '+n unit')
+
+LIKE is made case-sensitive (PRAGMA case_sensitive_like) as in Postgres.
+Dates are stored as ISO text and numerics as REAL, so DATE_TRUNC returns
+a date string and money sums may differ from Postgres in the last digits.
+
+Configuration (env):
+- SQLITE_MIRROR_PATH  mirror file (default data/local_mirror.sqlite)
+"""
+
+import csv
+import json
+import os
+import re
+import sqlite3
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from backend.services.change_feed import read_changes
+from backend.validator.query_shape import parse_query, split_top_level
+from backend.validator.validator import load_schema_registry
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+SQLITE_MIRROR_PATH = Path(os.getenv("SQLITE_MIRROR_PATH", str(PROJECT_ROOT / "data" / "local_mirror.sqlite")))
+
+META_TABLE = "_mirror_meta"
+SYNC_BATCH = 50000
+
+
+class TranslationError(Exception):
+    """
+    The query uses Postgres syntax the translator does not handle.
+    """
+
+
+# -----------------------------
+# Schema
+# -----------------------------
+
+def _sqlite_type(sql_type: str) -> str:
+    sql_type = sql_type.lower()
+    if sql_type.startswith(("int", "bigint", "smallint")):
+        return "INTEGER"
+    if sql_type.startswith(("numeric", "decimal", "real", "double", "float")):
+        return "REAL"
+    return "TEXT"  # text, varchar, date, timestamp (ISO strings)
+
+
+def create_schema(conn: sqlite3.Connection, registry: Dict) -> None:
+    """
+    Create (if missing) every registry table, plus the watermark table.
+    """
+    for table, tdef in registry["tables"].items():
+        cols = []
+        for name, cdef in tdef["columns"].items():
+            col = f"{name} {_sqlite_type(cdef['sql_type'])}"
+            if not cdef.get("nullable", True):
+                col += " NOT NULL"
+            cols.append(col)
+        if tdef.get("primary_key"):
+            cols.append(f"PRIMARY KEY ({', '.join(tdef['primary_key'])})")
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(cols)})")
+        for name, cdef in tdef["columns"].items():
+            if cdef.get("semantic_type") == "deal_date":
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_{name}_idx ON {table} ({name})")
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {META_TABLE} (key TEXT PRIMARY KEY, value TEXT)")
+    conn.commit()
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value: Optional[str]) -> None:
+    conn.execute(f"INSERT OR REPLACE INTO {META_TABLE} (key, value) VALUES (?, ?)", (key, value))
+
+
+def _get_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute(f"SELECT value FROM {META_TABLE} WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _load_order(registry: Dict) -> List[str]:
+    """
+    Referenced tables first.
+    """
+    tables = registry["tables"]
+    refs = lambda t: {c["references"]["table"] for c in tables[t]["columns"].values() if c.get("references")}
+    return sorted(tables, key=lambda t: (len(refs(t)), t))
+
+
+# -----------------------------
+# Loading
+# -----------------------------
+
+def load_csv_dir(conn: sqlite3.Connection, csv_dir: Path, registry: Optional[Dict] = None) -> Dict[str, int]:
+    """
+    Replace table contents from <csv_dir>/<table>.csv (header row required;
+    empty fields are NULL). Tables without a file are left untouched.
+    """
+    registry = registry or load_schema_registry()
+    create_schema(conn, registry)
+    loaded = {}
+    for table in _load_order(registry):
+        path = Path(csv_dir) / f"{table}.csv"
+        if not path.exists():
+            continue
+        columns = list(registry["tables"][table]["columns"])
+        with path.open("r", encoding="utf-8", newline="") as f:
+            reader = csv.DictReader(f)
+            missing = set(columns) - set(reader.fieldnames or []) - _nullable(registry, table)
+            if missing:
+                raise ValueError(f"{path.name}: missing columns {sorted(missing)}")
+            rows = ([r.get(c) or None for c in columns] for r in reader)
+            conn.execute(f"DELETE FROM {table}")
+            cur = conn.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+            )
+            loaded[table] = cur.rowcount
+    _set_meta(conn, "source", f"csv:{Path(csv_dir).resolve()}")
+    _set_meta(conn, "feed_watermark", None)
+    conn.commit()
+    return loaded
+
+
+def _nullable(registry: Dict, table: str) -> set:
+    return {c for c, d in registry["tables"][table]["columns"].items() if d.get("nullable", True)}
+
+
+def sync_from_postgres(conn: sqlite3.Connection, pg_conn, registry: Optional[Dict] = None,
+                       full: bool = False) -> Dict[str, Any]:
+    """
+    Bring the mirror up to date with Postgres. Without a stored watermark
+    (or with full=True) every table is copied in one REPEATABLE READ
+    transaction; afterwards only change_feed rows past the watermark that
+    were not applied yet are applied, in id order.
+    """
+    registry = registry or load_schema_registry()
+    create_schema(conn, registry)
+    watermark = None if full else _get_meta(conn, "feed_watermark")
+    if watermark is None:
+        return _full_copy(conn, pg_conn, registry)
+    return _apply_feed(conn, pg_conn, registry, int(watermark))
+
+
+def _full_copy(conn: sqlite3.Connection, pg_conn, registry: Dict) -> Dict[str, Any]:
+    copied = {}
+    pg_conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    try:
+        with pg_conn.cursor() as cur:
+            cur.execute(
+                "SELECT pg_snapshot_xmin(pg_current_snapshot())::text, EXISTS (SELECT 1 FROM "
+                "information_schema.columns WHERE table_name = 'change_feed' AND column_name = 'xact_id')"
+            )
+            watermark, has_feed = cur.fetchone()
+            applied = {}
+            if has_feed:
+                # Rows of transactions at or past the watermark that this
+                # snapshot already sees: the copy includes them.
+                cur.execute("SELECT id, xact_id::text FROM change_feed WHERE xact_id >= %s::xid8", (watermark,))
+                applied = {i: int(x) for i, x in cur.fetchall()}
+            for table in _load_order(registry):
+                columns = list(registry["tables"][table]["columns"])
+                conn.execute(f"DELETE FROM {table}")
+                with pg_conn.cursor(name=f"mirror_{table}") as rows:
+                    rows.itersize = SYNC_BATCH
+                    rows.execute(f"SELECT {', '.join(columns)} FROM {table}")
+                    cur_sqlite = conn.executemany(
+                        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                        (tuple(_to_sqlite(v) for v in r) for r in rows),
+                    )
+                copied[table] = cur_sqlite.rowcount
+    finally:
+        pg_conn.rollback()
+        pg_conn.set_session(isolation_level="DEFAULT", readonly="DEFAULT")
+
+    _set_meta(conn, "source", "postgres")
+    _set_feed_state(conn, int(watermark) if has_feed else None, applied)
+    conn.commit()
+    return {"mode": "full", "tables": copied, "incremental": bool(has_feed)}
+
+
+def _set_feed_state(conn: sqlite3.Connection, watermark: Optional[int], applied: Dict[int, int]) -> None:
+    """
+    Store the change_feed watermark and the ids applied at or above it
+    (they are read again until the watermark passes them).
+    """
+    _set_meta(conn, "feed_watermark", str(watermark) if watermark is not None else None)
+    _set_meta(conn, "feed_applied", json.dumps(sorted(applied.items())))
+
+
+def _apply_feed(conn: sqlite3.Connection, pg_conn, registry: Dict, watermark: int) -> Dict[str, Any]:
+    keys = {t: d["primary_key"][0] for t, d in registry["tables"].items() if d.get("primary_key")}
+    applied = {i: x for i, x in json.loads(_get_meta(conn, "feed_applied") or "[]")}
+    changes, watermark = read_changes(pg_conn, watermark, applied, "table_name, op, row_key, row_data", SYNC_BATCH)
+    pg_conn.rollback()
+    for change in changes:
+        table, row_key, row_data = change["table_name"], change["row_key"], change["row_data"]
+        applied[change["id"]] = change["xact_id"]
+        if table not in keys:
+            continue
+        if change["op"] == "truncate":
+            conn.execute(f"DELETE FROM {table}")
+        elif change["op"] == "delete":
+            conn.execute(f"DELETE FROM {table} WHERE {keys[table]} = ?", (row_key,))
+        else:
+            columns = list(registry["tables"][table]["columns"])
+            conn.execute(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [_to_sqlite(row_data.get(c)) for c in columns],
+            )
+
+    _set_feed_state(conn, watermark, {i: x for i, x in applied.items() if x >= watermark})
+    conn.commit()
+    return {"mode": "incremental", "changes": len(changes), "watermark": watermark}
+
+
+def _to_sqlite(value: Any) -> Any:
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return float(value)  # Decimal
+
+
+# -----------------------------
+# Dialect translation
+# -----------------------------
+
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_CALL_RE = re.compile(r"\b(extract|date_trunc|to_char|now)\s*\(", re.IGNORECASE)
+_CAST_RE = re.compile(r"\s*::\s*(\w+)(?:\s*\(\s*\d+\s*(?:,\s*\d+\s*)?\))?", re.IGNORECASE)
+_TYPED_LITERAL_RE = re.compile(r"\b(?:date|timestamp|timestamptz)\s+('(?:[^']|'')*')", re.IGNORECASE)
+_ILIKE_RE = re.compile(r"([\w.]+)\s+(not\s+)?ilike\s+('(?:[^']|'')*')", re.IGNORECASE)
+_INTERVAL_RE = re.compile(
+    r"(current_date|current_timestamp|datetime\('now'\)|[\w.]+|'[^']*')\s*([+-])\s*interval\s*"
+    r"'\s*(\d+)\s*(day|days|week|weeks|month|months|year|years)\s*'",
+    re.IGNORECASE,
+)
+
+_EXTRACT = {
+    "year": "CAST(strftime('%Y', {x}) AS INTEGER)",
+    "month": "CAST(strftime('%m', {x}) AS INTEGER)",
+    "day": "CAST(strftime('%d', {x}) AS INTEGER)",
+    "quarter": "((CAST(strftime('%m', {x}) AS INTEGER) + 2) / 3)",
+    "dow": "CAST(strftime('%w', {x}) AS INTEGER)",
+    "isodow": "((CAST(strftime('%w', {x}) AS INTEGER) + 6) % 7 + 1)",
+    "doy": "CAST(strftime('%j', {x}) AS INTEGER)",
+    # ISO week: the week of the year that holds this week's Thursday.
+    "week": "((CAST(strftime('%j', date({x}, '-' || ((CAST(strftime('%w', {x}) AS INTEGER) + 6) % 7) || ' days', "
+            "'+3 days')) AS INTEGER) + 6) / 7)",
+    "hour": "CAST(strftime('%H', {x}) AS INTEGER)",
+    "epoch": "CAST(strftime('%s', {x}) AS INTEGER)",
+}
+
+_DATE_TRUNC = {
+    "day": "date({x})",
+    "week": "date({x}, '-' || ((CAST(strftime('%w', {x}) AS INTEGER) + 6) % 7) || ' days')",
+    "month": "date({x}, 'start of month')",
+    "quarter": "date({x}, 'start of month', '-' || ((CAST(strftime('%m', {x}) AS INTEGER) - 1) % 3) || ' months')",
+    "year": "date({x}, 'start of year')",
+}
+
+_TO_CHAR = [("YYYY", "%Y"), ("HH24", "%H"), ("MM", "%m"), ("DD", "%d"), ("MI", "%M"), ("SS", "%S")]
+
+_CASTS = {
+    "date": "date({x})",
+    "timestamp": "datetime({x})",
+    "timestamptz": "datetime({x})",
+    "int": "CAST({x} AS INTEGER)",
+    "integer": "CAST({x} AS INTEGER)",
+    "bigint": "CAST({x} AS INTEGER)",
+    "numeric": "CAST({x} AS REAL)",
+    "decimal": "CAST({x} AS REAL)",
+    "float": "CAST({x} AS REAL)",
+    "real": "CAST({x} AS REAL)",
+    "text": "CAST({x} AS TEXT)",
+    "varchar": "CAST({x} AS TEXT)",
+}
+
+
+def _mask_literals(text: str) -> str:
+    return _LITERAL_RE.sub(lambda m: "'" + " " * (len(m.group(0)) - 2) + "'", text)
+
+
+def _closing_paren(masked: str, open_pos: int) -> int:
+    depth = 0
+    for i in range(open_pos, len(masked)):
+        if masked[i] == "(":
+            depth += 1
+        elif masked[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    raise TranslationError("unbalanced parentheses")
+
+
+def _sub_outside_literals(pattern: re.Pattern, repl: Callable[[re.Match], str], text: str) -> str:
+    """
+    re.sub() that skips matches starting inside a string literal.
+    """
+    literals = [m.span() for m in _LITERAL_RE.finditer(text)]
+    in_literal = lambda pos: any(a < pos < b for a, b in literals)
+    return pattern.sub(lambda m: m.group(0) if in_literal(m.start()) else repl(m), text)
+
+
+def translate_sql(sql: str) -> str:
+    """
+    Rewrite Postgres-dialect SQL (the validator subset) for SQLite.
+    Raises TranslationError for constructs it cannot map.
+    """
+    sql = _translate_calls(sql)
+    sql = _translate_casts(sql)
+    sql = _sub_outside_literals(_TYPED_LITERAL_RE, lambda m: m.group(1), sql)
+    sql = _sub_outside_literals(_INTERVAL_RE, _interval, sql)
+    sql = _sub_outside_literals(
+        _ILIKE_RE, lambda m: f"lower({m.group(1)}) {m.group(2) or ''}LIKE lower({m.group(3)})", sql
+    )
+    if re.search(r"\b(ilike|interval|date_trunc|extract)\b|::", _mask_literals(sql), re.IGNORECASE):
+        raise TranslationError("unsupported Postgres syntax left after translation")
+    return sql
+
+
+def _translate_calls(sql: str) -> str:
+    masked = _mask_literals(sql)
+    m = _CALL_RE.search(masked)
+    if m is None:
+        return sql
+    open_pos = m.end() - 1
+    close_pos = _closing_paren(masked, open_pos)
+    inner = _translate_calls(sql[open_pos + 1:close_pos])
+    replacement = _call(m.group(1).lower(), inner)
+    return sql[:m.start()] + replacement + _translate_calls(sql[close_pos + 1:])
+
+
+def _call(name: str, inner: str) -> str:
+    if name == "now":
+        return "datetime('now')"
+    if name == "extract":
+        m = re.match(r"^\s*(\w+)\s+from\s+(.+)$", inner, re.IGNORECASE | re.DOTALL)
+        if not m or m.group(1).lower() not in _EXTRACT:
+            raise TranslationError(f"EXTRACT({inner})")
+        return _EXTRACT[m.group(1).lower()].format(x=m.group(2).strip())
+    args = split_top_level(inner)
+    if name == "date_trunc":
+        unit = args[0].strip().strip("'").lower() if len(args) == 2 else None
+        if unit not in _DATE_TRUNC:
+            raise TranslationError(f"DATE_TRUNC({inner})")
+        return _DATE_TRUNC[unit].format(x=args[1].strip())
+    # to_char
+    if len(args) != 2 or not _LITERAL_RE.fullmatch(args[1].strip()):
+        raise TranslationError(f"TO_CHAR({inner})")
+    fmt = args[1].strip()[1:-1]
+    for pg, lite in _TO_CHAR:
+        fmt = fmt.replace(pg, lite)
+    if re.search(r"[A-Za-z]", re.sub(r"%[YmdHMS]", "", fmt)):
+        raise TranslationError(f"TO_CHAR format {args[1].strip()}")
+    return f"strftime('{fmt}', {args[0].strip()})"
+
+
+def _translate_casts(sql: str) -> str:
+    """
+    x::type -> CAST / date(); x is a literal, an identifier or a (...) group.
+    """
+    while True:
+        masked = _mask_literals(sql)
+        m = _CAST_RE.search(masked)
+        if m is None:
+            return sql
+        type_name = m.group(1).lower()
+        if type_name not in _CASTS:
+            raise TranslationError(f"cast to {type_name}")
+        end = m.start()
+        if masked[end - 1] == ")":
+            depth, start = 0, end - 1
+            while start >= 0:
+                depth += {")": 1, "(": -1}.get(masked[start], 0)
+                if depth == 0:
+                    break
+                start -= 1
+            # include a function name directly before the parenthesis
+            while start > 0 and (masked[start - 1].isalnum() or masked[start - 1] == "_"):
+                start -= 1
+        else:
+            operand = re.search(r"('[^']*'|[\w.]+)$", masked[:end])
+            if operand is None:
+                raise TranslationError("cast operand")
+            start = operand.start()
+        sql = sql[:start] + _CASTS[type_name].format(x=sql[start:end]) + sql[m.end():]
+
+
+def _interval(m: re.Match) -> str:
+    base, sign, n, unit = m.group(1), m.group(2), int(m.group(3)), m.group(4).lower().rstrip("s")
+    if unit == "week":
+        n, unit = n * 7, "day"
+    fn = "datetime" if base.lower() in ("current_timestamp", "datetime('now')") else "date"
+    if base.lower() == "datetime('now')":
+        base = "'now'"
+    return f"{fn}({base}, '{sign}{n} {unit}s')"
+
+
+# -----------------------------
+# Execution
+# -----------------------------
+
+def mirror_available(path: Optional[Path] = None) -> bool:
+    return Path(path or SQLITE_MIRROR_PATH).exists()
+
+
+def connect_mirror(path: Optional[Path] = None, read_only: bool = True) -> sqlite3.Connection:
+    path = Path(path or SQLITE_MIRROR_PATH)
+    if read_only:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(path)
+    conn.execute("PRAGMA case_sensitive_like = ON")
+    return conn
+
+
+def execute_on_mirror(sql: str, path: Optional[Path] = None):
+    """
+    Translate and run a validated query on the mirror.
+    Returns list of dicts, or {"error": "..."} on failure (with
+    "translated_sql" when the SQL was translated).
+    """
+    try:
+        translated = translate_sql(sql)
+    except TranslationError as e:
+        return {"error": f"Cannot run on the SQLite mirror: {e}"}
+    try:
+        conn = connect_mirror(path)
+    except sqlite3.Error as e:
+        return {"error": f"SQLite mirror unavailable: {e}"}
+    try:
+        cur = conn.execute(translated)
+        names = _output_names(sql, [d[0] for d in cur.description])
+        return [dict(zip(names, row)) for row in cur.fetchall()]
+    except sqlite3.Error as e:
+        return {"error": f"SQLite: {e}", "translated_sql": translated}
+    finally:
+        conn.close()
+
+
+def _output_names(sql: str, names: List[str]) -> List[str]:
+    """
+    SQLite names unaliased expressions by their text ("COUNT(*)"); use the
+    name Postgres would give ("count") where the query shape knows it.
+    """
+    shape = parse_query(sql)
+    if shape is None or len(shape["select"]) != len(names):
+        return names
+    return [item["name"] if item["name"] != "?column?" else name for item, name in zip(shape["select"], names)]
@@ -0,0 +1,94 @@
+"""
+SQL fingerprinting.
+
+Two queries that differ only in literal values (dates, ids, numbers) or in
+whitespace / keyword case get the same fingerprint, so logs, traces and
+caches can group them by "query shape".
+
+    SELECT SUM(volume) FROM deal_event WHERE direction = 'buy'
+    select sum(volume)  from deal_event where direction='sell'
+        -> same fingerprint
+"""
+
+import hashlib
+import re
+from typing import Set
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+_PUNCT_SPACING = re.compile(r"\s*([(),=<>])\s*")
+_POSITION_CLAUSE = re.compile(r"\b(?:group|order)\s+by\b", re.IGNORECASE)
+_CLAUSE_END = re.compile(r"\b(?:order|having|limit|offset|window|union|intersect|except|fetch|for)\b", re.IGNORECASE)
+_POSITION_ITEM = re.compile(r"\s*(\d+)(?:\s+(?:asc|desc))?(?:\s+nulls\s+(?:first|last))?\s*$", re.IGNORECASE)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Collapse whitespace and lowercase everything outside string literals.
+    Literal values (whitespace included) are kept, so this is safe to use
+    as an exact cache key.
+    """
+    out = []
+    last = 0
+    for m in _STRING_LITERAL.finditer(sql):
+        out.append(_WHITESPACE.sub(" ", sql[last:m.start()].lower()))
+        out.append(m.group(0))
+        last = m.end()
+    out.append(_WHITESPACE.sub(" ", sql[last:].lower()))
+    text = "".join(out)
+    text = text.strip().rstrip(";").strip()
+    return text
+
+
+def _positions(text: str) -> Set[int]:
+    """
+    Offsets of GROUP BY / ORDER BY column positions (ORDER BY 1): those
+    numbers refer to output columns, they are not literals.
+    """
+    starts: Set[int] = set()
+    for m in _POSITION_CLAUSE.finditer(text):
+        i = item = m.end()
+        depth = 0
+        while True:
+            end = i >= len(text)
+            if not end:
+                ch = text[i]
+                if ch == "(":
+                    depth += 1
+                elif ch == ")" and depth:
+                    depth -= 1
+                elif depth == 0:
+                    end = ch in ");" or _CLAUSE_END.match(text, i) is not None
+            if end or (depth == 0 and text[i] == ","):
+                position = _POSITION_ITEM.match(text, item, i)
+                if position:
+                    starts.add(position.start(1))
+                item = i + 1
+            if end:
+                break
+            i += 1
+    return starts
+
+
+def query_shape(sql: str) -> str:
+    """
+    Normalized SQL with every literal replaced by '?'.
+    IN-lists collapse to a single placeholder: IN (?, ?, ?) -> IN (?).
+    GROUP BY / ORDER BY positions are kept.
+    """
+    text = _STRING_LITERAL.sub("?", sql)
+    positions = _positions(text)
+    text = _NUMBER_LITERAL.sub(lambda m: m.group(0) if m.start() in positions else "?", text)
+    text = _WHITESPACE.sub(" ", text).strip().rstrip(";").strip().lower()
+    text = _PUNCT_SPACING.sub(r"\1", text)
+    text = _IN_LIST.sub("(?)", text)
+    return text
+
+
+def sql_fingerprint(sql: str) -> str:
+    """
+    Short stable hash of query_shape(sql).
+    """
+    return hashlib.sha1(query_shape(sql).encode("utf-8")).hexdigest()[:16]
@@ -0,0 +1,515 @@
+"""
+Query shape parser for the Validator v1 SELECT subset.
+
+Turns an already-validated query of the form
+
+    SELECT ... FROM t [JOIN t2 ON a.x = b.y ...] [WHERE ...]
+    [GROUP BY ...] [HAVING ...] [ORDER BY ...] [LIMIT n] [OFFSET n]
+
+into a plain dict describing its shape (tables, select items, aggregates,
+filters, grouping, ordering). Downstream stages (rollup rewrite, local
+engines, routing, caches) use it to decide whether they can serve a query.
+
+Like the validator, this is intentionally conservative and is NOT a full SQL
+parser. Anything it does not understand is kept as raw text and marked with
+kind "other" (expressions) or `where_supported = False` (filters), so callers
+can simply refuse such queries and let Postgres handle them.
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.validator.fingerprint import normalize_sql
+
+AGGREGATES = ("sum", "avg", "min", "max", "count")
+
+_CLAUSES = ("select", "from", "where", "group by", "having", "order by", "limit", "offset")
+_CLAUSE_RE = re.compile(r"\b(select|from|where|group\s+by|having|order\s+by|limit|offset)\b")
+_JOIN_RE = re.compile(r"\b((?:inner\s+|left\s+(?:outer\s+)?|right\s+(?:outer\s+)?|full\s+(?:outer\s+)?|cross\s+)?join)\b")
+
+_IDENT = r"[a-z_][a-z0-9_]*"
+_COLUMN_RE = re.compile(rf"^(?:({_IDENT})\.)?({_IDENT})$")
+_AGG_RE = re.compile(r"^(sum|avg|min|max|count)\s*\((.*)\)$", re.DOTALL)
+_EXTRACT_RE = re.compile(rf"^extract\s*\(\s*({_IDENT})\s+from\s+(.+)\)$", re.DOTALL)
+_DATE_TRUNC_RE = re.compile(r"^date_trunc\s*\(\s*'(\w+)'\s*,\s*(.+)\)$", re.DOTALL)
+_NUMBER_RE = re.compile(r"^-?\d+(\.\d+)?$")
+_STRING_RE = re.compile(r"^'((?:[^']|'')*)'$")
+_TYPED_STRING_RE = re.compile(r"^(date|timestamp)\s+'((?:[^']|'')*)'$")
+_CAST_STRING_RE = re.compile(r"^'((?:[^']|'')*)'\s*::\s*(date|timestamp)$")
+_AS_ALIAS_RE = re.compile(rf"^(.*\S)\s+as\s+({_IDENT})$", re.DOTALL)
+_BARE_ALIAS_RE = re.compile(rf"^(.*[\w)'])\s+({_IDENT})$", re.DOTALL)
+_COMPARE_RE = re.compile(r"^(.+?)\s*(<=|>=|<>|!=|=|<|>)\s*(.+)$", re.DOTALL)
+
+_KEYWORDS = {
+    "select", "from", "where", "group", "by", "having", "order", "limit", "offset",
+    "and", "or", "not", "in", "between", "is", "null", "like", "ilike", "asc", "desc",
+    "distinct", "join", "on", "as", "true", "false", "nulls", "first", "last",
+}
+
+_FLIP = {"<": ">", ">": "<", "<=": ">=", ">=": "<=", "=": "=", "<>": "<>", "!=": "!="}
+
+
+# -----------------------------
+# Low-level text helpers
+# -----------------------------
+
+def _mask(sql: str) -> str:
+    """
+    Same length as sql, but with string-literal contents and anything inside
+    parentheses replaced by spaces, so regexes only see top-level text.
+    Quotes and the outermost parentheses themselves are kept.
+    """
+    out = []
+    depth = 0
+    in_str = False
+    i = 0
+    while i < len(sql):
+        ch = sql[i]
+        if in_str:
+            if ch == "'" and i + 1 < len(sql) and sql[i + 1] == "'":
+                out.append("  ")
+                i += 2
+                continue
+            if ch == "'":
+                in_str = False
+                out.append("'" if depth == 0 else " ")
+            else:
+                out.append(" ")
+        elif ch == "'":
+            in_str = True
+            out.append("'" if depth == 0 else " ")
+        elif ch == "(":
+            out.append("(" if depth == 0 else " ")
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            out.append(")" if depth == 0 else " ")
+        else:
+            out.append(" " if depth > 0 else ch)
+        i += 1
+    return "".join(out)
+
+
+def split_top_level(text: str, sep: str = ",") -> List[str]:
+    """
+    Split on a separator that is outside parentheses and string literals.
+    """
+    masked = _mask(text)
+    parts, last = [], 0
+    for i, ch in enumerate(masked):
+        if ch == sep:
+            parts.append(text[last:i].strip())
+            last = i + 1
+    parts.append(text[last:].strip())
+    return [p for p in parts if p]
+
+
+def _split_keyword(text: str, pattern: re.Pattern) -> List[Tuple[Optional[str], str]]:
+    """
+    Split text at top-level keyword matches: [(keyword or None, chunk), ...].
+    """
+    masked = _mask(text)
+    pieces: List[Tuple[Optional[str], str]] = []
+    last, last_kw = 0, None
+    for m in pattern.finditer(masked):
+        pieces.append((last_kw, text[last:m.start()].strip()))
+        last_kw = re.sub(r"\s+", " ", m.group(1))
+        last = m.end()
+    pieces.append((last_kw, text[last:].strip()))
+    return pieces
+
+
+def replace_identifier(text: str, old: str, new: str) -> str:
+    """
+    Replace a table/column identifier outside string literals,
+    e.g. replace_identifier(sql, "deal_event", "deal_event_rollup_day").
+    """
+    masked = _mask_strings(text)
+    out, last = [], 0
+    for m in re.finditer(rf"\b{re.escape(old)}\b", masked):
+        out.append(text[last:m.start()])
+        out.append(new)
+        last = m.end()
+    out.append(text[last:])
+    return "".join(out)
+
+
+def _balanced(text: str) -> bool:
+    depth = 0
+    for ch in _mask_strings(text):
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth < 0:
+                return False
+    return depth == 0
+
+
+def _mask_strings(text: str) -> str:
+    return re.sub(r"'(?:[^']|'')*'", lambda m: "'" + " " * (len(m.group(0)) - 2) + "'", text)
+
+
+# -----------------------------
+# Expressions
+# -----------------------------
+
+def parse_literal(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse a literal value. Returns {"kind": "literal", "value": ..., "type": ...}
+    or None if text is not a literal.
+    """
+    text = text.strip()
+    if _NUMBER_RE.match(text):
+        value = float(text) if "." in text else int(text)
+        return {"kind": "literal", "value": value, "type": "number", "text": text}
+    m = _STRING_RE.match(text)
+    if m:
+        return {"kind": "literal", "value": m.group(1).replace("''", "'"), "type": "string", "text": text}
+    m = _TYPED_STRING_RE.match(text)
+    if m:
+        return {"kind": "literal", "value": m.group(2).replace("''", "'"), "type": m.group(1), "text": text}
+    m = _CAST_STRING_RE.match(text)
+    if m:
+        return {"kind": "literal", "value": m.group(1).replace("''", "'"), "type": m.group(2), "text": text}
+    if text in ("true", "false"):
+        return {"kind": "literal", "value": text == "true", "type": "boolean", "text": text}
+    if text == "null":
+        return {"kind": "literal", "value": None, "type": "null", "text": text}
+    return None
+
+
+def parse_expr(text: str) -> Dict[str, Any]:
+    """
+    Classify a (normalized, lowercase) expression.
+
+    kinds:
+      column     {"table", "column"}
+      agg        {"func", "arg" (expr or None for *), "distinct"}
+      extract    {"field", "arg"}
+      date_trunc {"unit", "arg"}
+      literal    {"value", "type"}
+      star       SELECT *
+      other      anything else (arithmetic, CASE, unknown functions...)
+    Every node keeps its source in "text".
+    """
+    text = text.strip()
+    while text.startswith("(") and text.endswith(")") and _balanced(text[1:-1]):
+        text = text[1:-1].strip()
+
+    if text == "*":
+        return {"kind": "star", "text": text}
+
+    lit = parse_literal(text)
+    if lit is not None:
+        return lit
+
+    m = _COLUMN_RE.match(text)
+    if m and m.group(2) not in _KEYWORDS:
+        return {"kind": "column", "table": m.group(1), "column": m.group(2), "text": text}
+
+    m = _AGG_RE.match(text)
+    if m and _balanced(m.group(2)):
+        inner = m.group(2).strip()
+        distinct = False
+        if inner.startswith("distinct "):
+            distinct = True
+            inner = inner[len("distinct "):].strip()
+        arg = None if inner == "*" else parse_expr(inner)
+        return {"kind": "agg", "func": m.group(1), "arg": arg, "distinct": distinct, "text": text}
+
+    m = _EXTRACT_RE.match(text)
+    if m and _balanced(m.group(2)):
+        return {"kind": "extract", "field": m.group(1), "arg": parse_expr(m.group(2)), "text": text}
+
+    m = _DATE_TRUNC_RE.match(text)
+    if m and _balanced(m.group(2)):
+        return {"kind": "date_trunc", "unit": m.group(1).lower(), "arg": parse_expr(m.group(2)), "text": text}
+
+    return {"kind": "other", "text": text}
+
+
+def expr_columns(expr: Optional[Dict[str, Any]]) -> List[Tuple[Optional[str], str]]:
+    """
+    (table, column) pairs referenced by a parsed expression.
+    For kind "other" the raw text is scanned for identifiers.
+    """
+    if expr is None:
+        return []
+    kind = expr["kind"]
+    if kind == "column":
+        return [(expr["table"], expr["column"])]
+    if kind in ("agg", "extract", "date_trunc"):
+        return expr_columns(expr.get("arg"))
+    if kind == "other":
+        found = []
+        for m in re.finditer(rf"\b(?:({_IDENT})\.)?({_IDENT})\b(?!\s*\()", _mask_strings(expr["text"])):
+            if m.group(2) not in _KEYWORDS and not m.group(2).isdigit():
+                found.append((m.group(1), m.group(2)))
+        return found
+    return []
+
+
+def contains_aggregate(expr: Dict[str, Any]) -> bool:
+    if expr["kind"] == "agg":
+        return True
+    if expr["kind"] == "other":
+        return bool(re.search(r"\b(sum|avg|min|max|count)\s*\(", expr["text"]))
+    return False
+
+
+# -----------------------------
+# WHERE predicates
+# -----------------------------
+
+def split_conjuncts(where: str) -> Optional[List[str]]:
+    """
+    Split a WHERE clause on top-level AND. Returns None when the clause has
+    a top-level OR / NOT (not a plain conjunction).
+    """
+    masked = _mask(where)
+    if re.search(r"\bor\b", masked) or re.match(r"^\s*not\b", masked):
+        return None
+
+    parts, last = [], 0
+    pending_between = False
+    for m in re.finditer(r"\b(between|and)\b", masked):
+        if m.group(1) == "between":
+            pending_between = True
+            continue
+        if pending_between:
+            pending_between = False
+            continue
+        parts.append(where[last:m.start()].strip())
+        last = m.end()
+    parts.append(where[last:].strip())
+    return [p for p in parts if p]
+
+
+def parse_predicate(text: str) -> Dict[str, Any]:
+    """
+    Parse one conjunct into {"expr", "op", "value"/"values"/"low"/"high"}.
+    Unsupported shapes come back as {"op": "other", "text": ...}.
+    """
+    text = text.strip()
+    while text.startswith("(") and text.endswith(")") and _balanced(text[1:-1]):
+        text = text[1:-1].strip()
+    masked = _mask(text)
+
+    m = re.match(r"^(.+?)\s+is\s+(not\s+)?null$", masked)
+    if m:
+        return {"expr": parse_expr(text[:m.end(1)]), "op": "is not null" if m.group(2) else "is null", "text": text}
+
+    m = re.match(r"^(.+?)\s+between\s+(.+?)\s+and\s+(.+)$", masked)
+    if m:
+        low = parse_literal(text[m.start(2):m.end(2)])
+        high = parse_literal(text[m.start(3):m.end(3)])
+        if low and high:
+            return {"expr": parse_expr(text[:m.end(1)]), "op": "between",
+                    "low": low, "high": high, "text": text}
+
+    m = re.match(r"^(.+?)\s+(not\s+)?in\s*\((.*)\)$", text, re.DOTALL)
+    if m and _balanced(m.group(1)) and _balanced(m.group(3)):
+        values = [parse_literal(v) for v in split_top_level(m.group(3))]
+        if values and all(values):
+            return {"expr": parse_expr(m.group(1)), "op": "not in" if m.group(2) else "in",
+                    "values": values, "text": text}
+
+    m = re.match(r"^(.+?)\s+(not\s+)?(i?like)\s+(.+)$", masked)
+    if m:
+        value = parse_literal(text[m.start(4):])
+        if value:
+            op = ("not " if m.group(2) else "") + m.group(3)
+            return {"expr": parse_expr(text[:m.end(1)]), "op": op, "value": value, "text": text}
+
+    m = _COMPARE_RE.match(masked)
+    if m:
+        lhs, op, rhs = text[:m.end(1)], m.group(2), text[m.start(3):]
+        value = parse_literal(rhs)
+        if value is not None:
+            return {"expr": parse_expr(lhs), "op": "<>" if op == "!=" else op, "value": value, "text": text}
+        value = parse_literal(lhs)
+        if value is not None:
+            flipped = _FLIP[op]
+            return {"expr": parse_expr(rhs), "op": "<>" if flipped == "!=" else flipped,
+                    "value": value, "text": text}
+
+    return {"op": "other", "text": text}
+
+
+def _split_alias(item: str) -> Tuple[Optional[str], str]:
+    """
+    "sum(volume) as total" / "sum(volume) total" -> ("total", "sum(volume)").
+    A bare alias is only accepted after an expression we can classify.
+    """
+    masked = _mask(item)
+    m = _AS_ALIAS_RE.match(masked)
+    if m:
+        return m.group(2), item[:m.end(1)].strip()
+    m = _BARE_ALIAS_RE.match(masked)
+    if m and m.group(2) not in _KEYWORDS:
+        candidate = item[:m.end(1)].strip()
+        if parse_expr(candidate)["kind"] != "other":
+            return m.group(2), candidate
+    return None, item
+
+
+def parse_conjunction(text: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Parse "a AND b AND ..." (a WHERE or HAVING body) into predicates.
+    Returns None if it is not a plain conjunction of supported predicates.
+    """
+    conjuncts = split_conjuncts(text)
+    if conjuncts is None:
+        return None
+    predicates = [parse_predicate(c) for c in conjuncts]
+    if any(p["op"] == "other" for p in predicates):
+        return None
+    return predicates
+
+
+# -----------------------------
+# Entry point
+# -----------------------------
+
+def parse_query(sql: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse a validated SELECT into its shape. Returns None if the text does
+    not even split into the expected clauses.
+
+    Shape:
+      {
+        "sql": normalized sql,
+        "distinct": bool,
+        "select": [{"expr": {...}, "alias": str|None, "name": output column name, "text": str}],
+        "from": table,
+        "joins": [{"type": "join", "table": t, "on": "a.x = b.y", "left": (t, c), "right": (t, c)}],
+        "tables": [from, *join tables],
+        "where": raw text or None,
+        "predicates": [parsed conjuncts] (empty if no WHERE),
+        "where_supported": False if WHERE has OR/NOT or unparsed conjuncts,
+        "group_by": [expr],
+        "having": raw text or None,
+        "order_by": [{"expr": {...}, "desc": bool, "text": str}],
+        "limit": int|None,
+        "offset": int|None,
+        "has_aggregates": bool,
+      }
+    """
+    text = normalize_sql(sql)
+    pieces = _split_keyword(text, _CLAUSE_RE)
+    if pieces[0][1] != "" or len(pieces) < 3:
+        return None
+
+    clauses: Dict[str, str] = {}
+    for kw, chunk in pieces[1:]:
+        if kw in clauses:
+            return None
+        clauses[kw] = chunk
+    if list(clauses)[:2] != ["select", "from"]:
+        return None
+    order = [c for c in _CLAUSES if c in clauses]
+    if list(clauses) != order:
+        return None
+
+    # SELECT list
+    select_text = clauses["select"]
+    distinct = False
+    if select_text.startswith("distinct "):
+        distinct = True
+        select_text = select_text[len("distinct "):]
+
+    select = []
+    for item in split_top_level(select_text):
+        alias, expr_text = _split_alias(item)
+        expr = parse_expr(expr_text)
+        if alias is not None:
+            name = alias
+        elif expr["kind"] == "column":
+            name = expr["column"]
+        elif expr["kind"] in ("agg", "extract", "date_trunc"):
+            name = {"extract": "extract", "date_trunc": "date_trunc"}.get(expr["kind"], expr.get("func"))
+        else:
+            name = "?column?"
+        select.append({"expr": expr, "alias": alias, "name": name, "text": item})
+
+    # FROM / JOINs
+    from_pieces = _split_keyword(clauses["from"], _JOIN_RE)
+    base_table = from_pieces[0][1].strip()
+    if not re.match(rf"^{_IDENT}$", base_table):
+        return None
+    joins = []
+    for join_type, chunk in from_pieces[1:]:
+        m = re.match(rf"^({_IDENT})\s+on\s+(.+)$", chunk, re.DOTALL)
+        if not m:
+            return None
+        on = m.group(2).strip()
+        jm = re.match(rf"^({_IDENT})\.({_IDENT})\s*=\s*({_IDENT})\.({_IDENT})$", on)
+        joins.append({
+            "type": join_type,
+            "table": m.group(1),
+            "on": on,
+            "left": (jm.group(1), jm.group(2)) if jm else None,
+            "right": (jm.group(3), jm.group(4)) if jm else None,
+        })
+
+    # WHERE
+    where = clauses.get("where")
+    predicates: List[Dict[str, Any]] = []
+    where_supported = True
+    if where:
+        conjuncts = split_conjuncts(where)
+        if conjuncts is None:
+            where_supported = False
+        else:
+            predicates = [parse_predicate(c) for c in conjuncts]
+            where_supported = all(p["op"] != "other" for p in predicates)
+
+    group_by = [parse_expr(g) for g in split_top_level(clauses["group by"])] if "group by" in clauses else []
+
+    order_by = []
+    for item in split_top_level(clauses.get("order by", "")):
+        m = re.match(r"^(.*?)(?:\s+(asc|desc))?(?:\s+nulls\s+(first|last))?$", item, re.DOTALL)
+        order_by.append({
+            "expr": parse_expr(m.group(1)),
+            "desc": m.group(2) == "desc",
+            "nulls": m.group(3),
+            "text": item,
+        })
+
+    limit = offset = None
+    if "limit" in clauses:
+        if not clauses["limit"].isdigit():
+            return None
+        limit = int(clauses["limit"])
+    if "offset" in clauses:
+        if not clauses["offset"].isdigit():
+            return None
+        offset = int(clauses["offset"])
+
+    return {
+        "sql": text,
+        "distinct": distinct,
+        "select": select,
+        "from": base_table,
+        "joins": joins,
+        "tables": [base_table] + [j["table"] for j in joins],
+        "where": where,
+        "predicates": predicates,
+        "where_supported": where_supported,
+        "group_by": group_by,
+        "having": clauses.get("having"),
+        "order_by": order_by,
+        "limit": limit,
+        "offset": offset,
+        "has_aggregates": any(contains_aggregate(s["expr"]) for s in select),
+        "clauses": clauses,
+    }
+
+
+def render_clauses(clauses: Dict[str, str]) -> str:
+    """
+    Inverse of the clause split in parse_query: {"select": ..., "from": ...,
+    ...} back to SQL, clauses in SELECT order.
+    """
+    return " ".join(f"{kw} {clauses[kw]}" for kw in _CLAUSES if clauses.get(kw))
@@ -0,0 +1,273 @@
+"""
+deal_date predicates that partition pruning and the deal_date index can use.
+
+Postgres only prunes deal_event partitions (migrations/003) and only uses
+the deal_date index when the bare column is compared with constants. The
+LLM likes to write
+
+    WHERE EXTRACT(YEAR FROM deal_date) = 2024
+
+which reads every partition. rewrite_date_predicates() turns such WHERE
+conjuncts into half-open ranges on the column:
+
+    EXTRACT(YEAR FROM deal_date) = 2024
+        -> deal_date >= '2024-01-01' and deal_date < '2025-01-01'
+    EXTRACT(YEAR ...) with >=, >, <, <=, BETWEEN, IN (consecutive years)
+    EXTRACT(YEAR ...) = 2024 AND EXTRACT(MONTH | QUARTER ...) = n
+        -> that month / quarter
+    DATE_TRUNC('month' | 'quarter' | 'year', deal_date) = / >= / > / < / <=
+    / BETWEEN '2024-03-01'
+        -> the matching range
+
+For a date column the result is exactly equivalent. Only top-level AND
+conjuncts are touched; anything under OR / NOT is left alone, and so are
+DATE_TRUNC comparisons with a timestamp that is not midnight
+('2024-03-01 12:00' is not a day boundary).
+
+It also classifies the query's deal_date filter ("date_filter"):
+
+    sargable     deal_date is compared directly: partitions are pruned
+    rewritten    sargable after the rewrite
+    nonsargable  deal_date is only filtered through an expression the
+                 rewrite does not cover: every partition is scanned
+    none         no deal_date filter (a full scan is expected)
+
+Configuration (env):
+- SARGABLE_REWRITE_ENABLED  "true"/"false" (default true; when off the
+                            filter is still classified)
+"""
+
+import datetime as dt
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from backend.validator.query_shape import expr_columns, parse_predicate, parse_query, split_conjuncts
+
+SARGABLE_REWRITE_ENABLED = os.getenv("SARGABLE_REWRITE_ENABLED", "true").lower() == "true"
+
+DATE_TABLE = "deal_event"
+DATE_COLUMN = "deal_date"
+
+DIRECT_OPS = ("=", "<", "<=", ">", ">=", "between", "in")
+TRUNC_UNITS = ("month", "quarter", "year")
+
+# A day, optionally at exactly midnight (no time zone).
+_DAY_LITERAL = re.compile(r"^(\d{4}-\d{2}-\d{2})(?:[ T]00:00(?::00(?:\.0+)?)?)?$")
+
+
+# -----------------------------
+# Date arithmetic on truncation units
+# -----------------------------
+
+def _floor(day: dt.date, unit: str) -> dt.date:
+    if unit == "year":
+        return dt.date(day.year, 1, 1)
+    if unit == "quarter":
+        return dt.date(day.year, 3 * ((day.month - 1) // 3) + 1, 1)
+    return dt.date(day.year, day.month, 1)
+
+
+def _next(start: dt.date, unit: str) -> dt.date:
+    months = {"year": 12, "quarter": 3, "month": 1}[unit]
+    index = start.year * 12 + start.month - 1 + months
+    return dt.date(index // 12, index % 12 + 1, 1)
+
+
+def _ceil(day: dt.date, unit: str) -> dt.date:
+    start = _floor(day, unit)
+    return start if start == day else _next(start, unit)
+
+
+def _bounds(op: str, values: List[dt.date], unit: str) -> Optional[tuple]:
+    """
+    (low, high) for `date_trunc(unit, col) <op> values` as `col >= low and
+    col < high` (either may be None), or None if there is no such range.
+    """
+    if op == "=":
+        start = values[0]
+        return (start, _next(start, unit)) if _floor(start, unit) == start else None
+    if op == ">=":
+        return _ceil(values[0], unit), None
+    if op == ">":
+        return _next(_floor(values[0], unit), unit), None
+    if op == "<":
+        return None, _ceil(values[0], unit)
+    if op == "<=":
+        return None, _next(_floor(values[0], unit), unit)
+    if op == "between":
+        return _ceil(values[0], unit), _next(_floor(values[1], unit), unit)
+    if op == "in":
+        starts = sorted(set(values))
+        if any(_floor(s, unit) != s for s in starts):
+            return None
+        if any(_next(a, unit) != b for a, b in zip(starts, starts[1:])):
+            return None
+        return starts[0], _next(starts[-1], unit)
+    return None
+
+
+def _render(column: str, low: Optional[dt.date], high: Optional[dt.date]) -> str:
+    parts = []
+    if low is not None:
+        parts.append(f"{column} >= '{low.isoformat()}'")
+    if high is not None:
+        parts.append(f"{column} < '{high.isoformat()}'")
+    return " and ".join(parts)
+
+
+# -----------------------------
+# Predicates
+# -----------------------------
+
+def _is_date_column(expr: Optional[Dict[str, Any]]) -> bool:
+    return (expr is not None and expr["kind"] == "column" and expr["column"] == DATE_COLUMN
+            and expr["table"] in (None, DATE_TABLE))
+
+
+def _literals(pred: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if pred["op"] == "between":
+        return [pred["low"], pred["high"]]
+    if pred["op"] == "in":
+        return pred["values"]
+    return [pred["value"]] if "value" in pred else []
+
+
+def _as_date(literal: Dict[str, Any]) -> dt.date:
+    """
+    The day of a date literal, or of a string / timestamp literal at
+    midnight; ValueError for anything else (a time of day shifts the
+    bounds, so those comparisons are not rewritten).
+    """
+    if literal["type"] not in ("string", "date", "timestamp"):
+        raise ValueError(literal["text"])
+    text = str(literal["value"]).strip()
+    if literal["type"] == "date":
+        text = text[:10]  # DATE '2024-03-01 12:00' is that day
+    match = _DAY_LITERAL.match(text)
+    if match is None:
+        raise ValueError(literal["text"])
+    return dt.date.fromisoformat(match.group(1))
+
+
+def _as_year(literal: Dict[str, Any]) -> int:
+    if literal["type"] != "number" or not isinstance(literal["value"], int) or not 1 <= literal["value"] <= 9998:
+        raise ValueError(literal["text"])
+    return literal["value"]
+
+
+def _truncated(pred: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    {"unit", "op", "values", "column"} when the predicate compares a
+    truncation of deal_date (EXTRACT(YEAR), DATE_TRUNC) with constants.
+    """
+    expr = pred.get("expr")
+    if expr is None or pred["op"] not in DIRECT_OPS or not _is_date_column(expr.get("arg")):
+        return None
+    try:
+        if expr["kind"] == "extract" and expr["field"] == "year":
+            values = [dt.date(_as_year(v), 1, 1) for v in _literals(pred)]
+            return {"unit": "year", "op": pred["op"], "values": values, "column": expr["arg"]["text"]}
+        if expr["kind"] == "date_trunc" and expr["unit"] in TRUNC_UNITS:
+            values = [_as_date(v) for v in _literals(pred)]
+            return {"unit": expr["unit"], "op": pred["op"], "values": values, "column": expr["arg"]["text"]}
+    except ValueError:
+        return None
+    return None
+
+
+def _extract_eq(pred: Dict[str, Any], field: str) -> Optional[int]:
+    """
+    n for `EXTRACT(<field> FROM deal_date) = n`, else None.
+    """
+    expr = pred.get("expr")
+    if (expr is None or expr["kind"] != "extract" or expr["field"] != field or pred["op"] != "="
+            or not _is_date_column(expr["arg"]) or pred["value"]["type"] != "number"):
+        return None
+    value = pred["value"]["value"]
+    return value if isinstance(value, int) else None
+
+
+def _mentions_date(pred: Dict[str, Any]) -> bool:
+    expr = pred.get("expr")
+    if expr is None:
+        return DATE_COLUMN in pred["text"]
+    return any(c == DATE_COLUMN and t in (None, DATE_TABLE) for t, c in expr_columns(expr))
+
+
+# -----------------------------
+# Entry point
+# -----------------------------
+
+def rewrite_date_predicates(sql: str) -> Dict[str, Any]:
+    """
+    Returns:
+        {
+          "sql": sql to run (normalized when rewritten, else unchanged),
+          "date_filter": "sargable" | "rewritten" | "nonsargable" | "none",
+          "rewrites": [{"from": conjunct, "to": range}, ...],
+        }
+    """
+    result = {"sql": sql, "date_filter": "none", "rewrites": []}
+    shape = parse_query(sql)
+    if shape is None or DATE_TABLE not in shape["tables"] or not shape["where"]:
+        return result
+    conjuncts = split_conjuncts(shape["where"])
+    if conjuncts is None:
+        # OR / NOT at the top: only classify.
+        if DATE_COLUMN in shape["where"]:
+            result["date_filter"] = "nonsargable"
+        return result
+
+    predicates = [parse_predicate(c) for c in conjuncts]
+    texts = list(conjuncts)
+    rewrites: List[Dict[str, str]] = []
+
+    if SARGABLE_REWRITE_ENABLED:
+        # YEAR = y together with MONTH / QUARTER = n: one month / quarter.
+        years = [i for i, p in enumerate(predicates) if _extract_eq(p, "year") is not None]
+        for unit in ("month", "quarter"):
+            parts = [i for i, p in enumerate(predicates) if _extract_eq(p, unit) is not None]
+            if len(years) != 1 or len(parts) != 1 or texts[years[0]] != conjuncts[years[0]]:
+                continue
+            y, n = _extract_eq(predicates[years[0]], "year"), _extract_eq(predicates[parts[0]], unit)
+            month = n if unit == "month" else 3 * n - 2
+            if not (1 <= y <= 9998 and 1 <= month <= 12 and (unit == "month" or n <= 4)):
+                continue
+            start = dt.date(y, month, 1)
+            new = _render(predicates[years[0]]["expr"]["arg"]["text"], start, _next(start, unit))
+            rewrites.append({"from": f"{conjuncts[years[0]]} and {conjuncts[parts[0]]}", "to": new})
+            texts[years[0]], texts[parts[0]] = new, None
+
+        for i, pred in enumerate(predicates):
+            if texts[i] != conjuncts[i]:
+                continue
+            truncated = _truncated(pred)
+            if truncated is None:
+                continue
+            try:
+                bounds = _bounds(truncated["op"], truncated["values"], truncated["unit"])
+            except ValueError:  # past year 9999
+                bounds = None
+            if bounds is None:
+                continue
+            new = _render(truncated["column"], *bounds)
+            rewrites.append({"from": conjuncts[i], "to": new})
+            texts[i] = new
+
+    untouched = [p for p, t, c in zip(predicates, texts, conjuncts) if t == c]
+    direct = [_is_date_column(p.get("expr")) and p["op"] in DIRECT_OPS for p in untouched]
+    if rewrites:
+        result["date_filter"] = "rewritten"
+    elif any(direct):
+        result["date_filter"] = "sargable"
+    elif any(_mentions_date(p) for p in untouched):
+        result["date_filter"] = "nonsargable"
+    if not rewrites:
+        return result
+
+    clauses = dict(shape["clauses"])
+    clauses["where"] = " and ".join(t for t in texts if t is not None)
+    result["sql"] = " ".join(f"{kw} {text}" for kw, text in clauses.items())
+    result["rewrites"] = rewrites
+    return result
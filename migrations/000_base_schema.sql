@@ -0,0 +1,41 @@
+-- migrations/000_base_schema.sql
+--
+-- Tables as described in metadata/schema_registry.json.
+-- Supabase already has these; this file exists so a local / benchmark
+-- Postgres can be brought up with the same shape.
+-- Safe to re-run.
+
+CREATE TABLE IF NOT EXISTS ref_product (
+    product_id   text PRIMARY KEY,
+    product_name text NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ref_currency (
+    currency_id   text PRIMARY KEY,
+    currency_name text NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ref_counterparty (
+    counterparty_id   text PRIMARY KEY,
+    counterparty_name text NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ref_unit (
+    unit_id   text PRIMARY KEY,
+    unit_name text NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS deal_event (
+    deal_id          text PRIMARY KEY,
+    deal_date        date NOT NULL,
+    product_id       text NOT NULL REFERENCES ref_product (product_id),
+    volume           integer NOT NULL,
+    price_usd_per_mt numeric(10,2) NOT NULL,
+    counterparty_id  text NOT NULL REFERENCES ref_counterparty (counterparty_id),
+    currency_id      text NOT NULL REFERENCES ref_currency (currency_id),
+    unit_id          text NOT NULL REFERENCES ref_unit (unit_id),
+    direction        text NOT NULL,
+    note             text
+);
+
+CREATE INDEX IF NOT EXISTS deal_event_deal_date_idx ON deal_event (deal_date);
@@ -0,0 +1,212 @@
+-- migrations/001_deal_event_rollups.sql
+--
+-- Pre-aggregated copies of deal_event at day and month grain.
+--
+-- Both tables keep every deal_event dimension (date, product, counterparty,
+-- currency, unit, direction) and additive measures per group, so
+-- SUM / COUNT / AVG / MIN / MAX over those dimensions can be answered from
+-- them (see backend/sql_executor/rollups.py for the query rewrite).
+--
+-- In deal_event_rollup_month, deal_date holds the first day of the month.
+-- Keeping the column name lets the rewrite swap the table name only.
+--
+-- Maintenance:
+-- - INSERT on deal_event: statement-level trigger adds the new rows'
+--   aggregates into both rollups (one upsert per statement, so bulk
+--   loads / COPY stay cheap).
+-- - UPDATE / DELETE: affected days are recomputed from deal_event and
+--   their months from the day rollup (MIN/MAX cannot be "subtracted").
+-- - TRUNCATE: rollups are truncated too.
+-- - SELECT deal_event_rollup_refresh(); rebuilds everything, e.g. on a
+--   schedule (pg_cron) if the triggers are ever disabled for a load.
+--
+-- Safe to re-run.
+
+CREATE TABLE IF NOT EXISTS deal_event_rollup_day (
+    deal_date       date    NOT NULL,
+    product_id      text    NOT NULL,
+    counterparty_id text    NOT NULL,
+    currency_id     text    NOT NULL,
+    unit_id         text    NOT NULL,
+    direction       text    NOT NULL,
+    deal_count      bigint  NOT NULL,
+    volume_sum      bigint  NOT NULL,
+    volume_min      integer NOT NULL,
+    volume_max      integer NOT NULL,
+    price_sum       numeric NOT NULL,
+    price_min       numeric(10,2) NOT NULL,
+    price_max       numeric(10,2) NOT NULL,
+    PRIMARY KEY (deal_date, product_id, counterparty_id, currency_id, unit_id, direction)
+);
+
+CREATE TABLE IF NOT EXISTS deal_event_rollup_month (
+    deal_date       date    NOT NULL,  -- first day of the month
+    product_id      text    NOT NULL,
+    counterparty_id text    NOT NULL,
+    currency_id     text    NOT NULL,
+    unit_id         text    NOT NULL,
+    direction       text    NOT NULL,
+    deal_count      bigint  NOT NULL,
+    volume_sum      bigint  NOT NULL,
+    volume_min      integer NOT NULL,
+    volume_max      integer NOT NULL,
+    price_sum       numeric NOT NULL,
+    price_min       numeric(10,2) NOT NULL,
+    price_max       numeric(10,2) NOT NULL,
+    PRIMARY KEY (deal_date, product_id, counterparty_id, currency_id, unit_id, direction)
+);
+
+-- Rebuilding days reads deal_event by date.
+CREATE INDEX IF NOT EXISTS deal_event_deal_date_idx ON deal_event (deal_date);
+
+
+-- -----------------------------
+-- Recompute helpers
+-- -----------------------------
+
+CREATE OR REPLACE FUNCTION deal_event_rollup_rebuild_days(days date[])
+RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+    months date[];
+BEGIN
+    SELECT array_agg(DISTINCT date_trunc('month', d)::date) INTO months FROM unnest(days) AS d;
+
+    DELETE FROM deal_event_rollup_day WHERE deal_date = ANY (days);
+    INSERT INTO deal_event_rollup_day
+    SELECT deal_date, product_id, counterparty_id, currency_id, unit_id, direction,
+           count(*), sum(volume), min(volume), max(volume),
+           sum(price_usd_per_mt), min(price_usd_per_mt), max(price_usd_per_mt)
+    FROM deal_event
+    WHERE deal_date = ANY (days)
+    GROUP BY deal_date, product_id, counterparty_id, currency_id, unit_id, direction;
+
+    DELETE FROM deal_event_rollup_month WHERE deal_date = ANY (months);
+    INSERT INTO deal_event_rollup_month
+    SELECT m.month, d.product_id, d.counterparty_id, d.currency_id, d.unit_id, d.direction,
+           sum(d.deal_count), sum(d.volume_sum), min(d.volume_min), max(d.volume_max),
+           sum(d.price_sum), min(d.price_min), max(d.price_max)
+    FROM unnest(months) AS m (month)
+    JOIN deal_event_rollup_day d
+      ON d.deal_date >= m.month AND d.deal_date < (m.month + interval '1 month')::date
+    GROUP BY m.month, d.product_id, d.counterparty_id, d.currency_id, d.unit_id, d.direction;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION deal_event_rollup_refresh()
+RETURNS void LANGUAGE plpgsql AS $$
+BEGIN
+    TRUNCATE deal_event_rollup_day, deal_event_rollup_month;
+
+    INSERT INTO deal_event_rollup_day
+    SELECT deal_date, product_id, counterparty_id, currency_id, unit_id, direction,
+           count(*), sum(volume), min(volume), max(volume),
+           sum(price_usd_per_mt), min(price_usd_per_mt), max(price_usd_per_mt)
+    FROM deal_event
+    GROUP BY deal_date, product_id, counterparty_id, currency_id, unit_id, direction;
+
+    INSERT INTO deal_event_rollup_month
+    SELECT date_trunc('month', deal_date)::date, product_id, counterparty_id, currency_id, unit_id, direction,
+           sum(deal_count), sum(volume_sum), min(volume_min), max(volume_max),
+           sum(price_sum), min(price_min), max(price_max)
+    FROM deal_event_rollup_day
+    GROUP BY 1, product_id, counterparty_id, currency_id, unit_id, direction;
+
+    ANALYZE deal_event_rollup_day;
+    ANALYZE deal_event_rollup_month;
+END;
+$$;
+
+
+-- -----------------------------
+-- Trigger functions
+-- -----------------------------
+
+CREATE OR REPLACE FUNCTION deal_event_rollup_on_insert()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO deal_event_rollup_day AS r
+    SELECT deal_date, product_id, counterparty_id, currency_id, unit_id, direction,
+           count(*), sum(volume), min(volume), max(volume),
+           sum(price_usd_per_mt), min(price_usd_per_mt), max(price_usd_per_mt)
+    FROM new_rows
+    GROUP BY deal_date, product_id, counterparty_id, currency_id, unit_id, direction
+    ON CONFLICT (deal_date, product_id, counterparty_id, currency_id, unit_id, direction) DO UPDATE SET
+        deal_count = r.deal_count + EXCLUDED.deal_count,
+        volume_sum = r.volume_sum + EXCLUDED.volume_sum,
+        volume_min = LEAST(r.volume_min, EXCLUDED.volume_min),
+        volume_max = GREATEST(r.volume_max, EXCLUDED.volume_max),
+        price_sum  = r.price_sum + EXCLUDED.price_sum,
+        price_min  = LEAST(r.price_min, EXCLUDED.price_min),
+        price_max  = GREATEST(r.price_max, EXCLUDED.price_max);
+
+    INSERT INTO deal_event_rollup_month AS r
+    SELECT date_trunc('month', deal_date)::date, product_id, counterparty_id, currency_id, unit_id, direction,
+           count(*), sum(volume), min(volume), max(volume),
+           sum(price_usd_per_mt), min(price_usd_per_mt), max(price_usd_per_mt)
+    FROM new_rows
+    GROUP BY 1, product_id, counterparty_id, currency_id, unit_id, direction
+    ON CONFLICT (deal_date, product_id, counterparty_id, currency_id, unit_id, direction) DO UPDATE SET
+        deal_count = r.deal_count + EXCLUDED.deal_count,
+        volume_sum = r.volume_sum + EXCLUDED.volume_sum,
+        volume_min = LEAST(r.volume_min, EXCLUDED.volume_min),
+        volume_max = GREATEST(r.volume_max, EXCLUDED.volume_max),
+        price_sum  = r.price_sum + EXCLUDED.price_sum,
+        price_min  = LEAST(r.price_min, EXCLUDED.price_min),
+        price_max  = GREATEST(r.price_max, EXCLUDED.price_max);
+
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION deal_event_rollup_on_delete()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM deal_event_rollup_rebuild_days(ARRAY(SELECT DISTINCT deal_date FROM old_rows));
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION deal_event_rollup_on_update()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM deal_event_rollup_rebuild_days(ARRAY(
+        SELECT deal_date FROM old_rows UNION SELECT deal_date FROM new_rows
+    ));
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION deal_event_rollup_on_truncate()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    TRUNCATE deal_event_rollup_day, deal_event_rollup_month;
+    RETURN NULL;
+END;
+$$;
+
+-- Transition tables require one trigger per event.
+DROP TRIGGER IF EXISTS deal_event_rollup_insert ON deal_event;
+CREATE TRIGGER deal_event_rollup_insert
+    AFTER INSERT ON deal_event
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION deal_event_rollup_on_insert();
+
+DROP TRIGGER IF EXISTS deal_event_rollup_delete ON deal_event;
+CREATE TRIGGER deal_event_rollup_delete
+    AFTER DELETE ON deal_event
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION deal_event_rollup_on_delete();
+
+DROP TRIGGER IF EXISTS deal_event_rollup_update ON deal_event;
+CREATE TRIGGER deal_event_rollup_update
+    AFTER UPDATE ON deal_event
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION deal_event_rollup_on_update();
+
+DROP TRIGGER IF EXISTS deal_event_rollup_truncate ON deal_event;
+CREATE TRIGGER deal_event_rollup_truncate
+    AFTER TRUNCATE ON deal_event
+    FOR EACH STATEMENT EXECUTE FUNCTION deal_event_rollup_on_truncate();
+
+-- Initial fill for an existing deal_event.
+SELECT deal_event_rollup_refresh();
@@ -0,0 +1,145 @@
+-- migrations/002_change_feed.sql
+--
+-- Change feed for deal_event and the ref_* tables.
+--
+-- Every INSERT / UPDATE / DELETE / TRUNCATE appends the affected rows to
+-- change_feed (statement-level triggers with transition tables, so a bulk
+-- load is one INSERT ... SELECT, not one trigger call per row) and sends
+-- one NOTIFY on channel 'change_feed' per statement:
+--
+--     {"table": "deal_event", "op": "insert", "first_id": 812, "last_id": 1311, "rows": 500}
+--
+-- NOTIFY is delivered on commit and never for rolled-back work.
+-- Notifications can still be missed (listener reconnecting), so listeners
+-- also poll change_feed by its changed_at watermark; see
+-- backend/services/change_feed.py.
+--
+-- Rows:
+--   op = 'upsert'    row_data is the new row (INSERT, or UPDATE's new version)
+--   op = 'delete'    row_key was removed (DELETE, or UPDATE that changed the key)
+--   op = 'truncate'  the whole table was emptied
+--
+-- change_feed grows with every write; prune it on a schedule:
+--     SELECT change_feed_prune(interval '1 day');
+--
+-- Safe to re-run.
+
+CREATE TABLE IF NOT EXISTS change_feed (
+    id          bigserial   PRIMARY KEY,
+    changed_at  timestamptz NOT NULL DEFAULT now(),  -- writer's transaction start
+    table_name  text        NOT NULL,
+    op          text        NOT NULL,
+    row_key     text,
+    row_data    jsonb
+);
+
+CREATE INDEX IF NOT EXISTS change_feed_changed_at_idx ON change_feed (changed_at);
+
+
+-- -----------------------------
+-- Capture
+-- -----------------------------
+
+-- TG_ARGV[0]: primary key column of the table.
+CREATE OR REPLACE FUNCTION change_feed_capture()
+RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    key_col  text := TG_ARGV[0];
+    first_id bigint;
+    last_id  bigint;
+    n        bigint;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        WITH logged AS (
+            INSERT INTO change_feed (table_name, op, row_key, row_data)
+            SELECT TG_TABLE_NAME, 'upsert', r ->> key_col, r
+            FROM (SELECT to_jsonb(t) AS r FROM new_rows t) s
+            RETURNING id
+        )
+        SELECT min(id), max(id), count(*) INTO first_id, last_id, n FROM logged;
+
+    ELSIF TG_OP = 'UPDATE' THEN
+        WITH logged AS (
+            INSERT INTO change_feed (table_name, op, row_key, row_data)
+            SELECT TG_TABLE_NAME, 'delete', o.k, NULL
+            FROM (SELECT to_jsonb(t) ->> key_col AS k FROM old_rows t) o
+            WHERE o.k NOT IN (SELECT to_jsonb(t) ->> key_col FROM new_rows t)
+            UNION ALL
+            SELECT TG_TABLE_NAME, 'upsert', r ->> key_col, r
+            FROM (SELECT to_jsonb(t) AS r FROM new_rows t) s
+            RETURNING id
+        )
+        SELECT min(id), max(id), count(*) INTO first_id, last_id, n FROM logged;
+
+    ELSIF TG_OP = 'DELETE' THEN
+        WITH logged AS (
+            INSERT INTO change_feed (table_name, op, row_key, row_data)
+            SELECT TG_TABLE_NAME, 'delete', to_jsonb(t) ->> key_col, NULL FROM old_rows t
+            RETURNING id
+        )
+        SELECT min(id), max(id), count(*) INTO first_id, last_id, n FROM logged;
+
+    ELSE  -- TRUNCATE
+        INSERT INTO change_feed (table_name, op) VALUES (TG_TABLE_NAME, 'truncate')
+        RETURNING id, id, 1 INTO first_id, last_id, n;
+    END IF;
+
+    IF n > 0 THEN
+        PERFORM pg_notify('change_feed', json_build_object(
+            'table', TG_TABLE_NAME, 'op', lower(TG_OP),
+            'first_id', first_id, 'last_id', last_id, 'rows', n
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION change_feed_prune(keep interval DEFAULT interval '1 day')
+RETURNS bigint LANGUAGE sql AS $$
+    WITH gone AS (DELETE FROM change_feed WHERE changed_at < now() - keep RETURNING 1)
+    SELECT count(*) FROM gone;
+$$;
+
+
+-- -----------------------------
+-- Triggers (one per event: transition tables)
+-- -----------------------------
+
+DO $$
+DECLARE
+    t record;
+BEGIN
+    FOR t IN SELECT * FROM (VALUES
+        ('deal_event', 'deal_id'),
+        ('ref_product', 'product_id'),
+        ('ref_currency', 'currency_id'),
+        ('ref_counterparty', 'counterparty_id'),
+        ('ref_unit', 'unit_id')
+    ) AS v (tbl, key_col)
+    LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t.tbl || '_change_feed_insert', t.tbl);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER INSERT ON %I REFERENCING NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION change_feed_capture(%L)',
+            t.tbl || '_change_feed_insert', t.tbl, t.key_col);
+
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t.tbl || '_change_feed_update', t.tbl);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER UPDATE ON %I REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION change_feed_capture(%L)',
+            t.tbl || '_change_feed_update', t.tbl, t.key_col);
+
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t.tbl || '_change_feed_delete', t.tbl);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER DELETE ON %I REFERENCING OLD TABLE AS old_rows '
+            'FOR EACH STATEMENT EXECUTE FUNCTION change_feed_capture(%L)',
+            t.tbl || '_change_feed_delete', t.tbl, t.key_col);
+
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t.tbl || '_change_feed_truncate', t.tbl);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER TRUNCATE ON %I '
+            'FOR EACH STATEMENT EXECUTE FUNCTION change_feed_capture(%L)',
+            t.tbl || '_change_feed_truncate', t.tbl, t.key_col);
+    END LOOP;
+END;
+$$;
@@ -0,0 +1,173 @@
+-- migrations/003_deal_event_partitioning.sql
+--
+-- Range-partition deal_event by deal_date, one partition per month:
+--
+--     deal_event              partitioned parent (queries and writes go here)
+--       deal_event_p202401    [2024-01-01, 2024-02-01)
+--       deal_event_p202402    ...
+--       deal_event_default    anything without a monthly partition yet
+--
+-- Queries with a plain deal_date range (backend/validator/sargable.py turns
+-- EXTRACT(YEAR FROM deal_date) = 2024 into one) only read the partitions
+-- in range.
+--
+-- Conversion of an existing deal_event, in one transaction (deal_event is
+-- locked throughout; plan a maintenance window for large tables):
+--   1. the old table is renamed to deal_event_unpartitioned,
+--   2. the partitioned deal_event is created with monthly partitions from
+--      the oldest deal to DEAL_EVENT_PARTITIONS_AHEAD months past today,
+--   3. rows are copied over before any trigger exists, so the rollups
+--      (001) and the change feed (002) are not touched: they already
+--      describe these rows,
+--   4. foreign keys are added after the copy (one validation query each
+--      instead of a trigger call per row), then the rollup / change-feed
+--      triggers are recreated on the new table and the old one dropped.
+--
+-- The primary key becomes (deal_id, deal_date): a unique index on a
+-- partitioned table has to include the partition key, so Postgres no
+-- longer enforces deal_id alone. Everything downstream (ingest
+-- idempotency, the change feed, the in-memory snapshot, the SQLite mirror)
+-- still keys deals by deal_id; backend/services/ingest.py skips staged
+-- deal_ids that already exist, whatever their date, and migrations/006
+-- enforces deal_id uniqueness for every other writer (apply it after this
+-- one).
+--
+-- Future partitions: deal_event_ensure_partitions(from, to) creates the
+-- missing months (and moves matching rows out of the default partition).
+-- It is scheduled daily with pg_cron when that extension is installed;
+-- otherwise run `python -m backend.scripts.partitions --dsn ...` from cron.
+--
+-- Safe to re-run: the conversion is skipped once deal_event is partitioned.
+
+-- -----------------------------
+-- Partition maintenance
+-- -----------------------------
+
+-- Creates the monthly partitions covering [from_date, to_date] that do not
+-- exist yet. Rows for those months already in deal_event_default are moved
+-- into the new partition first (attaching would fail otherwise); the move
+-- bypasses the parent's statement triggers, so rollups and change feed are
+-- untouched. Returns the number of partitions created.
+CREATE OR REPLACE FUNCTION deal_event_ensure_partitions(from_date date, to_date date)
+RETURNS integer LANGUAGE plpgsql AS $$
+DECLARE
+    month_start date := date_trunc('month', from_date)::date;
+    month_end   date;
+    part        text;
+    created     integer := 0;
+BEGIN
+    WHILE month_start <= to_date LOOP
+        month_end := (month_start + interval '1 month')::date;
+        part := 'deal_event_p' || to_char(month_start, 'YYYYMM');
+        IF to_regclass(part) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE deal_event INCLUDING DEFAULTS)', part);
+            -- Lets ATTACH skip its validation scan of the new partition.
+            EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I CHECK (deal_date >= %L AND deal_date < %L)',
+                           part, part || '_range', month_start, month_end);
+            IF to_regclass('deal_event_default') IS NOT NULL THEN
+                EXECUTE format(
+                    'WITH moved AS (DELETE FROM deal_event_default WHERE deal_date >= %L AND deal_date < %L RETURNING *) '
+                    'INSERT INTO %I SELECT * FROM moved',
+                    month_start, month_end, part);
+            END IF;
+            EXECUTE format('ALTER TABLE deal_event ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           part, month_start, month_end);
+            EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', part, part || '_range');
+            created := created + 1;
+        END IF;
+        month_start := month_end;
+    END LOOP;
+    RETURN created;
+END;
+$$;
+
+
+-- -----------------------------
+-- Conversion
+-- -----------------------------
+
+DO $$
+DECLARE
+    months_ahead constant integer := 3;  -- default of DEAL_EVENT_PARTITIONS_AHEAD (backend/scripts/partitions.py)
+    first_day date;
+    last_day  date;
+    pkey      text;
+    trg       record;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'deal_event'::regclass) = 'p' THEN
+        RAISE NOTICE 'deal_event is already partitioned';
+        RETURN;
+    END IF;
+
+    ALTER TABLE deal_event RENAME TO deal_event_unpartitioned;
+    -- Index-backed names must be free for the new table.
+    SELECT conname INTO pkey FROM pg_constraint
+    WHERE conrelid = 'deal_event_unpartitioned'::regclass AND contype = 'p';
+    IF pkey IS NOT NULL THEN
+        EXECUTE format('ALTER TABLE deal_event_unpartitioned RENAME CONSTRAINT %I TO deal_event_unpartitioned_pkey', pkey);
+    END IF;
+    ALTER INDEX IF EXISTS deal_event_deal_date_idx RENAME TO deal_event_unpartitioned_deal_date_idx;
+
+    CREATE TABLE deal_event (
+        deal_id          text NOT NULL,
+        deal_date        date NOT NULL,
+        product_id       text NOT NULL,
+        volume           integer NOT NULL,
+        price_usd_per_mt numeric(10,2) NOT NULL,
+        counterparty_id  text NOT NULL,
+        currency_id      text NOT NULL,
+        unit_id          text NOT NULL,
+        direction        text NOT NULL,
+        note             text,
+        PRIMARY KEY (deal_id, deal_date)
+    ) PARTITION BY RANGE (deal_date);
+    CREATE INDEX deal_event_deal_date_idx ON deal_event (deal_date);
+
+    SELECT min(deal_date), max(deal_date) INTO first_day, last_day FROM deal_event_unpartitioned;
+    PERFORM deal_event_ensure_partitions(
+        least(coalesce(first_day, current_date), current_date),
+        greatest(coalesce(last_day, current_date), (current_date + make_interval(months => months_ahead))::date)
+    );
+    CREATE TABLE deal_event_default PARTITION OF deal_event DEFAULT;
+
+    INSERT INTO deal_event (deal_id, deal_date, product_id, volume, price_usd_per_mt,
+                            counterparty_id, currency_id, unit_id, direction, note)
+    SELECT deal_id, deal_date, product_id, volume, price_usd_per_mt,
+           counterparty_id, currency_id, unit_id, direction, note
+    FROM deal_event_unpartitioned;
+
+    ALTER TABLE deal_event
+        ADD FOREIGN KEY (product_id) REFERENCES ref_product (product_id),
+        ADD FOREIGN KEY (counterparty_id) REFERENCES ref_counterparty (counterparty_id),
+        ADD FOREIGN KEY (currency_id) REFERENCES ref_currency (currency_id),
+        ADD FOREIGN KEY (unit_id) REFERENCES ref_unit (unit_id);
+
+    -- Rollup (001) and change-feed (002) triggers, if those were applied.
+    FOR trg IN
+        SELECT pg_get_triggerdef(oid) AS def
+        FROM pg_trigger
+        WHERE tgrelid = 'deal_event_unpartitioned'::regclass AND NOT tgisinternal
+    LOOP
+        EXECUTE regexp_replace(trg.def, ' ON (\S+\.)?deal_event_unpartitioned ', ' ON deal_event ');
+    END LOOP;
+
+    DROP TABLE deal_event_unpartitioned;
+    ANALYZE deal_event;
+END;
+$$;
+
+
+-- -----------------------------
+-- Schedule (pg_cron, when available)
+-- -----------------------------
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_cron') THEN
+        PERFORM cron.schedule(
+            'deal_event_partitions', '15 3 * * *',
+            $job$SELECT deal_event_ensure_partitions(current_date, (current_date + interval '3 months')::date)$job$
+        );
+    END IF;
+END;
+$$;
@@ -0,0 +1,83 @@
+-- migrations/004_change_feed_old_data.sql
+--
+-- Log the row as it was before an UPDATE or DELETE in change_feed.old_data
+-- (migrations/002), so consumers keyed on something other than row_key
+-- (e.g. the segment cache's months) can tell where a row moved from:
+--
+--   op = 'upsert'  from INSERT    old_data = '{}'
+--   op = 'upsert'  from UPDATE    old_data = the row before the update
+--   op = 'delete'                 old_data = the deleted row
+--   op = 'truncate'               old_data = NULL
+--
+-- Rows logged before this migration have old_data NULL; consumers treat
+-- that like a TRUNCATE (the old row is unknown).
+--
+-- Only replaces change_feed_capture(); the triggers of 002 (and those
+-- 003 recreates on the partitioned deal_event) call it by name.
+--
+-- Safe to re-run. Re-running 002 afterwards puts its capture function
+-- (without old_data) back; run 004 again after it.
+
+ALTER TABLE change_feed ADD COLUMN IF NOT EXISTS old_data jsonb;
+
+
+-- -----------------------------
+-- Capture
+-- -----------------------------
+
+-- TG_ARGV[0]: primary key column of the table.
+CREATE OR REPLACE FUNCTION change_feed_capture()
+RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    key_col  text := TG_ARGV[0];
+    first_id bigint;
+    last_id  bigint;
+    n        bigint;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        WITH logged AS (
+            INSERT INTO change_feed (table_name, op, row_key, row_data, old_data)
+            SELECT TG_TABLE_NAME, 'upsert', r ->> key_col, r, '{}'::jsonb
+            FROM (SELECT to_jsonb(t) AS r FROM new_rows t) s
+            RETURNING id
+        )
+        SELECT min(id), max(id), count(*) INTO first_id, last_id, n FROM logged;
+
+    ELSIF TG_OP = 'UPDATE' THEN
+        WITH old AS (
+            SELECT to_jsonb(t) AS r FROM old_rows t
+        ), logged AS (
+            INSERT INTO change_feed (table_name, op, row_key, row_data, old_data)
+            SELECT TG_TABLE_NAME, 'delete', o.r ->> key_col, NULL, o.r
+            FROM old o
+            WHERE o.r ->> key_col NOT IN (SELECT to_jsonb(t) ->> key_col FROM new_rows t)
+            UNION ALL
+            SELECT TG_TABLE_NAME, 'upsert', s.r ->> key_col, s.r, o.r
+            FROM (SELECT to_jsonb(t) AS r FROM new_rows t) s
+            LEFT JOIN old o ON o.r ->> key_col = s.r ->> key_col
+            RETURNING id
+        )
+        SELECT min(id), max(id), count(*) INTO first_id, last_id, n FROM logged;
+
+    ELSIF TG_OP = 'DELETE' THEN
+        WITH logged AS (
+            INSERT INTO change_feed (table_name, op, row_key, row_data, old_data)
+            SELECT TG_TABLE_NAME, 'delete', to_jsonb(t) ->> key_col, NULL, to_jsonb(t) FROM old_rows t
+            RETURNING id
+        )
+        SELECT min(id), max(id), count(*) INTO first_id, last_id, n FROM logged;
+
+    ELSE  -- TRUNCATE
+        INSERT INTO change_feed (table_name, op) VALUES (TG_TABLE_NAME, 'truncate')
+        RETURNING id, id, 1 INTO first_id, last_id, n;
+    END IF;
+
+    IF n > 0 THEN
+        PERFORM pg_notify('change_feed', json_build_object(
+            'table', TG_TABLE_NAME, 'op', lower(TG_OP),
+            'first_id', first_id, 'last_id', last_id, 'rows', n
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$;
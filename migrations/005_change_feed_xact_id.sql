@@ -0,0 +1,22 @@
+-- migrations/005_change_feed_xact_id.sql
+--
+-- Record the writing transaction's id on every change_feed row (migrations/002),
+-- so readers can follow the feed without missing late commits.
+--
+-- changed_at is the writer's transaction start and ids are handed out
+-- before commit, so neither tells a reader that nothing older is still
+-- to come: a COPY that commits ten minutes after it started appears
+-- behind rows already read. Transaction ids do: once a transaction id
+-- is below pg_snapshot_xmin(pg_current_snapshot()), that transaction has
+-- committed or rolled back. Readers (backend/services/change_feed.py,
+-- backend/sql_executor/sqlite_mirror.py) keep that xmin as their watermark
+-- and re-read rows with xact_id >= watermark, skipping ids they applied.
+--
+-- Needs Postgres 13+ (xid8). Rows logged before this migration get the
+-- migrating transaction's id.
+--
+-- Safe to re-run.
+
+ALTER TABLE change_feed ADD COLUMN IF NOT EXISTS xact_id xid8 NOT NULL DEFAULT pg_current_xact_id();
+
+CREATE INDEX IF NOT EXISTS change_feed_xact_id_idx ON change_feed (xact_id);
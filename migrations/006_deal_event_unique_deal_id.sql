@@ -0,0 +1,112 @@
+-- migrations/006_deal_event_unique_deal_id.sql
+--
+-- Enforce deal_id uniqueness on deal_event again.
+--
+-- The partitioned deal_event (003) has PRIMARY KEY (deal_id, deal_date):
+-- Postgres cannot enforce deal_id alone there, so a writer could insert
+-- a deal_id that already exists in another month. The change feed, the
+-- segment cache, the in-memory snapshot and ingest all key deals by
+-- deal_id. deal_event_key holds every deal_id under a primary key and is
+-- kept in step by statement triggers on deal_event: a statement that
+-- would duplicate a deal_id fails with a unique violation on
+-- deal_event_key_pkey, whichever month the other row is in.
+--
+-- The triggers are on the parent, like the rollup (001) and change-feed
+-- (002) triggers: writes must go through deal_event, not a partition.
+-- On an unpartitioned deal_event the primary key already enforces this;
+-- the key table is harmless there.
+--
+-- Applying it fails (and changes nothing) while deal_event holds
+-- duplicate deal_ids; the error lists a few.
+--
+-- Safe to re-run: the key table is refilled from deal_event.
+
+CREATE TABLE IF NOT EXISTS deal_event_key (
+    deal_id text PRIMARY KEY
+);
+
+
+-- -----------------------------
+-- Triggers
+-- -----------------------------
+
+CREATE OR REPLACE FUNCTION deal_event_key_on_insert()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO deal_event_key (deal_id) SELECT deal_id FROM new_rows;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION deal_event_key_on_delete()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    DELETE FROM deal_event_key k USING old_rows o WHERE k.deal_id = o.deal_id;
+    RETURN NULL;
+END;
+$$;
+
+-- Only rows whose deal_id changed touch the key table.
+CREATE OR REPLACE FUNCTION deal_event_key_on_update()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    DELETE FROM deal_event_key k
+    USING (SELECT deal_id FROM old_rows EXCEPT ALL SELECT deal_id FROM new_rows) o
+    WHERE k.deal_id = o.deal_id;
+    INSERT INTO deal_event_key (deal_id)
+    SELECT deal_id FROM new_rows EXCEPT ALL SELECT deal_id FROM old_rows;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION deal_event_key_on_truncate()
+RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    TRUNCATE deal_event_key;
+    RETURN NULL;
+END;
+$$;
+
+-- Transition tables require one trigger per event.
+DROP TRIGGER IF EXISTS deal_event_key_insert ON deal_event;
+CREATE TRIGGER deal_event_key_insert
+    AFTER INSERT ON deal_event
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION deal_event_key_on_insert();
+
+DROP TRIGGER IF EXISTS deal_event_key_delete ON deal_event;
+CREATE TRIGGER deal_event_key_delete
+    AFTER DELETE ON deal_event
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION deal_event_key_on_delete();
+
+DROP TRIGGER IF EXISTS deal_event_key_update ON deal_event;
+CREATE TRIGGER deal_event_key_update
+    AFTER UPDATE ON deal_event
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION deal_event_key_on_update();
+
+DROP TRIGGER IF EXISTS deal_event_key_truncate ON deal_event;
+CREATE TRIGGER deal_event_key_truncate
+    AFTER TRUNCATE ON deal_event
+    FOR EACH STATEMENT EXECUTE FUNCTION deal_event_key_on_truncate();
+
+
+-- -----------------------------
+-- Initial fill
+-- -----------------------------
+
+DO $$
+DECLARE
+    duplicates text;
+BEGIN
+    LOCK TABLE deal_event IN SHARE MODE;  -- no writes between the check and the fill
+    SELECT string_agg(deal_id, ', ') INTO duplicates
+    FROM (SELECT deal_id FROM deal_event GROUP BY deal_id HAVING count(*) > 1 ORDER BY deal_id LIMIT 10) d;
+    IF duplicates IS NOT NULL THEN
+        RAISE EXCEPTION 'deal_event has duplicate deal_ids (e.g. %); remove them and re-run', duplicates;
+    END IF;
+    TRUNCATE deal_event_key;
+    INSERT INTO deal_event_key (deal_id) SELECT deal_id FROM deal_event;
+END;
+$$;
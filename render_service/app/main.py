@@ -1,16 +1,52 @@
 # render_service/app/main.py
 
+import asyncio
+import contextvars
+import gzip
+import hmac
+import io
+import json
 import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+import anyio
+from fastapi import FastAPI, Header, Request, Response
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
 
-from backend.services.chat_handler import handle_question
+from backend.services.chat_handler import check_sql, handle_question
+from backend.services import metrics, profiler, tracing
+from backend.services.metrics import RequestTimer
+from backend.services.cancellation import CancelToken
+from backend.services.planner import combine_results
+from backend.services.sessions import SESSIONS_ENABLED, SessionStore
+from backend.services.batch import (
+    BATCH_MAX_QUESTIONS, BATCH_WORKERS, BULKHEADS as BATCH_BULKHEADS, BatchReport, SharedExecutions, dedupe, execution_key,
+)
+from backend.services.jobs import FINISHED as JOB_FINISHED, JOBS_ENABLED, PRIORITIES as JOB_PRIORITIES, JobQueue, QueueFull
+from backend.services.export import EXPORT_FORMATS, EXPORT_MAX_CONCURRENT, Exporter, QueryStream, rows_from_dicts
+from backend.services.downsample import check_request as check_downsample, downsample
+from backend.services.summary import RESPONSE_MODES, RESULT_STORE_MAX_ROWS, ResultStore, summarize, wants_summary
+from backend.services.change_feed import CHANGE_FEED_ENABLED, ChangeFeedListener
+from backend.services.ingest import FORMATS as INGEST_FORMATS, INGEST_REJECT_DIR, ingest_stream
+from backend.validator.fingerprint import query_shape, sql_fingerprint
+from backend.validator.query_shape import parse_query
+from backend.sql_executor.admission import ADMISSION_AUTO_LIMIT, admit, admit_cost, admit_result
+from backend.sql_executor.refine import NotDerivable, refine
+from backend.sql_executor.local_engine import LOCAL_ENGINE_ENABLED, SnapshotStore, Unsupported, execute
+from backend.sql_executor.router import route
+from backend.sql_executor.segment_cache import SEGMENT_CACHE_ENABLED, SegmentCache, Unavailable
+from backend.sql_executor.sqlite_mirror import SQLITE_MIRROR_PATH, execute_on_mirror, mirror_available
 
 
 # Load environment variables (.env locally, Render env in deployment)
@@ -51,6 +87,30 @@ class EchoRequest(BaseModel):
 
 class ChatRequest(BaseModel):
     question: str
+    dry_run: bool = False  # validate + EXPLAIN only, do not execute
+    max_staleness_s: float | None = None  # oldest in-memory snapshot acceptable (0 = live data)
+    session_id: str | None = None  # from a previous response: the question is a follow-up
+    mode: str = "rows"  # rows | summary (column statistics + sample + paging handle) | auto
+    downsample: int | None = None  # time series: reduce to about this many points for charting
+    downsample_method: str = "lttb"  # lttb | minmax
+
+
+class ChatJobRequest(ChatRequest):
+    priority: str = "interactive"  # interactive | batch (interactive jobs start first)
+
+
+class BatchRequest(BaseModel):
+    questions: list[str]
+    dry_run: bool = False
+    max_staleness_s: float | None = None
+    mode: str = "rows"  # applies to every question (see ChatRequest)
+
+
+class ExportRequest(BaseModel):
+    question: str | None = None  # NL question (NL -> SQL -> validator) ...
+    sql: str | None = None  # ... or SQL, validated the same way (needs X-Export-Token)
+    format: str = "csv"  # csv | jsonl
+    gzip: bool = True
 
 
 class ChatResponse(BaseModel):
@@ -60,7 +120,17 @@ class ChatResponse(BaseModel):
     sql: str | None = None
     validator: dict | None = None
     rows: list | None = None
+    plan: dict | None = None
+    rollup: dict | None = None
+    queries: list | None = None  # compound plan: per-query sql, validator, backend, timings
+    combine: dict | None = None
+    debug: dict | None = None  # routing decision, backend, timings
     error: str | None = None
+    session_id: str | None = None
+    follow_up: dict | None = None  # how a follow-up was answered (rule / llm, cached / database)
+    mode: str | None = None
+    summary: dict | None = None  # mode=summary: column statistics, sample, handle for paging the rows
+    downsample: dict | None = None  # method, time / measure columns, original and returned row counts
 
 
 # =========================
@@ -118,11 +188,10 @@ def sample_summary():
 # DB execution helper
 # =========================
 
-def execute_sql_sync(sql: str):
+def _db_dsn() -> str | dict:
     """
-    Executes a SQL query synchronously on Supabase using psycopg2.
-    Uses explicit DB_* environment variables so we fully control user/host.
-    Returns list of dicts, or {"error": "..."} on failure.
+    Build the psycopg2 DSN from explicit DB_* environment variables so we
+    fully control user/host. Returns {"error": "..."} if any are missing.
     """
     db_host = os.getenv("DB_HOST")
     db_port = os.getenv("DB_PORT", "5432")
@@ -141,25 +210,153 @@ def execute_sql_sync(sql: str):
     if missing:
         return {"error": f"Missing DB env vars: {', '.join(missing)}"}
 
-    dsn = (
+    return (
         f"dbname={db_name} "
         f"user={db_user} "
         f"password={db_password} "
         f"host={db_host} "
         f"port={db_port} "
-        f"sslmode=require"
+        f"sslmode={os.getenv('DB_SSLMODE', 'require')}"
     )
 
+
+def _background_connect():
+    dsn = _db_dsn()
+    if isinstance(dsn, dict):
+        raise RuntimeError(dsn["error"])
+    return psycopg2.connect(dsn)
+
+
+# In-memory deal_event snapshot for the local engine (loaded in the background).
+SNAPSHOTS = SnapshotStore(_background_connect) if LOCAL_ENGINE_ENABLED else None
+
+# Per-month partial aggregates for date-range queries.
+SEGMENTS = SegmentCache() if SEGMENT_CACHE_ENABLED else None
+
+# Conversations: last SQL and result per session_id, for follow-ups.
+SESSIONS = SessionStore() if SESSIONS_ENABLED else None
+
+# Full rows behind summary handles (GET /chat/results/{id}).
+RESULTS = ResultStore() if RESULT_STORE_MAX_ROWS > 0 else None
+
+# Change feed (LISTEN/NOTIFY) keeping in-process copies current.
+CHANGE_FEED = ChangeFeedListener(_background_connect) if CHANGE_FEED_ENABLED else None
+if CHANGE_FEED is not None and SNAPSHOTS is not None:
+    SNAPSHOTS.attach(CHANGE_FEED)
+if CHANGE_FEED is not None and SEGMENTS is not None:
+    SEGMENTS.attach(CHANGE_FEED)
+
+
+@app.on_event("startup")
+def start_change_feed():
+    if CHANGE_FEED is not None:
+        CHANGE_FEED.start()
+
+
+def open_db_connection(timer: RequestTimer, cancel: CancelToken | None = None):
+    """
+    Open a connection (timed as the db_connect stage).
+    Returns the connection, or {"error": "..."} on failure.
+
+    A timer with a db_connection bulkhead (batch questions) takes a slot
+    first and keeps it until close_db_connection(conn, timer); the wait
+    stops when the CancelToken is cancelled ({"cancelled": True}).
+    """
+    dsn = _db_dsn()
+    if isinstance(dsn, dict):
+        return dsn
+
+    refused = timer.hold("db_connection", cancel)
+    if refused is not None:
+        if cancel is not None and cancel.cancelled:
+            return {"error": f"Query {refused}.", "cancelled": True}
+        return {"error": f"Query not started: {refused}."}
+    try:
+        with timer.stage("db_connect"):
+            conn = psycopg2.connect(dsn)
+    except Exception as e:
+        timer.release("db_connection")
+        metrics.DB_CONNECTION_ERRORS.inc()
+        return {"error": str(e)}
+
+    metrics.DB_CONNECTIONS_OPENED.inc()
+    metrics.DB_CONNECTIONS_IN_USE.inc()
+    return conn
+
+
+def close_db_connection(conn, timer: RequestTimer | None = None) -> None:
+    """
+    Close a connection from open_db_connection; pass the same timer to
+    free its bulkhead slot.
+    """
     try:
-        conn = psycopg2.connect(dsn)
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute(sql)
-        rows = cur.fetchall()
-        cur.close()
         conn.close()
-        return [dict(r) for r in rows]
+    finally:
+        metrics.DB_CONNECTIONS_IN_USE.dec()
+        if timer is not None:
+            timer.release("db_connection")
+
+
+def run_query(conn, sql: str, timer: RequestTimer, cancel: CancelToken | None = None):
+    """
+    Run a query on an open connection (db_execute / db_rows stages).
+    Returns list of dicts, or {"error": "..."} on failure.
+
+    The query runs with `statement_timeout` set to what is left of the
+    request budget, and is cancelled server-side (cancel protocol) if the
+    CancelToken fires while it is running.
+    """
+    cancel = cancel or CancelToken()
+    unregister = cancel.on_cancel(conn.cancel)
+    try:
+        with timer.stage("db_execute") as span:
+            timeout_ms = cancel.statement_timeout_ms()
+            span.set_attribute("db.sql.fingerprint", sql_fingerprint(sql))
+            span.set_attribute("db.query.text", query_shape(sql))  # literal-free; read by index_advisor
+            span.set_attribute("db.statement_timeout_ms", timeout_ms)
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cur.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+            cur.execute(sql)
+            rows = cur.fetchall()
+            cur.close()
+            span.set_attribute("db.response.returned_rows", len(rows))
+        with timer.stage("db_rows"):
+            rows = [dict(r) for r in rows]
+        metrics.DB_QUERIES.inc(outcome="ok")
+        metrics.DB_ROWS_RETURNED.inc(len(rows))
+        return rows
+    except psycopg2.errors.QueryCanceled as e:
+        # Same SQLSTATE for both; the token tells us which one it was.
+        conn.rollback()
+        if cancel.cancelled:
+            metrics.DB_QUERIES.inc(outcome="cancelled")
+            return {"error": f"Query cancelled ({cancel.reason}).", "cancelled": True}
+        metrics.DB_QUERIES.inc(outcome="timeout")
+        return {"error": f"Query exceeded the time budget ({timeout_ms} ms): {e}"}
     except Exception as e:
+        metrics.DB_QUERIES.inc(outcome="error")
+        conn.rollback()
         return {"error": str(e)}
+    finally:
+        unregister()
+
+
+def execute_sql_sync(sql: str, timer: RequestTimer | None = None):
+    """
+    Executes a SQL query synchronously on Supabase using psycopg2.
+    Returns list of dicts, or {"error": "..."} on failure.
+
+    Connection setup and query execution are timed as separate stages
+    (db_connect / db_execute) on the given RequestTimer.
+    """
+    timer = timer or RequestTimer()
+    conn = open_db_connection(timer)
+    if isinstance(conn, dict):
+        return conn
+    try:
+        return run_query(conn, sql, timer)
+    finally:
+        close_db_connection(conn, timer)
 
 
 @app.get("/db-test")
@@ -177,43 +374,1118 @@ def db_test():
 # Main /chat endpoint (JSON)
 # =========================
 
+def _chat_response(result: dict, timer: RequestTimer) -> Response:
+    """
+    Serialize a ChatResponse ourselves so JSON encoding shows up as its own
+    stage, and attach the per-stage timings as a Server-Timing header.
+    """
+    _record_turn(result)
+    _downsample_result(result, timer)
+    _summarize_result(result, timer)
+    with timer.stage("serialize") as span:
+        body = ChatResponse(**result).model_dump_json()
+        span.set_attribute("http.response.body.size", len(body))
+
+    status = result.get("status", "ok")
+    if result.get("error") and status == "ok":
+        status = "error"
+    timer.finish(status=status, stage=result.get("stage", ""))
+
+    headers = {"Server-Timing": timer.server_timing_header(), "X-Chat-Status": status}
+    root = tracing.current_span()
+    if root.is_recording:
+        root.set_attributes({
+            "chat.status": status,
+            "chat.stage": result.get("stage", ""),
+            "http.response.body.size": len(body),
+        })
+        if result.get("sql"):
+            root.set_attribute("db.sql.fingerprint", sql_fingerprint(result["sql"]))
+        if result.get("rows") is not None:
+            root.set_attribute("db.response.returned_rows", len(result["rows"]))
+        root.set_status(status == "ok", result.get("error"))
+        headers["traceparent"] = root.traceparent()
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _record_turn(result: dict) -> None:
+    """
+    Remember a successful answer in its session (the next question may
+    refine it).
+    """
+    if SESSIONS is None or not result.get("session_id") or result.get("status") != "ok" or result.get("error"):
+        return
+    follow_up = result.get("follow_up")
+    rows_at = None
+    if follow_up is not None:
+        metrics.SESSION_FOLLOW_UPS.inc(source=follow_up["source"], answered=follow_up.get("answered_from", "database"))
+        if follow_up.get("cached_rows_age_s") is not None:
+            rows_at = time.time() - follow_up["cached_rows_age_s"]
+    SESSIONS.record(result["session_id"], result["question"], result.get("sql"), result.get("rows"), rows_at)
+
+
+def _downsample_result(result: dict, timer: RequestTimer) -> None:
+    """
+    downsample=N: reduce a time series result to about N rows and replace
+    the request options with what was done.
+    """
+    options = result.get("downsample")
+    if options is None or "target" not in options or result.get("rows") is None:
+        return
+    with timer.stage("downsample") as span:
+        reduced = downsample(result["rows"], options["target"], options["method"])
+        span.set_attribute("chat.downsample.rows", len(result["rows"]))
+    if "rows" in reduced:
+        result["rows"] = reduced["rows"]
+    result["downsample"] = reduced["meta"]
+
+
+def _summarize_result(result: dict, timer: RequestTimer) -> None:
+    """
+    mode=summary (or auto on a large result): replace the rows with column
+    statistics and a sample; the rows stay pageable behind a handle.
+    """
+    rows = result.get("rows")
+    if rows is None or not wants_summary(result.get("mode") or "rows", len(rows)):
+        return
+    with timer.stage("summarize") as span:
+        if result.get("combine"):
+            ordered = bool(result["combine"].get("order_by"))
+        else:
+            shape = parse_query(result["sql"]) if result.get("sql") else None
+            ordered = bool(shape and shape["order_by"])
+        summary = summarize(rows, ordered=ordered)
+        handle = RESULTS.put(rows) if RESULTS is not None else None
+        if handle is not None:
+            summary["handle"] = {
+                "id": handle,
+                "url": f"/chat/results/{handle}",
+                "expires_in_s": RESULTS.ttl_s,
+            }
+        span.set_attribute("chat.summary.rows", len(rows))
+    result["summary"] = summary
+    result["rows"] = None
+
+
+# Seconds between checks for a client disconnect while /chat is running.
+DISCONNECT_POLL_S = float(os.getenv("DISCONNECT_POLL_S", "0.25"))
+
+
+async def _watch_disconnect(request: Request, cancel: CancelToken) -> None:
+    """
+    Cancel the request's in-flight work (OpenAI stream, running query) as
+    soon as the HTTP client goes away.
+    """
+    while not cancel.cancelled:
+        if await request.is_disconnected():
+            # conn.cancel() opens a socket to the server, keep it off the loop.
+            await run_in_threadpool(cancel.cancel, "client_disconnected")
+            return
+        await asyncio.sleep(DISCONNECT_POLL_S)
+
+
+def _cancelled_response(result: dict, timer: RequestTimer, cancel: CancelToken) -> Response:
+    """
+    The client is gone; record the cancellation and build a response anyway
+    (the server still has to complete the ASGI cycle).
+    """
+    stage = result.get("stage", "")
+    metrics.CHAT_CANCELLED.inc(reason=cancel.reason or "cancelled", stage=stage)
+    result["status"] = "cancelled"
+    result["error"] = f"Request cancelled ({cancel.reason})."
+    return _chat_response(result, timer)
+
+
 @app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest, request: Request, x_profile: str | None = Header(default=None)):
     """
     Main AI → SQL → Validator → optional Supabase execution.
 
     This is the "engine" endpoint used both by:
       - the front-end chat page (/)
       - any debug tools (e.g. /docs, curl, Postman)
+
+    Stage timings are returned in the Server-Timing header and aggregated
+    on /metrics. Sampled requests (TRACE_SAMPLE_RATE) are also traced; the
+    trace id comes back in the traceparent header.
+
+    Sending `X-Profile: <PROFILE_TOKEN>` (or PROFILE_SAMPLE_RATE) runs a
+    sampling profiler around the request; the collapsed-stack file name is
+    returned in the X-Profile-Output header.
+
+    The blocking pipeline runs in the threadpool while this coroutine
+    watches for a client disconnect; on disconnect the OpenAI stream and
+    any running query are aborted. Every query carries a statement_timeout
+    derived from REQUEST_BUDGET_S.
+
+    Validated SQL is routed (backend.sql_executor.router) to a rollup, the
+    segment cache, the in-memory snapshot or Postgres; `debug` in the response says which
+    backend answered, why, and how long it took.
     """
+    cancel = CancelToken()
+    watcher = asyncio.create_task(_watch_disconnect(request, cancel))
+    try:
+        return await run_in_threadpool(_chat_sync, req, cancel, x_profile)
+    finally:
+        watcher.cancel()
+
+
+def _chat_sync(req: ChatRequest, cancel: CancelToken, x_profile: str | None) -> Response:
+    timer = RequestTimer()
+    with profiler.maybe_profile(x_profile, label="chat") as prof:
+        with tracing.start_trace("POST /chat", {"chat.question": req.question}):
+            response = _run_chat(req, timer, cancel)
+
+    if prof is not None:
+        response.headers["X-Profile-Output"] = prof.output_path.name
+    return response
 
-    # 1. Run NL → SQL → Validator
-    result = handle_question(req.question)
+
+def _run_chat(req: ChatRequest, timer: RequestTimer, cancel: CancelToken, prepared: dict | None = None) -> Response:
+    # 1. Run NL → SQL → Validator (a follow-up when the session is known).
+    # Batches pass the handle_question result in as `prepared`; their
+    # questions are stateless (no session).
+    session = None
+    session_id = None
+    if SESSIONS is not None and prepared is None:
+        session_id = req.session_id or SESSIONS.new_id()
+        session = SESSIONS.get(req.session_id, req.max_staleness_s) if req.session_id else None
+    error = check_downsample(req.downsample, req.downsample_method)
+    if req.mode not in RESPONSE_MODES:
+        error = f"Unknown mode {req.mode!r}; expected one of {', '.join(RESPONSE_MODES)}."
+    elif req.mode == "summary" and req.downsample is not None:
+        error = "downsample returns chart points; it cannot be combined with mode=summary."
+    if error:
+        return _chat_response({"status": "error", "stage": "request", "question": req.question, "error": error}, timer)
+    if prepared is not None:
+        result = prepared
+    else:
+        result = handle_question(req.question, timer=timer, cancel=cancel, session=session)
+    result["session_id"] = session_id
+    result["mode"] = req.mode
+    if req.downsample is not None:
+        result["downsample"] = {"target": req.downsample, "method": req.downsample_method}
+
+    if cancel.cancelled:
+        return _cancelled_response(result, timer, cancel)
 
     # If validator failed, return immediately
     if result.get("validator", {}).get("status") != "ok":
         # result is already shaped correctly for ChatResponse
-        return ChatResponse(**result)
+        return _chat_response(result, timer)
+
+    # Compound question: several queries, combined in process
+    if result.get("queries"):
+        return _run_compound(result, req, timer, cancel)
+
+    # Follow-up that only narrows / reshapes the previous result
+    if session is not None and session["rows"] is not None and not req.dry_run:
+        response = _run_session(result, session, timer, cancel)
+        if response is not None:
+            return response
 
-    # 2. Local mode: skip DB execution
+    # 2. Local mode: run on the SQLite mirror if one was built, else skip execution
     if os.getenv("LOCAL_MODE", "false").lower() == "true":
+        if mirror_available() and not req.dry_run:
+            return _run_mirror(result, timer, cancel)
         result["rows"] = None
         result["stage"] = "validator (local mode, DB skip)"
-        return ChatResponse(**result)
+        return _chat_response(result, timer)
 
-    # 3. Execute on Supabase (Render mode)
-    sql = result["sql"]
-    db_result = execute_sql_sync(sql)
+    # 3. Route: month rollup / segment cache / in-memory snapshot / day rollup / Postgres
+    snapshot = SNAPSHOTS.get() if SNAPSHOTS is not None else None
+    with timer.stage("route") as span:
+        routing = route(result["sql"], snapshot, req.max_staleness_s)
+        span.set_attribute("query.backend", routing["candidates"][0]["backend"])
+    candidates = routing["candidates"]
+    debug = {
+        "backend": None,
+        "candidates": [c["backend"] for c in candidates],
+        "considered": routing["considered"],
+        "shape": routing["shape"],
+        "fallbacks": [],
+        "execute_ms": None,
+    }
+    if SNAPSHOTS is not None:
+        debug["snapshot"] = {
+            "rows": snapshot.rows if snapshot else None,
+            "age_s": round(time.time() - snapshot.loaded_at, 1) if snapshot else None,
+            "loading": SNAPSHOTS.loading,
+            "error": SNAPSHOTS.last_error,
+        }
+    if SEGMENTS is not None:
+        debug["segment_cache"] = SEGMENTS.status()
+    if CHANGE_FEED is not None:
+        debug["change_feed"] = CHANGE_FEED.status()
+    result["debug"] = debug
+
+    # 3a. Segment cache / in-memory snapshot; each falls through when it
+    # cannot serve the query after all
+    while candidates[0]["backend"] in ("segments", "local"):
+        if req.dry_run:
+            debug["backend"] = candidates[0]["backend"]
+            result["stage"] = "route (dry run)"
+            return _chat_response(result, timer)
+        if candidates[0]["backend"] == "segments":
+            response = _run_segments(result, candidates[0], timer, cancel)
+        else:
+            response = _run_local(result, snapshot, timer, cancel)
+        if response is not None:
+            return response
+        candidates = candidates[1:]
+
+    # 4. Execute on Supabase (rollup or base table)
+    candidate = candidates[0]
+    if candidate["backend"].startswith("rollup"):
+        result["rollup"] = {"table": candidate["table"], "original_sql": result["sql"]}
+
+    conn = open_db_connection(timer, cancel)
+    if isinstance(conn, dict):
+        if conn.get("cancelled"):
+            return _cancelled_response(result, timer, cancel)
+        result["error"] = conn["error"]
+        return _chat_response(result, timer)
+
+    try:
+        # 4a. Cost-based admission (cached EXPLAIN); may reject or add a LIMIT
+        with timer.stage("admission") as span:
+            try:
+                admission = admit(conn, candidate["sql"])
+            except Exception as e:
+                conn.rollback()
+                result["error"] = str(e)
+                result["stage"] = "admission"
+                return _chat_response(result, timer)
+            span.set_attribute("admission.decision", admission["decision"])
+
+        if admission["plan"] is not None:
+            result["plan"] = {
+                **admission["plan"],
+                "decision": admission["decision"],
+                "reason": admission["reason"],
+            }
+
+        if admission["decision"] == "rejected":
+            result["status"] = "rejected"
+            result["stage"] = "admission"
+            result["error"] = admission["reason"]
+            return _chat_response(result, timer)
+
+        sql = admission["sql"]
+        result["sql"] = sql
+        debug["backend"] = candidate["backend"]
+
+        if req.dry_run:
+            result["stage"] = "admission (dry run)"
+            return _chat_response(result, timer)
+
+        if cancel.cancelled:
+            return _cancelled_response(result, timer, cancel)
+
+        t0 = time.perf_counter()
+        db_result = run_query(conn, sql, timer, cancel)
+        _record_backend(debug, candidate["backend"], time.perf_counter() - t0)
+    finally:
+        close_db_connection(conn, timer)
+
+    if isinstance(db_result, dict) and db_result.get("cancelled"):
+        return _cancelled_response(result, timer, cancel)
 
     if isinstance(db_result, dict) and "error" in db_result:
         result["error"] = db_result["error"]
         # Keep stage as whatever handle_question set, or override if you prefer
-        return ChatResponse(**result)
+        return _chat_response(result, timer)
 
     result["rows"] = db_result
     result["stage"] = "db_execution"
 
-    return ChatResponse(**result)
+    return _chat_response(result, timer)
+
+
+def _run_session(result: dict, session: dict, timer: RequestTimer, cancel: CancelToken) -> Response | None:
+    """
+    Answer a follow-up from the session's cached rows (backend.sql_executor.refine).
+    Returns None (and notes why in follow_up) when it needs new data.
+    """
+    if cancel.cancelled:
+        return _cancelled_response(result, timer, cancel)
+    follow_up = result.setdefault("follow_up", {"source": "llm", "previous_sql": session["sql"]})
+
+    t0 = time.perf_counter()
+    try:
+        with timer.stage("refine") as span:
+            rows = refine(session["rows"], session["shape"], result["sql"])
+            span.set_attribute("db.response.returned_rows", len(rows))
+    except NotDerivable as e:
+        follow_up["answered_from"] = "database"
+        follow_up["reason"] = str(e)
+        return None
+    result["debug"] = {"backend": None, "fallbacks": [], "execute_ms": None}
+    _record_backend(result["debug"], "session", time.perf_counter() - t0)
+
+    follow_up["answered_from"] = "cached"
+    follow_up["cached_rows_age_s"] = round(time.time() - session["rows_at"], 1)
+    result["rows"] = rows
+    result["stage"] = "session_refinement"
+    return _chat_response(result, timer)
+
+
+def _run_local(result: dict, snapshot, timer: RequestTimer, cancel: CancelToken) -> Response | None:
+    """
+    Answer from the in-memory snapshot. Returns None (and records the
+    fallback) when the engine does not support the query.
+    """
+    debug = result["debug"]
+    if cancel.cancelled:
+        return _cancelled_response(result, timer, cancel)
+
+    t0 = time.perf_counter()
+    try:
+        with timer.stage("local_execute") as span:
+            rows = execute(snapshot, result["sql"])
+            span.set_attribute("db.response.returned_rows", len(rows))
+    except Unsupported as e:
+        debug["fallbacks"].append({"backend": "local", "reason": str(e)})
+        metrics.QUERY_BACKEND_REQUESTS.inc(backend="local", outcome="fallback")
+        return None
+    _record_backend(debug, "local", time.perf_counter() - t0)
+
+    return _admitted_response(result, rows, "local_execution", timer)
+
+
+def _run_segments(result: dict, candidate: dict, timer: RequestTimer, cancel: CancelToken) -> Response | None:
+    """
+    Answer from cached month segments, fetching the missing months on a
+    connection opened only when needed. Returns None (and records the
+    fallback) when the fetch is over the admission cost budget.
+    """
+    debug = result["debug"]
+    if cancel.cancelled:
+        return _cancelled_response(result, timer, cancel)
+
+    t0 = time.perf_counter()
+    try:
+        answer = _segment_answer(candidate, timer, cancel)
+    except Unavailable as e:
+        debug["fallbacks"].append({"backend": "segments", "reason": str(e)})
+        metrics.QUERY_BACKEND_REQUESTS.inc(backend="segments", outcome="fallback")
+        return None
+
+    if answer.get("cancelled"):
+        return _cancelled_response(result, timer, cancel)
+    if "error" in answer:
+        result["error"] = answer["error"]
+        return _chat_response(result, timer)
+    _record_backend(debug, "segments", time.perf_counter() - t0)
+    debug["segments"] = {**answer["segments"], "fetch_sql": answer["fetch_sql"]}
+
+    return _admitted_response(result, answer["rows"], "segment_cache", timer)
+
+
+def _segment_answer(candidate: dict, timer: RequestTimer, cancel: CancelToken) -> dict:
+    """
+    SEGMENTS.execute() with a connection opened only when months have to be
+    fetched. Raises Unavailable when the fetch is over the cost budget.
+    """
+    conn = None
+
+    def run(sql: str, admission: bool = False):
+        nonlocal conn
+        if conn is None:
+            opened = open_db_connection(timer, cancel)
+            if isinstance(opened, dict):
+                return opened
+            conn = opened
+        if admission:
+            with timer.stage("admission") as span:
+                try:
+                    decision = admit_cost(conn, sql)
+                except Exception as e:
+                    conn.rollback()
+                    raise Unavailable(f"segment fetch: {e}")
+                span.set_attribute("admission.decision", decision["decision"])
+            if decision["decision"] == "rejected":
+                raise Unavailable(f"segment fetch rejected: {decision['reason']}")
+        return run_query(conn, sql, timer, cancel)
+
+    try:
+        return SEGMENTS.execute(candidate["plan"], run, candidate["max_staleness_s"])
+    finally:
+        if conn is not None:
+            close_db_connection(conn, timer)
+
+
+def _run_mirror(result: dict, timer: RequestTimer, cancel: CancelToken) -> Response:
+    """
+    LOCAL_MODE: answer from the SQLite mirror (see sqlite_mirror.py).
+    """
+    debug = {"backend": None, "mirror": str(SQLITE_MIRROR_PATH), "fallbacks": [], "execute_ms": None}
+    result["debug"] = debug
+    if cancel.cancelled:
+        return _cancelled_response(result, timer, cancel)
+
+    t0 = time.perf_counter()
+    with timer.stage("sqlite_execute") as span:
+        rows = execute_on_mirror(result["sql"])
+        if isinstance(rows, list):
+            span.set_attribute("db.response.returned_rows", len(rows))
+    if isinstance(rows, dict):
+        debug["translated_sql"] = rows.get("translated_sql")
+        result["error"] = rows["error"]
+        result["stage"] = "local_mirror_execution"
+        return _chat_response(result, timer)
+    _record_backend(debug, "sqlite", time.perf_counter() - t0)
+
+    return _admitted_response(result, rows, "local_mirror_execution", timer)
+
+
+def _run_compound(result: dict, req: ChatRequest, timer: RequestTimer, cancel: CancelToken) -> Response:
+    """
+    Compound plan (backend.services.planner): run its queries concurrently,
+    each routed like a single query and on a connection of its own, then
+    combine their rows in process. Wall time is that of the slowest query.
+    """
+    queries = result["queries"]
+    local_mode = os.getenv("LOCAL_MODE", "false").lower() == "true"
+    if local_mode and (req.dry_run or not mirror_available()):
+        result["stage"] = "planner (local mode, DB skip)"
+        return _chat_response(result, timer)
+
+    snapshot = SNAPSHOTS.get() if SNAPSHOTS is not None else None
+    if req.dry_run:
+        with timer.stage("route"):
+            for query in queries:
+                query["backend"] = route(query["sql"], snapshot, req.max_staleness_s)["candidates"][0]["backend"]
+        result["stage"] = "route (dry run)"
+        return _chat_response(result, timer)
+
+    with timer.stage("subqueries") as span:
+        span.set_attribute("planner.queries", len(queries))
+        with ThreadPoolExecutor(max_workers=len(queries), thread_name_prefix="subquery") as pool:
+            # One context copy per task keeps the tracing spans parented here.
+            futures = [
+                pool.submit(contextvars.copy_context().run, _run_subquery,
+                            query, snapshot, req.max_staleness_s, local_mode, timer, cancel)
+                for query in queries
+            ]
+            answers = [f.result() for f in futures]
+
+    result["debug"] = {
+        "backend": "compound",
+        "backends": [q.get("backend") for q in queries],
+        "execute_ms": max((q.get("execute_ms") or 0.0) for q in queries),
+    }
+    if cancel.cancelled or any(a.get("cancelled") for a in answers):
+        return _cancelled_response(result, timer, cancel)
+    for query, answer in zip(queries, answers):
+        if "error" in answer:
+            if answer.get("rejected"):
+                result["status"] = "rejected"
+            result["error"] = f"{query['name']}: {answer['error']}"
+            result["stage"] = "subqueries"
+            return _chat_response(result, timer)
+
+    with timer.stage("combine") as span:
+        try:
+            rows = combine_results(result, [a["rows"] for a in answers])
+        except Exception as e:
+            result["error"] = f"Could not combine the query results: {type(e).__name__}: {e}"
+            result["stage"] = "combine"
+            return _chat_response(result, timer)
+        span.set_attribute("db.response.returned_rows", len(rows))
+
+    result["rows"] = rows
+    result["stage"] = "compound_execution"
+    return _chat_response(result, timer)
+
+
+def _run_subquery(query: dict, snapshot, max_staleness_s: float | None, local_mode: bool,
+                  timer: RequestTimer, cancel: CancelToken) -> dict:
+    """
+    One query of a compound plan, on the first backend that can serve it.
+    Fills in query["backend"] / ["execute_ms"] / ["row_count"] and returns
+    {"rows": [...]} or {"error": ..., "rejected" / "cancelled": True}.
+    """
+    sql = query["sql"]
+    if local_mode:
+        candidates = [{"backend": "sqlite", "sql": sql}]
+    else:
+        candidates = route(sql, snapshot, max_staleness_s)["candidates"]
+
+    for candidate in candidates:
+        if cancel.cancelled:
+            return {"error": f"Query cancelled ({cancel.reason}).", "cancelled": True}
+        backend = candidate["backend"]
+        t0 = time.perf_counter()
+        if backend == "sqlite":
+            with timer.stage("sqlite_execute"):
+                rows = execute_on_mirror(sql)
+            if isinstance(rows, dict):
+                return {"error": rows["error"]}
+        elif backend == "local":
+            try:
+                with timer.stage("local_execute"):
+                    rows = execute(snapshot, sql)
+            except Unsupported as e:
+                query.setdefault("fallbacks", []).append({"backend": "local", "reason": str(e)})
+                metrics.QUERY_BACKEND_REQUESTS.inc(backend="local", outcome="fallback")
+                continue
+        elif backend == "segments":
+            try:
+                answer = _segment_answer(candidate, timer, cancel)
+            except Unavailable as e:
+                query.setdefault("fallbacks", []).append({"backend": "segments", "reason": str(e)})
+                metrics.QUERY_BACKEND_REQUESTS.inc(backend="segments", outcome="fallback")
+                continue
+            if "error" in answer:
+                return answer
+            rows = answer["rows"]
+        else:
+            conn = open_db_connection(timer, cancel)
+            if isinstance(conn, dict):
+                return conn
+            try:
+                with timer.stage("admission"):
+                    try:
+                        admission = admit(conn, candidate["sql"])
+                    except Exception as e:
+                        conn.rollback()
+                        return {"error": str(e)}
+                if admission["decision"] == "rejected":
+                    return {"error": admission["reason"], "rejected": True}
+                query["sql"] = admission["sql"]
+                if backend.startswith("rollup"):
+                    query["rollup"] = candidate["table"]
+                rows = run_query(conn, admission["sql"], timer, cancel)
+            finally:
+                close_db_connection(conn, timer)
+            if isinstance(rows, dict):
+                return rows
+        _record_backend(query, backend, time.perf_counter() - t0)
+
+        if backend in ("sqlite", "local", "segments"):
+            admission, rows = _admit_rows(sql, rows)
+            if admission["decision"] == "rejected":
+                return {"error": admission["reason"], "rejected": True}
+            query["sql"] = admission["sql"]
+        query["row_count"] = len(rows)
+        return {"rows": rows}
+    return {"error": "no backend could serve the query"}
+
+
+def _admit_rows(sql: str, rows: list) -> tuple[dict, list]:
+    """
+    Result-size admission for rows computed in process (snapshot, segment
+    cache, SQLite mirror): nothing to estimate beforehand, so the row count
+    decides. Returns the admit_result() decision and the rows, cut to
+    ADMISSION_AUTO_LIMIT when limited.
+    """
+    admission = admit_result(sql, len(rows))
+    if admission["decision"] == "limited":
+        rows = rows[:ADMISSION_AUTO_LIMIT]
+    return admission, rows
+
+
+def _admitted_response(result: dict, rows: list, stage: str, timer: RequestTimer) -> Response:
+    """
+    Admit rows an in-process backend produced and build the /chat response:
+    rejected at stage "admission", or the (possibly limited) rows at `stage`.
+    """
+    admission, rows = _admit_rows(result["sql"], rows)
+    result["plan"] = {**admission["plan"], "decision": admission["decision"], "reason": admission["reason"]}
+    if admission["decision"] == "rejected":
+        result["status"] = "rejected"
+        result["stage"] = "admission"
+        result["error"] = admission["reason"]
+        return _chat_response(result, timer)
+
+    result["sql"] = admission["sql"]
+    result["rows"] = rows
+    result["stage"] = stage
+    return _chat_response(result, timer)
+
+
+def _record_backend(debug: dict, backend: str, seconds: float) -> None:
+    debug["backend"] = backend
+    debug["execute_ms"] = round(seconds * 1000.0, 2)
+    metrics.QUERY_BACKEND_REQUESTS.inc(backend=backend, outcome="served")
+    metrics.QUERY_BACKEND_SECONDS.observe(seconds, backend=backend)
+    tracing.current_span().set_attribute("query.backend", backend)
+
+
+@app.get("/chat/results/{handle}")
+def chat_results(handle: str, offset: int = 0, limit: int = 100):
+    """
+    Page through the full rows of a summarized /chat answer
+    (summary.handle.id). The page size is capped at RESULT_PAGE_MAX_ROWS.
+    """
+    page = RESULTS.page(handle, offset, limit) if RESULTS is not None else None
+    if page is None:
+        return JSONResponse({"error": f"Unknown or expired result handle {handle!r}."}, status_code=404)
+    return {"handle": handle, **page}
+
+
+# =========================
+# Export (/chat/export)
+# =========================
+
+# Token for exporting SQL passed directly (X-Export-Token); unset = questions only.
+EXPORT_SQL_TOKEN = os.getenv("EXPORT_SQL_TOKEN") or None
+
+# Exports holding a connection; /chat/export answers 429 when all are taken.
+EXPORT_SLOTS = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+
+def _export_response(columns: list, fetch, close, fmt: str, compress: bool, name: str,
+                     cancel=None) -> StreamingResponse:
+    """
+    Stream batches from fetch() (until it returns []) as CSV / JSONL,
+    optionally gzipped, with chunked transfer. Fetching and encoding run in
+    the threadpool one batch at a time, so memory stays at one batch
+    whatever the size of the result; close() runs however the stream ends,
+    in the threadpool, after cancel() when the stream was cut short.
+    """
+    exporter = Exporter(fmt, columns, compress)
+
+    def next_chunk():
+        batch = fetch()
+        if not batch:
+            return None, 0
+        return exporter.encode(batch), len(batch)
+
+    async def body():
+        rows = 0
+        finished = False
+        try:
+            yield exporter.start()
+            while True:
+                chunk, count = await run_in_threadpool(next_chunk)
+                if chunk is None:
+                    break
+                rows += count
+                yield chunk
+            finished = True
+            yield exporter.finish()
+        finally:
+            metrics.EXPORT_ROWS.inc(rows, format=fmt)
+            if not finished and cancel is not None:
+                cancel()  # a FETCH may still hold the connection
+            # Shielded: on a disconnect the scope is already cancelled.
+            with anyio.CancelScope(shield=True):
+                await run_in_threadpool(close)
+
+    filename = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.{fmt}" + (".gz" if compress else "")
+    return StreamingResponse(
+        body(),
+        media_type="application/gzip" if compress else EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def _prepare_export(req: ExportRequest) -> dict:
+    """
+    Question / SQL -> validated SQL -> cost admission -> running
+    server-side cursor. Returns {"stream", "sql"} or {"error", "status_code", ...}.
+    """
+    timer = RequestTimer()
+    if req.sql:
+        result = check_sql(req.sql, timer)
+    else:
+        result = handle_question(req.question, timer=timer)
+    if result.get("queries"):
+        return {"error": "Compound questions combine several queries and cannot be exported; ask for one result.",
+                "status_code": 400}
+    if result.get("validator", {}).get("status") != "ok":
+        return {"error": result.get("error") or "SQL did not pass the validator.",
+                "validator": result.get("validator"), "status_code": 400}
+
+    conn = open_db_connection(timer)
+    if isinstance(conn, dict):
+        return {"error": conn["error"], "status_code": 503}
+    # Only the cost budget applies: the export is the full result.
+    try:
+        admission = admit_cost(conn, result["sql"])
+    except Exception as e:
+        conn.rollback()
+        close_db_connection(conn)
+        return {"error": str(e).strip(), "sql": result["sql"], "status_code": 400}
+    if admission["decision"] == "rejected":
+        close_db_connection(conn)
+        return {"error": admission["reason"], "sql": result["sql"], "plan": admission["plan"], "status_code": 400}
+    try:
+        stream = QueryStream(conn, result["sql"], close=close_db_connection)
+    except psycopg2.Error as e:
+        metrics.DB_QUERIES.inc(outcome="error")
+        return {"error": str(e).strip(), "sql": result["sql"], "status_code": 400}
+    metrics.DB_QUERIES.inc(outcome="ok")
+    return {"stream": stream, "sql": result["sql"]}
+
+
+@app.post("/chat/export")
+async def chat_export(req: ExportRequest, x_export_token: str | None = Header(default=None)):
+    """
+    Full result of a question (or of SQL passed directly, validated like
+    model output) as a CSV / JSONL download, gzip by default.
+
+    SQL passed directly needs EXPORT_SQL_TOKEN to be set and sent in
+    X-Export-Token. Rows come from a server-side cursor in
+    EXPORT_FETCH_ROWS batches, so exports of millions of rows run in
+    constant memory; the connection is opened for the export alone and
+    closed once the cursor is drained (or the client goes away). The
+    admission cost budget applies, its row limits do not; at most
+    EXPORT_MAX_CONCURRENT exports run at once (429 beyond that).
+    Errors before the first row (validation, admission, SQL) are JSON 4xx
+    responses; a failure mid-stream truncates the download (a gzip export
+    then lacks its trailer, so it does not decompress cleanly).
+    """
+    if req.format not in EXPORT_FORMATS:
+        return JSONResponse({"error": f"Unknown format {req.format!r}; expected one of {', '.join(EXPORT_FORMATS)}."},
+                            status_code=400)
+    if not (req.sql or req.question):
+        return JSONResponse({"error": "Pass a question or sql to export."}, status_code=400)
+    if req.sql:
+        if EXPORT_SQL_TOKEN is None:
+            return JSONResponse({"error": "SQL export is disabled (EXPORT_SQL_TOKEN not set); pass a question."},
+                                status_code=403)
+        if not x_export_token or not hmac.compare_digest(x_export_token.encode(), EXPORT_SQL_TOKEN.encode()):
+            return JSONResponse({"error": "Invalid X-Export-Token"}, status_code=403)
+    if not EXPORT_SLOTS.acquire(blocking=False):
+        return JSONResponse({"error": f"Too many exports running (limit {EXPORT_MAX_CONCURRENT}); retry later."},
+                            status_code=429, headers={"Retry-After": "5"})
+
+    try:
+        prepared = await run_in_threadpool(_prepare_export, req)
+    except BaseException:
+        EXPORT_SLOTS.release()
+        raise
+    if "error" in prepared:
+        EXPORT_SLOTS.release()
+        status_code = prepared.pop("status_code")
+        return JSONResponse(prepared, status_code=status_code)
+    stream = prepared["stream"]
+
+    def close():
+        try:
+            stream.close()
+        finally:
+            EXPORT_SLOTS.release()
+
+    response = _export_response(stream.columns, stream.fetch, close, req.format, req.gzip, "export",
+                                cancel=stream.cancel)
+    response.headers["X-Export-SQL-Fingerprint"] = sql_fingerprint(prepared["sql"])
+    return response
+
+
+@app.get("/chat/results/{handle}/export")
+def chat_results_export(handle: str, format: str = "csv", gzip: bool = True):
+    """
+    Download the full rows behind a summary handle (see /chat/results/{id}).
+    """
+    if format not in EXPORT_FORMATS:
+        return JSONResponse({"error": f"Unknown format {format!r}; expected one of {', '.join(EXPORT_FORMATS)}."},
+                            status_code=400)
+    rows = RESULTS.rows(handle) if RESULTS is not None else None
+    if rows is None:
+        return JSONResponse({"error": f"Unknown or expired result handle {handle!r}."}, status_code=404)
+    columns, fetch = rows_from_dicts(rows)
+    return _export_response(columns, fetch, lambda: None, format, gzip, "result")
+
+
+# =========================
+# Background jobs (/chat/jobs)
+# =========================
+
+# Seconds between status checks of an /events subscription.
+JOB_EVENTS_POLL_S = float(os.getenv("JOB_EVENTS_POLL_S", "0.5"))
+# Comment line sent on an idle /events stream so proxies keep it open.
+JOB_EVENTS_KEEPALIVE_S = 15.0
+
+
+def _run_job(req: ChatJobRequest, on_stage, cancel: CancelToken) -> tuple[bytes, str]:
+    """
+    The /chat pipeline for a background job; returns the response body and
+    its status. Stage starts are reported to the job as progress.
+    """
+    timer = RequestTimer(on_stage=on_stage)
+    with tracing.start_trace("chat job", {"chat.question": req.question, "chat.job.priority": req.priority}):
+        response = _run_chat(req, timer, cancel)
+    return response.body, response.headers["X-Chat-Status"]
+
+
+JOBS = JobQueue(_run_job) if JOBS_ENABLED else None
+
+
+@app.on_event("startup")
+def start_job_workers():
+    if JOBS is not None:
+        JOBS.start()
+
+
+def _unknown_job(job_id: str) -> JSONResponse:
+    return JSONResponse({"error": f"Unknown or expired job {job_id!r}."}, status_code=404)
+
+
+@app.post("/chat/jobs", status_code=202)
+def submit_chat_job(req: ChatJobRequest):
+    """
+    Queue a /chat question and return its job id at once. The answer (the
+    usual /chat response) is fetched from /chat/jobs/{id}/result once the
+    job is done; progress is on /chat/jobs/{id} (poll) or
+    /chat/jobs/{id}/events (SSE).
+    """
+    if JOBS is None:
+        return JSONResponse({"error": "Background jobs are disabled (JOBS_ENABLED=false)."}, status_code=404)
+    if req.priority not in JOB_PRIORITIES:
+        return JSONResponse(
+            {"error": f"Unknown priority {req.priority!r}; expected one of {', '.join(JOB_PRIORITIES)}."},
+            status_code=400,
+        )
+    try:
+        return JOBS.submit(req, req.question, req.priority)
+    except QueueFull as e:
+        return JSONResponse({"error": f"Job queue full: {e}"}, status_code=429)
+
+
+@app.get("/chat/jobs/{job_id}")
+def chat_job_status(job_id: str):
+    info = JOBS.status(job_id) if JOBS is not None else None
+    return info if info is not None else _unknown_job(job_id)
+
+
+@app.get("/chat/jobs/{job_id}/events")
+async def chat_job_events(job_id: str):
+    """
+    Server-Sent Events: the job status (as on /chat/jobs/{id}) every time
+    it changes (queued -> running -> each pipeline stage -> done / failed /
+    cancelled); the stream ends with the job.
+    """
+    if JOBS is None or JOBS.status(job_id) is None:
+        return _unknown_job(job_id)
+
+    async def events():
+        version = -1
+        idle_since = time.monotonic()
+        while True:
+            info = JOBS.status(job_id)
+            if info is None:
+                yield f"event: expired\ndata: {json.dumps({'job_id': job_id})}\n\n"
+                return
+            if info["version"] != version:
+                version = info["version"]
+                idle_since = time.monotonic()
+                yield f"event: {info['status']}\ndata: {json.dumps(info)}\n\n"
+                if info["status"] in JOB_FINISHED:
+                    return
+            elif time.monotonic() - idle_since >= JOB_EVENTS_KEEPALIVE_S:
+                idle_since = time.monotonic()
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(JOB_EVENTS_POLL_S)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/chat/jobs/{job_id}/result")
+def chat_job_result(job_id: str, accept_encoding: str | None = Header(default=None)):
+    """
+    The job's /chat response. Stored gzip-compressed and sent as is to
+    clients that accept gzip.
+    """
+    info = JOBS.status(job_id) if JOBS is not None else None
+    if info is None:
+        return _unknown_job(job_id)
+    compressed = JOBS.result(job_id)
+    if compressed is None:
+        return JSONResponse(
+            {"error": f"Job is {info['status']}; no result.", "status": info["status"], "job_error": info["error"]},
+            status_code=409,
+        )
+    if accept_encoding and "gzip" in accept_encoding:
+        return Response(content=compressed, media_type="application/json",
+                        headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+    return Response(content=gzip.decompress(compressed), media_type="application/json",
+                    headers={"Vary": "Accept-Encoding"})
+
+
+@app.delete("/chat/jobs/{job_id}")
+def cancel_chat_job(job_id: str):
+    info = JOBS.cancel(job_id) if JOBS is not None else None
+    return info if info is not None else _unknown_job(job_id)
+
+
+# =========================
+# Batch questions (/chat/batch)
+# =========================
+
+def _batch_item(req: BatchRequest, question: str, shared: SharedExecutions, cancels: list) -> tuple[dict, dict]:
+    """
+    One distinct question of a batch: NL -> SQL, then the /chat pipeline,
+    unless another question of the batch already runs the same SQL.
+    Returns (item, stage seconds).
+    """
+    timer = RequestTimer(bulkheads=BATCH_BULKHEADS)
+    cancel = CancelToken()
+    cancels.append(cancel)
+    item_req = ChatRequest(question=question, dry_run=req.dry_run, max_staleness_s=req.max_staleness_s, mode=req.mode)
+    dedup = None
+    try:
+        with tracing.start_trace("chat batch item", {"chat.question": question}):
+            prepared = handle_question(question, timer=timer, cancel=cancel)
+            key = execution_key(prepared) if not cancel.cancelled else None
+            owner, execution = shared.claim(key) if key is not None else (True, None)
+            if owner:
+                try:
+                    result = json.loads(_run_chat(item_req, timer, cancel, prepared=prepared).body)
+                except BaseException as e:
+                    if execution is not None:
+                        execution.set_exception(e)
+                    raise
+                if execution is not None:
+                    execution.set_result(result)
+            else:
+                result = {**execution.result(), "question": question}
+                dedup = "sql"
+    except Exception as e:
+        result = {"status": "error", "stage": "batch", "question": question, "error": f"{type(e).__name__}: {e}"}
+    item = {"question": question, "dedup": dedup, "elapsed_ms": round(timer.elapsed() * 1000.0, 1), "result": result}
+    return item, dict(timer.stages)
+
+
+@app.post("/chat/batch")
+async def chat_batch(req: BatchRequest):
+    """
+    Answer a list of questions; NDJSON, one line per question as it
+    finishes ({"index", "question", "dedup", "elapsed_ms", "result"} where
+    result is the /chat response), then {"report": {...}}. See
+    backend.services.batch for deduplication and the stage bulkheads.
+    If the client goes away, unfinished questions are cancelled.
+    """
+    if not req.questions:
+        return JSONResponse({"error": "No questions."}, status_code=400)
+    if len(req.questions) > BATCH_MAX_QUESTIONS:
+        return JSONResponse({"error": f"At most {BATCH_MAX_QUESTIONS} questions per batch."}, status_code=400)
+    if req.mode not in RESPONSE_MODES:
+        return JSONResponse({"error": f"Unknown mode {req.mode!r}; expected one of {', '.join(RESPONSE_MODES)}."},
+                            status_code=400)
+
+    groups = dedupe(req.questions)
+    duplicates = dict(groups)
+    shared = SharedExecutions()
+    report = BatchReport(len(req.questions), len(groups))
+    cancels: list[CancelToken] = []
+    started = time.perf_counter()
+
+    def line(index: int, item: dict) -> bytes:
+        return (json.dumps({"index": index, **item}) + "\n").encode("utf-8")
+
+    async def run(first: int, pool: ThreadPoolExecutor):
+        loop = asyncio.get_running_loop()
+        item, stages = await loop.run_in_executor(
+            pool, contextvars.copy_context().run, _batch_item, req, req.questions[first], shared, cancels,
+        )
+        return first, item, stages
+
+    async def body():
+        pool = ThreadPoolExecutor(max_workers=min(BATCH_WORKERS, len(groups)), thread_name_prefix="batch")
+        finished = False
+        try:
+            for done in asyncio.as_completed([run(first, pool) for first, _ in groups]):
+                first, item, stages = await done
+                report.add(item, stages)
+                yield line(first, item)
+                for index in duplicates[first]:
+                    copy = {
+                        "question": req.questions[index],
+                        "dedup": "question",
+                        "elapsed_ms": 0.0,
+                        "result": {**item["result"], "question": req.questions[index]},
+                    }
+                    report.add(copy)
+                    yield line(index, copy)
+            finished = True
+            yield (json.dumps({"report": report.render(time.perf_counter() - started)}) + "\n").encode("utf-8")
+        finally:
+            if not finished:
+                for cancel in cancels:
+                    cancel.cancel("client_disconnected")
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+# =========================
+# Bulk ingest (CSV / JSONL deal files)
+# =========================
+
+INGEST_TOKEN = os.getenv("INGEST_TOKEN") or None
+
+
+@app.post("/ingest")
+async def ingest(request: Request, format: str = "csv", x_ingest_token: str | None = Header(default=None)):
+    """
+    Load a deal file sent as the request body (backend.services.ingest):
+
+        curl -X POST 'localhost:8000/ingest?format=csv' \\
+             -H 'X-Ingest-Token: ...' --data-binary @deals.csv
+
+    Needs INGEST_TOKEN to be set and sent in X-Ingest-Token. The body is
+    spooled to a temp file (memory stays flat for large uploads), then
+    validated and loaded with COPY; idempotent on deal_id. Rejected rows
+    are written to INGEST_REJECT_DIR; the summary names the file and
+    includes the first few.
+    """
+    if INGEST_TOKEN is None:
+        return JSONResponse({"error": "Ingest is disabled (INGEST_TOKEN not set)"}, status_code=403)
+    if not x_ingest_token or not hmac.compare_digest(x_ingest_token.encode(), INGEST_TOKEN.encode()):
+        return JSONResponse({"error": "Invalid X-Ingest-Token"}, status_code=403)
+    if format not in INGEST_FORMATS:
+        return JSONResponse({"error": f"format must be one of {INGEST_FORMATS}"}, status_code=400)
+    dsn = _db_dsn()
+    if isinstance(dsn, dict):
+        return JSONResponse(dsn, status_code=503)
+
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 2**20)
+    async for chunk in request.stream():
+        spool.write(chunk)
+    spool.seek(0)
+    return await run_in_threadpool(_ingest_sync, spool, format, dsn)
+
+
+def _ingest_sync(spool, fmt: str, dsn: str) -> dict:
+    INGEST_REJECT_DIR.mkdir(parents=True, exist_ok=True)
+    reject_path = INGEST_REJECT_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.rejects.jsonl"
+    try:
+        conn = psycopg2.connect(dsn)
+    except Exception as e:
+        metrics.DB_CONNECTION_ERRORS.inc()
+        return {"error": str(e)}
+    summary: dict = {}
+    try:
+        with open(reject_path, "w", encoding="utf-8") as rejects, \
+                io.TextIOWrapper(spool, encoding="utf-8", newline="") as text:
+            summary = ingest_stream(conn, text, fmt, reject_file=rejects, connect=lambda: psycopg2.connect(dsn))
+    finally:
+        conn.close()
+        if not summary.get("rejected"):
+            reject_path.unlink(missing_ok=True)
+    if summary.get("rejected"):
+        summary["reject_file"] = reject_path.name
+    return summary
+
+
+# =========================
+# Metrics (Prometheus text format)
+# =========================
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """
+    Process-wide stage histograms and pool / token / query counters.
+    """
+    return PlainTextResponse(
+        metrics.render_prometheus(),
+        media_type="text/plain; version=0.0.4",
+    )
 
 
 # =========================
@@ -0,0 +1,59 @@
+# tests/test_batch.py
+import threading
+
+from backend.services.batch import SharedExecutions, dedupe, execution_key
+from backend.services.cancellation import CancelToken
+from backend.services.metrics import RequestTimer
+
+
+def _answer(sql):
+    return {"validator": {"status": "ok"}, "sql": sql}
+
+
+def test_questions_differing_only_in_a_literal_are_executed_separately():
+    buys = _answer("SELECT SUM(volume) FROM deal_event WHERE direction = 'buy'")
+    sells = _answer("SELECT SUM(volume) FROM deal_event WHERE direction = 'sell'")
+    y2023 = _answer("SELECT COUNT(*) FROM deal_event WHERE deal_date >= DATE '2023-01-01'")
+    y2024 = _answer("SELECT COUNT(*) FROM deal_event WHERE deal_date >= DATE '2024-01-01'")
+    assert execution_key(buys) != execution_key(sells)
+    assert execution_key(y2023) != execution_key(y2024)
+
+    shared = SharedExecutions()
+    assert shared.claim(execution_key(buys))[0]
+    assert shared.claim(execution_key(sells))[0]
+
+
+def test_identical_sql_shares_one_execution():
+    a = _answer("SELECT SUM(volume) FROM deal_event WHERE direction = 'buy'")
+    b = _answer("select sum(volume)\n  from deal_event where direction = 'buy';")
+    assert execution_key(a) == execution_key(b)
+
+    shared = SharedExecutions()
+    first, future = shared.claim(execution_key(a))
+    again, same = shared.claim(execution_key(b))
+    assert first and not again and same is future
+
+
+def test_whitespace_inside_literals_matters():
+    a = _answer("SELECT * FROM deal_event WHERE note = 'a  b'")
+    b = _answer("SELECT * FROM deal_event WHERE note = 'a b'")
+    assert execution_key(a) != execution_key(b)
+
+
+def test_no_key_for_unvalidated_or_compound_answers():
+    assert execution_key({"validator": {"status": "rejected"}, "sql": "SELECT 1"}) is None
+    assert execution_key({**_answer("SELECT 1"), "queries": [{"name": "a"}]}) is None
+
+
+def test_dedupe_groups_questions():
+    assert dedupe(["Volume by product?", "volume  by product", "daily price"]) == [(0, [1]), (2, [])]
+
+
+def test_bulkhead_wait_stops_when_cancelled():
+    slot = threading.BoundedSemaphore(1)
+    slot.acquire()  # taken by another question
+    cancel = CancelToken()
+    timer = RequestTimer(bulkheads={"db_connection": slot})
+    threading.Timer(0.2, cancel.cancel, args=("client_disconnected",)).start()
+    assert timer.hold("db_connection", cancel) == "cancelled (client_disconnected)"
+    assert "db_connection_wait" in timer.stages
@@ -0,0 +1,23 @@
+# tests/test_index_advisor.py
+from backend.scripts.index_advisor import _parseable, explainable, shape_columns
+from backend.validator.fingerprint import query_shape
+from backend.validator.validator import load_schema_registry
+
+SQL = (
+    "SELECT product_id, SUM(volume) FROM deal_event "
+    "WHERE deal_date >= DATE '2024-01-01' AND deal_date < DATE '2024-02-01' "
+    "GROUP BY 1 ORDER BY 2 DESC LIMIT 10"
+)
+
+
+def test_typed_placeholders_parse_as_range_predicates():
+    shape = query_shape(SQL)
+    assert "date '?'" in _parseable(shape) and "''?''" not in _parseable(shape)
+    assert shape_columns(shape, load_schema_registry())["deal_event"]["range"] == ["deal_date"]
+
+
+def test_explainable_keeps_group_and_order_positions():
+    assert explainable(query_shape(SQL)) == (
+        "select product_id,sum(volume)from deal_event where deal_date>=$1::date and deal_date<$2::date "
+        "group by 1 order by 2 desc limit $3"
+    )
@@ -0,0 +1,13 @@
+# tests/test_ingest.py
+import pytest
+
+from backend.services.ingest import _make_check, _Reject
+
+
+def test_date_check_takes_only_yyyy_mm_dd():
+    check, _ = _make_check({"sql_type": "date", "nullable": False}, None)
+    assert check("2024-01-01") == "2024-01-01"
+    # fromisoformat accepts the ISO week form; COPY into a date column does not.
+    for value in ("2024-W01-1", "20240101", "2024-1-1"):
+        with pytest.raises(_Reject):
+            check(value)
@@ -0,0 +1,23 @@
+# tests/test_planner.py
+import json
+
+from backend.services.planner import parse_plan
+
+QUERIES = [
+    {"name": "buys", "sql": "SELECT product_id, SUM(volume) AS volume FROM deal_event WHERE direction = 'buy' GROUP BY product_id"},
+    {"name": "sells", "sql": "SELECT product_id, SUM(volume) AS volume FROM deal_event WHERE direction = 'sell' GROUP BY product_id"},
+]
+
+
+def _plan(fill_missing):
+    return json.dumps({
+        "queries": QUERIES,
+        "combine": {"op": "compare", "keys": ["product_id"], "values": ["volume"], "fill_missing": fill_missing},
+    })
+
+
+def test_fill_missing_must_be_a_number_or_null():
+    assert "fill_missing" in parse_plan(_plan("none"))["error"]
+    assert "fill_missing" in parse_plan(_plan(True))["error"]
+    assert "plan" in parse_plan(_plan(0))
+    assert "plan" in parse_plan(_plan(None))
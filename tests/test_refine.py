@@ -0,0 +1,21 @@
+# tests/test_refine.py
+import pytest
+
+from backend.sql_executor.refine import NotDerivable, refine
+from backend.validator.query_shape import parse_query
+
+
+def test_distinct_follow_up_of_a_limited_result_is_not_derivable():
+    # The previous LIMIT kept P1 x3 and P2 x3; the table has more products.
+    prev_sql = "SELECT product_id FROM deal_event ORDER BY product_id LIMIT 6"
+    rows = [{"product_id": "P1"}] * 3 + [{"product_id": "P2"}] * 3
+    with pytest.raises(NotDerivable):
+        refine(rows, parse_query(prev_sql),
+               "SELECT DISTINCT product_id FROM deal_event ORDER BY product_id LIMIT 4")
+
+
+def test_narrower_limit_of_a_limited_result_is_derived():
+    prev_sql = "SELECT product_id FROM deal_event ORDER BY product_id LIMIT 6"
+    rows = [{"product_id": p} for p in ("P1", "P2", "P3", "P4", "P5", "P6")]
+    result = refine(rows, parse_query(prev_sql), "SELECT product_id FROM deal_event ORDER BY product_id LIMIT 2")
+    assert result == [{"product_id": "P1"}, {"product_id": "P2"}]
@@ -0,0 +1,16 @@
+# tests/test_rollups.py
+from backend.sql_executor.rollups import plan_rewrite
+
+
+def test_count_over_empty_filter_is_zero_not_null():
+    # COUNT(*) over no rows is 0; SUM(deal_count) over no rows is NULL.
+    result = plan_rewrite("SELECT COUNT(*) AS n FROM deal_event WHERE direction = 'none'")
+    assert result["rollup"] == "month"
+    assert result["sql"] == (
+        "select coalesce(sum(deal_count), 0)::bigint as n from deal_event_rollup_month where direction = 'none'"
+    )
+
+
+def test_count_keeps_its_column_name():
+    result = plan_rewrite("SELECT direction, COUNT(*) FROM deal_event GROUP BY direction")
+    assert "coalesce(sum(deal_count), 0)::bigint as count" in result["sql"]
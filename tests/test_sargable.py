@@ -0,0 +1,25 @@
+# tests/test_sargable.py
+from backend.validator.sargable import rewrite_date_predicates
+
+
+def test_date_trunc_with_a_time_of_day_is_not_rewritten():
+    # '2024-03-01 12:00' is not a month start: the comparison matches no rows
+    # as written, and truncating it to the day would match all of March.
+    sql = "SELECT deal_id FROM deal_event WHERE DATE_TRUNC('month', deal_date) = '2024-03-01 12:00:00'"
+    result = rewrite_date_predicates(sql)
+    assert result["sql"] == sql
+    assert result["rewrites"] == []
+
+
+def test_date_trunc_lower_bound_with_a_timestamp_is_not_rewritten():
+    sql = "SELECT deal_id FROM deal_event WHERE DATE_TRUNC('month', deal_date) >= TIMESTAMP '2024-03-01 12:00'"
+    assert rewrite_date_predicates(sql)["sql"] == sql
+
+
+def test_date_trunc_at_midnight_is_rewritten():
+    for literal in ("'2024-03-01'", "DATE '2024-03-01'", "TIMESTAMP '2024-03-01 00:00:00'"):
+        result = rewrite_date_predicates(
+            f"SELECT deal_id FROM deal_event WHERE DATE_TRUNC('month', deal_date) = {literal}"
+        )
+        assert result["date_filter"] == "rewritten"
+        assert result["sql"].endswith("where deal_date >= '2024-03-01' and deal_date < '2024-04-01'")